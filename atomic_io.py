@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+原子文件写入
+先写入同目录下的临时文件，再通过os.replace重命名，读者永远不会看到写了一半的文件
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterator
+
+
+@contextmanager
+def atomic_open(path: str) -> Iterator[BinaryIO]:
+    """
+    以二进制方式写入同目录下的临时文件（fp.name为临时文件路径），正常退出时fsync并重命名为目标文件，
+    出现异常时删除临时文件，目标文件保持不变
+
+    Args:
+        path: 目标文件路径，所在目录不存在时自动创建
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # mkstemp创建的文件权限为0600，沿用已有文件的权限，新文件使用0644
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o644
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    os.close(fd)
+    try:
+        with open(temp_path, "wb") as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """
+    原子地写入二进制文件
+
+    Args:
+        path: 目标文件路径，所在目录不存在时自动创建
+        data: 文件内容
+    """
+    with atomic_open(path) as fp:
+        fp.write(data)
+
+
+def atomic_write_text(path: str, text: str, encoding: str = "utf-8") -> None:
+    """原子地写入文本文件"""
+    atomic_write_bytes(path, text.encode(encoding))
+
+
+def atomic_write_json(path: str, data: Any, indent: int = 2) -> None:
+    """原子地写入JSON文件（UTF-8，不转义中文）"""
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=indent))
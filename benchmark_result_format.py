@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+结果传递微基准
+比较查询结果从引擎到MCP响应文本的两种方式，按每MB结果文本消耗的CPU时间输出：
+
+- 旧方式：守护进程json.dumps -> 客户端json.loads -> json.dumps(indent=2, ensure_ascii=False)
+- 新方式：守护进程encode_result编码一次 -> 客户端只做UTF-8解码和拼接（EncodedResult直通）
+
+用法:
+    python benchmark_result_format.py [行数]
+"""
+
+import json
+import random
+import sys
+import time
+
+from result_format import EncodedResult, encode_result, wrap_result
+
+
+def make_rows(count: int):
+    """生成与多语言表相似的结果行"""
+    random.seed(1)
+    words = ["乐观", "悲观", "勇敢", "胆小", "Optimist", "Brave", "Lazy", "HardWorking", "研究", "建造"]
+    return [{
+        "Id": i + 1,
+        "key": f"Key_{i}",
+        "Category": i % 7,
+        "Chinese": random.choice(words) + random.choice(words) + str(i % 5000),
+        "English": random.choice(words) + " " + str(i % 3000),
+        "Weight": round(random.random() * 100, 3),
+        "Content": random.choice(["a", "b", None]),
+    } for i in range(count)]
+
+
+def measure(func, repeat: int = 3):
+    """返回最少CPU时间（秒）和输出文本"""
+    best, text = None, None
+    for _ in range(repeat):
+        start = time.process_time()
+        text = func()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, text
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(count)
+    print(f"结果行数: {count}")
+
+    # 守护进程一侧
+    old_wire, old_wire_bytes = measure(lambda: json.dumps(
+        {"id": 1, "result": rows}, ensure_ascii=False, default=str).encode("utf-8"))
+    new_wire, new_wire_bytes = measure(lambda: encode_result(rows).encode("utf-8"))
+
+    # MCP服务器一侧
+    def old_client():
+        result = json.loads(old_wire_bytes)["result"]
+        return json.dumps(result, indent=2, ensure_ascii=False)
+
+    def new_client():
+        return wrap_result(EncodedResult(new_wire_bytes.decode("utf-8")))
+
+    old_server, old_text = measure(old_client)
+    new_server, new_text = measure(new_client)
+    assert json.loads(new_text)["result"] == json.loads(old_text)
+
+    megabytes = len(new_text.encode("utf-8")) / (1 << 20)
+    print(f"响应文本: 旧 {len(old_text.encode('utf-8')) / (1 << 20):.1f} MB，新 {megabytes:.1f} MB")
+    print(f"{'':12}{'守护进程编码':>14}{'MCP服务器':>12}{'合计':>10}{'每MB':>12}")
+    for label, wire, server in (("旧方式", old_wire, old_server), ("新方式", new_wire, new_server)):
+        total = wire + server
+        print(f"{label:10}{wire * 1000:>12.0f}ms{server * 1000:>10.0f}ms{total * 1000:>8.0f}ms"
+              f"{total * 1000 / megabytes:>9.1f}ms/MB")
+    print(f"MCP服务器CPU降低 {old_server / max(new_server, 1e-9):.0f} 倍，"
+          f"总CPU降低 {(old_wire + old_server) / max(new_wire + new_server, 1e-9):.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
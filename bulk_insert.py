@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+批量插入
+把大量行一次追加到工作表（excel_bulk_insert），代替逐条INSERT：
+
+- 来源为按列的数组（{列名: [值, ...]}）或本地CSV（第一行为列名）、NDJSON/JSON Lines（每行一个对象）、
+  JSON（按列的数组或对象数组）文件
+- 列名按第一行字段名匹配（先精确再忽略大小写），值按第二行声明的类型逐列转换和校验：
+  整数类型检查是否为整数及取值范围，浮点类型检查是否为有限数值，布尔类型只接受true/false/1/0/yes/no，
+  其余类型按文本存储（数组和对象按逗号连接为复合类型单元格的文本格式）
+- 校验失败的行汇总报告（每列的失败行数和前若干条明细），默认有失败时不插入任何行，
+  skip_invalid为True时跳过这些行、插入其余行
+"""
+
+import csv
+import json
+import math
+import os
+from itertools import compress
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from column_store import ColumnTable
+
+# 报告中最多列出的失败明细数
+MAX_REPORTED_ERRORS = 20
+
+_INTEGER_RANGES = {
+    "byte": (0, 2 ** 8 - 1),
+    "short": (-2 ** 15, 2 ** 15 - 1),
+    "int": (-2 ** 31, 2 ** 31 - 1),
+    "uint": (0, 2 ** 32 - 1),
+    "long": (-2 ** 63, 2 ** 63 - 1),
+    "ulong": (0, 2 ** 64 - 1),
+}
+_REAL_TYPES = {"float", "double"}
+_BOOLEAN_TYPES = {"bool", "boolean"}
+_TRUE_TEXTS = {"1", "true", "yes"}
+_FALSE_TEXTS = {"0", "false", "no"}
+
+
+class BulkInsertError(ValueError):
+    """批量插入的来源或列定义错误（整个请求无法执行）"""
+
+
+def read_source(source: Union[str, Dict[str, List[Any]]]) -> Tuple[List[str], List[List[Any]]]:
+    """
+    读取插入的数据
+
+    Args:
+        source: {列名: [值, ...]}，或CSV/NDJSON/JSON文件路径（按扩展名区分，.jsonl同NDJSON）
+
+    Returns:
+        (列名, 各列的值)
+
+    Raises:
+        BulkInsertError: 格式错误或各列长度不一致
+        FileNotFoundError: 文件不存在
+    """
+    if isinstance(source, dict):
+        return _column_arrays(source)
+    if not isinstance(source, str) or not source:
+        raise BulkInsertError("source应为按列的数组对象或CSV/NDJSON文件路径")
+    extension = os.path.splitext(source)[1].lower()
+    if extension == ".csv":
+        return _read_csv(source)
+    if extension in (".ndjson", ".jsonl"):
+        with open(source, "r", encoding="utf-8-sig") as fp:
+            objects = []
+            for number, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    raise BulkInsertError(f"{os.path.basename(source)} 第 {number} 行不是有效的JSON: {e}")
+                if not isinstance(item, dict):
+                    raise BulkInsertError(f"{os.path.basename(source)} 第 {number} 行不是JSON对象")
+                objects.append(item)
+        return _row_objects(objects)
+    if extension == ".json":
+        with open(source, "r", encoding="utf-8-sig") as fp:
+            try:
+                data = json.load(fp)
+            except ValueError as e:
+                raise BulkInsertError(f"{os.path.basename(source)} 不是有效的JSON: {e}")
+        if isinstance(data, dict):
+            return _column_arrays(data)
+        if isinstance(data, list) and all(isinstance(item, dict) for item in data):
+            return _row_objects(data)
+        raise BulkInsertError(f"{os.path.basename(source)} 应为按列的数组对象或对象数组")
+    raise BulkInsertError(f"不支持的文件类型: {extension or source}，可选: .csv、.ndjson、.jsonl、.json")
+
+
+def _column_arrays(data: Dict[str, Any]) -> Tuple[List[str], List[List[Any]]]:
+    names = [str(name) for name in data]
+    columns = [data[name] for name in data]
+    for name, values in zip(names, columns):
+        if not isinstance(values, list):
+            raise BulkInsertError(f"列 {name} 的值应为数组")
+    lengths = {len(values) for values in columns}
+    if len(lengths) > 1:
+        detail = ", ".join(f"{name}={len(values)}" for name, values in zip(names, columns))
+        raise BulkInsertError(f"各列的行数不一致: {detail}")
+    return names, columns
+
+
+def _row_objects(objects: List[Dict[str, Any]]) -> Tuple[List[str], List[List[Any]]]:
+    names: Dict[str, None] = {}
+    for item in objects:
+        for name in item:
+            names.setdefault(name, None)
+    return list(names), [[item.get(name) for item in objects] for name in names]
+
+
+def _read_csv(path: str) -> Tuple[List[str], List[List[Any]]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as fp:
+        reader = csv.reader(fp)
+        names = next(reader, None)
+        if not names:
+            raise BulkInsertError(f"{os.path.basename(path)} 没有列名行")
+        width = len(names)
+        rows = [row for row in reader if row]
+    # 缺少的单元格和空字符串为空值
+    columns: List[List[Any]] = [[] for _ in range(width)]
+    for row in rows:
+        if len(row) < width:
+            row = row + [""] * (width - len(row))
+        for column, value in zip(columns, row):
+            column.append(value if value != "" else None)
+    return names, columns
+
+
+def _integer_converter(kind: str) -> Callable[[Any], Any]:
+    low, high = _INTEGER_RANGES[kind]
+
+    def convert(value: Any) -> Any:
+        if isinstance(value, str):
+            text = value.strip()
+            if not text:
+                return None
+            try:
+                value = int(text)
+            except ValueError:
+                try:
+                    value = float(text)
+                except ValueError:
+                    raise ValueError("不是整数")
+        if isinstance(value, float):
+            if not value.is_integer():
+                raise ValueError("不是整数")
+            value = int(value)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError("不是整数")
+        if not low <= value <= high:
+            raise ValueError(f"超出{kind}的取值范围")
+        return value
+
+    return convert
+
+
+def _real(value: Any) -> Any:
+    if isinstance(value, str) and not value.strip():
+        return None
+    if isinstance(value, bool):
+        raise ValueError("不是数值")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("不是数值")
+    if not math.isfinite(number):
+        raise ValueError("不是有限的数值")
+    return number
+
+
+def _boolean(value: Any) -> Any:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if not text:
+            return None
+        if text in _TRUE_TEXTS:
+            return True
+        if text in _FALSE_TEXTS:
+            return False
+    raise ValueError("不是布尔值")
+
+
+def _text(value: Any) -> Any:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return ",".join("" if item is None else str(item) for item in value)
+    if isinstance(value, dict):
+        return ",".join(f"{key}:{item}" for key, item in value.items())
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def converter_for(data_type: str) -> Callable[[Any], Any]:
+    """第二行声明类型对应的转换函数，值无效时抛出ValueError"""
+    kind = data_type.strip().lower()
+    if kind in _INTEGER_RANGES:
+        return _integer_converter(kind)
+    if kind in _REAL_TYPES:
+        return _real
+    if kind in _BOOLEAN_TYPES:
+        return _boolean
+    return _text
+
+
+def convert_columns(table: ColumnTable, names: List[str], columns: List[List[Any]],
+                    skip_invalid: bool = False) -> Tuple[List[int], List[List[Any]], Dict[str, Any]]:
+    """
+    按表的列定义逐列转换和校验插入的值
+
+    Args:
+        table: 目标表
+        names: 来源的列名
+        columns: 各列的值
+        skip_invalid: 是否去掉校验失败的行
+
+    Returns:
+        (列位置, 转换后的各列值, 校验报告)；报告包含rows（来源行数）、rejectedRows、byColumn和errors明细，
+        没有跳过失败的行时转换后的值包含失败的行，调用方应根据rejectedRows决定是否插入
+
+    Raises:
+        BulkInsertError: 列名不存在或重复，或没有任何列
+    """
+    if not names:
+        raise BulkInsertError("没有要插入的列")
+    positions: List[int] = []
+    unknown = []
+    for name in names:
+        position = table.column_position(name)
+        if position is None:
+            unknown.append(name)
+        elif position in positions:
+            raise BulkInsertError(f"列 {table.columns[position].name} 重复出现")
+        else:
+            positions.append(position)
+    if unknown:
+        raise BulkInsertError(f"表 {table.name} 中不存在列: {', '.join(unknown)}；可用的列: "
+                              f"{', '.join(table.column_names)}")
+    row_count = len(columns[0])
+    valid = bytearray(b"\x01") * row_count
+    by_column: Dict[str, int] = {}
+    errors: List[Dict[str, Any]] = []
+    converted: List[List[Any]] = []
+    for position, values in zip(positions, columns):
+        column = table.columns[position]
+        convert = converter_for(column.data_type)
+        output: List[Any] = []
+        failed = 0
+        for row, value in enumerate(values):
+            if value is None:
+                output.append(None)
+                continue
+            try:
+                output.append(convert(value))
+            except (TypeError, ValueError, OverflowError) as e:
+                output.append(None)
+                valid[row] = 0
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": row + 1, "column": column.name, "type": column.data_type,
+                                   "value": value, "error": str(e) or "无法转换"})
+        if failed:
+            by_column[column.name] = failed
+        converted.append(output)
+    rejected = row_count - sum(valid)
+    if rejected and skip_invalid:
+        converted = [list(compress(values, valid)) for values in converted]
+    report: Dict[str, Any] = {"rows": row_count, "rejectedRows": rejected}
+    if rejected:
+        errors.sort(key=lambda item: item["row"])
+        report.update(byColumn=by_column, errors=errors)
+    return positions, converted, report
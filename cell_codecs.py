@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+复合单元格类型的编解码
+第二行声明的数组和字典类型（如 int[]、List<string>、Map<Enums.ELanguage,string>()）在单元格中以文本保存，
+加载列式表时按声明类型解码一次，存为扁平数组加偏移量（CompositeColumn），
+查询中的CONTAINS/ELEMENT/ELEMENT_COUNT直接在解码结果上计算，不再逐行拆分字符串。
+
+文本格式:
+    数组: 元素以逗号、分号或竖线分隔，可以带外层方括号，如 "1,2,3"、"[1|2|3]"
+    字典: 键值对以逗号、分号或竖线分隔，键和值以冒号或等号分隔，如 "CN:你好,EN:Hello"
+
+通过register_codec可以为其它声明类型注册编解码器；列在SQL中仍为TEXT，SELECT返回原始文本。
+"""
+
+import logging
+import operator
+import re
+import sys
+from array import array
+from functools import lru_cache
+from itertools import accumulate, chain, compress, repeat
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from xlsx_reader import coerce_value
+
+logger = logging.getLogger(__name__)
+
+_INTEGER_TYPES = {"int", "long", "short", "byte", "uint", "ulong"}
+_REAL_TYPES = {"float", "double"}
+_SEPARATORS = re.compile(r"[,;|]")
+_PAIR_SEPARATORS = re.compile(r"[:=]")
+
+_ARRAY_TYPE = re.compile(r"^\s*(?:([\w.]+)\s*\[\s*\]|(?:List|Array)\s*<\s*([\w.]+)\s*>)\s*(?:\(\s*\))?\s*$", re.IGNORECASE)
+_MAP_TYPE = re.compile(r"^\s*(?:Map|Dictionary|Dict)\s*<\s*([\w.]+)\s*,\s*([\w.]+)\s*>\s*(?:\(\s*\))?\s*$",
+                       re.IGNORECASE)
+
+
+class ElementType:
+    """数组元素或字典键/值的类型：数值类型存为定宽数组，其余类型存为文本"""
+
+    __slots__ = ("name", "typecode")
+
+    def __init__(self, name: str):
+        self.name = name
+        kind = name.lower()
+        self.typecode = "q" if kind in _INTEGER_TYPES else "d" if kind in _REAL_TYPES else None
+
+    def parse(self, text: str) -> Any:
+        """转换一个元素，数值类型无法转换时保留原文本"""
+        if self.typecode is None:
+            return text
+        try:
+            return int(text) if self.typecode == "q" else float(text)
+        except ValueError:
+            return coerce_value(text, self.name)
+
+    def coerce(self, value: Any) -> Any:
+        """把查询中的比较值转换为元素类型，无法转换时返回None（不与任何元素相等）"""
+        if value is None:
+            return None
+        if self.typecode is None:
+            return coerce_value(value, "string")
+        if isinstance(value, str):
+            value = coerce_value(value, self.name)
+            return None if isinstance(value, str) else value
+        return value if isinstance(value, (int, float)) else None
+
+    def pack(self, items: List[Any]) -> Sequence[Any]:
+        """元素全部为数值时存为定宽数组，否则保留列表"""
+        if self.typecode is not None:
+            try:
+                return array(self.typecode, items)
+            except (TypeError, OverflowError):
+                logger.debug(f"{self.name} 元素中有无法转换的值，按列表保存")
+        return items
+
+
+class CellCodec:
+    """复合类型编解码器的基类"""
+
+    # 是否为字典（键值对）
+    is_map = False
+
+    def __init__(self, data_type: str):
+        self.data_type = data_type
+
+    def decode(self, text: str) -> List[Any]:
+        """
+        解码一个单元格
+
+        Returns:
+            数组为元素列表，字典为(键, 值)列表
+        """
+        raise NotImplementedError
+
+
+def _split(text: str) -> List[str]:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == "[" and text[-1] == "]":
+        text = text[1:-1]
+    if not text.strip():
+        return []
+    return list(map(str.strip, _SEPARATORS.split(text)))
+
+
+class ArrayCodec(CellCodec):
+    """元素数组，如 int[]、List<string>"""
+
+    def __init__(self, data_type: str, element: str):
+        super().__init__(data_type)
+        self.element = ElementType(element)
+
+    def decode(self, text: str) -> List[Any]:
+        parts = _split(text)
+        typecode = self.element.typecode
+        if typecode is not None:
+            try:
+                return list(map(int if typecode == "q" else float, parts))
+            except ValueError:
+                pass
+        parse = self.element.parse
+        return [parse(part) for part in parts if part != ""]
+
+
+class MapCodec(CellCodec):
+    """键值对，如 Map<Enums.ELanguage,string>()；缺少分隔符的项按键处理，值为NULL"""
+
+    is_map = True
+
+    def __init__(self, data_type: str, key: str, value: str):
+        super().__init__(data_type)
+        self.key = ElementType(key)
+        self.element = ElementType(value)
+
+    def decode(self, text: str) -> List[Any]:
+        pairs = []
+        for part in _split(text):
+            if part == "":
+                continue
+            pieces = _PAIR_SEPARATORS.split(part, 1)
+            value = self.element.parse(pieces[1].strip()) if len(pieces) > 1 else None
+            pairs.append((self.key.parse(pieces[0].strip()), value))
+        return pairs
+
+
+# (匹配声明类型的函数, 创建编解码器的函数)，后注册的优先
+_REGISTRY: List[Tuple[Callable[[str], Optional[Any]], Callable[[str, Any], CellCodec]]] = []
+
+
+def register_codec(match: Callable[[str], Optional[Any]], factory: Callable[[str, Any], CellCodec]) -> None:
+    """
+    注册复合类型的编解码器
+
+    Args:
+        match: 声明类型 -> 匹配结果，不匹配时返回None
+        factory: (声明类型, 匹配结果) -> 编解码器
+    """
+    _REGISTRY.insert(0, (match, factory))
+    codec_for.cache_clear()
+
+
+@lru_cache(maxsize=256)
+def codec_for(data_type: str) -> Optional[CellCodec]:
+    """声明类型对应的编解码器，不是复合类型时返回None"""
+    for match, factory in _REGISTRY:
+        matched = match(data_type or "")
+        if matched is not None:
+            return factory(data_type, matched)
+    return None
+
+
+register_codec(_ARRAY_TYPE.match, lambda data_type, m: ArrayCodec(data_type, m.group(1) or m.group(2)))
+register_codec(_MAP_TYPE.match, lambda data_type, m: MapCodec(data_type, m.group(1), m.group(2)))
+
+
+class CompositeColumn:
+    """
+    解码后的复合列
+
+    第row行的元素为keys[offsets[row]:offsets[row + 1]]，字典的值在values的相同位置；
+    owners[i]为第i个元素所在的行，nulls中为空单元格的行
+    """
+
+    def __init__(self, codec: CellCodec, offsets: array, owners: array, keys: Sequence[Any],
+                 values: Optional[Sequence[Any]], nulls: bytearray):
+        self.codec = codec
+        self.offsets = offsets
+        self.owners = owners
+        self.keys = keys
+        self.values = values
+        self.nulls = nulls
+
+    def __len__(self) -> int:
+        return len(self.nulls)
+
+    def elements(self, row: int) -> Optional[Sequence[Any]]:
+        """一行的元素（字典为键），空单元格返回None"""
+        if self.nulls[row]:
+            return None
+        return self.keys[self.offsets[row]:self.offsets[row + 1]]
+
+    def count(self, row: int) -> Optional[int]:
+        if self.nulls[row]:
+            return None
+        return self.offsets[row + 1] - self.offsets[row]
+
+    def element(self, row: int, key: Any) -> Any:
+        """数组按从0开始的下标取元素，字典按键取值；不存在时返回None"""
+        if self.nulls[row] or key is None:
+            return None
+        start, stop = self.offsets[row], self.offsets[row + 1]
+        if self.codec.is_map:
+            key = self.codec.key.coerce(key)
+            for i in range(start, stop):
+                if self.keys[i] == key:
+                    return self.values[i]
+            return None
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            return None
+        return self.keys[start + index] if 0 <= index < stop - start else None
+
+    def rows_containing(self, value: Any) -> bytearray:
+        """
+        包含value的行（数组比较元素，字典比较键），一次遍历扁平数组得到全表的行标记
+
+        Returns:
+            按行的0/1标记
+        """
+        hits = bytearray(len(self.nulls))
+        value = self.codec.element.coerce(value) if not self.codec.is_map else self.codec.key.coerce(value)
+        if value is None:
+            return hits
+        for row in compress(self.owners, map(operator.eq, self.keys, repeat(value))):
+            hits[row] = 1
+        return hits
+
+    def nbytes(self) -> int:
+        size = self.offsets.itemsize * len(self.offsets) + self.owners.itemsize * len(self.owners) + len(self.nulls)
+        for items in (self.keys, self.values):
+            if isinstance(items, array):
+                size += items.itemsize * len(items)
+            elif items is not None:
+                size += sys.getsizeof(items)
+        return size
+
+
+def decode_column(codec: CellCodec, texts: Sequence[Optional[str]]) -> CompositeColumn:
+    """
+    解码一列文本，相同的文本只解码一次
+
+    Args:
+        codec: 编解码器
+        texts: 每行的原始文本，None表示空单元格
+
+    Returns:
+        解码后的复合列
+    """
+    decode = codec.decode
+    decoded: Dict[str, List[Any]] = {}
+    rows: List[List[Any]] = []
+    nulls = bytearray(len(texts))
+    for row, text in enumerate(texts):
+        if text is None:
+            nulls[row] = 1
+            rows.append([])
+            continue
+        items = decoded.get(text)
+        if items is None:
+            items = decoded[text] = decode(text)
+        rows.append(items)
+    lengths = list(map(len, rows))
+    offsets = array("i", [0])
+    offsets.extend(accumulate(lengths))
+    owners = array("i", chain.from_iterable(map(repeat, range(len(rows)), lengths)))
+    items = list(chain.from_iterable(rows))
+    if codec.is_map:
+        keys = [key for key, _ in items]
+        values = [value for _, value in items]
+        return CompositeColumn(codec, offsets, owners, codec.key.pack(keys), codec.element.pack(values), nulls)
+    return CompositeColumn(codec, offsets, owners, codec.element.pack(items), None, nulls)
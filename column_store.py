@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+列式表存储
+Python引擎中的表按列存储：数值列为值列表，文本列为整数编码数组 + 工作簿级字符串字典。
+
+字符串字典直接由xlsx共享字符串表初始化，编码即共享字符串索引（重复文本归一到第一次出现的索引），
+加载时不会为每个单元格展开字符串对象；等值过滤、GROUP BY和JOIN直接比较编码。
+
+声明为数组/字典类型的列（见cell_codecs）在加载时额外解码一次，供CONTAINS等元素谓词使用。
+"""
+
+import logging
+import sys
+import threading
+import weakref
+import zipfile
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from cell_codecs import CompositeColumn, codec_for, decode_column
+from xlsx_reader import (HEADER_ROWS, NUMERIC_TYPES, SHARED_STRINGS_PART, SKIPPED_SHEETS, Column, SharedStringRef,
+                         cell_converter, is_numeric, iter_sheet_rows, list_workbook_sheets, parse_header,
+                         part_signature, read_shared_strings, sheet_fingerprint)
+
+logger = logging.getLogger(__name__)
+
+# 空值编码
+NULL_CODE = -1
+
+
+class StringDictionary:
+    """
+    工作簿级字符串字典
+
+    strings[code]为编码对应的文本；由共享字符串表初始化，新文本（内联字符串、写入的值）追加在末尾。
+    canonical[i]为共享字符串索引i对应的编码，保存工作簿时追加到共享字符串表的文本通过extend_shared登记
+    """
+
+    def __init__(self, strings: Optional[List[str]] = None, signature: str = ""):
+        # 共享字符串表的签名，签名一致的工作簿可以复用同一个字典
+        self.signature = signature
+        self.strings: List[str] = []
+        self._index: Dict[str, int] = {}
+        # 共享字符串索引 -> 规范编码（共享字符串表允许出现重复文本）
+        self.canonical = array("i")
+        self._translations: "weakref.WeakKeyDictionary[StringDictionary, Tuple[int, int, array]]" = weakref.WeakKeyDictionary()
+        # 编码 -> 共享字符串索引，只记录初始化之后追加到共享字符串表的文本
+        self._shared_positions: Dict[int, int] = {}
+        # 追加文本时持有：字典可能被多个工作簿（内容相同的镜像）的加载和修改同时使用，读取不需要加锁
+        self._append_lock = threading.Lock()
+        for text in strings or ():
+            code = self._index.get(text)
+            if code is None:
+                code = len(self.strings)
+                self._index[text] = code
+            # 保留原始索引位置，使规范编码与共享字符串索引对齐
+            self.strings.append(text)
+            self.canonical.append(code)
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getstate__(self):
+        # 跨字典映射是可重建的缓存，不参与序列化
+        state = dict(self.__dict__)
+        state["_translations"] = None
+        state.pop("_append_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._translations = weakref.WeakKeyDictionary()
+        self._append_lock = threading.Lock()
+
+    def code_of(self, text: str) -> Optional[int]:
+        """返回文本的编码，字典中不存在时返回None"""
+        return self._index.get(text)
+
+    def intern(self, text: str) -> int:
+        """返回文本的编码，不存在时追加"""
+        code = self._index.get(text)
+        if code is None:
+            with self._append_lock:
+                code = self._index.get(text)
+                if code is None:
+                    code = len(self.strings)
+                    self.strings.append(text)
+                    self._index[text] = code
+        return code
+
+    def decode(self, code: int) -> Optional[str]:
+        return self.strings[code] if code >= 0 else None
+
+    def shared_text(self, position: int) -> str:
+        """共享字符串索引对应的文本"""
+        return self.strings[self.canonical[position]]
+
+    def shared_index(self, text: str) -> Optional[int]:
+        """文本在共享字符串表中的索引，不在表中时返回None"""
+        code = self._index.get(text)
+        if code is None:
+            return None
+        # 初始化时首次出现的文本编码等于其共享字符串索引
+        if code < len(self.canonical) and self.canonical[code] == code:
+            return code
+        return self._shared_positions.get(code)
+
+    def extend_shared(self, texts: List[str], signature: str) -> None:
+        """
+        登记保存工作簿时追加到共享字符串表末尾的文本
+
+        Args:
+            texts: 追加的文本，按共享字符串索引顺序
+            signature: 保存后共享字符串表的签名
+        """
+        for text in texts:
+            code = self.intern(text)
+            with self._append_lock:
+                self._shared_positions.setdefault(code, len(self.canonical))
+                self.canonical.append(code)
+        self.signature = signature
+
+    def translation_from(self, other: "StringDictionary") -> array:
+        """
+        其他字典编码 -> 本字典编码的映射，本字典中不存在的文本映射为-2（不等于任何编码，也不是空值）
+
+        用于跨工作簿的等值比较和JOIN，映射按两个字典的大小缓存
+        """
+        cached = self._translations.get(other)
+        if cached is not None and cached[0] == len(other.strings) and cached[1] == len(self.strings):
+            return cached[2]
+        index = self._index
+        mapping = array("i", (index.get(text, -2) for text in other.strings))
+        self._translations[other] = (len(other.strings), len(self.strings), mapping)
+        return mapping
+
+    def nbytes(self) -> int:
+        """估算字典占用的内存"""
+        return (sys.getsizeof(self.strings) + sum(sys.getsizeof(s) for s in self.strings)
+                + sys.getsizeof(self._index) + self.canonical.itemsize * len(self.canonical))
+
+
+class DictColumn:
+    """字典编码的文本列，codes中NULL_CODE表示空值"""
+
+    encoded = True
+
+    def __init__(self, dictionary: StringDictionary, codes: Optional[array] = None):
+        self.dictionary = dictionary
+        self.codes = codes if codes is not None else array("i")
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def value(self, row: int) -> Optional[str]:
+        code = self.codes[row]
+        return self.dictionary.strings[code] if code >= 0 else None
+
+    def values(self, rows: Optional[Iterable[int]] = None) -> List[Optional[str]]:
+        strings = self.dictionary.strings
+        codes = self.codes
+        if rows is None:
+            return [strings[c] if c >= 0 else None for c in codes]
+        return [strings[c] if c >= 0 else None for c in (codes[i] for i in rows)]
+
+    def append(self, value: Optional[str]) -> None:
+        self.codes.append(NULL_CODE if value is None else self.dictionary.intern(value))
+
+    def set(self, row: int, value: Optional[str]) -> None:
+        self.codes[row] = NULL_CODE if value is None else self.dictionary.intern(value)
+
+    def copy(self) -> "DictColumn":
+        return DictColumn(self.dictionary, array("i", self.codes))
+
+    def nbytes(self) -> int:
+        return self.codes.itemsize * len(self.codes)
+
+
+class ValueColumn:
+    """普通值列（数值、布尔及无法编码的混合值）"""
+
+    encoded = False
+
+    def __init__(self, values: Optional[List[Any]] = None):
+        self.data = values if values is not None else []
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def value(self, row: int) -> Any:
+        return self.data[row]
+
+    def values(self, rows: Optional[Iterable[int]] = None) -> List[Any]:
+        if rows is None:
+            return list(self.data)
+        data = self.data
+        return [data[i] for i in rows]
+
+    def append(self, value: Any) -> None:
+        self.data.append(value)
+
+    def set(self, row: int, value: Any) -> None:
+        self.data[row] = value
+
+    def copy(self) -> "ValueColumn":
+        return ValueColumn(list(self.data))
+
+    def nbytes(self) -> int:
+        # 小整数和None为共享对象，这里只估算列表本身
+        return sys.getsizeof(self.data)
+
+
+class ColumnTable:
+    """列式数据表"""
+
+    def __init__(self, name: str, file_path: str, columns: List[Column], data: List[Any],
+                 row_count: int, fingerprint: str = "", dictionary: Optional[StringDictionary] = None,
+                 source_rows: Optional[array] = None):
+        self.name = name
+        self.file_path = file_path
+        self.columns = columns
+        self.data = data
+        self.row_count = row_count
+        self.fingerprint = fingerprint
+        self.dictionary = dictionary
+        # 列位置 -> 按需建立的二级索引（见text_index），随表一起随指纹失效
+        self.indexes: Dict[int, Any] = {}
+        # 列位置 -> 复合类型列的解码结果，修改后丢弃并在下次使用时重新解码
+        self.composites: Dict[int, CompositeColumn] = {}
+        # 每行数据在工作表中的行索引（从0开始），保存修改时用于定位<row>
+        self.source_rows = source_rows if source_rows is not None else array("i", range(row_count))
+        # 尚未写回工作簿的修改：工作表行索引 -> 修改过的列位置；被删除的工作表行索引；追加在表尾的新行
+        self.changed: Dict[int, Set[int]] = {}
+        self.deleted: Set[int] = set()
+        self.inserted: Set[int] = set()
+        # 与其它表共享列数据（见view/fork）时为True，第一次修改前复制列列表，之后只复制被修改的列
+        self.shared = False
+        # 脱离共享后已复制出的列位置，None表示全部列都属于本表
+        self._copied: Optional[Set[int]] = None
+        # 共享的表在sheet_store中的内容键
+        self.content_key = ""
+        self._positions = {c.name: i for i, c in enumerate(columns)}
+        self._lower_positions = {}
+        for i, c in enumerate(columns):
+            self._lower_positions.setdefault(c.name.lower(), i)
+
+    def __getstate__(self):
+        # 二级索引依赖进程内的字符串哈希，不参与序列化
+        state = dict(self.__dict__)
+        state["indexes"] = {}
+        return state
+
+    def view(self, name: str, file_path: str, fingerprint: str) -> "ColumnTable":
+        """
+        共享本表列数据、字典、二级索引和复合列解码结果的新表，用于内容相同的另一个工作表
+
+        两个表都标记为共享，任何一方修改前先复制自己的列数据（写时复制），不影响另一方
+        """
+        table = ColumnTable(name, file_path, self.columns, self.data, self.row_count, fingerprint,
+                            self.dictionary, self.source_rows)
+        table.indexes = self.indexes
+        table.composites = self.composites
+        table.shared = self.shared = True
+        return table
+
+    def fork(self) -> "ColumnTable":
+        """
+        表的新版本：与本表共享列数据（修改时只复制被修改的列），未保存的修改记录单独复制
+
+        修改新版本不影响仍在读取本表的查询
+        """
+        table = self.view(self.name, self.file_path, self.fingerprint)
+        table.changed = {row: set(positions) for row, positions in self.changed.items()}
+        table.deleted = set(self.deleted)
+        table.inserted = set(self.inserted)
+        return table
+
+    def _detach(self, position: Optional[int] = None) -> None:
+        """
+        共享的表在修改前复制列列表和随列数据失效的缓存
+
+        Args:
+            position: 将要原地修改的列，尚未复制时复制该列
+        """
+        if self.shared:
+            self.data = list(self.data)
+            self.indexes = dict(self.indexes)
+            self.composites = dict(self.composites)
+            self._copied = set()
+            self.shared = False
+        if position is not None and self._copied is not None and position not in self._copied:
+            self.data[position] = self.data[position].copy()
+            self._copied.add(position)
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    def column_position(self, name: str) -> Optional[int]:
+        """按列名查找列位置，先精确匹配再忽略大小写匹配"""
+        position = self._positions.get(name)
+        if position is None:
+            position = self._lower_positions.get(name.lower())
+        return position
+
+    def composite(self, position: int) -> Optional[CompositeColumn]:
+        """列的解码结果，声明类型不是复合类型时返回None"""
+        decoded = self.composites.get(position)
+        if decoded is None:
+            codec = codec_for(self.columns[position].data_type)
+            if codec is None:
+                return None
+            decoded = self.composites[position] = decode_column(codec, self.data[position].values())
+        return decoded
+
+    def decode_composites(self) -> None:
+        """解码全部复合类型列"""
+        for position in range(len(self.columns)):
+            self.composite(position)
+
+    def row(self, index: int) -> List[Any]:
+        return [column.value(index) for column in self.data]
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        names = self.column_names
+        columns = [c.values() for c in self.data]
+        return [dict(zip(names, values)) for values in zip(*columns)] if columns else []
+
+    def nbytes(self) -> int:
+        """估算列数据占用的内存（不含共享的字符串字典）"""
+        return sum(column.nbytes() for column in self.data) + sum(c.nbytes() for c in self.composites.values())
+
+    def resident_bytes(self) -> int:
+        """估算表常驻内存：列数据、复合列解码结果和二级索引（不含共享的字符串字典）"""
+        return self.nbytes() + sum(index.nbytes() for index in self.indexes.values())
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.changed or self.deleted or self.inserted)
+
+    def update_cells(self, rows: List[int], position: int, values: Iterable[Any]) -> None:
+        """修改一列中若干行的值，按声明类型转换（cell_converter：数值列为数值，其余列为文本）"""
+        self._detach(position)
+        column = self.data[position]
+        convert = cell_converter(self.columns[position].data_type)
+        source_rows = self.source_rows
+        for row, value in zip(rows, values):
+            column.set(row, convert(value))
+            self.changed.setdefault(source_rows[row], set()).add(position)
+        self.indexes.pop(position, None)
+        self.composites.pop(position, None)
+
+    def delete_rows(self, rows: List[int]) -> None:
+        """删除若干行，其余行保持原有顺序"""
+        if not rows:
+            return
+        self._detach()
+        removed = set(rows)
+        keep = [i not in removed for i in range(self.row_count)]
+        for row in rows:
+            source = self.source_rows[row]
+            self.deleted.add(source)
+            self.changed.pop(source, None)
+            self.inserted.discard(source)
+        # 新建列对象，不修改可能仍被其它版本共享的列
+        self.data = [DictColumn(column.dictionary, array("i", compress(column.codes, keep))) if column.encoded
+                     else ValueColumn(list(compress(column.data, keep))) for column in self.data]
+        self._copied = None
+        self.source_rows = array("i", compress(self.source_rows, keep))
+        self.row_count = len(self.source_rows)
+        self.indexes.clear()
+        self.composites.clear()
+
+    def insert_rows(self, positions: List[int], columns: List[List[Any]]) -> None:
+        """
+        在表尾追加行，数值列按声明类型转换，其余列按文本存储
+
+        新行的工作表行索引接在所有已有行（包括已删除、尚未保存的行）之后，保存时追加到工作表末尾
+
+        Args:
+            positions: 提供了值的列位置
+            columns: 对应列的值，长度相同；未提供的列为空值
+        """
+        count = len(columns[0]) if columns else 0
+        if not count:
+            return
+        self._detach()
+        provided = dict(zip(positions, columns))
+        data = []
+        # 新建列对象，不修改可能仍被其它版本共享的列
+        for position, column in enumerate(self.data):
+            values = provided.get(position)
+            convert = cell_converter(self.columns[position].data_type)
+            if column.encoded:
+                codes = array("i", column.codes)
+                if values is None:
+                    codes.extend(array("i", [NULL_CODE]) * count)
+                else:
+                    intern = column.dictionary.intern
+                    codes.extend(NULL_CODE if v is None else intern(convert(v)) for v in values)
+                data.append(DictColumn(column.dictionary, codes))
+            else:
+                added = [None] * count if values is None else [convert(v) for v in values]
+                data.append(ValueColumn(column.data + added))
+        self.data = data
+        self._copied = None
+        start = max(max(self.source_rows, default=-1), max(self.deleted, default=-1)) + 1
+        # 没有数据行时从表头之后的第一行开始
+        start = max(start, HEADER_ROWS)
+        self.source_rows = self.source_rows + array("i", range(start, start + count))
+        self.inserted.update(range(start, start + count))
+        self.row_count = len(self.source_rows)
+        self.indexes.clear()
+        self.composites.clear()
+
+    def mark_saved(self, fingerprint: str) -> None:
+        """修改已写回工作簿：清空待保存的修改，按删除的行重新编号工作表行索引"""
+        if self.deleted:
+            deleted = sorted(self.deleted)
+            self.source_rows = array("i", (r - bisect_left(deleted, r) for r in self.source_rows))
+        self.changed = {}
+        self.deleted = set()
+        self.inserted = set()
+        self.fingerprint = fingerprint
+
+
+class _ColumnBuilder:
+    """
+    按声明类型构建单列
+
+    数值类型存为值列；其余类型（string、枚举、Map等）在SQL中均为TEXT，
+    与SQLite的TEXT亲和一致，数值单元格转换为文本后统一字典编码
+    """
+
+    def __init__(self, column: Column, dictionary: StringDictionary):
+        self.column = column
+        self.index = column.index
+        self.data_type = column.data_type
+        self.dictionary = dictionary
+        self.numeric = column.data_type.lower() in NUMERIC_TYPES
+        self.convert = cell_converter(column.data_type)
+        self.codes: Optional[array] = None if self.numeric else array("i")
+        self.values: Optional[List[Any]] = [] if self.numeric else None
+
+    def append(self, value: Any) -> None:
+        if self.codes is not None:
+            if value is None:
+                self.codes.append(NULL_CODE)
+            elif type(value) is SharedStringRef:
+                self.codes.append(self.dictionary.canonical[value])
+            else:
+                self.codes.append(self.dictionary.intern(self.convert(value)))
+            return
+        if type(value) is SharedStringRef:
+            value = self.dictionary.shared_text(value)
+        self.values.append(self.convert(value))
+
+    def build(self):
+        if self.codes is not None:
+            return DictColumn(self.dictionary, self.codes)
+        return ValueColumn(self.values)
+
+
+def _decode(value: Any, dictionary: StringDictionary) -> Any:
+    return dictionary.shared_text(value) if type(value) is SharedStringRef else value
+
+
+def _load_columnar_sheet(zf: zipfile.ZipFile, info, dictionary: StringDictionary, path: str) -> ColumnTable:
+    """解析单个工作表为列式表，数据起始行规则与xlsx_reader._load_sheet_rows一致"""
+    fingerprint = sheet_fingerprint(zf, info.part)
+    head_rows: Dict[int, Dict[int, Any]] = {}
+    builders: Optional[List[_ColumnBuilder]] = None
+    header_index = 0
+    data_start: Optional[int] = None
+    # 表头未读完或数据起始行未确定之前的行
+    buffered: List[Tuple[int, Dict[int, Any]]] = []
+    source_rows = array("i")
+    last_row = -1
+
+    def append_row(row_index: int, cells: Dict[int, Any]) -> None:
+        for builder in builders:
+            builder.append(cells.get(builder.index))
+        source_rows.append(row_index)
+
+    for row_index, cells in iter_sheet_rows(zf, info.part, None):
+        last_row = row_index
+        if row_index < HEADER_ROWS:
+            head_rows[row_index] = {c: _decode(v, dictionary) for c, v in cells.items()}
+        if data_start is None and is_numeric(_decode(cells.get(0), dictionary)):
+            data_start = row_index
+        if builders is None and row_index >= HEADER_ROWS:
+            columns, header_index = parse_header(head_rows)
+            builders = [_ColumnBuilder(c, dictionary) for c in columns]
+        if builders is None or data_start is None:
+            buffered.append((row_index, cells))
+            continue
+        if buffered:
+            for index, row in buffered:
+                if index >= data_start:
+                    append_row(index, row)
+            buffered = []
+        append_row(row_index, cells)
+
+    if last_row < HEADER_ROWS:
+        logger.debug(f"工作表 {info.name} 行数不足，跳过")
+        return ColumnTable(info.name, path, [], [], 0, fingerprint, dictionary)
+    if data_start is None:
+        data_start = header_index + 1
+    for index, row in buffered:
+        if index >= data_start:
+            append_row(index, row)
+    table = ColumnTable(info.name, path, [b.column for b in builders], [b.build() for b in builders],
+                        len(source_rows), fingerprint, dictionary, source_rows)
+    table.decode_composites()
+    return table
+
+
+def load_columnar_workbook(path: str, sheet_names: Optional[List[str]] = None,
+                           dictionary: Optional[StringDictionary] = None) -> List[ColumnTable]:
+    """
+    以列式结构加载工作簿
+
+    Args:
+        path: xlsx文件路径
+        sheet_names: 只加载这些工作表，None表示全部
+        dictionary: 可复用的工作簿字符串字典，共享字符串表签名不一致时忽略并新建
+
+    Returns:
+        列式表列表（跳过Struct表），同一工作簿的表共享一个字符串字典
+    """
+    tables = []
+    with zipfile.ZipFile(path) as zf:
+        sheets = [s for s in list_workbook_sheets(zf) if s.name not in SKIPPED_SHEETS]
+        if sheet_names is not None:
+            wanted = set(sheet_names)
+            sheets = [s for s in sheets if s.name in wanted]
+        if not sheets:
+            return tables
+        signature = part_signature(zf, SHARED_STRINGS_PART)
+        if dictionary is None or dictionary.signature != signature:
+            dictionary = StringDictionary(read_shared_strings(zf), signature)
+        for info in sheets:
+            tables.append(_load_columnar_sheet(zf, info, dictionary, path))
+    return tables
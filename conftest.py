@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+pytest公共夹具
+- workdir: XLSX目录中工作簿的副本，测试可以任意修改
+- cache_dir: 独立的缓存目录（工作表目录、日志、sheet_store）
+- make_workbook: 按给定的单元格XML生成最小的xlsx，用于构造其它工具写出的工作簿（属性顺序、内联字符串等）
+"""
+
+import glob
+import os
+import shutil
+import zipfile
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+import pytest
+
+from xlsx_reader import column_letter
+
+XLSX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "XLSX")
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\
+<Default Extension="xml" ContentType="application/xml"/>\
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>\
+{overrides}</Types>"""
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" \
+Target="xl/workbook.xml"/></Relationships>"""
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" \
+xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>{sheets}</sheets></workbook>"""
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{relationships}</Relationships>"""
+_SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>{rows}</sheetData></worksheet>"""
+_SHARED_STRINGS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="{count}" uniqueCount="{count}">\
+{items}</sst>"""
+_WORKSHEET_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+_SHARED_STRINGS_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+
+
+def cell_xml(reference: str, value: Any) -> str:
+    """单元格XML：数值写为<v>，文本写为内联字符串，None不写单元格"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{reference}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{reference}"><v>{value}</v></c>'
+    return f'<c r="{reference}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def rows_xml(rows: Sequence[Sequence[Any]], start: int = 1) -> str:
+    """按行写出的<row>，第一行的行号为start"""
+    return "".join(
+        f'<row r="{number}">'
+        + "".join(cell_xml(f"{column_letter(index)}{number}", value) for index, value in enumerate(row))
+        + "</row>"
+        for number, row in enumerate(rows, start))
+
+
+def write_xlsx(path: str, sheets: Dict[str, str], shared_strings: Optional[List[str]] = None) -> str:
+    """
+    写出只包含工作表和共享字符串表的最小xlsx
+
+    Args:
+        path: 输出路径
+        sheets: 工作表名 -> <sheetData>中的XML（如rows_xml的结果）
+        shared_strings: 共享字符串表，None表示不写
+    """
+    overrides = "".join(f'<Override PartName="/xl/worksheets/sheet{index}.xml" ContentType="{_WORKSHEET_TYPE}"/>'
+                        for index in range(1, len(sheets) + 1))
+    relationships = "".join(
+        f'<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        f'worksheet" Target="worksheets/sheet{index}.xml"/>' for index in range(1, len(sheets) + 1))
+    if shared_strings is not None:
+        overrides += f'<Override PartName="/xl/sharedStrings.xml" ContentType="{_SHARED_STRINGS_TYPE}"/>'
+        relationships += ('<Relationship Id="rIdStrings" Type="http://schemas.openxmlformats.org/officeDocument/'
+                          '2006/relationships/sharedStrings" Target="sharedStrings.xml"/>')
+    names = "".join(f'<sheet name="{escape(name)}" sheetId="{index}" r:id="rId{index}"/>'
+                    for index, name in enumerate(sheets, 1))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES.format(overrides=overrides))
+        zf.writestr("_rels/.rels", _ROOT_RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(sheets=names))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS.format(relationships=relationships))
+        for index, rows in enumerate(sheets.values(), 1):
+            zf.writestr(f"xl/worksheets/sheet{index}.xml", _SHEET.format(rows=rows))
+        if shared_strings is not None:
+            items = "".join(f"<si><t>{escape(text)}</t></si>" for text in shared_strings)
+            zf.writestr("xl/sharedStrings.xml", _SHARED_STRINGS.format(count=len(shared_strings), items=items))
+    return path
+
+
+@pytest.fixture
+def workdir(tmp_path) -> str:
+    """XLSX目录中工作簿的副本"""
+    directory = tmp_path / "xlsx"
+    directory.mkdir()
+    for path in glob.glob(os.path.join(XLSX_DIR, "*.xlsx")):
+        shutil.copy(path, directory)
+    return str(directory)
+
+
+@pytest.fixture
+def cache_dir(tmp_path) -> str:
+    """工作表目录、日志和sheet_store的缓存目录"""
+    return str(tmp_path / "cache")
+
+
+@pytest.fixture
+def make_workbook(tmp_path) -> Callable[..., str]:
+    """
+    生成最小的xlsx：make_workbook(文件名, {工作表名: 行}, shared_strings=None, directory=None)，
+    行为值的列表（依次为字段名、类型、描述和数据行，按rows_xml写出）或直接给出的<sheetData>内的XML
+    """
+    def make(name: str, sheets: Dict[str, Any], shared_strings: Optional[List[str]] = None,
+             directory: Optional[str] = None) -> str:
+        target = directory or str(tmp_path)
+        os.makedirs(target, exist_ok=True)
+        xml = {sheet: rows if isinstance(rows, str) else rows_xml(rows) for sheet, rows in sheets.items()}
+        return write_xlsx(os.path.join(target, name), xml, shared_strings)
+    return make
@@ -0,0 +1,699 @@
+#!/usr/bin/env python3
+"""
+引擎守护进程
+在独立进程中持有已加载的表、字符串字典、索引和工作表目录，通过本地Unix域套接字为多个MCP服务器提供服务，
+同时打开的多个IDE会话共享同一份内存数据和热缓存。
+
+协议为每行一个JSON：
+    请求 {"id": 序号, "method": 方法名, "params": {参数}, "encoded": 是否返回编码后的结果}
+    响应 {"id": 序号, "result": 结果} 或 {"id": 序号, "error": {"type": 异常类型, "message": 说明}}
+encoded为true时成功响应为一行 {"id": 序号, "length": 字节数}，其后紧跟length字节的UTF-8结果JSON文本
+（result_format.encode_result），客户端不解析直接交给MCP响应。
+
+MCP服务器通过default_service访问引擎：
+- 默认在MCP服务器进程内执行（EXCEL_SQL_ENGINE=local），不启动其它进程
+- EXCEL_SQL_ENGINE=daemon且平台支持Unix域套接字时连接守护进程，守护进程不存在时自动启动
+  （在后台脱离MCP服务器运行，空闲后自动退出）；不支持Unix域套接字的平台（Windows）仍在进程内执行
+- 自动启动的守护进程默认由监督进程管理（engine_supervisor.py，EXCEL_SQL_SUPERVISE=0时直接启动）：健康检查、
+  异常退出后重启、重启有请求执行超过EXCEL_SQL_REQUEST_TIMEOUT秒的工作进程，以及按请求数或常驻内存预热替换工作进程。
+  替换时旧进程对新请求返回WorkerDraining（请求未执行），客户端在请求的超时时间内重新连接并在新进程上重发
+
+多个会话同时发出的相同只读请求（列出表、表结构、相同的SELECT、刷新同一目录）在服务内合并为一次执行
+（single_flight），合并次数见stats的coalescing。
+
+守护进程在没有连接且空闲EXCEL_SQL_DAEMON_IDLE秒（默认1800秒）后保存未保存的修改并退出。
+客户端的每个线程使用自己的连接，请求超过EXCEL_SQL_REQUEST_TIMEOUT秒（默认300秒，0表示不限制）没有响应时
+断开连接并抛出TimeoutError。
+
+用法:
+    python engine_daemon.py [--socket 套接字路径] [--idle 空闲秒数] [--supervise]
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from bulk_insert import BulkInsertError
+from excel_catalog import TableNotFoundError, default_cache_dir, default_catalog
+from excel_engine import default_engine
+from excel_schema import get_table_schema
+from query_export import ExportError
+from result_format import EncodedResult, LogPreview, encode_result
+from single_flight import SingleFlight, request_key
+from sql_engine import SqlError, UnsupportedSqlError
+from text_lookup import TextLookupError
+
+logger = logging.getLogger(__name__)
+
+ENGINE_MODE = os.environ.get("EXCEL_SQL_ENGINE", "local").lower()
+IDLE_TIMEOUT = float(os.environ.get("EXCEL_SQL_DAEMON_IDLE", "1800"))
+SUPERVISE = os.environ.get("EXCEL_SQL_SUPERVISE", "1") != "0"
+# 等待自动启动的守护进程开始监听的时间（秒）
+SPAWN_TIMEOUT = 15.0
+# 被替换的工作进程停止接受请求后，等待客户端迁移到新进程的最长时间（秒）
+DRAIN_GRACE = 10.0
+# 被替换的工作进程拒绝新请求后，最多等待进行中的请求多久（秒），超时则恢复服务并放弃这次替换
+DRAIN_WAIT = 10.0
+# 单个请求的最长执行时间（秒），0表示不限制：客户端超过该时间没有收到响应时断开连接并报错，
+# 监督进程重启有请求执行超过该时间的工作进程
+REQUEST_TIMEOUT = float(os.environ.get("EXCEL_SQL_REQUEST_TIMEOUT", "300"))
+
+# 可以在客户端按原类型重新抛出的异常，其余异常以RuntimeError抛出
+_ERROR_TYPES = {cls.__name__: cls for cls in (UnsupportedSqlError, SqlError, ExportError, BulkInsertError,
+                                               TextLookupError, ValueError, KeyError, FileNotFoundError, PermissionError)}
+
+
+class WorkerDraining(RuntimeError):
+    """工作进程正在被替换，请求没有执行，客户端重新连接后重发"""
+
+
+def default_socket_path() -> str:
+    """守护进程套接字路径：EXCEL_SQL_SOCKET，默认为缓存目录下的engine.sock"""
+    return os.environ.get("EXCEL_SQL_SOCKET") or os.path.join(default_cache_dir(), "engine.sock")
+
+
+def _absolute(path: Optional[str]) -> Optional[str]:
+    # 守护进程的工作目录与MCP服务器不同，相对路径在客户端解析
+    return os.path.abspath(path) if path else path
+
+
+def rss_bytes() -> int:
+    """当前进程的常驻内存（字节），没有/proc的平台返回峰值常驻内存"""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS以字节为单位，Linux以KB为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LocalEngineService:
+    """在当前进程内执行的引擎服务，也是守护进程实际调用的实现"""
+
+    def __init__(self):
+        # 同时到达的相同只读请求只执行一次
+        self.flights = SingleFlight()
+
+    def execute(self, sql: str, directory: str, fetch_all: bool = False, params: Optional[List[Any]] = None) -> Any:
+        return default_engine.execute(sql, directory, fetch_all, params)
+
+    def explain(self, sql: str, directory: str, params: Optional[List[Any]] = None, analyze: bool = True) -> Any:
+        return default_engine.explain(sql, directory, params, analyze)
+
+    def export_query(self, sql: str, directory: str, path: str, format: Optional[str] = None,
+                     params: Optional[List[Any]] = None) -> Dict[str, Any]:
+        return default_engine.export_query(sql, directory, path, format, params)
+
+    def bulk_insert(self, table_name: str, directory: str, source: Union[str, Dict[str, List[Any]]],
+                    skip_invalid: bool = False) -> Dict[str, Any]:
+        return default_engine.bulk_insert(table_name, directory, source, skip_invalid)
+
+    def lookup_text(self, keys: List[str], directory: str, languages: Optional[List[str]] = None,
+                    tables: Optional[List[str]] = None, key_column: str = "key") -> Dict[str, Any]:
+        return default_engine.lookup_text(keys, directory, languages, tables, key_column)
+
+    def table_names(self, directory: str) -> List[str]:
+        return default_catalog.table_names(directory)
+
+    def describe(self, directory: str) -> List[Dict[str, Any]]:
+        return default_catalog.describe(directory)
+
+    def table_schema(self, table_name: str, directory: str) -> Any:
+        return get_table_schema(table_name, directory)
+
+    def invalidate(self, directory: Optional[str] = None) -> None:
+        self.flights.do(request_key("invalidate", {"directory": directory}), lambda: self._invalidate(directory))
+
+    @staticmethod
+    def _invalidate(directory: Optional[str]) -> None:
+        default_catalog.invalidate(directory)
+        default_engine.invalidate(directory)
+
+    def commit(self, directory: Optional[str] = None) -> Dict[str, Any]:
+        return default_engine.commit(directory)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(default_engine.stats(), mode="local", pid=os.getpid(), coalescing=self.flights.stats())
+
+    def encoded(self, method: str, **params: Any) -> EncodedResult:
+        """调用方法并把结果编码为JSON文本，同时进行的相同只读请求共享一次执行和编码"""
+        key = None if method == "invalidate" else request_key(method, params, default_engine.writes)
+        if key is not None:
+            key += ("encoded",)
+        return self.flights.do(key, lambda: EncodedResult(encode_result(getattr(self, method)(**params))))
+
+    def start(self) -> None:
+        """服务器启动时调用：重放并保存上次进程留下的修改日志"""
+        default_engine.recover()
+
+
+# 守护进程对外提供的方法
+_METHODS = ("execute", "explain", "export_query", "bulk_insert", "lookup_text", "table_names", "describe", "table_schema", "invalidate", "commit", "stats")
+# 监督进程使用的控制方法，不计入请求数和空闲时间，替换期间照常执行
+_CONTROL_METHODS = ("ping", "resident", "warm", "drain", "activate")
+
+
+def _is_control(line: bytes) -> bool:
+    try:
+        return json.loads(line).get("method") in _CONTROL_METHODS
+    except (ValueError, AttributeError):
+        return False
+
+
+def _error_payload(error: Exception) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"type": type(error).__name__, "message": str(error)}
+    if isinstance(error, TableNotFoundError):
+        payload.update(table=error.table_name, available=error.available)
+    return payload
+
+
+def _raise_error(payload: Dict[str, Any]) -> None:
+    error_type = payload.get("type")
+    message = payload.get("message", "")
+    if error_type == TableNotFoundError.__name__:
+        raise TableNotFoundError(payload.get("table", ""), payload.get("available", []))
+    cls = _ERROR_TYPES.get(error_type)
+    if cls is not None:
+        raise cls(message)
+    raise RuntimeError(f"引擎守护进程错误 {error_type}: {message}")
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """处理一个客户端连接：按顺序读取请求行并逐个响应"""
+
+    def handle(self) -> None:
+        server: EngineDaemon = self.server
+        # 只发送控制方法的连接（监督进程的健康检查）不算客户端连接，不影响空闲退出
+        client = False
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                if not client and not _is_control(line):
+                    client = True
+                    server.connection_opened()
+                for chunk in server.dispatch(line):
+                    self.wfile.write(chunk)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            if client:
+                server.connection_closed()
+
+
+class EngineDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """引擎守护进程：每个连接一个线程，引擎内部自带锁"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: Optional[LocalEngineService] = None):
+        self.service = service or LocalEngineService()
+        self.started = time.time()
+        self.last_activity = time.monotonic()
+        self.connections = 0
+        self.requests = 0
+        # 进行中的请求：序号 -> (开始时间, 方法名)，健康检查报告最久的一个，监督进程据此发现挂起的请求
+        self._inflight: Dict[int, Tuple[float, str]] = {}
+        self._request_ids = itertools.count(1)
+        # 正在被替换：拒绝新的请求，进行中的请求结束时通知_drain
+        self.draining = False
+        self._state_lock = threading.Lock()
+        self._idle = threading.Condition(self._state_lock)
+        super().__init__(socket_path, _RequestHandler)
+
+    def server_bind(self) -> None:
+        # 只允许当前用户连接：套接字文件在bind时以0600创建，不存在其它用户可以连接的时间窗口
+        previous = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(previous)
+
+    def connection_opened(self) -> None:
+        with self._state_lock:
+            self.connections += 1
+            self.last_activity = time.monotonic()
+
+    def connection_closed(self) -> None:
+        with self._state_lock:
+            self.connections -= 1
+            self.last_activity = time.monotonic()
+
+    def idle_seconds(self) -> float:
+        with self._state_lock:
+            return 0.0 if self.connections else time.monotonic() - self.last_activity
+
+    def dispatch(self, line: bytes) -> List[bytes]:
+        """执行一行请求，返回依次写出的响应数据"""
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            method = request.get("method")
+            params = request.get("params", {})
+            if method in _CONTROL_METHODS:
+                result = self._control(method, params)
+            elif method not in _METHODS:
+                raise ValueError(f"未知方法: {method}")
+            else:
+                result = self._call(method, params, bool(request.get("encoded")))
+            if request.get("encoded"):
+                text = result.text if isinstance(result, EncodedResult) else encode_result(result)
+                payload = text.encode("utf-8")
+                return [(json.dumps({"id": request_id, "length": len(payload)}) + "\n").encode("utf-8"), payload]
+            response = {"id": request_id, "result": result}
+        except Exception as e:
+            if not isinstance(e, (SqlError, KeyError, FileNotFoundError, WorkerDraining)):
+                logger.exception("请求处理失败: %s", LogPreview(line, 200))
+            response = {"id": request_id, "error": _error_payload(e)}
+        return [(json.dumps(response, ensure_ascii=False, default=str) + "\n").encode("utf-8")]
+
+    def _call(self, method: str, params: Dict[str, Any], encoded: bool) -> Any:
+        with self._state_lock:
+            if self.draining:
+                raise WorkerDraining("引擎工作进程正在被替换，请重新连接")
+            self.requests += 1
+            token = next(self._request_ids)
+            self._inflight[token] = (time.monotonic(), method)
+            self.last_activity = time.monotonic()
+        try:
+            if method == "stats":
+                return self._stats()
+            if encoded:
+                return self.service.encoded(method, **params)
+            return getattr(self.service, method)(**params)
+        finally:
+            with self._state_lock:
+                del self._inflight[token]
+                self._idle.notify_all()
+
+    def _control(self, method: str, params: Dict[str, Any]) -> Any:
+        """执行监督进程的控制方法（见engine_supervisor）"""
+        if method == "ping":
+            with self._state_lock:
+                status = {"pid": os.getpid(), "requests": self.requests, "inflight": len(self._inflight),
+                          "connections": self.connections, "draining": self.draining}
+                if self._inflight:
+                    started, method = min(self._inflight.values())
+                    status.update(oldestRequest=round(time.monotonic() - started, 3), oldestMethod=method)
+            return dict(status, standby=default_engine.standby, rss=rss_bytes())
+        if method == "resident":
+            return default_engine.resident_tables()
+        if method == "warm":
+            return self._warm(params.get("tables") or [])
+        if method == "drain":
+            return self._drain(float(params.get("grace", DRAIN_GRACE)), float(params.get("wait", DRAIN_WAIT)))
+        result = default_engine.activate()
+        logger.info(f"工作进程开始服务 (pid {os.getpid()})")
+        return result
+
+    def _warm(self, tables: List[Dict[str, str]]) -> Dict[str, Any]:
+        """备用工作进程预热：加载被替换的工作进程已加载的表"""
+        started = time.perf_counter()
+        loaded = 0
+        for item in tables:
+            try:
+                default_engine.get_table(item["directory"], item["table"])
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"预热表 {item.get('table')} 失败: {e}")
+        seconds = time.perf_counter() - started
+        logger.info(f"预热完成: {loaded}/{len(tables)} 个表，{seconds:.1f} 秒")
+        return {"tables": loaded, "seconds": round(seconds, 3)}
+
+    def _drain(self, grace: float, wait: float) -> Dict[str, Any]:
+        """
+        停止服务以便替换：先在继续服务时保存修改，再拒绝新请求、等待进行中的请求结束并保存剩余的修改，
+        之后等待客户端迁移（最多grace秒）后退出
+
+        被拒绝的客户端在替换完成前不断重发，进行中的请求wait秒内没有全部结束时恢复服务、放弃这次替换，
+        不让一个长请求使其它请求在替换期间失败
+
+        Returns:
+            {"drained": 是否已停止服务, "saved": [文件名], "failed": {文件名: 错误信息}}，
+            放弃替换时附带仍在进行的请求数inflight
+        """
+        first = default_engine.commit()
+        deadline = time.monotonic() + wait
+        with self._state_lock:
+            self.draining = True
+            while self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.draining = False
+                    logger.warning(f"{len(self._inflight)} 个请求在 {wait:.0f} 秒内没有结束，恢复服务，放弃这次替换")
+                    return dict(first, drained=False, inflight=len(self._inflight))
+                self._idle.wait(remaining)
+        result = default_engine.commit()
+        threading.Thread(target=self._retire, args=(grace,), daemon=True).start()
+        return {"drained": True, "saved": sorted(set(first["saved"]) | set(result["saved"])),
+                "failed": dict(first["failed"], **result["failed"])}
+
+    def _retire(self, grace: float) -> None:
+        deadline = time.monotonic() + grace
+        while time.monotonic() < deadline:
+            with self._state_lock:
+                if not self.connections:
+                    break
+            time.sleep(0.1)
+        logger.info(f"工作进程已被替换，退出 (pid {os.getpid()})")
+        self.shutdown()
+
+    def _stats(self) -> Dict[str, Any]:
+        with self._state_lock:
+            connections, requests = self.connections, self.requests
+        return dict(default_engine.stats(), mode="daemon", pid=os.getpid(), connections=connections,
+                    requests=requests, uptime=round(time.time() - self.started, 1),
+                    coalescing=self.service.flights.stats())
+
+
+def acquire_daemon_lock(socket_path: str):
+    """取得守护进程锁，已有守护进程持有时返回None（多个客户端同时自动启动时只保留一个）"""
+    import fcntl
+    fp = open(socket_path + ".lock", "a+")
+    try:
+        fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fp.close()
+        return None
+    return fp
+
+
+def serve(socket_path: Optional[str] = None, idle_timeout: float = IDLE_TIMEOUT, worker: bool = False) -> bool:
+    """
+    运行守护进程直到空闲超时或收到SIGTERM/SIGINT
+
+    Args:
+        socket_path: 套接字路径，默认default_socket_path()
+        idle_timeout: 没有连接时的空闲退出秒数，0表示不自动退出
+        worker: 作为监督进程的工作进程运行：守护进程锁由监督进程持有，启动后处于备用状态，
+            收到activate后才恢复日志（见engine_supervisor）
+
+    Returns:
+        是否实际运行（已有守护进程在运行时返回False）
+    """
+    socket_path = socket_path or default_socket_path()
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    lock = None if worker else acquire_daemon_lock(socket_path)
+    if lock is None and not worker:
+        logger.info(f"守护进程已在运行: {socket_path}")
+        return False
+    try:
+        # 持有锁时残留的套接字文件来自已退出的守护进程（工作进程的套接字路径是监督进程分配的私有路径）
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = EngineDaemon(socket_path)
+        stop = threading.Event()
+
+        def shutdown(*_args) -> None:
+            stop.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        def watch_idle() -> None:
+            while not stop.wait(min(60.0, max(1.0, idle_timeout / 10))):
+                if server.idle_seconds() >= idle_timeout:
+                    logger.info(f"空闲 {idle_timeout:.0f} 秒，守护进程退出")
+                    shutdown()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        if idle_timeout > 0:
+            threading.Thread(target=watch_idle, daemon=True).start()
+        if worker:
+            default_engine.standby = True
+        else:
+            threading.Thread(target=server.service.start, daemon=True).start()
+        logger.info(f"引擎{'工作' if worker else '守护'}进程已启动: {socket_path} (pid {os.getpid()})")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            try:
+                os.remove(socket_path)
+            except OSError:
+                pass
+            result = default_engine.commit()
+            logger.info(f"守护进程已退出，保存结果: {result}")
+        return True
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def _peer_closed(sock: socket.socket) -> bool:
+    """空闲连接是否已被对端关闭（可读且读到EOF）"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and not sock.recv(1, socket.MSG_PEEK)
+    except OSError:
+        return True
+
+
+class EngineClient:
+    """
+    守护进程客户端，方法与LocalEngineService一致
+
+    每个线程使用自己的连接（MCP服务器在线程池中调用），一个请求等待响应时不阻塞其它线程的请求；
+    连接不存在或已断开时重新连接，必要时启动守护进程。请求发出之后连接断开或超过timeout秒没有响应时
+    不会重试（UPDATE/DELETE不能重复执行），以ConnectionError/TimeoutError抛出。
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, spawn: bool = True, timeout: float = REQUEST_TIMEOUT):
+        self.socket_path = socket_path or default_socket_path()
+        self.spawn = spawn
+        self.timeout = timeout
+        # 当前线程的连接（sock、reader）
+        self._local = threading.local()
+        # 所有线程的连接，close时全部关闭
+        self._sockets: Set[socket.socket] = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # 多个线程同时发现守护进程不存在时只启动一次
+        self._spawn_lock = threading.Lock()
+
+    @property
+    def _sock(self) -> Optional[socket.socket]:
+        return getattr(self._local, "sock", None)
+
+    def _connect_once(self) -> bool:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            return False
+        sock.settimeout(self.timeout if self.timeout > 0 else None)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        with self._lock:
+            self._sockets.add(sock)
+        return True
+
+    def _spawn_daemon(self) -> None:
+        log_path = os.path.join(os.path.dirname(os.path.abspath(self.socket_path)), "engine-daemon.log")
+        logger.info(f"启动引擎守护进程: {self.socket_path}")
+        command = [sys.executable, os.path.abspath(__file__), "--socket", self.socket_path]
+        if SUPERVISE:
+            command.append("--supervise")
+        with open(log_path, "ab") as log:
+            subprocess.Popen(command,
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), start_new_session=True)
+
+    def _ensure_connected(self) -> None:
+        if self._sock is not None or self._connect_once():
+            return
+        if not self.spawn:
+            raise ConnectionError(f"引擎守护进程未运行: {self.socket_path}")
+        with self._spawn_lock:
+            # 等待期间其它线程可能已经启动了守护进程
+            if self._connect_once():
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+            self._spawn_daemon()
+            deadline = time.monotonic() + SPAWN_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                if self._connect_once():
+                    return
+        raise ConnectionError(f"引擎守护进程在 {SPAWN_TIMEOUT:.0f} 秒内没有启动: {self.socket_path}")
+
+    def close(self) -> None:
+        """关闭所有线程的连接"""
+        with self._lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _close(self) -> None:
+        """关闭当前线程的连接"""
+        sock = self._sock
+        if sock is not None:
+            with self._lock:
+                self._sockets.discard(sock)
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = self._local.reader = None
+
+    def call(self, method: str, **params: Any) -> Any:
+        """发送一个请求并等待响应"""
+        return self._request(method, params, False)
+
+    def encoded(self, method: str, **params: Any) -> EncodedResult:
+        """发送一个请求，结果以守护进程编码好的JSON文本返回"""
+        return self._request(method, params, True)
+
+    def _request(self, method: str, params: Dict[str, Any], encoded: bool) -> Any:
+        # source为文件路径时同样在客户端解析
+        for name in ("directory", "path", "source"):
+            if isinstance(params.get(name), str) and params[name]:
+                params[name] = _absolute(params[name])
+        request = (json.dumps({"id": next(self._ids), "method": method, "params": params, "encoded": encoded},
+                              ensure_ascii=False) + "\n").encode("utf-8")
+        send_failures = 0
+        # 工作进程被替换期间（最多为旧进程等待进行中请求的时间加新进程接替的时间）在请求的超时时间内重发
+        deadline = time.monotonic() + self.timeout if self.timeout > 0 else None
+        while True:
+            self._ensure_connected()
+            if _peer_closed(self._sock):
+                # 守护进程已关闭这个连接（空闲退出或工作进程被替换），请求尚未发出，重新连接
+                self._close()
+                self._ensure_connected()
+            try:
+                self._sock.sendall(request)
+            except OSError:
+                # 守护进程已重启，旧连接失效，请求尚未送达时可以安全重试
+                self._close()
+                send_failures += 1
+                if send_failures > 1:
+                    raise
+                continue
+            reader = self._local.reader
+            try:
+                line = reader.readline()
+                if not line:
+                    self._close()
+                    raise ConnectionError("引擎守护进程在处理请求时断开连接")
+                response = json.loads(line)
+                if "length" in response:
+                    payload = reader.read(response["length"])
+                    if len(payload) != response["length"]:
+                        self._close()
+                        raise ConnectionError("引擎守护进程在发送结果时断开连接")
+                    return EncodedResult(payload.decode("utf-8"))
+            except socket.timeout:
+                # 连接上可能还会收到这个请求迟到的响应，不能再用于其它请求
+                self._close()
+                raise TimeoutError(f"引擎守护进程在 {self.timeout:.0f} 秒内没有响应（EXCEL_SQL_REQUEST_TIMEOUT），"
+                                   f"请求 {method} 可能仍在执行")
+            if response.get("error", {}).get("type") == WorkerDraining.__name__:
+                # 工作进程正在被替换，请求没有执行：等待公共套接字切换到新进程后重发
+                self._close()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"引擎工作进程在 {self.timeout:.0f} 秒内没有完成替换"
+                                       f"（EXCEL_SQL_REQUEST_TIMEOUT），请求 {method} 没有执行")
+                time.sleep(0.05)
+                continue
+            break
+        if "error" in response:
+            _raise_error(response["error"])
+        return response.get("result")
+
+    def execute(self, sql: str, directory: str, fetch_all: bool = False, params: Optional[List[Any]] = None) -> Any:
+        return self.call("execute", sql=sql, directory=directory, fetch_all=fetch_all, params=params)
+
+    def explain(self, sql: str, directory: str, params: Optional[List[Any]] = None, analyze: bool = True) -> Any:
+        return self.call("explain", sql=sql, directory=directory, params=params, analyze=analyze)
+
+    def export_query(self, sql: str, directory: str, path: str, format: Optional[str] = None,
+                     params: Optional[List[Any]] = None) -> Dict[str, Any]:
+        return self.call("export_query", sql=sql, directory=directory, path=path, format=format, params=params)
+
+    def bulk_insert(self, table_name: str, directory: str, source: Union[str, Dict[str, List[Any]]],
+                    skip_invalid: bool = False) -> Dict[str, Any]:
+        return self.call("bulk_insert", table_name=table_name, directory=directory, source=source,
+                         skip_invalid=skip_invalid)
+
+    def lookup_text(self, keys: List[str], directory: str, languages: Optional[List[str]] = None,
+                    tables: Optional[List[str]] = None, key_column: str = "key") -> Dict[str, Any]:
+        return self.call("lookup_text", keys=keys, directory=directory, languages=languages, tables=tables,
+                         key_column=key_column)
+
+    def table_names(self, directory: str) -> List[str]:
+        return self.call("table_names", directory=directory)
+
+    def describe(self, directory: str) -> List[Dict[str, Any]]:
+        return self.call("describe", directory=directory)
+
+    def table_schema(self, table_name: str, directory: str) -> Any:
+        return self.call("table_schema", table_name=table_name, directory=directory)
+
+    def invalidate(self, directory: Optional[str] = None) -> None:
+        return self.call("invalidate", directory=directory)
+
+    def commit(self, directory: Optional[str] = None) -> Dict[str, Any]:
+        return self.call("commit", directory=directory)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.call("stats")
+
+    def start(self) -> None:
+        """服务器启动时调用：提前连接（必要时启动）守护进程，日志恢复由守护进程完成"""
+        try:
+            self._ensure_connected()
+        except OSError as e:
+            logger.warning(f"连接引擎守护进程失败，将在第一次请求时重试: {e}")
+
+
+def create_service():
+    """按EXCEL_SQL_ENGINE和平台选择进程内服务（默认）或守护进程客户端"""
+    if ENGINE_MODE == "daemon" and hasattr(socket, "AF_UNIX"):
+        return EngineClient()
+    return LocalEngineService()
+
+
+# MCP服务器共用的引擎服务
+default_service = create_service()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Excel SQL引擎守护进程")
+    parser.add_argument("--socket", default=None, help="Unix域套接字路径")
+    parser.add_argument("--idle", type=float, default=IDLE_TIMEOUT, help="没有连接时的空闲退出秒数，0表示不退出")
+    parser.add_argument("--supervise", action="store_true", help="由监督进程启动和管理工作进程")
+    parser.add_argument("--worker", action="store_true", help="作为监督进程的工作进程运行（内部使用）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.supervise:
+        from engine_supervisor import supervise
+        supervise(args.socket, args.idle)
+    else:
+        serve(args.socket, args.idle, args.worker)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+引擎守护进程的监督进程
+客户端自动启动守护进程时默认启动监督进程（engine_daemon.py --supervise，EXCEL_SQL_SUPERVISE=0时直接启动守护进程）。
+监督进程持有守护进程锁，在私有套接字上启动工作进程（engine_daemon.py --worker），工作进程就绪后把公共套接字路径
+（硬链接）指向它，客户端不需要知道工作进程的变化。
+
+- 健康检查：每EXCEL_SQL_HEALTH_INTERVAL秒发送ping，连续3次超时或出错视为挂起，终止后重启；工作进程异常退出时
+  立即重启，连续失败时按指数退避（0.5秒起，最长30秒），稳定运行60秒后退避复位。ping同时报告最久的进行中请求
+  已执行的时间，超过EXCEL_SQL_REQUEST_TIMEOUT秒的请求视为挂起（ping仍能响应），同样终止后重启。
+  未保存的修改留在日志中，新的工作进程接替时重放并保存
+- 回收：工作进程处理的请求数达到EXCEL_SQL_WORKER_MAX_REQUESTS，或常驻内存超过EXCEL_SQL_WORKER_MAX_RSS字节时替换。
+  先启动备用工作进程并预热旧进程已加载的表（旧进程照常服务），再让旧进程保存修改、停止接受新请求并等待进行中的
+  请求完成，然后切换公共套接字；期间被拒绝的请求没有执行，客户端重新连接后在新进程上重发。进行中的请求
+  在DRAIN_WAIT秒内没有结束时旧进程恢复服务，放弃这次替换，下次健康检查时再试
+- 工作进程空闲退出时监督进程一起退出；收到SIGTERM/SIGINT时终止工作进程（保存修改）后退出
+
+环境变量:
+    EXCEL_SQL_HEALTH_INTERVAL: 健康检查间隔（秒，默认10）
+    EXCEL_SQL_HEALTH_TIMEOUT: 健康检查超时（秒，默认5）
+    EXCEL_SQL_WORKER_MAX_REQUESTS: 工作进程处理多少个请求后替换（默认0表示不限制）
+    EXCEL_SQL_WORKER_MAX_RSS: 工作进程常驻内存超过多少字节时替换（默认0表示不限制）
+    EXCEL_SQL_REQUEST_TIMEOUT: 请求执行超过多少秒时视为挂起并重启工作进程（默认300，0表示不检查）
+"""
+
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from engine_daemon import (DRAIN_GRACE, DRAIN_WAIT, IDLE_TIMEOUT, REQUEST_TIMEOUT, SPAWN_TIMEOUT,
+                           acquire_daemon_lock, default_socket_path)
+
+logger = logging.getLogger(__name__)
+
+HEALTH_INTERVAL = float(os.environ.get("EXCEL_SQL_HEALTH_INTERVAL", "10"))
+HEALTH_TIMEOUT = float(os.environ.get("EXCEL_SQL_HEALTH_TIMEOUT", "5"))
+MAX_REQUESTS = int(os.environ.get("EXCEL_SQL_WORKER_MAX_REQUESTS", "0"))
+MAX_RSS = int(os.environ.get("EXCEL_SQL_WORKER_MAX_RSS", "0"))
+# 连续多少次健康检查失败视为挂起
+HEALTH_FAILURES = 3
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+# 工作进程运行多久后重启退避复位（秒）
+STABLE_SECONDS = 60.0
+# 预热、停止和接替的等待时间（秒），预热可能需要解析较大的工作簿
+WARM_TIMEOUT = 600.0
+DRAIN_TIMEOUT = 120.0
+ACTIVATE_TIMEOUT = 300.0
+
+_DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine_daemon.py")
+
+
+def _control(path: str, method: str, timeout: Optional[float], **params: Any) -> Any:
+    """在新连接上向工作进程发送一个控制请求"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps({"id": 0, "method": method, "params": params}, ensure_ascii=False) + "\n")
+                     .encode("utf-8"))
+        with sock.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError(f"工作进程在处理 {method} 时断开连接")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(f"工作进程 {method} 失败: {response['error'].get('message')}")
+    return response.get("result")
+
+
+class _Worker:
+    """一个工作进程及其私有套接字路径"""
+
+    def __init__(self, process: subprocess.Popen, path: str):
+        self.process = process
+        self.path = path
+        self.started = time.monotonic()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def call(self, method: str, timeout: Optional[float] = HEALTH_TIMEOUT, **params: Any) -> Any:
+        return _control(self.path, method, timeout, **params)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """SIGTERM（工作进程保存修改后退出），超时后强制终止"""
+        if self.alive():
+            self.process.terminate()
+        self.wait(timeout)
+
+    def wait(self, timeout: float) -> None:
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"工作进程 {self.pid} 没有在 {timeout:.0f} 秒内退出，强制终止")
+            self.kill()
+
+    def kill(self) -> None:
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Supervisor:
+    """
+    监督一个工作进程：健康检查、异常后重启和按阈值预热替换
+
+    Args:
+        socket_path: 客户端连接的公共套接字路径
+        idle_timeout: 传给工作进程的空闲退出秒数
+    """
+
+    def __init__(self, socket_path: str, idle_timeout: float = IDLE_TIMEOUT):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.worker: Optional[_Worker] = None
+        # 公共套接字路径当前指向的套接字文件的inode，退出时只删除自己发布的路径
+        self._published: Optional[int] = None
+        self.restarts = 0
+        self.recycles = 0
+        self._sequence = itertools.count(1)
+        self._backoff = BACKOFF_INITIAL
+        self._stop = threading.Event()
+        # 工作进程退出或收到停止信号时唤醒健康检查循环
+        self._wake = threading.Event()
+
+    def stop(self, *_args) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _spawn(self) -> _Worker:
+        """启动备用工作进程并等待它响应ping"""
+        path = f"{self.socket_path}.{os.getpid()}-{next(self._sequence)}"
+        process = subprocess.Popen([sys.executable, _DAEMON_SCRIPT, "--socket", path,
+                                    "--idle", str(self.idle_timeout), "--worker"],
+                                   stdin=subprocess.DEVNULL, cwd=os.path.dirname(_DAEMON_SCRIPT))
+        worker = _Worker(process, path)
+        threading.Thread(target=self._watch_exit, args=(worker,), daemon=True).start()
+        deadline = time.monotonic() + SPAWN_TIMEOUT
+        while time.monotonic() < deadline:
+            if not worker.alive():
+                raise RuntimeError(f"工作进程启动失败，退出码 {process.returncode}")
+            try:
+                worker.call("ping")
+                return worker
+            except OSError:
+                time.sleep(0.05)
+        worker.kill()
+        raise RuntimeError(f"工作进程在 {SPAWN_TIMEOUT:.0f} 秒内没有启动")
+
+    def _watch_exit(self, worker: _Worker) -> None:
+        worker.process.wait()
+        self._wake.set()
+
+    def _publish(self, worker: _Worker) -> None:
+        """把公共套接字路径原子地指向工作进程，此后的新连接都由它处理"""
+        temp = f"{self.socket_path}.{os.getpid()}.tmp"
+        try:
+            if os.path.lexists(temp):
+                os.remove(temp)
+            os.link(worker.path, temp)
+            os.replace(temp, self.socket_path)
+        except OSError:
+            # 文件系统不支持套接字的硬链接时移动工作进程的套接字
+            os.replace(worker.path, self.socket_path)
+            worker.path = self.socket_path
+        self._published = os.stat(self.socket_path).st_ino
+        self.worker = worker
+
+    def _wait_backoff(self) -> None:
+        self._stop.wait(self._backoff)
+        self._backoff = min(BACKOFF_MAX, self._backoff * 2)
+
+    def _start(self) -> bool:
+        """启动工作进程（恢复日志）并接替公共套接字，失败时退避重试，直到成功或停止"""
+        while not self._stop.is_set():
+            worker = None
+            try:
+                worker = self._spawn()
+                worker.call("activate", timeout=ACTIVATE_TIMEOUT)
+                self._publish(worker)
+                logger.info(f"工作进程已就绪 (pid {worker.pid})")
+                return True
+            except (OSError, ValueError, RuntimeError) as e:
+                logger.error(f"启动工作进程失败: {e}")
+                if worker is not None:
+                    worker.kill()
+                self._wait_backoff()
+        return False
+
+    def _restart(self, reason: str) -> bool:
+        logger.error(f"工作进程 {self.worker.pid} {reason}，重启")
+        self.worker.kill()
+        self.restarts += 1
+        if time.monotonic() - self.worker.started < STABLE_SECONDS:
+            self._wait_backoff()
+        return self._start()
+
+    def _recycle_reason(self, status: Dict[str, Any]) -> Optional[str]:
+        if MAX_REQUESTS and status.get("requests", 0) >= MAX_REQUESTS:
+            return f"已处理 {status['requests']} 个请求"
+        if MAX_RSS and status.get("rss", 0) >= MAX_RSS:
+            return f"常驻内存 {status['rss'] >> 20}MB"
+        return None
+
+    @staticmethod
+    def _hung_reason(status: Dict[str, Any]) -> Optional[str]:
+        age = status.get("oldestRequest", 0)
+        if REQUEST_TIMEOUT > 0 and age > REQUEST_TIMEOUT:
+            return f"请求 {status.get('oldestMethod')} 已执行 {age:.0f} 秒（超过EXCEL_SQL_REQUEST_TIMEOUT）"
+        return None
+
+    def _recycle(self, reason: str) -> None:
+        """预热替换：新进程预热 -> 旧进程保存并停止接受请求 -> 新进程接替"""
+        old = self.worker
+        logger.info(f"替换工作进程 {old.pid}: {reason}")
+        try:
+            new = self._spawn()
+        except (OSError, RuntimeError) as e:
+            logger.error(f"启动替换的工作进程失败，继续使用当前进程: {e}")
+            self._wait_backoff()
+            return
+        try:
+            new.call("warm", timeout=WARM_TIMEOUT, tables=old.call("resident"))
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.error(f"预热替换的工作进程失败，继续使用当前进程: {e}")
+            new.kill()
+            self._wait_backoff()
+            return
+        try:
+            saved = old.call("drain", timeout=DRAIN_TIMEOUT, grace=DRAIN_GRACE, wait=DRAIN_WAIT)
+            if not saved.get("drained", True):
+                logger.warning(f"工作进程 {old.pid} 有 {saved.get('inflight')} 个请求在 {DRAIN_WAIT:.0f} 秒内没有结束，"
+                               f"放弃这次替换")
+                new.kill()
+                self._wait_backoff()
+                return
+            logger.info(f"工作进程 {old.pid} 已停止接受请求，保存结果: {saved}")
+        except (OSError, ValueError, RuntimeError) as e:
+            # 未保存的修改仍在日志中，由新进程接替时重放
+            logger.error(f"工作进程 {old.pid} 没有正常停止，强制终止: {e}")
+            old.kill()
+        try:
+            new.call("activate", timeout=ACTIVATE_TIMEOUT)
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.error(f"替换的工作进程恢复日志失败: {e}")
+        self._publish(new)
+        self.recycles += 1
+        logger.info(f"工作进程已替换: {old.pid} -> {new.pid}（第 {self.recycles} 次替换）")
+        # 旧进程等待客户端迁移后自行退出
+        threading.Thread(target=old.wait, args=(DRAIN_GRACE + 30.0,), daemon=True).start()
+
+    def run(self) -> None:
+        """启动工作进程并监督，直到工作进程空闲退出或收到停止信号"""
+        if not self._start():
+            return
+        failures = 0
+        while not self._stop.is_set():
+            self._wake.wait(HEALTH_INTERVAL)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            worker = self.worker
+            if not worker.alive():
+                if worker.process.returncode == 0:
+                    logger.info("工作进程已正常退出，监督进程退出")
+                    break
+                if not self._restart(f"异常退出（退出码 {worker.process.returncode}）"):
+                    break
+                failures = 0
+                continue
+            try:
+                status = worker.call("ping")
+            except (OSError, ValueError, RuntimeError) as e:
+                failures += 1
+                logger.warning(f"工作进程 {worker.pid} 健康检查失败（{failures}/{HEALTH_FAILURES}）: {e}")
+                if failures >= HEALTH_FAILURES:
+                    if not self._restart("没有响应"):
+                        break
+                    failures = 0
+                continue
+            failures = 0
+            hung = self._hung_reason(status)
+            if hung:
+                if not self._restart(hung):
+                    break
+                continue
+            if time.monotonic() - worker.started >= STABLE_SECONDS:
+                self._backoff = BACKOFF_INITIAL
+            reason = self._recycle_reason(status)
+            if reason:
+                self._recycle(reason)
+
+    def shutdown(self) -> None:
+        """终止工作进程并删除指向它的公共套接字"""
+        if self.worker is not None:
+            self.worker.stop()
+        try:
+            if os.stat(self.socket_path).st_ino == self._published:
+                os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+def supervise(socket_path: Optional[str] = None, idle_timeout: float = IDLE_TIMEOUT) -> bool:
+    """
+    运行监督进程直到工作进程空闲退出或收到SIGTERM/SIGINT
+
+    Args:
+        socket_path: 公共套接字路径，默认default_socket_path()
+        idle_timeout: 工作进程没有连接时的空闲退出秒数，0表示不自动退出
+
+    Returns:
+        是否实际运行（已有守护进程在运行时返回False）
+    """
+    socket_path = socket_path or default_socket_path()
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    lock = acquire_daemon_lock(socket_path)
+    if lock is None:
+        logger.info(f"守护进程已在运行: {socket_path}")
+        return False
+    try:
+        supervisor = Supervisor(socket_path, idle_timeout)
+        signal.signal(signal.SIGTERM, supervisor.stop)
+        signal.signal(signal.SIGINT, supervisor.stop)
+        logger.info(f"引擎监督进程已启动: {socket_path} (pid {os.getpid()})")
+        try:
+            supervisor.run()
+        finally:
+            supervisor.shutdown()
+            logger.info(f"监督进程已退出：重启 {supervisor.restarts} 次，替换 {supervisor.recycles} 次")
+        return True
+    finally:
+        lock.close()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+工作表目录
+从xl/workbook.xml、xl/_rels/workbook.xml.rels和每个工作表的<dimension>建立
+表名 → (工作簿, 工作表部件, 区域, 估计行数, 指纹) 的映射，不解析任何单元格数据。
+
+目录按Excel目录持久化到缓存目录（默认为系统临时目录下的ExcelSqlTool，
+可用环境变量EXCEL_SQL_CACHE_DIR覆盖），工作簿按(修改时间, 大小)判断是否需要重新读取，
+因此新进程列出未变化目录的表时只需对每个工作簿执行一次stat。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from atomic_io import atomic_write_json
+from xlsx_reader import (HEADER_ROWS, SKIPPED_SHEETS, dimension_last_row, list_workbook_sheets,
+                         read_sheet_dimension, sheet_fingerprint)
+
+logger = logging.getLogger(__name__)
+
+# 持久化格式版本，结构变化时递增
+CATALOG_FORMAT_VERSION = 1
+
+# 表名别名配置（{"tableMappings": {别名: 工作表名}}）
+DEFAULT_MAPPING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "table_mapping.json")
+MAPPING_FILE_NAME = "table_mapping.json"
+
+
+def default_cache_dir() -> str:
+    """缓存目录，与C#端SqliteManager一致放在系统临时目录的ExcelSqlTool下"""
+    return os.environ.get("EXCEL_SQL_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "ExcelSqlTool")
+
+
+@dataclass
+class CatalogEntry:
+    """目录条目：一个可查询的工作表"""
+    name: str
+    workbook: str
+    part: str
+    fingerprint: str
+    dimension: str = ""
+    row_estimate: int = 0
+
+    @property
+    def file_name(self) -> str:
+        return os.path.basename(self.workbook)
+
+    def to_info(self) -> Dict[str, Any]:
+        """供excel_list_sheets返回的摘要"""
+        return {
+            "table": self.name,
+            "file": self.file_name,
+            "dimension": self.dimension,
+            "rowCount": self.row_estimate,
+        }
+
+
+def list_workbook_files(directory: str) -> List[str]:
+    """列出目录下的xlsx文件（忽略Excel的~$锁文件），按文件名排序"""
+    if not directory or not os.path.isdir(directory):
+        return []
+    files = []
+    for entry in os.scandir(directory):
+        name = entry.name
+        if entry.is_file() and name.lower().endswith(".xlsx") and not name.startswith("~$"):
+            files.append(entry.path)
+    files.sort(key=lambda p: os.path.basename(p).lower())
+    return files
+
+
+def read_workbook_entries(path: str) -> List[CatalogEntry]:
+    """读取单个工作簿的目录条目，只解析workbook.xml、关系文件和各工作表开头的<dimension>"""
+    entries = []
+    with zipfile.ZipFile(path) as zf:
+        for info in list_workbook_sheets(zf):
+            if info.name in SKIPPED_SHEETS:
+                continue
+            try:
+                dimension = read_sheet_dimension(zf, info.part)
+            except KeyError:
+                logger.warning(f"{path} 中缺少工作表部件 {info.part}")
+                continue
+            entries.append(CatalogEntry(
+                name=info.name,
+                workbook=path,
+                part=info.part,
+                fingerprint=sheet_fingerprint(zf, info.part),
+                dimension=dimension,
+                row_estimate=max(0, dimension_last_row(dimension) - HEADER_ROWS),
+            ))
+    return entries
+
+
+def load_table_mappings(directory: str, mapping_file: Optional[str] = None) -> Dict[str, str]:
+    """
+    读取表名别名，优先使用Excel目录下的table_mapping.json，其次使用项目根目录的配置
+
+    Returns:
+        {别名: 工作表名}
+    """
+    candidates = [mapping_file] if mapping_file else [os.path.join(directory, MAPPING_FILE_NAME), DEFAULT_MAPPING_FILE]
+    for path in candidates:
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as fp:
+                    mappings = json.load(fp).get("tableMappings", {})
+                return {str(k): str(v) for k, v in mappings.items()}
+            except (OSError, ValueError, AttributeError) as e:
+                logger.warning(f"读取表名映射失败 {path}: {e}")
+    return {}
+
+
+class TableNotFoundError(KeyError):
+    """表名在目录中不存在"""
+
+    def __init__(self, table_name: str, available: List[str]):
+        self.table_name = table_name
+        self.available = available
+        message = f"表 '{table_name}' 不存在。\n"
+        message += "注意：表名应为Excel文件中的工作表名称，而不是Excel文件名。\n"
+        message += "可用的表名包括：\n"
+        for name in available:
+            message += f"  - {name}\n"
+        super().__init__(message)
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+class _DirectoryCatalog:
+    """单个Excel目录的目录数据"""
+
+    def __init__(self, directory: str, cache_file: str):
+        self.directory = directory
+        self.cache_file = cache_file
+        # 文件名 -> {"stat": [mtime_ns, size], "sheets": [条目字典]}
+        self.workbooks: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError) as e:
+            logger.warning(f"目录缓存读取失败，将重新建立: {e}")
+            return
+        if data.get("version") == CATALOG_FORMAT_VERSION and data.get("directory") == self.directory:
+            self.workbooks = data.get("workbooks", {})
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        try:
+            atomic_write_json(self.cache_file, {
+                "version": CATALOG_FORMAT_VERSION,
+                "directory": self.directory,
+                "workbooks": self.workbooks,
+            }, indent=None)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"目录缓存写入失败: {e}")
+
+    def entries(self) -> List[CatalogEntry]:
+        """按需刷新变化的工作簿并返回所有条目"""
+        result = []
+        present = set()
+        for path in list_workbook_files(self.directory):
+            file_name = os.path.basename(path)
+            present.add(file_name)
+            stat = os.stat(path)
+            key = [stat.st_mtime_ns, stat.st_size]
+            cached = self.workbooks.get(file_name)
+            if cached is None or cached.get("stat") != key:
+                try:
+                    sheets = [asdict(e) for e in read_workbook_entries(path)]
+                except (zipfile.BadZipFile, KeyError, OSError) as e:
+                    logger.warning(f"跳过无法读取的工作簿 {path}: {e}")
+                    sheets = []
+                cached = {"stat": key, "sheets": sheets}
+                self.workbooks[file_name] = cached
+                self.dirty = True
+            for sheet in cached["sheets"]:
+                sheet = dict(sheet, workbook=path)
+                result.append(CatalogEntry(**sheet))
+        for file_name in list(self.workbooks):
+            if file_name not in present:
+                del self.workbooks[file_name]
+                self.dirty = True
+        return result
+
+
+class SheetCatalog:
+    """持久化的工作表目录，线程安全"""
+
+    def __init__(self, cache_dir: Optional[str] = None, mapping_file: Optional[str] = None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.mapping_file = mapping_file
+        self._lock = threading.Lock()
+        self._directories: Dict[str, _DirectoryCatalog] = {}
+
+    def _cache_file(self, directory: str) -> str:
+        digest = hashlib.sha1(directory.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"catalog-{digest}.json")
+
+    def _directory(self, directory: str) -> _DirectoryCatalog:
+        directory = os.path.abspath(directory)
+        catalog = self._directories.get(directory)
+        if catalog is None:
+            catalog = _DirectoryCatalog(directory, self._cache_file(directory))
+            self._directories[directory] = catalog
+        return catalog
+
+    def entries(self, directory: str) -> List[CatalogEntry]:
+        """列出目录下所有工作表条目（按工作簿文件名、工作表顺序排列）"""
+        with self._lock:
+            catalog = self._directory(directory)
+            entries = catalog.entries()
+            catalog.save()
+        return entries
+
+    def table_names(self, directory: str) -> List[str]:
+        """列出目录下的表名（去重并排序，与SHOW TABLES一致）"""
+        return sorted({e.name for e in self.entries(directory)})
+
+    def aliases(self, directory: str) -> Dict[str, str]:
+        """返回目标存在于目录中的表名别名"""
+        names = {e.name for e in self.entries(directory)}
+        return {alias: target for alias, target in load_table_mappings(directory, self.mapping_file).items()
+                if target in names}
+
+    def describe(self, directory: str) -> List[Dict[str, Any]]:
+        """列出工作表摘要（表名、文件、区域、估计行数及别名）"""
+        entries = self.entries(directory)
+        names = {e.name for e in entries}
+        aliases: Dict[str, List[str]] = {}
+        for alias, target in load_table_mappings(directory, self.mapping_file).items():
+            if target in names:
+                aliases.setdefault(target, []).append(alias)
+        result = []
+        for entry in entries:
+            info = entry.to_info()
+            if entry.name in aliases:
+                info["aliases"] = aliases[entry.name]
+            result.append(info)
+        return result
+
+    def resolve(self, directory: str, table_name: str) -> CatalogEntry:
+        """
+        按表名查找工作表：精确匹配、忽略大小写匹配，最后按table_mapping.json中的别名匹配
+
+        Raises:
+            TableNotFoundError: 表不存在
+        """
+        entries = self.entries(directory)
+        for entry in entries:
+            if entry.name == table_name:
+                return entry
+        lowered = table_name.lower()
+        for entry in entries:
+            if entry.name.lower() == lowered:
+                return entry
+        mappings = load_table_mappings(directory, self.mapping_file)
+        target = mappings.get(table_name)
+        if target is None:
+            target = next((v for k, v in mappings.items() if k.lower() == lowered), None)
+        if target is not None:
+            for entry in entries:
+                if entry.name == target:
+                    return entry
+        raise TableNotFoundError(table_name, sorted({e.name for e in entries}))
+
+    def workbook_entries(self, directory: str, file_name: str) -> Optional[List[CatalogEntry]]:
+        """按Excel文件名（可不带.xlsx）查找该工作簿的全部工作表，不存在时返回None"""
+        if not file_name.lower().endswith(".xlsx"):
+            file_name += ".xlsx"
+        matched = [e for e in self.entries(directory) if e.file_name.lower() == file_name.lower()]
+        return matched or None
+
+    def invalidate(self, directory: Optional[str] = None) -> None:
+        """丢弃内存中的目录数据（指定目录时只丢弃该目录），下次访问时重新校验所有工作簿"""
+        with self._lock:
+            if directory is None:
+                targets = list(self._directories.values())
+                self._directories.clear()
+            else:
+                target = self._directories.pop(os.path.abspath(directory), None)
+                targets = [target] if target else []
+            for catalog in targets:
+                try:
+                    os.remove(catalog.cache_file)
+                except OSError:
+                    pass
+
+
+# 进程内共享的目录实例
+default_catalog = SheetCatalog()
@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+"""
+工作簿差异比较
+比较同一工作表的两个版本（或两个目录下的同名工作簿），按键列匹配行，报告新增、删除和修改的行以及修改的单元格。
+
+第一遍流式扫描两个版本的工作表XML，每行只保留键和单元格内容的哈希（内存与行数成正比，不保存整行数据）；
+第二遍只解码哈希不同的行，给出逐单元格的差异。
+- 共享字符串按内容比较，两个版本的共享字符串表顺序不同不影响结果；单元格引用中的行号、属性的顺序和
+  样式等其它属性（s、cm、vm、ph）不参与比较，t="n"与省略t相同
+- 列按字段名对齐，列的增删只在columnsAdded/columnsRemoved中报告，行差异只比较两个版本共有的列
+- 工作表部件和共享字符串表的CRC/大小都相同的工作表直接判定为未变化，不解压
+
+用法:
+    python excel_diff.py 旧文件或目录 新文件或目录 [--sheet 表名] [--key 列名] [--limit 行数] [--output diff.json]
+"""
+
+import argparse
+import bisect
+import html
+import json
+import logging
+import os
+import re
+import sys
+import time
+import zipfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from excel_catalog import list_workbook_files
+from xlsx_reader import (HEADER_ROWS, SHARED_STRINGS_PART, SKIPPED_SHEETS, Column, _number, column_letter,
+                         is_numeric, list_workbook_sheets, part_signature, read_shared_string_items,
+                         read_sheet_header)
+
+logger = logging.getLogger(__name__)
+
+# 每类差异（新增/删除/修改）最多返回的行明细数，计数不受影响
+DIFF_DETAIL_LIMIT = 100
+# 流式解压时每次读取的字节数
+_CHUNK_SIZE = 1 << 20
+
+_ROW_NUMBER = re.compile(rb'\br="(\d+)"')
+_ROW_START = re.compile(rb'<row\b[^>]*?\sr="(\d+)"')
+# (单元格属性, 单元格内容)，属性顺序任意
+_CELL = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_ATTRIBUTE = re.compile(rb'''([\w:]+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+_COLUMN_LETTERS = re.compile(rb"[A-Z]+")
+_VALUE = re.compile(rb"<v>([^<]*)</v>")
+_TEXT = re.compile(rb"<t\b[^>]*>([^<]*)</t>")
+_PHONETIC = re.compile(rb"<rPh\b.*?</rPh>", re.S)
+# 第一遍比较前的规范化：单元格开始标签统一为 <c r="单元格引用"[ t="类型"]>，替换共享字符串索引，映射列字母。
+# Excel和NPOI写出的形式（r在最前，可选的s和t）只需去掉样式，其它属性顺序或带其它属性的标签逐个解析
+_OTHER_CELL_TAG = re.compile(rb'<c\b(?! r="[A-Z]+\d+"(?: s="\d+")?(?: t="(?!n")\w+")?/?>)([^>]*?)(/?)>')
+_CELL_STYLE = re.compile(rb' s="\d+"')
+_CELL_TAG_STYLE = re.compile(rb'(<c r="[A-Z]+\d+") s="\d+"')
+# 单元格的属性只有r、s、t、cm、vm、ph（ECMA-376 CT_Cell）；去掉s后块中没有cm/vm（m="）、ph（h="）、t="n"，
+# 且每个单元格标签都以r开头时，单元格标签都是 <c r="..."[ t="..."]> 形式，不需要逐个解析
+# （换行、单引号表示格式化输出或不常见的写法，也逐个解析）
+_UNUSUAL_CELL_MARKERS = (b"\n", b"'", b'm="', b'h="', b't="n"')
+# 单元格引用中的行号，插入或删除行后整体变化，不参与比较
+_CELL_ROW_NUMBER = re.compile(rb'(<c r="[A-Z]+)\d+"')
+
+
+def _has_free_text(xml: bytes) -> bool:
+    """
+    是否有内联字符串或公式（t="str"的公式结果总是带有<f>），其中可能出现任意文本；
+    没有时<v>中只有数字，属性值只出现在标签中。只有数字内容的行中小写f只会出现在<f>中，单字节查找快得多
+    """
+    return b"f" in xml or b"<is" in xml
+_SHARED_INDEX = re.compile(rb't="s"><v>(\d+)</v>')
+_NORMALIZED_CELL = re.compile(rb'<c r="([A-Z]+)\d*"[^>]*?(?:/>|>.*?</c>)', re.S)
+_CELL_XML = re.compile(rb'<c r="[A-Z]+"[^>]*?(?:/>|>.*?</c>)', re.S)
+
+
+def cell_attributes(raw: bytes) -> Dict[bytes, bytes]:
+    """解析单元格开始标签中的属性（顺序任意，单双引号均可）"""
+    return {name: double or single for name, double, single in _ATTRIBUTE.findall(raw)}
+
+
+def _canonical_cell_tag(m) -> bytes:
+    attributes = cell_attributes(m.group(1))
+    reference = attributes.get(b"r")
+    cell_type = attributes.get(b"t", b"n")
+    return (b"<c" + (b' r="' + reference + b'"' if reference else b"")
+            + (b' t="' + cell_type + b'"' if cell_type != b"n" else b"") + m.group(2) + b">")
+
+
+def canonical_cells(block: bytes, free_text: Optional[bool] = None) -> bytes:
+    """
+    把单元格开始标签规范为 <c r="单元格引用"[ t="类型"]>：统一属性顺序，去掉引用和类型以外的属性
+
+    Args:
+        block: 由完整的<row>组成的数据块
+        free_text: _has_free_text(block)，调用方已计算时传入
+    """
+    if free_text if free_text is not None else _has_free_text(block):
+        block = _OTHER_CELL_TAG.sub(_canonical_cell_tag, block)
+        return _CELL_TAG_STYLE.sub(rb"\1", block)
+    # 只有数字内容时样式属性只会出现在单元格标签中，可以整体去掉
+    block = _CELL_STYLE.sub(b"", block)
+    if block.count(b"<c") != block.count(b'<c r="') or any(marker in block for marker in _UNUSUAL_CELL_MARKERS):
+        block = _OTHER_CELL_TAG.sub(_canonical_cell_tag, block)
+    return block
+
+
+def _text(raw: bytes) -> str:
+    text = raw.decode("utf-8")
+    return html.unescape(text) if "&" in text else text
+
+
+def decode_cell(cell_type: bytes, inner: bytes, shared_strings: List[str]) -> Any:
+    """解码_CELL匹配到的单元格，规则与xlsx_reader._cell_value一致"""
+    if cell_type == b"inlineStr":
+        return "".join(_text(t) for t in _TEXT.findall(_PHONETIC.sub(b"", inner)))
+    match = _VALUE.search(inner)
+    if match is None:
+        return None
+    value = match.group(1)
+    if cell_type == b"s":
+        if value[:1] == b"~":
+            # 规范化时写入的、新版本共享字符串表中不存在的文本
+            return _text(value[1:])
+        try:
+            return shared_strings[int(value)]
+        except (ValueError, IndexError):
+            return None
+    if cell_type == b"b":
+        return value == b"1"
+    if cell_type in (b"str", b"e"):
+        return _text(value)
+    return _number(value.decode("ascii", errors="replace"))
+
+
+class SharedStrings:
+    """
+    共享字符串表：保留每个<si>的原始XML，按索引访问时才解码为文本
+
+    两个版本的共享字符串表直接比较原始XML，不需要先解码全部字符串
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.items: List[bytes] = read_shared_string_items(zf)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index: int) -> str:
+        item = self.items[index]
+        if b"<rPh" in item:
+            item = _PHONETIC.sub(b"", item)
+        return "".join(map(_text, _TEXT.findall(item)))
+
+
+def iter_raw_rows(zf: zipfile.ZipFile, part: str, transform: Optional[Callable[[bytes], bytes]] = None,
+                  wanted: Optional[List[int]] = None, canonical: bool = False) -> Iterator[Tuple[int, bytes]]:
+    """
+    流式遍历工作表的<row>，每次只在内存中保留一个数据块
+
+    Args:
+        zf: 已打开的xlsx压缩包
+        part: 工作表部件路径
+        transform: 对每个数据块（由完整的<row>组成）做的整体替换，在逐行切分之前执行
+        wanted: 升序的行索引，给出时跳过不含这些行的数据块（不切分行）
+        canonical: 先用canonical_cells规范单元格标签（在transform之前），并去掉单元格引用中的行号
+            （<c r="A5" -> <c r="A"），插入或删除行后行号整体变化，不参与比较
+
+    Yields:
+        (从0开始的行索引, <row>内的XML)
+    """
+    next_row = 0
+    buffer = b""
+    with zf.open(part) as fp:
+        while True:
+            chunk = fp.read(_CHUNK_SIZE)
+            if chunk:
+                buffer += chunk
+                end = buffer.rfind(b"</row>")
+                if end < 0:
+                    continue
+                end += len(b"</row>")
+                block, buffer = buffer[:end], buffer[end:]
+            else:
+                block, buffer = buffer, b""
+            if wanted is not None:
+                first = _ROW_START.search(block)
+                last = _ROW_START.search(block, block.rfind(b"<row "))
+                if first is not None and last is not None:
+                    low, high = int(first.group(1)) - 1, int(last.group(1)) - 1
+                    position = bisect.bisect_left(wanted, low)
+                    if position == len(wanted) or wanted[position] > high:
+                        next_row = high + 1
+                        if not chunk:
+                            break
+                        continue
+            free_text = False
+            if canonical:
+                free_text = _has_free_text(block)
+                block = canonical_cells(block, free_text)
+            if transform is not None:
+                block = transform(block)
+            # 块中只有数字内容时行号只会出现在单元格引用中，可以按行整体替换；
+            # transform写入的新版本共享字符串表中不存在的文本以~开头，也可能包含任意文本
+            free_text = free_text or canonical and b"~" in block
+            # 按"<row"切分比整块正则匹配快数倍
+            for piece in block.split(b"<row")[1:]:
+                head, _, body = piece.partition(b">")
+                if head[:1] not in (b" ", b"", b"/"):
+                    continue
+                if head[:4] == b' r="':
+                    row_index = int(head[4:head.index(b'"', 4)]) - 1
+                else:
+                    number = _ROW_NUMBER.search(head)
+                    row_index = int(number.group(1)) - 1 if number else next_row
+                next_row = row_index + 1
+                body = b"" if head.endswith(b"/") else body[:body.rfind(b"</row>")]
+                if canonical:
+                    body = _CELL_ROW_NUMBER.sub(rb'\1"', body) if free_text else \
+                        body.replace(b'%d"' % (row_index + 1), b'"')
+                yield row_index, body
+            if not chunk:
+                break
+
+
+class _SheetVersion:
+    """一个版本的工作表：列定义和共享字符串表"""
+
+    def __init__(self, path: str, zf: zipfile.ZipFile, part: str):
+        self.path = path
+        self.zf = zf
+        self.part = part
+        self.columns: List[Column] = read_sheet_header(zf, part)
+        self.letters: Dict[str, bytes] = {c.name: column_letter(c.index).encode("ascii") for c in self.columns}
+        self.shared_strings = SharedStrings(zf)
+
+
+def _block_normalizer(letters: Optional[Dict[bytes, bytes]], strings: Optional[List[bytes]]
+                      ) -> Callable[[bytes], bytes]:
+    """
+    生成把数据块转换为可直接比较形式的函数：按需映射列和共享字符串（单元格标签已由iter_raw_rows规范化）
+
+    Args:
+        letters: 列字母 -> 比较用的列字母，不在其中的列被去掉；None表示列布局相同
+        strings: 共享字符串索引 -> 比较用的标识（新版本中的索引或转义后的文本），None表示索引可以直接比较
+    """
+    replacements = {b"%d" % index: b't="s"><v>' + value + b"</v>" for index, value in enumerate(strings or ())}.get
+
+    def shared(m):
+        return replacements(m[1], b't="s"><v>?</v>')
+
+    def cell(m):
+        letter = letters.get(m.group(1))
+        return b"" if letter is None else b'<c r="' + letter + m.group(0)[len(m.group(1)) + 6:]
+
+    def normalize(block: bytes) -> bytes:
+        if strings is not None:
+            block = _SHARED_INDEX.sub(shared, block)
+        if letters is not None:
+            block = _NORMALIZED_CELL.sub(cell, block)
+        return block
+    return normalize
+
+
+class _RowHashes:
+    """一个版本中每个键对应的行哈希和行索引"""
+
+    def __init__(self):
+        self.rows: Dict[Any, Tuple[int, int]] = {}
+        self.duplicates = 0
+        self.count = 0
+
+
+def _hash_rows(version: _SheetVersion, normalize: Callable[[bytes], bytes], letters: Optional[Dict[bytes, bytes]],
+               key_letter: bytes, strings: List[str]) -> _RowHashes:
+    """
+    第一遍扫描：每行只保留键、规范化后行内容的哈希和行索引
+
+    数据行从元数据行之后第一个A列为数值的行开始（与列式表加载规则一致）
+
+    Args:
+        version: 工作表版本
+        key_letter: 规范化后键列的列字母
+        normalize: _block_normalizer生成的函数
+        letters: 传给_block_normalizer的列映射；列被重新映射时单元格先按列排序再计算哈希
+        key_letter: 规范化后键列的列字母
+        strings: 解码规范化后的共享字符串索引所用的共享字符串表
+    """
+    hashes = _RowHashes()
+    rows = hashes.rows
+    first_letter = b"A" if letters is None else letters.get(b"A")
+    first_cell = re.compile(rb'<c r="' + (first_letter or b"A") + rb'"(?: t="(\w+)")?(?:/>|>(.*?)</c>)', re.S)
+    key_cell = re.compile(rb'<c r="' + key_letter + rb'"(?: t="(\w+)")?(?:/>|>(.*?)</c>)', re.S)
+    started = False
+    for row_index, body in iter_raw_rows(version.zf, version.part, normalize, canonical=True):
+        if row_index < HEADER_ROWS:
+            continue
+        if not started and first_letter is not None:
+            first = first_cell.search(body)
+            if first is None or not is_numeric(decode_cell(first.group(1), first.group(2), strings)):
+                continue
+            started = True
+        hashes.count += 1
+        # 键按规范化后的原始XML比较，只有输出明细时才解码
+        match = key_cell.search(body)
+        key = match.group() if match else None
+        if key is None or key in rows:
+            # 重复或为空的键按出现次序区分
+            hashes.duplicates += key is not None
+            occurrence = 2
+            while (key, occurrence) in rows:
+                occurrence += 1
+            key = (key, occurrence)
+        rows[key] = (hash(body if letters is None else tuple(sorted(_CELL_XML.findall(body)))), row_index)
+    return hashes
+
+
+def _decode_rows(version: _SheetVersion, wanted: set) -> Dict[int, Dict[str, Any]]:
+    """解码指定行索引的行，返回 行索引 -> {字段名: 值}"""
+    names = {column_letter(c.index).encode("ascii"): c.name for c in version.columns}
+    decoded = {}
+    if not wanted:
+        return decoded
+    remaining = len(wanted)
+    for row_index, body in iter_raw_rows(version.zf, version.part, wanted=sorted(wanted)):
+        if row_index not in wanted:
+            continue
+        row = {}
+        for raw, inner in _CELL.findall(body):
+            attributes = cell_attributes(raw)
+            letters = _COLUMN_LETTERS.match(attributes.get(b"r", b""))
+            name = names.get(letters.group()) if letters else None
+            if name is not None:
+                row[name] = decode_cell(attributes.get(b"t", b""), inner, version.shared_strings)
+        decoded[row_index] = row
+        remaining -= 1
+        if remaining == 0:
+            break
+    return decoded
+
+
+def diff_sheet(old_path: str, new_path: str, sheet: str, key: Optional[str] = None,
+               limit: int = DIFF_DETAIL_LIMIT) -> Dict[str, Any]:
+    """
+    比较同一工作表的两个版本
+
+    Args:
+        old_path: 旧版本工作簿路径
+        new_path: 新版本工作簿路径
+        sheet: 工作表名称
+        key: 用于匹配行的键列，默认为第一列
+        limit: 每类差异最多返回的行明细数
+
+    Returns:
+        {"sheet", "key", "columnsAdded", "columnsRemoved", "rows": {"old", "new"}, "added", "removed",
+         "changed", "unchanged", "formatOnly", "duplicateKeys", "addedRows", "removedRows", "changedRows", "truncated", "elapsedMs"}
+
+    Raises:
+        ValueError: 工作表或键列不存在
+    """
+    started = time.perf_counter()
+    with zipfile.ZipFile(old_path) as old_zf, zipfile.ZipFile(new_path) as new_zf:
+        old_parts = {s.name: s.part for s in list_workbook_sheets(old_zf)}
+        new_parts = {s.name: s.part for s in list_workbook_sheets(new_zf)}
+        if sheet not in old_parts or sheet not in new_parts:
+            raise ValueError(f"工作表 '{sheet}' 不同时存在于 {old_path} 和 {new_path}")
+        old = _SheetVersion(old_path, old_zf, old_parts[sheet])
+        new = _SheetVersion(new_path, new_zf, new_parts[sheet])
+        common = [c.name for c in new.columns if c.name in old.letters]
+        key = key or (new.columns[0].name if new.columns else None)
+        if key not in common:
+            raise ValueError(f"键列 '{key}' 不同时存在于两个版本的工作表 {sheet} 中")
+
+        # 列位置一致时直接比较列字母，否则按字段名映射到新版本的列字母
+        same_layout = all(old.letters[name] == new.letters[name] for name in common) and \
+            len(common) == len(old.columns) == len(new.columns)
+        old_letters = new_letters = None
+        if not same_layout:
+            old_letters = {old.letters[name]: new.letters[name] for name in common}
+            new_letters = {new.letters[name]: new.letters[name] for name in common}
+        # 新版本的共享字符串表以旧版本为前缀（只在末尾追加）时索引可以直接比较
+        old_strings = None
+        if part_signature(old_zf, SHARED_STRINGS_PART) != part_signature(new_zf, SHARED_STRINGS_PART):
+            old_items, new_items = old.shared_strings.items, new.shared_strings.items
+            if new_items[:len(old_items)] != old_items:
+                # 逆序构造使重复的字符串取第一次出现的索引
+                positions = dict(zip(reversed(new_items), range(len(new_items) - 1, -1, -1)))
+                old_strings = [b"%d" % positions[item] if item in positions else
+                               b"~" + html.escape(old.shared_strings[index], quote=False).encode("utf-8")
+                               for index, item in enumerate(old_items)]
+
+        old_hashes = _hash_rows(old, _block_normalizer(old_letters, old_strings), old_letters,
+                                old.letters[key] if old_letters is None else new.letters[key],
+                                old.shared_strings if old_strings is None else new.shared_strings)
+        new_hashes = _hash_rows(new, _block_normalizer(new_letters, None), new_letters, new.letters[key],
+                                new.shared_strings)
+
+        old_rows, new_rows = old_hashes.rows, new_hashes.rows
+        removed = [k for k in old_rows if k not in new_rows]
+        added = [k for k in new_rows if k not in old_rows]
+        changed = [k for k, (digest, _) in new_rows.items() if k in old_rows and old_rows[k][0] != digest]
+        removed.sort(key=lambda k: old_rows[k][1])
+        added.sort(key=lambda k: new_rows[k][1])
+        changed.sort(key=lambda k: new_rows[k][1])
+
+        # 哈希不同的行可能只是表示形式不同（如数值写法），解码后逐列确认；只确认明细所需的前若干行
+        verify = changed[:max(limit, 1) * 4]
+        old_wanted = {old_rows[k][1] for k in removed[:limit]} | {old_rows[k][1] for k in verify}
+        new_wanted = {new_rows[k][1] for k in added[:limit]} | {new_rows[k][1] for k in verify}
+        old_decoded = _decode_rows(old, old_wanted)
+        new_decoded = _decode_rows(new, new_wanted)
+
+    changed_rows = []
+    identical = 0
+    for k in verify:
+        before = old_decoded.get(old_rows[k][1], {})
+        after = new_decoded.get(new_rows[k][1], {})
+        cells = {name: {"old": before.get(name), "new": after.get(name)}
+                 for name in common if before.get(name) != after.get(name)}
+        if not cells:
+            identical += 1
+            continue
+        if len(changed_rows) < limit:
+            changed_rows.append({"key": after.get(key), "oldRow": old_rows[k][1] + 1,
+                                 "newRow": new_rows[k][1] + 1, "cells": cells})
+    changed_count = len(changed) - identical
+
+    def detail(keys: List[Any], rows: Dict[Any, Tuple[int, int]], decoded: Dict[int, Dict[str, Any]]):
+        return [{"key": decoded.get(rows[k][1], {}).get(key), "row": rows[k][1] + 1, "values": decoded.get(rows[k][1], {})}
+                for k in keys[:limit]]
+
+    return {
+        "sheet": sheet,
+        "old": old_path,
+        "new": new_path,
+        "key": key,
+        "columnsAdded": [c.name for c in new.columns if c.name not in old.letters],
+        "columnsRemoved": [c.name for c in old.columns if c.name not in new.letters],
+        "rows": {"old": old_hashes.count, "new": new_hashes.count},
+        "added": len(added),
+        "removed": len(removed),
+        "changed": changed_count,
+        "unchanged": len(new_rows) - len(added) - changed_count,
+        "formatOnly": identical,
+        "duplicateKeys": old_hashes.duplicates + new_hashes.duplicates,
+        "addedRows": detail(added, new_rows, new_decoded),
+        "removedRows": detail(removed, old_rows, old_decoded),
+        "changedRows": changed_rows,
+        "truncated": len(added) > limit or len(removed) > limit or changed_count > len(changed_rows),
+        "elapsedMs": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _unchanged(old_zf: zipfile.ZipFile, old_part: str, new_zf: zipfile.ZipFile, new_part: str) -> bool:
+    """工作表部件和共享字符串表的CRC/大小都相同，只读取zip目录"""
+    return (old_zf.NameToInfo[old_part].CRC == new_zf.NameToInfo[new_part].CRC
+            and old_zf.NameToInfo[old_part].file_size == new_zf.NameToInfo[new_part].file_size
+            and part_signature(old_zf, SHARED_STRINGS_PART) == part_signature(new_zf, SHARED_STRINGS_PART))
+
+
+def diff_workbooks(old_path: str, new_path: str, sheet: Optional[str] = None, key: Optional[str] = None,
+                   limit: int = DIFF_DETAIL_LIMIT) -> Dict[str, Any]:
+    """
+    比较两个版本的工作簿
+
+    Returns:
+        {"old", "new", "sheetsAdded", "sheetsRemoved", "unchangedSheets", "sheets": [diff_sheet的结果], "errors"}
+    """
+    with zipfile.ZipFile(old_path) as old_zf, zipfile.ZipFile(new_path) as new_zf:
+        old_parts = {s.name: s.part for s in list_workbook_sheets(old_zf) if s.name not in SKIPPED_SHEETS}
+        new_parts = {s.name: s.part for s in list_workbook_sheets(new_zf) if s.name not in SKIPPED_SHEETS}
+        names = [n for n in new_parts if n in old_parts and (sheet is None or n == sheet)]
+        unchanged = [n for n in names if _unchanged(old_zf, old_parts[n], new_zf, new_parts[n])]
+    if sheet is not None and not names:
+        raise ValueError(f"工作表 '{sheet}' 不同时存在于 {old_path} 和 {new_path}")
+    result: Dict[str, Any] = {
+        "old": old_path,
+        "new": new_path,
+        "sheetsAdded": [n for n in new_parts if n not in old_parts] if sheet is None else [],
+        "sheetsRemoved": [n for n in old_parts if n not in new_parts] if sheet is None else [],
+        "unchangedSheets": unchanged,
+        "sheets": [],
+        "errors": {},
+    }
+    for name in [n for n in names if n not in unchanged]:
+        try:
+            diff = diff_sheet(old_path, new_path, name, key, limit)
+        except ValueError as e:
+            if sheet is not None:
+                raise
+            result["errors"][name] = str(e)
+            continue
+        if diff["added"] or diff["removed"] or diff["changed"] or diff["columnsAdded"] or diff["columnsRemoved"]:
+            result["sheets"].append(diff)
+        else:
+            # 只有样式或单元格顺序等不影响内容的变化
+            unchanged.append(name)
+    return result
+
+
+def diff_paths(old_path: str, new_path: str, sheet: Optional[str] = None, key: Optional[str] = None,
+               limit: int = DIFF_DETAIL_LIMIT) -> Dict[str, Any]:
+    """
+    比较两个工作簿，或两个目录下的同名工作簿
+
+    Args:
+        old_path: 旧版本的xlsx文件或目录
+        new_path: 新版本的xlsx文件或目录（与old_path同为文件或同为目录）
+        sheet: 只比较该工作表
+        key: 用于匹配行的键列，默认为每个工作表的第一列
+        limit: 每个工作表每类差异最多返回的行明细数，0表示只返回数量
+
+    Returns:
+        文件: diff_workbooks的结果；目录: {"old", "new", "filesAdded", "filesRemoved", "workbooks": [...]}
+
+    Raises:
+        ValueError: 路径不存在、一个是文件另一个是目录，或limit为负数
+    """
+    if limit < 0:
+        raise ValueError(f"limit不能为负数: {limit}")
+    for path in (old_path, new_path):
+        if not os.path.exists(path):
+            raise ValueError(f"路径不存在: {path}")
+    if os.path.isdir(old_path) != os.path.isdir(new_path):
+        raise ValueError("两个路径需要同为xlsx文件或同为目录")
+    if not os.path.isdir(old_path):
+        return diff_workbooks(old_path, new_path, sheet, key, limit)
+
+    old_files = {os.path.basename(p).lower(): p for p in list_workbook_files(old_path)}
+    new_files = {os.path.basename(p).lower(): p for p in list_workbook_files(new_path)}
+    workbooks = []
+    for name, path in new_files.items():
+        if name not in old_files:
+            continue
+        if sheet is not None:
+            with zipfile.ZipFile(path) as zf, zipfile.ZipFile(old_files[name]) as old_zf:
+                if not any(s.name == sheet for s in list_workbook_sheets(zf)) or \
+                        not any(s.name == sheet for s in list_workbook_sheets(old_zf)):
+                    continue
+        diff = diff_workbooks(old_files[name], path, sheet, key, limit)
+        if diff["sheets"] or diff["sheetsAdded"] or diff["sheetsRemoved"] or diff["errors"]:
+            workbooks.append(diff)
+    return {
+        "old": old_path,
+        "new": new_path,
+        "filesAdded": [os.path.basename(p) for n, p in new_files.items() if n not in old_files],
+        "filesRemoved": [os.path.basename(p) for n, p in old_files.items() if n not in new_files],
+        "workbooks": workbooks,
+    }
+
+
+def current_version_path(old_path: str, directory: str) -> str:
+    """
+    与旧版本对应的当前版本路径：旧版本为目录时为当前Excel目录，为文件时为当前目录下的同名文件
+
+    Args:
+        old_path: 旧版本的xlsx文件或目录（如版本库中导出的历史版本）
+        directory: 当前Excel目录
+    """
+    return directory if os.path.isdir(old_path) else os.path.join(directory, os.path.basename(old_path))
+
+
+def _print_sheet(diff: Dict[str, Any]) -> None:
+    print(f"\n[{os.path.basename(diff['new'])} / {diff['sheet']}] 键: {diff['key']}  "
+          f"行数 {diff['rows']['old']} -> {diff['rows']['new']}  "
+          f"新增 {diff['added']}  删除 {diff['removed']}  修改 {diff['changed']}  ({diff['elapsedMs']:.0f}ms)")
+    if diff["columnsAdded"] or diff["columnsRemoved"]:
+        print(f"  新增列: {diff['columnsAdded']}  删除列: {diff['columnsRemoved']}")
+    if diff["duplicateKeys"]:
+        print(f"  重复的键: {diff['duplicateKeys']} 个（按出现次序匹配）")
+    for row in diff["addedRows"]:
+        print(f"  + {row['key']} (第{row['row']}行) {json.dumps(row['values'], ensure_ascii=False, default=str)}")
+    for row in diff["removedRows"]:
+        print(f"  - {row['key']} (第{row['row']}行) {json.dumps(row['values'], ensure_ascii=False, default=str)}")
+    for row in diff["changedRows"]:
+        print(f"  ~ {row['key']} (第{row['oldRow']}行 -> 第{row['newRow']}行)")
+        for name, cell in row["cells"].items():
+            print(f"      {name}: {cell['old']!r} -> {cell['new']!r}")
+    if diff["truncated"]:
+        print("  ...（明细已截断，使用--limit显示更多）")
+
+
+def _print_workbook(diff: Dict[str, Any]) -> None:
+    if diff["sheetsAdded"] or diff["sheetsRemoved"]:
+        print(f"\n{os.path.basename(diff['new'])}: 新增工作表 {diff['sheetsAdded']}  删除工作表 {diff['sheetsRemoved']}")
+    for sheet in diff["sheets"]:
+        _print_sheet(sheet)
+    for name, error in diff["errors"].items():
+        print(f"\n[{os.path.basename(diff['new'])} / {name}] 无法比较: {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="比较两个版本的工作簿或目录，按键列报告新增、删除和修改的行")
+    parser.add_argument("old", help="旧版本的xlsx文件或目录")
+    parser.add_argument("new", help="新版本的xlsx文件或目录")
+    parser.add_argument("--sheet", default=None, help="只比较该工作表")
+    parser.add_argument("--key", default=None, help="用于匹配行的键列（默认为第一列）")
+    parser.add_argument("--limit", type=int, default=DIFF_DETAIL_LIMIT, help=f"每类差异最多显示的行数（默认{DIFF_DETAIL_LIMIT}）")
+    parser.add_argument("--output", default=None, help="把JSON格式的结果写入该文件")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    try:
+        result = diff_paths(args.old, args.new, args.sheet, args.key, args.limit)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print(f"比较失败: {e}", file=sys.stderr)
+        sys.exit(2)
+    if "workbooks" in result:
+        if result["filesAdded"] or result["filesRemoved"]:
+            print(f"新增工作簿: {result['filesAdded']}  删除工作簿: {result['filesRemoved']}")
+        for workbook in result["workbooks"]:
+            _print_workbook(workbook)
+        different = bool(result["workbooks"] or result["filesAdded"] or result["filesRemoved"])
+    else:
+        _print_workbook(result)
+        different = bool(result["sheets"] or result["sheetsAdded"] or result["sheetsRemoved"])
+    if not different:
+        print("没有差异")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2, default=str)
+    sys.exit(1 if different else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,841 @@
+#!/usr/bin/env python3
+"""
+Python查询引擎
+按需把工作表加载为列式表（column_store），在其上执行SELECT语句（sql_engine）。
+
+表按(工作簿, 工作表)缓存，并用目录中的工作表指纹校验，工作簿变化后下次查询自动重新加载；
+同一工作簿的表共享一个由共享字符串表建立的字符串字典，共享字符串表不变时跨重新加载复用。
+加载的表按内容存入sheet_store，不同目录中内容相同的工作表共享一份列数据（各自的表是写时复制的视图），
+切换到另一个分支的目录时只需加载内容不同的工作表。
+
+查询读取已发布的表版本（快照）：SELECT开始时固定当前快照，加载、刷新和UPDATE/DELETE生成表的新版本后
+原子地发布新快照，不修改正在被读取的版本；旧版本在最后一个使用它的查询结束后释放。
+加载、修改和保存按工作簿串行，不阻塞其它工作簿的操作和已加载表上的查询。
+
+UPDATE/DELETE在表的新版本上修改（只复制被修改的列），语句先写入写前日志（excel_journal），
+同一工作簿的修改在最后一次修改SAVE_DELAY秒后合并保存一次（持续修改时最迟SAVE_MAX_DELAY秒），
+也可以调用commit立即保存。进程崩溃后，日志中尚未保存的语句在下次加载该工作表时重放。
+bulk_insert把整批行追加到表尾（bulk_insert模块校验），只写一条日志并立即保存一次工作簿。
+
+语句的解析结果和SELECT的查询计划缓存在plan_cache中，只有字面量或参数不同的语句直接复用。
+
+设置内存预算后，常驻的列数据、二级索引和字符串字典超过预算时按最久未查询的顺序移出没有未保存修改的表，
+下次访问时透明地重新加载（sheet_store中有磁盘镜像时直接反序列化，否则重新解析工作簿）。
+
+export_query把SELECT的结果按批计算并流式写入本地文件（query_export），只返回路径、行数和文件大小。
+
+lookup_text在Language表的键索引上批量查找文本键（text_lookup），索引随表的新版本复用或增量更新。
+
+环境变量:
+    EXCEL_SQL_MEMORY_BUDGET: 表缓存的内存预算（字节，默认0表示不限制）
+    EXCEL_SQL_EXPORT_BATCH_ROWS: 导出查询结果时每批的行数（默认65536）
+"""
+
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+import zipfile
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from bulk_insert import convert_columns, read_source
+from column_store import ColumnTable, StringDictionary, load_columnar_workbook
+from excel_catalog import SheetCatalog, default_catalog
+from excel_journal import WriteJournal, list_journaled_workbooks
+from plan_cache import PlanCache
+from query_export import resolve_format, write_result
+from result_guard import bound_result
+from sheet_store import SheetStore, default_store_dir
+from sql_engine import (DeleteStatement, SelectStatement, SqlError, UnsupportedSqlError, UpdateStatement,
+                        evaluate_delete, evaluate_update, parameterize, parse_explain, parse_sql, plan_query,
+                        statement_tables)
+from text_lookup import DEFAULT_KEY_COLUMN, TextLookup, TextLookupError
+from xlsx_reader import SHARED_STRINGS_PART, list_workbook_sheets, part_signature, sheet_fingerprint
+from xlsx_writer import SheetPatch, write_workbook
+
+logger = logging.getLogger(__name__)
+
+# 最后一次修改后等待多久保存工作簿（秒）
+SAVE_DELAY = float(os.environ.get("EXCEL_SQL_SAVE_DELAY", "2"))
+# 持续修改时，第一次未保存的修改最多等待多久（秒）
+SAVE_MAX_DELAY = float(os.environ.get("EXCEL_SQL_SAVE_MAX_DELAY", "30"))
+# 表缓存的内存预算（字节），0表示不限制
+MEMORY_BUDGET = int(os.environ.get("EXCEL_SQL_MEMORY_BUDGET", "0"))
+# 导出查询结果时每批计算和写入的行数
+EXPORT_BATCH_ROWS = int(os.environ.get("EXCEL_SQL_EXPORT_BATCH_ROWS", "65536"))
+
+
+class _Snapshot:
+    """已发布的表版本：(工作簿路径, 工作表名) -> 列式表，发布后不再修改"""
+
+    __slots__ = ("version", "tables", "__weakref__")
+
+    def __init__(self, version: int, tables: Dict[Tuple[str, str], ColumnTable]):
+        self.version = version
+        self.tables = tables
+
+
+class ExcelEngine:
+    """列式表缓存 + SQL执行，线程安全"""
+
+    def __init__(self, catalog: SheetCatalog = default_catalog, journal_dir: Optional[str] = None,
+                 store: Optional[SheetStore] = None, memory_budget: int = MEMORY_BUDGET):
+        self.catalog = catalog
+        self.journal_dir = journal_dir or catalog.cache_dir
+        self.store = store or SheetStore(default_store_dir(catalog.cache_dir))
+        self.memory_budget = memory_budget
+        # 只保护下面的内部状态，持有时间很短；加载、修改和保存工作簿时持有该工作簿的锁（_workbook_lock）
+        self._lock = threading.RLock()
+        self._workbook_locks: Dict[str, threading.RLock] = {}
+        # (工作簿路径, 工作表名) -> 每个表的当前版本，变化后通过_publish发布为新快照
+        self._tables: Dict[Tuple[str, str], ColumnTable] = {}
+        self._snapshot = _Snapshot(0, {})
+        # 仍在使用的快照（当前快照和查询固定的旧快照）
+        self._snapshots: "weakref.WeakSet[_Snapshot]" = weakref.WeakSet([self._snapshot])
+        # 表 -> 最近一次查询的序号，内存超出预算时移出序号最小的表
+        self._clock = itertools.count(1)
+        self._last_used: Dict[Tuple[str, str], int] = {}
+        # 正在后台刷新的目录 -> 刷新期间是否又收到了刷新请求
+        self._refreshing: Dict[str, bool] = {}
+        # 因超出内存预算被移出的表，下次加载时计为重新加载
+        self._evicted: Set[Tuple[str, str]] = set()
+        # 字符串字典 -> (字符串数, 估算的内存)，字典只会追加，大小不变时不重新估算
+        self._dictionary_sizes: "weakref.WeakKeyDictionary[StringDictionary, Tuple[int, int]]" = \
+            weakref.WeakKeyDictionary()
+        self.evictions = 0
+        self.reloads = 0
+        self.reload_seconds = 0.0
+        # 已发布的UPDATE/DELETE次数，相同请求的合并键包含该值（single_flight）
+        self.writes = 0
+        # 备用工作进程（engine_supervisor预热的替换进程）：旧进程仍在写日志和保存工作簿，加载时不重放日志
+        self.standby = False
+        # 工作簿路径 -> 字符串字典
+        self._dictionaries: Dict[str, StringDictionary] = {}
+        self._journals: Dict[str, WriteJournal] = {}
+        # 工作簿路径 -> 延迟保存定时器 / 第一次未保存修改的时间
+        self._timers: Dict[str, threading.Timer] = {}
+        self._first_pending: Dict[str, float] = {}
+        self.plans = PlanCache()
+        self.texts = TextLookup()
+
+    def _journal(self, workbook: str) -> WriteJournal:
+        with self._lock:
+            journal = self._journals.get(workbook)
+            if journal is None:
+                journal = self._journals[workbook] = WriteJournal(workbook, self.journal_dir)
+            return journal
+
+    def _workbook_lock(self, workbook: str) -> threading.RLock:
+        """串行化同一工作簿的加载、修改和保存（字符串字典、日志和文件只有一个写入方）"""
+        with self._lock:
+            lock = self._workbook_locks.get(workbook)
+            if lock is None:
+                lock = self._workbook_locks[workbook] = threading.RLock()
+            return lock
+
+    def _publish(self) -> None:
+        """把当前各表的版本发布为新快照，调用方持有self._lock"""
+        snapshot = _Snapshot(self._snapshot.version + 1, dict(self._tables))
+        self._snapshots.add(snapshot)
+        self._snapshot = snapshot
+
+    def _replace(self, key: Tuple[str, str], table: Optional[ColumnTable]) -> None:
+        """
+        替换表的当前版本（table为None时移除）并发布新快照，调用方持有self._lock
+
+        被替换的版本不再被计划缓存和sheet_store引用，固定了旧快照的查询仍可继续读取
+        """
+        replaced = self._tables.pop(key, None)
+        if table is not None:
+            self._tables[key] = table
+            self._last_used[key] = next(self._clock)
+        else:
+            self._last_used.pop(key, None)
+            self.texts.release(*key)
+            if not any(path == key[0] for path, _ in self._tables):
+                self._dictionaries.pop(key[0], None)
+        if replaced is not None and replaced is not table:
+            self.plans.release(replaced)
+            self._release(replaced)
+        self._publish()
+
+    def _release(self, table: ColumnTable) -> None:
+        """表不再使用sheet_store中的镜像（被替换、丢弃或已复制出自己的列数据）"""
+        self.store.release(table.content_key)
+        table.content_key = ""
+
+    def _dictionary_bytes(self, dictionary: StringDictionary) -> int:
+        cached = self._dictionary_sizes.get(dictionary)
+        if cached is None or cached[0] != len(dictionary):
+            cached = self._dictionary_sizes[dictionary] = (len(dictionary), dictionary.nbytes())
+        return cached[1]
+
+    def _resident_bytes(self, tables: List[ColumnTable]) -> int:
+        """表的常驻内存，共享的列数据和字符串字典只计一次"""
+        distinct = {id(t.data): t for t in tables}.values()
+        dictionaries = {id(t.dictionary): t.dictionary for t in tables if t.dictionary is not None}.values()
+        return sum(t.resident_bytes() for t in distinct) + sum(self._dictionary_bytes(d) for d in dictionaries)
+
+    def _enforce_budget(self, keep: Optional[Tuple[str, str]] = None) -> None:
+        """
+        常驻内存超过预算时按最久未查询的顺序移出表，调用方持有self._lock
+
+        有未保存修改的表不移出；keep为刚加载的表，避免加载后立即被移出
+        """
+        if self.memory_budget <= 0:
+            return
+        resident = self._resident_bytes(list(self._tables.values()))
+        if resident <= self.memory_budget:
+            return
+        for key in sorted(self._tables, key=lambda k: self._last_used.get(k, 0)):
+            if resident <= self.memory_budget:
+                break
+            if key == keep or self._tables[key].dirty:
+                continue
+            self._replace(key, None)
+            self._evicted.add(key)
+            self.evictions += 1
+            workbook = key[0]
+            resident = self._resident_bytes(list(self._tables.values()))
+            logger.info(f"内存超出预算，移出表 {key[1]}（{os.path.basename(workbook)}）: "
+                        f"常驻 {resident} 字节，预算 {self.memory_budget} 字节")
+        if resident > self.memory_budget:
+            logger.debug(f"内存超出预算且没有可移出的表: 常驻 {resident} 字节，预算 {self.memory_budget} 字节")
+
+    def _load_table(self, workbook: str, sheet: str) -> ColumnTable:
+        """
+        取得工作表的列式表（内容相同的工作表已在sheet_store中时直接共享，否则从磁盘加载），
+        重放日志中尚未保存的语句后发布为表的新版本；调用方持有该工作簿的锁
+        """
+        started = time.perf_counter()
+        with zipfile.ZipFile(workbook) as zf:
+            info = next((s for s in list_workbook_sheets(zf) if s.name == sheet), None)
+            if info is None:
+                raise SqlError(f"工作表 {sheet} 无法从 {os.path.basename(workbook)} 加载")
+            key = self.store.content_key(zf, info.part)
+            fingerprint = sheet_fingerprint(zf, info.part)
+            shared_signature = part_signature(zf, SHARED_STRINGS_PART)
+        image = self.store.acquire(key)
+        if image is None:
+            tables = load_columnar_workbook(workbook, [sheet], self._dictionaries.get(workbook))
+            if not tables:
+                raise SqlError(f"工作表 {sheet} 无法从 {os.path.basename(workbook)} 加载")
+            image = self.store.put(key, tables[0])
+        table = image.view(sheet, workbook, fingerprint)
+        table.content_key = key
+        logger.info(f"加载表 {sheet}（{os.path.basename(workbook)}）: {table.row_count} 行，{len(table.columns)} 列")
+        # 发布前重放日志，查询不会看到只重放了一部分的表
+        journal = self._journal(workbook)
+        pending = []
+        if journal.exists() and not self.standby:
+            pending = journal.pending(sheet, table.fingerprint)
+            for record in pending:
+                if record.get("type") == "insert":
+                    self._apply_insert(record, table)
+                    continue
+                prepared, values = self.plans.prepare(record["sql"], record.get("params") or ())
+                self._apply(prepared.statement, table, values)
+            if table.dirty:
+                self._release(table)
+        with self._lock:
+            # 镜像可能来自共享字符串表不同的工作簿，只有签名一致的字典才作为本工作簿的字典复用
+            if table.dictionary is not None and table.dictionary.signature == shared_signature:
+                self._dictionaries[workbook] = table.dictionary
+            self._replace((workbook, sheet), table)
+            if pending:
+                logger.info(f"重放日志: {sheet} {len(pending)} 条未保存的语句")
+                self._schedule_save(workbook)
+            if (workbook, sheet) in self._evicted:
+                self._evicted.discard((workbook, sheet))
+                self.reloads += 1
+                self.reload_seconds += time.perf_counter() - started
+            self._enforce_budget((workbook, sheet))
+        return table
+
+    def get_table(self, directory: str, table_name: str, snapshot: Optional[_Snapshot] = None) -> ColumnTable:
+        """
+        获取列式表，指纹变化时重新加载
+
+        已加载的表直接从快照中读取，不加锁；需要加载时只等待同一工作簿的写入方
+
+        Args:
+            directory: Excel文件目录
+            table_name: 表名
+            snapshot: 查询开始时固定的快照，优先使用其中的表版本
+
+        Raises:
+            TableNotFoundError: 表不存在
+        """
+        entry = self.catalog.resolve(directory, table_name)
+        key = (entry.workbook, entry.name)
+        for published in (snapshot, self._snapshot):
+            table = published.tables.get(key) if published is not None else None
+            if table is not None and table.fingerprint == entry.fingerprint:
+                self._last_used[key] = next(self._clock)
+                return table
+        with self._workbook_lock(entry.workbook):
+            # 等待期间其它线程可能已经加载
+            table = self._tables.get(key)
+            if table is not None and table.fingerprint == entry.fingerprint:
+                return table
+            return self._load_table(entry.workbook, entry.name)
+
+    def execute(self, sql: str, directory: str, fetch_all: bool = True, params: Optional[Sequence[Any]] = None) -> Any:
+        """
+        执行SELECT/UPDATE/DELETE语句
+
+        Args:
+            sql: SQL语句，可以包含?占位符
+            directory: Excel文件目录
+            fetch_all: 为False时SELECT结果受result_guard的行数/字节数上限约束
+            params: ?占位符按顺序对应的参数值
+
+        Returns:
+            SELECT返回结果行列表（超过上限时为带列摘要的截断结果，见result_guard.bound_result）；
+            UPDATE/DELETE返回{"affectedRows": 行数, "message": 说明}；
+            EXPLAIN [ANALYZE] 前缀的语句返回执行计划（见explain）
+
+        Raises:
+            UnsupportedSqlError: 语句不受支持，调用方应回退到ExcelSqlTool
+            SqlError: 语法或语义错误
+            TableNotFoundError: 表不存在
+        """
+        explain = parse_explain(sql)
+        if explain is not None:
+            return self.explain(explain[0], directory, params, analyze=explain[1])
+        params = list(params or ())
+        prepared, values = self.plans.prepare(sql, params)
+        statement = prepared.statement
+        if isinstance(statement, SelectStatement):
+            snapshot = self._snapshot
+            plan = self.plans.plan(prepared, directory, lambda name: self.get_table(directory, name, snapshot))
+            try:
+                if fetch_all:
+                    return plan.execute(values)
+                return bound_result(*plan.execute_columns(values))
+            finally:
+                # 查询可能建立了新的二级索引或解码了复合列
+                if self.memory_budget > 0:
+                    with self._lock:
+                        self._enforce_budget()
+        return self._execute_dml(statement, values, sql, params, directory)
+
+    def explain(self, sql: str, directory: str, params: Optional[Sequence[Any]] = None,
+                analyze: bool = True) -> Dict[str, Any]:
+        """
+        生成SELECT语句的执行计划
+
+        使用新解析、新规划的计划（不取自计划缓存），analyze为True时执行一次查询并丢弃结果
+
+        Args:
+            sql: SELECT语句，可以包含?占位符
+            directory: Excel文件目录
+            params: ?占位符按顺序对应的参数值
+            analyze: 是否执行查询并统计各算子的输入/输出行数、耗时和内存
+
+        Returns:
+            {"engine": "python", "parseMs", "loadMs", "planMs", "executeMs", "rows", "plan": 算子树, ...}；
+            Python引擎不支持的语句返回{"engine": "ExcelSqlTool", "reason": 原因}
+
+        Raises:
+            SqlError: 语法错误或不是SELECT语句
+            TableNotFoundError: 表不存在
+        """
+        started = time.perf_counter()
+        try:
+            # 保留字面量，计划中展示实际的常量
+            _, tokens, values = parameterize(sql, list(params or ()), lift_literals=False)
+            statement = parse_sql(sql, tokens)
+        except UnsupportedSqlError as e:
+            return {"engine": "ExcelSqlTool", "sql": sql, "reason": str(e),
+                    "message": "Python引擎不支持该语句，excel_query会把它转发给ExcelSqlTool执行，没有可展示的执行计划"}
+        if not isinstance(statement, SelectStatement):
+            raise SqlError("EXPLAIN只支持SELECT语句")
+        parsed = time.perf_counter()
+        snapshot = self._snapshot
+        tables = {name: self.get_table(directory, name, snapshot) for name in statement_tables(statement)}
+        loaded = time.perf_counter()
+        plan = plan_query(statement, lambda name: tables[name] if name in tables else self.get_table(directory, name))
+        planned = time.perf_counter()
+        result: Dict[str, Any] = {
+            "engine": "python",
+            "sql": sql,
+            "analyze": analyze,
+            "parseMs": round((parsed - started) * 1000, 3),
+            "loadMs": round((loaded - parsed) * 1000, 3),
+            "planMs": round((planned - loaded) * 1000, 3),
+        }
+        result.update(plan.explain(values, analyze))
+        return result
+
+    def export_query(self, sql: str, directory: str, path: str, fmt: Optional[str] = None,
+                     params: Optional[Sequence[Any]] = None) -> Dict[str, Any]:
+        """
+        执行SELECT语句并把结果流式写入本地文件（见query_export）
+
+        输出列按EXPORT_BATCH_ROWS行一批计算和写入，结果不经过内存中的行列表，也不受result_guard的上限约束
+
+        Args:
+            sql: SELECT语句，可以包含?占位符
+            directory: Excel文件目录
+            path: 目标文件路径
+            fmt: csv/ndjson/xlsx/bytes，为空时按扩展名推断
+            params: ?占位符按顺序对应的参数值
+
+        Returns:
+            {"path": 绝对路径, "format": 格式, "rows": 行数, "bytes": 文件字节数, "elapsedMs": 耗时}
+
+        Raises:
+            SqlError: 语法错误或不是SELECT语句
+            ExportError: 不支持的导出格式
+            TableNotFoundError: 表不存在
+        """
+        started = time.perf_counter()
+        fmt = resolve_format(path, fmt)
+        prepared, values = self.plans.prepare(sql, list(params or ()))
+        if not isinstance(prepared.statement, SelectStatement):
+            raise SqlError("导出只支持SELECT语句")
+        snapshot = self._snapshot
+        plan = self.plans.plan(prepared, directory, lambda name: self.get_table(directory, name, snapshot))
+        try:
+            names, row_count, batches = plan.execute_batches(values, EXPORT_BATCH_ROWS)
+            result = write_result(path, fmt, names, plan.column_types(), row_count, batches)
+        finally:
+            if self.memory_budget > 0:
+                with self._lock:
+                    self._enforce_budget()
+        result["elapsedMs"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    def lookup_text(self, keys: Sequence[str], directory: str, languages: Optional[Sequence[str]] = None,
+                    tables: Optional[Sequence[str]] = None, key_column: str = DEFAULT_KEY_COLUMN) -> Dict[str, Any]:
+        """
+        批量查找文本键在各语言下的文本（见text_lookup）
+
+        Args:
+            keys: 文本键
+            directory: Excel文件目录
+            languages: 语言名（如Chinese、English），为空时返回所有语言列
+            tables: 按顺序查找的表，为空时为目录中名称以Language开头的表
+            key_column: 键列名
+
+        Returns:
+            {"languages", "texts": {键: {语言: 文本}}, "found", "missing", "tables", "elapsedMs"}
+
+        Raises:
+            TextLookupError: 没有Language表、表中没有键列或未知的语言
+            TableNotFoundError: 表不存在
+        """
+        started = time.perf_counter()
+        names = list(tables or ())
+        if not names:
+            names = [name for name in self.catalog.table_names(directory) if name.lower().startswith("language")]
+            if not names:
+                raise TextLookupError(f"目录 {directory} 中没有名称以Language开头的表，请用tables指定要查找的表")
+        snapshot = self._snapshot
+        loaded = [self.get_table(directory, name, snapshot) for name in names]
+        result = self.texts.lookup(loaded, keys, languages, key_column)
+        if self.memory_budget > 0:
+            with self._lock:
+                self._enforce_budget()
+        result["tables"] = [table.name for table in loaded]
+        result["elapsedMs"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    @staticmethod
+    def _apply(statement, table: ColumnTable, values: Sequence[Any]) -> int:
+        """在表上执行UPDATE/DELETE，返回影响的行数"""
+        if isinstance(statement, UpdateStatement):
+            rows, assignments = evaluate_update(statement, table, values)
+            for position, column in assignments:
+                table.update_cells(rows, position, column)
+            return len(rows)
+        rows = evaluate_delete(statement, table, values)
+        table.delete_rows(rows)
+        return len(rows)
+
+    @staticmethod
+    def _apply_insert(record: Dict[str, Any], table: ColumnTable) -> None:
+        """重放日志中的批量插入，工作表中已不存在的列忽略"""
+        positions, columns = [], []
+        for name, values in zip(record.get("columns") or [], record.get("values") or []):
+            position = table.column_position(name)
+            if position is None:
+                logger.warning(f"重放批量插入: 表 {table.name} 中已不存在列 {name}，忽略该列")
+                continue
+            positions.append(position)
+            columns.append(values)
+        table.insert_rows(positions, columns)
+
+    def bulk_insert(self, table_name: str, directory: str, source: Union[str, Dict[str, List[Any]]],
+                    skip_invalid: bool = False) -> Dict[str, Any]:
+        """
+        把大量行追加到表尾并立即保存工作簿（见bulk_insert）
+
+        整批行只写一条日志、发布一次表的新版本、保存一次工作簿；保存失败时修改保留在日志中，稍后自动重试
+
+        Args:
+            table_name: 表名
+            directory: Excel文件目录
+            source: {列名: [值, ...]}，或CSV/NDJSON/JSON文件路径
+            skip_invalid: 跳过校验失败的行并插入其余行；默认有失败的行时不插入
+
+        Returns:
+            {"insertedRows", "rejectedRows", "totalRows", "saved", "elapsedMs", ...}，
+            有校验失败的行时附带byColumn（每列的失败行数）和errors（前若干条明细）
+
+        Raises:
+            BulkInsertError: 来源格式错误、列不存在或重复
+            TableNotFoundError: 表不存在
+        """
+        started = time.perf_counter()
+        names, values = read_source(source)
+        loaded = time.perf_counter()
+        entry = self.catalog.resolve(directory, table_name)
+        with self._workbook_lock(entry.workbook):
+            table = self.get_table(directory, table_name)
+            workbook = os.path.abspath(table.file_path)
+            positions, columns, report = convert_columns(table, names, values, skip_invalid)
+            validated = time.perf_counter()
+            inserted = len(columns[0]) if columns else 0
+            if report["rejectedRows"] and not skip_invalid:
+                inserted = 0
+            result: Dict[str, Any] = {"table": table.name, "insertedRows": inserted}
+            result.update(report)
+            if inserted:
+                self._journal(workbook).append_insert(table.name, table.fingerprint,
+                                                      [table.columns[p].name for p in positions], columns)
+                updated = table.fork()
+                updated.insert_rows(positions, columns)
+                with self._lock:
+                    self._replace((entry.workbook, entry.name), updated)
+                    self.writes += 1
+                try:
+                    result["saved"] = self.save_workbook(workbook)
+                except Exception as e:
+                    logger.error(f"保存工作簿失败 {workbook}: {e}")
+                    result.update(saved=False, saveError=str(e))
+                    self._schedule_save(workbook)
+                table = updated
+            result["totalRows"] = table.row_count
+        finished = time.perf_counter()
+        result.update(readMs=round((loaded - started) * 1000, 3), validateMs=round((validated - loaded) * 1000, 3),
+                      elapsedMs=round((finished - started) * 1000, 3))
+        if inserted:
+            result["message"] = f"成功插入 {inserted} 行数据"
+        elif report["rejectedRows"]:
+            result["message"] = f"{report['rejectedRows']} 行校验失败，没有插入任何行（skip_invalid为true时跳过失败的行）"
+        else:
+            result["message"] = "没有要插入的行"
+        return result
+
+    def _execute_dml(self, statement, values: Sequence[Any], sql: str, params: Sequence[Any],
+                     directory: str) -> Dict[str, Any]:
+        entry = self.catalog.resolve(directory, statement.table.name)
+        with self._workbook_lock(entry.workbook):
+            table = self.get_table(directory, statement.table.name)
+            workbook = os.path.abspath(table.file_path)
+            if isinstance(statement, UpdateStatement):
+                rows, assignments = evaluate_update(statement, table, values)
+            else:
+                rows, assignments = evaluate_delete(statement, table, values), []
+            if rows:
+                # 先落盘日志再修改内存；在新版本上修改，正在读取当前版本的查询不受影响
+                self._journal(workbook).append_dml(table.name, table.fingerprint, sql, params)
+                updated = table.fork()
+                for position, column_values in assignments:
+                    updated.update_cells(rows, position, column_values)
+                if isinstance(statement, DeleteStatement):
+                    updated.delete_rows(rows)
+                with self._lock:
+                    self._replace((entry.workbook, entry.name), updated)
+                    self._schedule_save(workbook)
+                    self.writes += 1
+        verb = "更新" if isinstance(statement, UpdateStatement) else "删除"
+        return {"affectedRows": len(rows), "message": f"成功{verb} {len(rows)} 行数据"}
+
+    def _schedule_save(self, workbook: str) -> None:
+        """延迟保存工作簿，期间的修改合并为一次保存"""
+        with self._lock:
+            now = time.monotonic()
+            first = self._first_pending.setdefault(workbook, now)
+            timer = self._timers.pop(workbook, None)
+            if timer is not None:
+                timer.cancel()
+            delay = max(0.0, min(SAVE_DELAY, first + SAVE_MAX_DELAY - now))
+            timer = threading.Timer(delay, self._flush, (workbook,))
+            timer.daemon = True
+            self._timers[workbook] = timer
+            timer.start()
+
+    def _flush(self, workbook: str) -> None:
+        try:
+            self.save_workbook(workbook)
+        except Exception as e:
+            # 日志仍然保留，下次修改或commit时重试
+            logger.error(f"保存工作簿失败 {workbook}: {e}")
+
+    def save_workbook(self, workbook: str) -> bool:
+        """
+        把工作簿的所有未保存修改写回文件
+
+        Returns:
+            是否写入了文件（没有未保存的修改时返回False）
+        """
+        workbook = os.path.abspath(workbook)
+        with self._workbook_lock(workbook):
+            with self._lock:
+                timer = self._timers.pop(workbook, None)
+                if timer is not None:
+                    timer.cancel()
+                self._first_pending.pop(workbook, None)
+                loaded = {name: table for (path, name), table in self._tables.items() if path == workbook}
+            journal = self._journal(workbook)
+            sheets = {name for name, table in loaded.items() if table.dirty}
+            if journal.exists():
+                sheets.update(journal.sheets())
+            if not sheets:
+                return False
+            with zipfile.ZipFile(workbook) as zf:
+                parts = {info.name: info.part for info in list_workbook_sheets(zf)}
+                on_disk = {name: sheet_fingerprint(zf, part) for name, part in parts.items()}
+                shared_signature = part_signature(zf, SHARED_STRINGS_PART)
+            tables: Dict[str, ColumnTable] = {}
+            patches: Dict[str, SheetPatch] = {}
+            for sheet in sheets:
+                if sheet not in parts:
+                    logger.warning(f"{os.path.basename(workbook)} 中已不存在工作表 {sheet}，丢弃其未保存的修改")
+                    continue
+                table = loaded.get(sheet)
+                if table is None or table.fingerprint != on_disk[sheet]:
+                    # 文件在内存修改之后被改动过（外部编辑或其它进程已保存），按日志在新内容上重放
+                    table = self._load_table(workbook, sheet)
+                tables[sheet] = table
+                patches[parts[sheet]] = _sheet_patch(table)
+            # 与磁盘上共享字符串表对齐的字典可以直接给出文本的共享字符串索引，免去重新解析共享字符串表
+            dictionary = self._dictionaries.get(workbook)
+            if dictionary is not None and dictionary.signature != shared_signature:
+                dictionary = None
+            # 未修改且与磁盘一致的已加载表，保存后只需更新指纹（追加共享字符串会改变所有工作表的指纹）
+            clean = {sheet: table for sheet, table in loaded.items()
+                     if sheet not in tables and table.fingerprint == on_disk.get(sheet)}
+            fingerprints: Dict[str, str] = {}
+
+            def before_replace(temp_path: str) -> None:
+                nonlocal shared_signature
+                with zipfile.ZipFile(temp_path) as zf:
+                    for sheet in list(tables) + list(clean):
+                        fingerprints[sheet] = sheet_fingerprint(zf, parts[sheet])
+                    shared_signature = part_signature(zf, SHARED_STRINGS_PART)
+                journal.mark_saved({sheet: fingerprints[sheet] for sheet in tables})
+
+            if not any(p.updates or p.deleted or p.appended for p in patches.values()):
+                journal.discard()
+                return False
+            appended = write_workbook(workbook, patches, before_replace,
+                                      dictionary.shared_index if dictionary is not None else None)
+            # 保存只更新表的元数据（指纹、待保存的修改、工作表行索引），查询读取的列数据不变
+            for sheet, table in tables.items():
+                table.mark_saved(fingerprints[sheet])
+            for sheet, table in clean.items():
+                table.fingerprint = fingerprints[sheet]
+            if dictionary is not None:
+                dictionary.extend_shared(appended, shared_signature)
+            journal.discard()
+            with self._lock:
+                # 重放日志时可能重新安排了保存
+                timer = self._timers.pop(workbook, None)
+                if timer is not None:
+                    timer.cancel()
+                self._first_pending.pop(workbook, None)
+            return True
+
+    def commit(self, directory: Optional[str] = None, include_journals: bool = True) -> Dict[str, Any]:
+        """
+        立即保存所有未保存的修改（指定目录时只保存该目录下的工作簿）
+
+        Args:
+            directory: 只保存该目录下的工作簿，None表示全部
+            include_journals: 同时重放并保存缓存目录中其它进程（如已崩溃的进程）留下的日志
+
+        Returns:
+            {"saved": [已保存的文件名], "failed": {文件名: 错误信息}}
+        """
+        with self._lock:
+            workbooks = set(self._timers) | {p for (p, _), t in self._tables.items() if t.dirty}
+            if include_journals:
+                workbooks.update(os.path.abspath(p) for p in list_journaled_workbooks(self.journal_dir))
+        if directory is not None:
+            prefix = os.path.join(os.path.abspath(directory), "")
+            workbooks = {p for p in workbooks if p.startswith(prefix)}
+        saved, failed = [], {}
+        for workbook in sorted(workbooks):
+            try:
+                if not os.path.exists(workbook):
+                    raise FileNotFoundError(f"工作簿不存在: {workbook}")
+                if self.save_workbook(workbook):
+                    saved.append(os.path.basename(workbook))
+            except Exception as e:
+                logger.error(f"保存工作簿失败 {workbook}: {e}")
+                failed[os.path.basename(workbook)] = str(e)
+        return {"saved": saved, "failed": failed}
+
+    def recover(self) -> Dict[str, Any]:
+        """启动时调用：重放并保存上次进程留下的日志"""
+        if not list_journaled_workbooks(self.journal_dir):
+            return {"saved": [], "failed": {}}
+        result = self.commit()
+        logger.info(f"日志恢复完成: {result}")
+        return result
+
+    def activate(self) -> Dict[str, Any]:
+        """备用工作进程接替服务时调用：丢弃仍有日志的工作簿中备用期间加载（未重放日志）的表，再恢复日志"""
+        with self._lock:
+            self.standby = False
+            journaled = {os.path.abspath(p) for p in list_journaled_workbooks(self.journal_dir)}
+            for key in [key for key in self._tables if key[0] in journaled]:
+                self._replace(key, None)
+        return self.recover()
+
+    def resident_tables(self) -> List[Dict[str, str]]:
+        """已加载的表（目录、表名），最近查询的在前，用于预热替换的工作进程"""
+        with self._lock:
+            keys = sorted(self._tables, key=lambda key: -self._last_used.get(key, 0))
+        return [{"directory": os.path.dirname(workbook), "table": sheet} for workbook, sheet in keys]
+
+    def invalidate(self, directory: Optional[str] = None) -> None:
+        """
+        目录中的工作簿可能已变化（刷新缓存）：在后台按新的指纹重新加载变化的表并逐个发布，不清空缓存
+
+        刷新期间的查询继续读取当前版本（查询总是按指纹校验表，访问已变化的表时直接加载新内容）；
+        工作簿或工作表已不存在的表被移除，未保存的修改保留在日志中。同一目录的刷新进行中时再次请求，
+        当前刷新结束后只再检查一次
+
+        Args:
+            directory: 只刷新该目录下的工作簿，None表示全部
+        """
+        with self._lock:
+            directories = {os.path.dirname(path) for path, _ in self._tables}
+            if directory is not None:
+                directory = os.path.abspath(directory)
+                prefix = os.path.join(directory, "")
+                directories = {d for d in directories if d == directory or d.startswith(prefix)}
+                self._evicted = {k for k in self._evicted if not k[0].startswith(prefix)}
+            else:
+                self._evicted.clear()
+            for target in directories:
+                if target in self._refreshing:
+                    self._refreshing[target] = True
+                    continue
+                self._refreshing[target] = False
+                threading.Thread(target=self._refresh, args=(target,), name="excel-engine-refresh",
+                                 daemon=True).start()
+
+    def _refresh(self, directory: str) -> None:
+        """后台刷新一个目录中已加载的表"""
+        while True:
+            started = time.perf_counter()
+            reloaded = removed = 0
+            try:
+                entries = {(e.workbook, e.name): e for e in self.catalog.entries(directory)}
+                for key, table in list(self._snapshot.tables.items()):
+                    if os.path.dirname(key[0]) != directory:
+                        continue
+                    entry = entries.get(key)
+                    if entry is not None and entry.fingerprint == table.fingerprint:
+                        continue
+                    with self._workbook_lock(key[0]):
+                        current = self._tables.get(key)
+                        if current is None:
+                            continue
+                        if entry is None:
+                            with self._lock:
+                                self._replace(key, None)
+                            removed += 1
+                        elif current.fingerprint != entry.fingerprint:
+                            self._load_table(*key)
+                            reloaded += 1
+            except Exception as e:
+                logger.error(f"刷新目录失败 {directory}: {e}")
+            if reloaded or removed:
+                logger.info(f"刷新目录 {directory}: 重新加载 {reloaded} 个表，移除 {removed} 个表，"
+                            f"耗时 {time.perf_counter() - started:.2f}s")
+            with self._lock:
+                if not self._refreshing.get(directory):
+                    self._refreshing.pop(directory, None)
+                    return
+                self._refreshing[directory] = False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        缓存统计：表数量、行数、估算的列数据/字典内存（共享的列数据只计一次）、待保存的工作簿数、
+        语句/计划缓存的命中和解析规划耗时、sheet_store的共享情况、内存预算的移出/重新加载次数
+        及快照版本（当前版本号、仍被查询使用的版本数、正在后台刷新的目录数）、文本键索引（text_lookup）
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            tables = list(snapshot.tables.values())
+            versions = {
+                "version": snapshot.version,
+                "liveVersions": len(self._snapshots),
+                "refreshing": len(self._refreshing),
+            }
+            dictionaries = list({id(t.dictionary): t.dictionary for t in tables if t.dictionary is not None}.values())
+            pending = len(self._timers)
+            dictionary_bytes = sum(self._dictionary_bytes(d) for d in dictionaries)
+            resident = self._resident_bytes(tables)
+            largest = sorted(((t.resident_bytes(), t) for t in tables), key=lambda item: -item[0])[:5]
+            memory = {
+                "budget": self.memory_budget,
+                "residentBytes": resident,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+                "reloadMs": round(self.reload_seconds * 1000, 3),
+                "evictedTables": len(self._evicted),
+                "largestTables": [{"table": t.name, "workbook": os.path.basename(t.file_path), "bytes": size}
+                                  for size, t in largest],
+            }
+        distinct = list({id(t.data): t for t in tables}.values())
+        return {
+            "tables": len(tables),
+            "sharedTables": len(tables) - len(distinct),
+            "rows": sum(t.row_count for t in tables),
+            "columnBytes": sum(t.nbytes() for t in distinct),
+            "dictionaryBytes": dictionary_bytes,
+            "pendingSaves": pending,
+            "planCache": self.plans.stats(),
+            "sheetStore": self.store.stats(),
+            "memory": memory,
+            "snapshots": versions,
+            "textLookup": self.texts.stats(),
+        }
+
+
+def _sheet_patch(table: ColumnTable) -> SheetPatch:
+    """由表中记录的修改生成工作表补丁，尚未保存的新行按当前的值整行追加"""
+    updates: Dict[int, Dict[int, Any]] = {}
+    inserted = table.inserted
+    if table.changed:
+        changed = table.changed
+        for row, source in enumerate(table.source_rows):
+            positions = changed.get(source)
+            if positions and source not in inserted:
+                updates[source] = {table.columns[p].index: table.data[p].value(row) for p in positions}
+    appended: Dict[int, Dict[int, Any]] = {}
+    if inserted:
+        rows = [row for row, source in enumerate(table.source_rows) if source in inserted]
+        indexes = [column.index for column in table.columns]
+        values = [column.values(rows) for column in table.data]
+        for row, cells in zip(rows, zip(*values)):
+            appended[table.source_rows[row]] = dict(zip(indexes, cells))
+    return SheetPatch(updates=updates, deleted=set(table.deleted), appended=appended)
+
+
+# 进程内共享的引擎实例
+default_engine = ExcelEngine()
+# 正常退出时保存本进程尚未保存的修改（异常退出时由日志恢复）；
+# 不处理其它进程的日志，避免连接守护进程的MCP服务器退出时抢先保存守护进程的修改
+atexit.register(default_engine.commit, include_journals=False)
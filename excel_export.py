@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+增量并行导出
+读取config.xml中的xlsPath/jsonPath/bytePath，只导出指纹发生变化的工作表，
+JSON和二进制文件在工作进程中并行生成，并通过临时文件+重命名原子写入。
+
+用法:
+    python excel_export.py [config.xml] [--force] [--workers N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+
+from atomic_io import atomic_write_bytes, atomic_write_json
+from xlsx_reader import SKIPPED_SHEETS, SheetTable, list_workbook_sheets, load_sheet, sheet_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 导出格式版本，格式变化时递增，清单中版本不一致会触发全量导出
+EXPORT_FORMAT_VERSION = 2
+
+MANIFEST_NAME = ".export_manifest.json"
+
+# 二进制表文件头
+BYTES_MAGIC = b"XTB1"
+BYTES_EXTENSION = ".bytes"
+
+_NULL_STRING = 0xFFFFFFFF
+
+
+@dataclass
+class ExportConfig:
+    """config.xml中与导出相关的配置"""
+    xls_path: str
+    json_path: str
+    byte_path: str
+    config_path: str = ""
+
+
+def _normalize_config_path(value: str, base_dir: str) -> str:
+    """将config.xml中的Windows风格相对路径（如 .\\XLSX）解析为绝对路径"""
+    value = (value or "").strip().replace("\\", "/")
+    if not value:
+        return ""
+    if not os.path.isabs(value) and not (len(value) > 1 and value[1] == ":"):
+        value = os.path.join(base_dir, value)
+    return os.path.normpath(value)
+
+
+def load_export_config(config_path: str) -> ExportConfig:
+    """
+    读取config.xml
+
+    Args:
+        config_path: 配置文件路径，相对路径以配置文件所在目录为基准解析
+
+    Returns:
+        导出配置
+    """
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"配置文件不存在: {config_path}")
+    root = ElementTree.parse(config_path).getroot()
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+
+    def text(tag: str) -> str:
+        elem = root.find(tag)
+        return elem.text if elem is not None and elem.text else ""
+
+    config = ExportConfig(
+        xls_path=_normalize_config_path(text("xlsPath"), base_dir),
+        json_path=_normalize_config_path(text("jsonPath"), base_dir),
+        byte_path=_normalize_config_path(text("bytePath"), base_dir),
+        config_path=os.path.abspath(config_path),
+    )
+    if not config.xls_path:
+        raise ValueError("config.xml缺少xlsPath配置")
+    if not config.json_path and not config.byte_path:
+        raise ValueError("config.xml至少需要配置jsonPath或bytePath之一")
+    return config
+
+
+def _manifest_path(config: ExportConfig) -> str:
+    """清单文件放在jsonPath下（未配置jsonPath时放在bytePath下）"""
+    return os.path.join(config.json_path or config.byte_path, MANIFEST_NAME)
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """读取上次导出的清单，不存在、损坏或版本不一致时返回空清单"""
+    empty = {"version": EXPORT_FORMAT_VERSION, "sheets": {}}
+    if not os.path.exists(path):
+        return empty
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError) as e:
+        logger.warning(f"导出清单读取失败，将全量导出: {e}")
+        return empty
+    if manifest.get("version") != EXPORT_FORMAT_VERSION or not isinstance(manifest.get("sheets"), dict):
+        return empty
+    return manifest
+
+
+def encode_table_json(table: SheetTable) -> bytes:
+    """将工作表编码为JSON数组（每行一个对象，键为字段名）"""
+    names = [c.name for c in table.columns]
+    rows = [dict(zip(names, row)) for row in table.rows]
+    return json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _pack_string(out: bytearray, value: Optional[str]) -> None:
+    if value is None:
+        out += struct.pack("<I", _NULL_STRING)
+        return
+    data = value.encode("utf-8")
+    out += struct.pack("<I", len(data))
+    out += data
+
+
+def _pack_number(out: bytearray, fmt: str, value: Any) -> None:
+    try:
+        out += struct.pack(fmt, value if value is not None else 0)
+    except (struct.error, TypeError):
+        out += struct.pack(fmt, 0)
+
+
+_NUMERIC_FORMATS = {
+    "int": "<i",
+    "uint": "<I",
+    "short": "<h",
+    "byte": "<B",
+    "long": "<q",
+    "ulong": "<Q",
+    "float": "<f",
+    "double": "<d",
+}
+
+
+def bytes_header(names: Sequence[str], types: Sequence[str], row_count: int) -> bytearray:
+    """二进制表文件头：magic、列定义（字段名、类型名）和行数"""
+    out = bytearray(BYTES_MAGIC)
+    out += struct.pack("<H", len(names))
+    for name, data_type in zip(names, types):
+        _pack_string(out, name)
+        _pack_string(out, data_type)
+    out += struct.pack("<I", row_count)
+    return out
+
+
+def bytes_row_writers(types: Sequence[str]) -> List[Tuple[str, Optional[str]]]:
+    """按声明类型确定每列的写入方式（见encode_table_bytes）"""
+    writers = []
+    for data_type in types:
+        kind = data_type.lower()
+        if kind in _NUMERIC_FORMATS:
+            writers.append(("num", _NUMERIC_FORMATS[kind]))
+        elif kind in ("bool", "boolean"):
+            writers.append(("bool", "<B"))
+        else:
+            writers.append(("str", None))
+    return writers
+
+
+def pack_bytes_rows(out: bytearray, writers: List[Tuple[str, Optional[str]]], rows: Iterable[Sequence[Any]]) -> None:
+    """把行按列的写入方式追加到out"""
+    for row in rows:
+        for (kind, fmt), value in zip(writers, row):
+            if kind == "num":
+                _pack_number(out, fmt, value)
+            elif kind == "bool":
+                out += struct.pack(fmt, 1 if value else 0)
+            else:
+                if value is not None and not isinstance(value, str):
+                    value = str(value)
+                _pack_string(out, value)
+
+
+def encode_table_bytes(table: SheetTable) -> bytes:
+    """
+    将工作表编码为二进制格式
+
+    布局（小端）:
+        magic "XTB1"
+        uint16 列数，随后每列: 字段名、类型名（字符串）
+        uint32 行数，随后按行、按列依次写入单元格
+    字符串为uint32长度前缀的UTF-8，长度0xFFFFFFFF表示空值；
+    数值类型按声明类型定宽写入（空值写0）；bool为1字节；其余类型按字符串写入
+    """
+    types = [column.data_type for column in table.columns]
+    out = bytes_header([column.name for column in table.columns], types, len(table.rows))
+    pack_bytes_rows(out, bytes_row_writers(types), table.rows)
+    return bytes(out)
+
+
+def _export_sheet_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """工作进程入口：加载单个工作表并原子写入JSON/二进制文件"""
+    started = time.perf_counter()
+    table = load_sheet(job["workbook"], job["sheet"])
+    if table is None:
+        raise ValueError(f"工作表 {job['sheet']} 不存在于 {job['workbook']}")
+    if job.get("json"):
+        atomic_write_bytes(job["json"], encode_table_json(table))
+    if job.get("bytes"):
+        atomic_write_bytes(job["bytes"], encode_table_bytes(table))
+    return {
+        "key": job["key"],
+        "sheet": job["sheet"],
+        "rows": len(table.rows),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _scan_sheets(xls_path: str) -> List[Dict[str, Any]]:
+    """扫描目录下所有工作簿的工作表及指纹（只读取zip目录和workbook.xml）"""
+    sheets = []
+    for file_name in sorted(os.listdir(xls_path)):
+        if not file_name.lower().endswith(".xlsx") or file_name.startswith("~$"):
+            continue
+        workbook = os.path.join(xls_path, file_name)
+        try:
+            with zipfile.ZipFile(workbook) as zf:
+                for info in list_workbook_sheets(zf):
+                    if info.name in SKIPPED_SHEETS:
+                        continue
+                    sheets.append({
+                        "key": f"{file_name}/{info.name}",
+                        "workbook": workbook,
+                        "sheet": info.name,
+                        "fingerprint": sheet_fingerprint(zf, info.part),
+                    })
+        except (zipfile.BadZipFile, KeyError) as e:
+            logger.warning(f"跳过无法读取的工作簿 {file_name}: {e}")
+    return sheets
+
+
+def _remove_quietly(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除过期导出文件失败 {path}: {e}")
+
+
+def run_export(config_path: str, force: bool = False, max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    执行增量导出
+
+    Args:
+        config_path: config.xml路径
+        force: 忽略清单，全量导出
+        max_workers: 工作进程数，默认使用CPU核数
+
+    Returns:
+        导出摘要：导出/跳过/删除的工作表、失败信息及耗时
+    """
+    started = time.perf_counter()
+    config = load_export_config(config_path)
+    if not os.path.isdir(config.xls_path):
+        raise FileNotFoundError(f"xlsPath目录不存在: {config.xls_path}")
+
+    manifest_file = _manifest_path(config)
+    manifest = {"version": EXPORT_FORMAT_VERSION, "sheets": {}} if force else load_manifest(manifest_file)
+    previous = manifest["sheets"]
+
+    jobs = []
+    current = {}
+    seen_names = {}
+    skipped = []
+    for sheet in _scan_sheets(config.xls_path):
+        if sheet["sheet"] in seen_names:
+            logger.warning(f"工作表 {sheet['sheet']} 同时存在于 {seen_names[sheet['sheet']]} 和 {sheet['key']}，忽略后者")
+            continue
+        seen_names[sheet["sheet"]] = sheet["key"]
+        json_out = os.path.join(config.json_path, sheet["sheet"] + ".json") if config.json_path else None
+        bytes_out = os.path.join(config.byte_path, sheet["sheet"] + BYTES_EXTENSION) if config.byte_path else None
+        entry = {"fingerprint": sheet["fingerprint"], "json": json_out, "bytes": bytes_out}
+        current[sheet["key"]] = entry
+
+        old = previous.get(sheet["key"])
+        outputs_present = all(p is None or os.path.exists(p) for p in (json_out, bytes_out))
+        if old and old == entry and outputs_present:
+            skipped.append(sheet["key"])
+            continue
+        jobs.append(dict(sheet, json=json_out, bytes=bytes_out))
+
+    # 清理已删除工作表的导出文件
+    removed = []
+    for key, entry in previous.items():
+        if key not in current:
+            _remove_quietly(entry.get("json"))
+            _remove_quietly(entry.get("bytes"))
+            removed.append(key)
+
+    exported = []
+    failed = []
+    if len(jobs) == 1 or max_workers == 1:
+        # 单表变更直接在当前进程导出，避免启动进程池的开销
+        for job in jobs:
+            try:
+                exported.append(_export_sheet_job(job))
+            except Exception as e:
+                failed.append({"key": job["key"], "error": str(e)})
+    elif jobs:
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_export_sheet_job, job): job for job in jobs}
+            for future, job in futures.items():
+                try:
+                    exported.append(future.result())
+                except Exception as e:
+                    failed.append({"key": job["key"], "error": str(e)})
+
+    # 失败的工作表不写入清单，下次运行时重试
+    failed_keys = {f["key"] for f in failed}
+    manifest = {
+        "version": EXPORT_FORMAT_VERSION,
+        "sheets": {k: v for k, v in current.items() if k not in failed_keys},
+    }
+    atomic_write_json(manifest_file, manifest)
+
+    summary = {
+        "exported": exported,
+        "skipped": len(skipped),
+        "removed": removed,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info(f"导出完成: 导出 {len(exported)} 个，跳过 {len(skipped)} 个，删除 {len(removed)} 个，失败 {len(failed)} 个")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量导出Excel表到jsonPath/bytePath")
+    parser.add_argument("config", nargs="?", default="config.xml", help="config.xml路径")
+    parser.add_argument("--force", action="store_true", help="忽略导出清单，全量导出")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        summary = run_export(args.config, force=args.force, max_workers=args.workers)
+    except Exception as e:
+        print(f"导出失败: {e}")
+        sys.exit(1)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
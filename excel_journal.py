@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+写前日志（write-ahead journal）
+Python引擎执行的UPDATE/DELETE和批量插入先追加到工作簿对应的日志文件，再修改内存中的表，工作簿稍后合并保存。
+
+日志为JSON Lines，放在缓存目录（与工作表目录相同）下，每个工作簿一个文件：
+    {"type": "dml", "workbook": 路径, "sheet": 工作表, "base": 执行时磁盘上的工作表指纹, "sql": 语句,
+     "params": ?占位符的参数（语句没有参数时省略）}
+    {"type": "insert", "workbook": 路径, "sheet": 工作表, "base": 指纹, "columns": [列名], "values": [[各列的值]]}
+    {"type": "saved", "workbook": 路径, "fingerprints": {工作表: 保存后的指纹}}
+保存时先写新工作簿的临时文件，追加saved记录，再替换原文件并删除日志；
+进程在任意一步崩溃后，下次加载该工作表时按日志重放尚未写入工作簿的语句。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from excel_catalog import default_cache_dir
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PREFIX = "journal-"
+JOURNAL_SUFFIX = ".jsonl"
+# 需要重放的记录类型
+_CHANGE_TYPES = ("dml", "insert")
+
+
+def journal_path(workbook: str, cache_dir: Optional[str] = None) -> str:
+    """工作簿对应的日志文件路径"""
+    digest = hashlib.sha1(os.path.abspath(workbook).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir or default_cache_dir(), f"{JOURNAL_PREFIX}{digest}{JOURNAL_SUFFIX}")
+
+
+class WriteJournal:
+    """单个工作簿的写前日志，线程安全"""
+
+    def __init__(self, workbook: str, cache_dir: Optional[str] = None):
+        self.workbook = os.path.abspath(workbook)
+        self.path = journal_path(self.workbook, cache_dir)
+        self._lock = threading.Lock()
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a+b") as fp:
+                # 上次崩溃可能留下没有换行的半行，新记录从新的一行开始
+                if fp.seek(0, os.SEEK_END) > 0:
+                    fp.seek(-1, os.SEEK_END)
+                    if fp.read(1) != b"\n":
+                        line = b"\n" + line
+                fp.write(line)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def append_dml(self, sheet: str, base: str, sql: str, params: Sequence[Any] = ()) -> None:
+        """记录一条已生效的UPDATE/DELETE语句及其参数，返回时已落盘"""
+        record = {"type": "dml", "workbook": self.workbook, "sheet": sheet, "base": base, "sql": sql}
+        if params:
+            record["params"] = list(params)
+        self._append(record)
+
+    def append_insert(self, sheet: str, base: str, columns: List[str], values: List[List[Any]]) -> None:
+        """记录一次批量插入（按列的已转换值），返回时已落盘"""
+        self._append({"type": "insert", "workbook": self.workbook, "sheet": sheet, "base": base,
+                      "columns": columns, "values": values})
+
+    def mark_saved(self, fingerprints: Dict[str, str]) -> None:
+        """记录新工作簿（替换原文件之前）中各工作表的指纹"""
+        self._append({"type": "saved", "workbook": self.workbook, "fingerprints": fingerprints})
+
+    def records(self) -> List[Dict[str, Any]]:
+        """读取全部记录，忽略崩溃时写了一半的最后一行"""
+        with self._lock:
+            try:
+                with open(self.path, "rb") as fp:
+                    lines = fp.read().splitlines()
+            except FileNotFoundError:
+                return []
+        records = []
+        for i, line in enumerate(lines):
+            try:
+                records.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                if i != len(lines) - 1:
+                    logger.warning(f"日志 {self.path} 第 {i + 1} 行已损坏，已跳过")
+        return records
+
+    def pending(self, sheet: str, fingerprint: str) -> List[Dict[str, Any]]:
+        """
+        返回需要在当前磁盘内容（工作表指纹为fingerprint）上重放的语句
+
+        最近一次saved记录中的指纹与磁盘一致时，之前的语句已经写入工作簿，只重放之后的语句；
+        否则重放该工作表的全部语句（磁盘内容被外部修改时按新内容重新执行，并记录警告）
+        """
+        records = self.records()
+        start = 0
+        for i, record in enumerate(records):
+            if record.get("type") == "saved" and record.get("fingerprints", {}).get(sheet) == fingerprint:
+                start = i + 1
+        pending = [r for r in records[start:] if r.get("type") in _CHANGE_TYPES and r.get("sheet") == sheet]
+        if pending and pending[0].get("base") != fingerprint:
+            logger.warning(f"{os.path.basename(self.workbook)} 的工作表 {sheet} 在保存前被外部修改，"
+                           f"{len(pending)} 条未保存的语句将在新内容上重新执行")
+        return pending
+
+    def sheets(self) -> List[str]:
+        """日志中有未保存语句的工作表"""
+        sheets = []
+        for record in self.records():
+            if record.get("type") in _CHANGE_TYPES and record.get("sheet") not in sheets:
+                sheets.append(record.get("sheet"))
+        return sheets
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def discard(self) -> None:
+        """工作簿已保存，删除日志"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def list_journaled_workbooks(cache_dir: Optional[str] = None) -> List[str]:
+    """列出缓存目录中存在未删除日志的工作簿路径"""
+    cache_dir = cache_dir or default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return []
+    workbooks = []
+    for name in sorted(os.listdir(cache_dir)):
+        if not (name.startswith(JOURNAL_PREFIX) and name.endswith(JOURNAL_SUFFIX)):
+            continue
+        try:
+            with open(os.path.join(cache_dir, name), "rb") as fp:
+                first = json.loads(fp.readline().decode("utf-8"))
+            workbooks.append(first["workbook"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"无法读取日志 {name}: {e}")
+    return workbooks
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+表结构查询
+通过工作表目录定位目标工作表，只流式读取前几行元数据（字段名、类型、描述）生成建表语句，
+结果按工作表指纹缓存，与表的数据量无关。
+"""
+
+import logging
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from excel_catalog import CatalogEntry, SheetCatalog, TableNotFoundError, default_catalog
+from xlsx_reader import Column, read_sheet_header
+
+logger = logging.getLogger(__name__)
+
+_SHOW_TABLES = re.compile(r"^\s*SHOW\s+TABLES\s*;?\s*$", re.IGNORECASE)
+_SHOW_CREATE_TABLE = re.compile(r"^\s*SHOW\s+CREATE\s+TABLE\s+[`\"\[]?([^`\"\]\s;]+)[`\"\]]?\s*;?\s*$", re.IGNORECASE)
+
+# 指纹 -> 列定义，最多缓存的工作表数
+_CACHE_LIMIT = 512
+_header_cache: "OrderedDict[str, List[Column]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def is_show_tables(sql: str) -> bool:
+    """判断是否为SHOW TABLES语句"""
+    return bool(_SHOW_TABLES.match(sql or ""))
+
+
+def parse_show_create_table(sql: str) -> Optional[str]:
+    """解析SHOW CREATE TABLE语句，返回表名；不是该语句时返回None"""
+    match = _SHOW_CREATE_TABLE.match(sql or "")
+    return match.group(1) if match else None
+
+
+def map_sql_type(data_type: str) -> str:
+    """将第二行声明的类型映射为SQL类型（与SqliteManager.MapType一致）"""
+    kind = (data_type or "").upper()
+    if kind == "INT":
+        return "INTEGER"
+    if kind in ("FLOAT", "DOUBLE"):
+        return "REAL"
+    if kind == "BOOLEAN":
+        return "INTEGER"
+    return "TEXT"
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_create_table(table_name: str, columns: List[Column]) -> str:
+    """根据列定义生成建表语句，第三行描述作为列注释"""
+    lines = []
+    for i, column in enumerate(columns):
+        line = f"    {quote_ident(column.name)} {map_sql_type(column.data_type)}"
+        if i < len(columns) - 1:
+            line += ","
+        if column.comments:
+            line += " -- " + column.comments.replace("\n", " ")
+        lines.append(line)
+    return f"CREATE TABLE {quote_ident(table_name)} (\n" + "\n".join(lines) + "\n);"
+
+
+def read_columns(entry: CatalogEntry) -> List[Column]:
+    """读取工作表的列定义，命中指纹缓存时不打开文件"""
+    with _cache_lock:
+        cached = _header_cache.get(entry.fingerprint)
+        if cached is not None:
+            _header_cache.move_to_end(entry.fingerprint)
+            return cached
+
+    with zipfile.ZipFile(entry.workbook) as zf:
+        columns = read_sheet_header(zf, entry.part)
+
+    with _cache_lock:
+        _header_cache[entry.fingerprint] = columns
+        while len(_header_cache) > _CACHE_LIMIT:
+            _header_cache.popitem(last=False)
+    return columns
+
+
+def get_table_schema(table_name: str, directory: str,
+                     catalog: SheetCatalog = default_catalog) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    获取建表语句
+
+    Args:
+        table_name: 工作表名称；也可以是Excel文件名（可不带.xlsx），此时返回该文件所有工作表的建表语句
+        directory: Excel文件目录
+        catalog: 工作表目录
+
+    Returns:
+        {"table": 表名, "createTable": 建表语句}，按文件名查询多个工作表时返回列表
+    """
+    try:
+        entry = catalog.resolve(directory, table_name)
+        return {"table": entry.name, "createTable": build_create_table(entry.name, read_columns(entry))}
+    except TableNotFoundError:
+        entries = catalog.workbook_entries(directory, table_name)
+        if not entries:
+            raise
+    results = [{"table": e.name, "createTable": build_create_table(e.name, read_columns(e))} for e in entries]
+    return results[0] if len(results) == 1 else results
@@ -7,9 +7,11 @@ Excel SQL Tool FastMCP Server
 import asyncio
 import json
 import subprocess
+import threading
+import time
 import sys
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 import logging
 from pathlib import Path
 import concurrent.futures
@@ -31,6 +33,16 @@ except ImportError as e:
     print("请运行 'pip install fastmcp' 安装FastMCP")
     sys.exit(1)
 
+from engine_daemon import default_service
+from result_format import EncodedResult, LogPreview, encode_result, wrap_result
+from excel_diff import DIFF_DETAIL_LIMIT, current_version_path, diff_paths
+from excel_export import run_export
+from excel_schema import is_show_tables, parse_show_create_table
+from single_flight import SingleFlight, request_key
+from slow_log import slow_query_log
+from sql_engine import UnsupportedSqlError, parse_query_params
+from text_lookup import parse_names
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -71,13 +83,38 @@ class NonStandardRequestMiddleware(Middleware):
         return await call_next(context)
 
 
+class SlowQueryMiddleware(Middleware):
+    """耗时超过阈值的工具调用写入慢查询日志"""
+    
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        started = time.perf_counter()
+        arguments = smart_parse_arguments(dict(context.message.arguments or {}))
+        try:
+            result = await call_next(context)
+        except Exception as e:
+            text, is_error = f"错误: {str(e)}", True
+            raise
+        else:
+            text = "".join(getattr(item, "text", "") for item in result.content)
+            is_error = text.startswith("错误")
+        finally:
+            slow_query_log.observe("fastmcp", context.message.name, arguments,
+                                   arguments.get("directory") or default_excel_directory,
+                                   started, len(text), is_error)
+        return result
+
+
 # 创建 MCP Server
 mcp = FastMCP("excel-sql-tool")
 mcp.add_middleware(NonStandardRequestMiddleware())
+mcp.add_middleware(SlowQueryMiddleware())
 
 # 默认Excel目录
 default_excel_directory = "./XLSX"
 
+# 同时进行的同一目录的excel_refresh_cache只执行一次（包括Excel工具进程）
+_refresh_flights = SingleFlight()
+
 
 def smart_parse_arguments(args: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -282,25 +319,25 @@ def excel_show_tables(directory: str = None) -> str:
         
         logger.info(f"使用目录: {actual_directory}")
         
-        # 使用线程池执行器运行异步代码
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(_execute_sql_sync, "SHOW TABLES", actual_directory)
-            return future.result()
+        return _get_tables_sync(actual_directory)
     except Exception as e:
         logger.error(f"excel_show_tables 错误: {str(e)}")
         return f"错误: {str(e)}"
 
 @ide_tool_wrapper
 @mcp.tool
-def excel_query(sql: str = None, directory: str = None) -> str:  # pyright: ignore[reportArgumentType]
+def excel_query(sql: str = None, directory: str = None, params: Optional[List[Any]] = None,  # pyright: ignore[reportArgumentType]
+                fetch_all: bool = False) -> str:
     """执行SQL查询Excel数据，表名应为工作表名称而非文件名，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
     
     Args/arguments:
-        sql: SQL查询语句，支持SELECT、SHOW TABLES、SHOW CREATE TABLE等。注意：表名应为工作表名称
+        sql: SQL查询语句，支持SELECT、UPDATE、DELETE、SHOW TABLES、SHOW CREATE TABLE等。注意：表名应为工作表名称
         directory: Excel文件所在的目录路径（可选，默认使用已设置的目录）
+        params: SQL中?占位符按顺序对应的参数值（可选），如 [1001, "攻击"]
+        fetch_all: 返回全部结果行，不受行数/字节数上限限制（可选，默认False）
     """
     try:
-        logger.info(f"excel_query 收到参数: sql={sql}, directory={directory}")
+        logger.info(f"excel_query 收到参数: sql={sql}, directory={directory}, params={params}, fetch_all={fetch_all}")
         
         actual_directory = directory if directory is not None else default_excel_directory
         
@@ -309,9 +346,16 @@ def excel_query(sql: str = None, directory: str = None) -> str:  # pyright: igno
             
         logger.info(f"执行查询: SQL={sql}, 目录={actual_directory}")
         
+        if is_show_tables(sql):
+            return _get_tables_sync(actual_directory)
+        show_create_table = parse_show_create_table(sql)
+        if show_create_table:
+            return _get_create_table_sync(show_create_table, actual_directory)
+        
         # 使用线程池执行器运行异步代码
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(_execute_sql_sync, sql, actual_directory)
+            future = executor.submit(_execute_sql_sync, sql, actual_directory, bool(fetch_all),
+                                     parse_query_params(params))
             return future.result()
     except Exception as e:
         logger.error(f"excel_query 错误: {str(e)}")
@@ -336,10 +380,7 @@ def excel_get_table_schema(sheet_name: str = None, directory: str = None) -> str
             
         logger.info(f"获取表结构: 表名={sheet_name}, 目录={actual_directory}")
         
-        # 使用线程池执行器运行异步代码
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(_get_create_table_sync, sheet_name, actual_directory)
-            return future.result()
+        return _get_create_table_sync(sheet_name, actual_directory)
     except Exception as e:
         logger.error(f"excel_get_table_schema 错误: {str(e)}")
         return f"错误: {str(e)}"
@@ -382,28 +423,240 @@ def excel_list_sheets(directory: str = None) -> str:
         
         logger.info(f"列出工作表目录: {excel_dir}")
         
-        # 使用线程池执行器运行异步代码
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(_get_tables_sync, excel_dir)
-            return future.result()
+        return _list_sheets_sync(excel_dir)
     except Exception as e:
         logger.error(f"excel_list_sheets 错误: {str(e)}")
         return f"错误: {str(e)}"
 
-def _execute_sql_sync(sql: str, directory: str) -> str:
-    """同步执行SQL语句"""
+@ide_tool_wrapper
+@mcp.tool
+def excel_export(config_path: str = None, force: bool = False) -> str:
+    """按config.xml增量导出表格到jsonPath和bytePath，只导出内容发生变化的工作表，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        config_path: config.xml路径（可选，默认使用服务器目录下的config.xml）
+        force: 忽略导出清单，全量导出（可选）
+    """
+    try:
+        logger.info(f"excel_export 收到参数: config_path={config_path}, force={force}")
+        
+        actual_config = config_path if config_path is not None else str(Path(__file__).parent / "config.xml")
+        
+        return _format_result({"result": run_export(actual_config, force=bool(force))})
+    except Exception as e:
+        logger.error(f"excel_export 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+@ide_tool_wrapper
+@mcp.tool
+def excel_diff(old_path: str = None, new_path: str = None, sheet: str = None, key: str = None,
+               limit: int = DIFF_DETAIL_LIMIT) -> str:
+    """比较工作表的两个版本（xlsx文件或目录），按键列报告新增、删除和修改的行及修改的单元格，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        old_path: 旧版本的xlsx文件或目录
+        new_path: 新版本的xlsx文件或目录（可选，默认为当前Excel目录或其中的同名文件）
+        sheet: 只比较该工作表（可选）
+        key: 用于匹配行的键列（可选，默认为第一列）
+        limit: 每类差异最多返回的行明细数（可选，默认100，0表示只返回数量）
+    """
+    try:
+        logger.info(f"excel_diff 收到参数: old_path={old_path}, new_path={new_path}, sheet={sheet}, key={key}, limit={limit}")
+        
+        if not old_path:
+            return "错误: 旧版本路径不能为空"
+        actual_new = new_path if new_path is not None else current_version_path(old_path, default_excel_directory)
+        
+        limit = DIFF_DETAIL_LIMIT if limit is None else int(limit)
+        if limit < 0:
+            return f"错误: limit不能为负数: {limit}"
+        return _format_result({"result": diff_paths(old_path, actual_new, sheet, key, limit)})
+    except Exception as e:
+        logger.error(f"excel_diff 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+@ide_tool_wrapper
+@mcp.tool
+def excel_explain(sql: str = None, directory: str = None, params: Optional[List[Any]] = None,  # pyright: ignore[reportArgumentType]
+                  analyze: bool = True) -> str:
+    """返回SELECT语句的执行计划（扫描/索引/过滤/连接/聚合/排序算子树），默认执行一次并统计各算子的输入输出行数、耗时和内存；也可以在excel_query中使用EXPLAIN ANALYZE前缀，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        sql: SELECT语句。注意：表名应为工作表名称
+        directory: Excel文件所在的目录路径（可选，默认使用已设置的目录）
+        params: SQL中?占位符按顺序对应的参数值（可选）
+        analyze: 是否执行查询并统计各算子的行数和耗时（可选，默认True；False时只返回计划）
+    """
+    try:
+        logger.info(f"excel_explain 收到参数: sql={sql}, directory={directory}, params={params}, analyze={analyze}")
+        
+        if sql is None:
+            return "错误: SQL查询语句不能为空"
+        excel_dir = directory if directory is not None else default_excel_directory
+        
+        return _format_result({"result": default_service.encoded("explain", sql=sql, directory=excel_dir,
+                                                                 params=parse_query_params(params),
+                                                                 analyze=bool(analyze))})
+    except Exception as e:
+        logger.error(f"excel_explain 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+@ide_tool_wrapper
+@mcp.tool
+def excel_export_query(sql: str = None, path: str = None, format: str = None,  # pyright: ignore[reportArgumentType]
+                       directory: str = None, params: Optional[List[Any]] = None) -> str:  # pyright: ignore[reportArgumentType]
+    """执行SELECT语句并把全部结果流式写入本地文件（csv/ndjson/xlsx/bytes），只返回路径、行数、字节数和耗时，不受结果行数上限约束，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        sql: SELECT语句。注意：表名应为工作表名称
+        path: 输出文件路径，已存在时覆盖
+        format: csv、ndjson、xlsx或bytes（可选，默认按扩展名推断，无法推断时为csv）
+        directory: Excel文件所在的目录路径（可选，默认使用已设置的目录）
+        params: SQL中?占位符按顺序对应的参数值（可选）
+    """
+    try:
+        logger.info(f"excel_export_query 收到参数: sql={sql}, path={path}, format={format}, directory={directory}, params={params}")
+        
+        if sql is None:
+            return "错误: SQL查询语句不能为空"
+        if not path:
+            return "错误: 输出文件路径不能为空"
+        excel_dir = directory if directory is not None else default_excel_directory
+        
+        return _format_result({"result": default_service.encoded("export_query", sql=sql, directory=excel_dir,
+                                                                 path=path, format=format,
+                                                                 params=parse_query_params(params))})
+    except Exception as e:
+        logger.error(f"excel_export_query 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+@ide_tool_wrapper
+@mcp.tool
+def excel_bulk_insert(table: str = None, source: Union[str, Dict[str, List[Any]]] = None,  # pyright: ignore[reportArgumentType]
+                      directory: str = None, skip_invalid: bool = False) -> str:  # pyright: ignore[reportArgumentType]
+    """把大量行一次追加到工作表并立即保存（代替逐条INSERT），按第一行字段名和第二行类型校验，校验失败的行汇总报告，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        table: 表名（工作表名称）
+        source: 按列的数组，如 {"Id": [1, 2], "Name": ["a", "b"]}；或CSV（第一行为列名）/NDJSON/JSON文件路径
+        directory: Excel文件所在的目录路径（可选，默认使用已设置的目录）
+        skip_invalid: 跳过校验失败的行并插入其余行（可选，默认False：有失败的行时不插入任何行）
+    """
+    try:
+        logger.info(f"excel_bulk_insert 收到参数: table={table}, source={type(source).__name__}, "
+                    f"directory={directory}, skip_invalid={skip_invalid}")
+        
+        if not table:
+            return "错误: 表名不能为空"
+        if not source:
+            return "错误: 插入的数据来源不能为空"
+        excel_dir = directory if directory is not None else default_excel_directory
+        
+        return _format_result({"result": default_service.encoded("bulk_insert", table_name=table, directory=excel_dir,
+                                                                 source=source, skip_invalid=bool(skip_invalid))})
+    except Exception as e:
+        logger.error(f"excel_bulk_insert 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+@ide_tool_wrapper
+@mcp.tool
+def excel_lookup_text(keys: Union[str, List[str]] = None, languages: Union[str, List[str]] = None,  # pyright: ignore[reportArgumentType]
+                      tables: Union[str, List[str]] = None, key_column: str = "key",  # pyright: ignore[reportArgumentType]
+                      directory: str = None) -> str:  # pyright: ignore[reportArgumentType]
+    """批量查找Language表中文本键的各语言文本（键索引查找，代替逐个键的excel_query），一次可以查找数百个键，请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        keys: 要查找的文本键（key列的值），数组或逗号分隔的文本
+        languages: 语言，如 ["Chinese", "English"]（可选，默认返回所有语言列）
+        tables: 按顺序查找的表（可选，默认为名称以Language开头的表）
+        key_column: 键列名（可选，默认key）
+        directory: Excel文件所在的目录路径（可选，默认使用已设置的目录）
+    """
+    try:
+        logger.info(f"excel_lookup_text 收到参数: keys={keys}, languages={languages}, tables={tables}, "
+                    f"key_column={key_column}, directory={directory}")
+        
+        names = parse_names(keys, "keys")
+        if not names:
+            return "错误: 要查找的文本键不能为空"
+        excel_dir = directory if directory is not None else default_excel_directory
+        
+        return _format_result({"result": default_service.encoded("lookup_text", keys=names, directory=excel_dir,
+                                                                 languages=parse_names(languages, "languages"),
+                                                                 tables=parse_names(tables, "tables"),
+                                                                 key_column=key_column or "key")})
+    except Exception as e:
+        logger.error(f"excel_lookup_text 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+@ide_tool_wrapper
+@mcp.tool
+def excel_commit(directory: str = None) -> str:
+    """立即把UPDATE/DELETE的未保存修改写回Excel文件（修改默认在最后一次修改几秒后自动合并保存），请求参数不需要包装成包含server_name和tool_name的结构，而是直接传递啊Args
+    
+    Args/arguments:
+        directory: Excel文件所在的目录路径（可选，默认使用已设置的目录）
+    """
+    try:
+        logger.info(f"excel_commit 收到参数: directory={directory}")
+        
+        excel_dir = directory if directory is not None else default_excel_directory
+        
+        return _format_result({"result": default_service.encoded("commit", directory=excel_dir)})
+    except Exception as e:
+        logger.error(f"excel_commit 错误: {str(e)}")
+        return f"错误: {str(e)}"
+
+def _execute_sql_sync(sql: str, directory: str, fetch_all: bool = False, params: Optional[List[Any]] = None) -> str:
+    """同步执行SQL语句，SELECT/UPDATE/DELETE由Python引擎执行，引擎不支持的语句转发给Excel工具"""
+    try:
+        return _format_result({"result": default_service.encoded("execute", sql=sql, directory=directory,
+                                                                 fetch_all=fetch_all, params=params)})
+    except UnsupportedSqlError as e:
+        if params:
+            return _format_result({"error": {"message": f"执行SQL失败: 带参数的语句只能由Python引擎执行，{str(e)}"}})
+        logger.info(f"{e}，转发给Excel工具")
+    except Exception as e:
+        return _format_result({"error": {"message": f"执行SQL失败: {str(e)}"}})
+    try:
+        # Excel工具从磁盘读取工作簿，先写回Python引擎中尚未保存的UPDATE/DELETE，避免读到修改前的数据
+        summary = default_service.commit(directory)
+    except Exception as e:
+        return _format_result({"error": {"message": f"执行SQL失败: 未保存的修改写回失败: {str(e)}"}})
+    if summary.get("failed"):
+        return _format_result({"error": {"message": f"执行SQL失败: 未保存的修改写回失败，无法转发给Excel工具: "
+                                                    f"{summary['failed']}"}})
     return _run_async_task(_execute_sql_internal(sql, directory))
 
 def _get_create_table_sync(table_name: str, directory: str) -> str:
-    """同步获取表结构"""
-    return _run_async_task(_get_create_table_internal(table_name, directory))
+    """同步获取表结构（只读取目标工作表的表头行）"""
+    try:
+        schema = default_service.encoded("table_schema", table_name=table_name, directory=directory)
+        return _format_result({"result": schema})
+    except Exception as e:
+        return _format_result({"error": {"message": f"获取表结构失败: {str(e)}"}})
 
 def _get_tables_sync(directory: str) -> str:
-    """同步获取所有表"""
-    return _run_async_task(_get_tables_internal(directory))
+    """同步获取所有表（只读取工作簿目录信息，不加载单元格数据）"""
+    try:
+        return _format_result({"result": default_service.encoded("table_names", directory=directory)})
+    except Exception as e:
+        return _format_result({"error": {"message": f"获取表列表失败: {str(e)}"}})
+
+def _list_sheets_sync(directory: str) -> str:
+    """同步列出工作表摘要（所属文件、区域、估计行数、别名）"""
+    try:
+        return _format_result({"result": default_service.encoded("describe", directory=directory)})
+    except Exception as e:
+        return _format_result({"error": {"message": f"获取工作表列表失败: {str(e)}"}})
 
 def _refresh_cache_sync(directory: str) -> str:
-    """同步刷新缓存"""
+    """同步刷新缓存，同时进行的同一目录的刷新只执行一次"""
+    return _refresh_flights.do(request_key("refresh", {"directory": directory}),
+                               lambda: _refresh_directory(directory))
+
+def _refresh_directory(directory: str) -> str:
+    default_service.invalidate(directory)
     return _run_async_task(_refresh_cache_internal(directory))
 
 def _run_async_task(coro):
@@ -426,22 +679,6 @@ async def _execute_sql_internal(sql: str, directory: str) -> Dict[str, Any]:
     }
     return await _send_request_to_excel_tool(request, directory)
 
-async def _get_create_table_internal(table_name: str, directory: str) -> Dict[str, Any]:
-    """获取表结构"""
-    request = {
-        "method": "get_create_table",
-        "params": {"table": table_name}
-    }
-    return await _send_request_to_excel_tool(request, directory)
-
-async def _get_tables_internal(directory: str) -> Dict[str, Any]:
-    """获取所有表"""
-    request = {
-        "method": "get_tables",
-        "params": {}
-    }
-    return await _send_request_to_excel_tool(request, directory)
-
 async def _refresh_cache_internal(directory: str) -> Dict[str, Any]:
     """刷新缓存"""
     request = {
@@ -489,7 +726,7 @@ async def _send_request_to_excel_tool(request: Dict[str, Any], directory: str) -
         
         # 解析响应
         response_text = result.stdout.decode('utf-8', errors='ignore')
-        logger.info(f"Excel工具响应: {response_text}")
+        logger.info("Excel工具响应: %s", LogPreview(response_text))
         
         # 查找JSON响应
         lines = response_text.split('\n')
@@ -514,14 +751,19 @@ async def _send_request_to_excel_tool(request: Dict[str, Any], directory: str) -
         raise Exception(f"调用Excel工具失败: {str(e)}")
 
 def _format_result(result: Any) -> str:
-    """格式化结果"""
+    """格式化结果，{"result": ...}中的结果由引擎编码好后原样拼接"""
     try:
+        if isinstance(result, dict) and len(result) == 1 and "result" in result:
+            value = result["result"]
+            return wrap_result(value if isinstance(value, EncodedResult) else EncodedResult(encode_result(value)))
         return json.dumps(result, ensure_ascii=False, indent=2)
     except Exception as e:
         return f"格式化结果失败: {str(e)}"
 
 if __name__ == "__main__":
     try:
+        # 后台启动引擎服务：进程内模式（默认）重放并保存上次进程留下的修改日志，守护进程模式连接守护进程
+        threading.Thread(target=default_service.start, daemon=True).start()
         # 运行FastMCP服务器
         mcp.run()
     except KeyboardInterrupt:
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+MCP负载工具
+record: 作为IDE与MCP服务器之间的stdio代理，原样转发并记录双方的JSON-RPC消息，
+        IDE发出的非标准参数包装（server_name/tool_name/args等，见smart_parse_tool_call_params）也按原样保存。
+replay: 把记录中IDE发出的请求作为负载，启动多个服务器进程（每个会话一个stdio连接）并发回放，
+        输出吞吐量和延迟分位数。
+
+记录文件为JSON Lines，每行 {"session": 会话标识, "t": 相对会话开始的秒数, "direction": "client"/"server", "message": 消息}；
+也可以直接每行写一条客户端JSON-RPC消息，作为手工编写的负载。
+
+负载模式:
+    closed: 每个会话发出请求后等待响应（可加思考时间）再发下一条，并发度等于会话数
+    open:   请求按--rate指定的到达率（泊松或均匀间隔）发出，不等待之前的响应，
+            延迟从计划发出时间算起，服务器跟不上时排队时间计入延迟
+
+用法:
+    python mcp_load.py record --output session.jsonl -- python mcp_server.py ./XLSX
+    python mcp_load.py replay session.jsonl --server "python mcp_server.py ./XLSX" --sessions 8 --duration 30
+    python mcp_load.py replay session.jsonl --mode open --rate 50 --sessions 4 --output report.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 服务器单行响应的最大长度（查询结果可能有数MB）
+_LINE_LIMIT = 64 << 20
+_PERCENTILES = (50, 90, 95, 99)
+
+_DEFAULT_INITIALIZE = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {},
+    "clientInfo": {"name": "mcp-load", "version": "1.0.0"},
+}
+
+
+# ---------------------------------------------------------------------------
+# 记录
+# ---------------------------------------------------------------------------
+
+class _Recorder:
+    """把代理转发的每一行追加到记录文件，两个转发线程共用"""
+
+    def __init__(self, path: str):
+        self.session = time.strftime("%Y%m%d-%H%M%S-") + str(os.getpid())
+        self.started = time.perf_counter()
+        self._fp = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, direction: str, line: bytes) -> None:
+        record: Dict[str, Any] = {"session": self.session, "t": round(time.perf_counter() - self.started, 6),
+                                  "direction": direction}
+        text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+        try:
+            record["message"] = json.loads(text)
+        except json.JSONDecodeError:
+            # 服务器启动时打印到stdout的提示等非JSON内容
+            record["raw"] = text
+        with self._lock:
+            self._fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._fp.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._fp.close()
+
+
+def _pump(source, target, recorder: _Recorder, direction: str, close_target: bool) -> None:
+    for line in iter(source.readline, b""):
+        target.write(line)
+        target.flush()
+        if line.strip():
+            recorder.write(direction, line)
+    if close_target:
+        target.close()
+
+
+def record(output: str, command: List[str]) -> int:
+    """
+    启动MCP服务器并代理stdio，记录双方的消息
+
+    Args:
+        output: 记录文件（追加写入）
+        command: 服务器命令行
+
+    Returns:
+        服务器进程的退出码
+    """
+    recorder = _Recorder(output)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    upstream = threading.Thread(target=_pump, args=(sys.stdin.buffer, process.stdin, recorder, "client", True),
+                                daemon=True)
+    downstream = threading.Thread(target=_pump, args=(process.stdout, sys.stdout.buffer, recorder, "server", False))
+    upstream.start()
+    downstream.start()
+    try:
+        code = process.wait()
+        downstream.join()
+    except KeyboardInterrupt:
+        process.terminate()
+        code = process.wait()
+    finally:
+        recorder.close()
+    return code
+
+
+# ---------------------------------------------------------------------------
+# 回放
+# ---------------------------------------------------------------------------
+
+def _label(message: Dict[str, Any]) -> str:
+    """统计分组：工具调用按工具名（包括包装格式中的tool_name），其它请求按方法名"""
+    method = message.get("method", "")
+    params = message.get("params") or {}
+    if method == "tools/call" and isinstance(params, dict):
+        tool = params.get("name") or params.get("tool_name")
+        if tool:
+            return str(tool)
+    return method
+
+
+def load_workload(path: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    从记录文件提取负载
+
+    Args:
+        path: 记录文件或手工编写的消息文件
+
+    Returns:
+        (第一条initialize请求的参数，没有时为None, 按顺序排列的客户端请求和通知，不含握手消息)
+    """
+    initialize = None
+    messages: List[Dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"忽略无法解析的行: {line[:80]}")
+                continue
+            if "direction" in entry:
+                if entry["direction"] != "client" or not isinstance(entry.get("message"), dict):
+                    continue
+                entry = entry["message"]
+            method = entry.get("method")
+            if not method:
+                continue
+            if method == "initialize":
+                if initialize is None:
+                    initialize = entry.get("params") or {}
+                continue
+            if method == "notifications/initialized":
+                continue
+            messages.append(entry)
+    return initialize, messages
+
+
+class _Sample:
+    __slots__ = ("label", "latency", "error")
+
+    def __init__(self, label: str, latency: float, error: Optional[str]):
+        self.label = label
+        self.latency = latency
+        self.error = error
+
+
+class _Session:
+    """一个stdio连接上的MCP会话，请求可以同时在途，按id匹配响应"""
+
+    def __init__(self, command: List[str], timeout: float):
+        self.command = command
+        self.timeout = timeout
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, initialize: Dict[str, Any]) -> None:
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, limit=_LINE_LIMIT)
+        self._reader = asyncio.create_task(self._read())
+        response = await self.request({"jsonrpc": "2.0", "id": 0, "method": "initialize", "params": initialize})
+        if "error" in response:
+            raise RuntimeError(f"初始化失败: {response['error']}")
+        await self._send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    async def _read(self) -> None:
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            future = self._pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("服务器进程已退出"))
+        self._pending.clear()
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        self.process.stdin.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+
+    async def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """发送请求（id替换为本会话的序号）并等待响应；通知发送后立即返回空响应"""
+        if "id" not in message:
+            await self._send(message)
+            return {}
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        await self._send(dict(message, id=request_id))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def close(self) -> None:
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self._reader is not None:
+            await self._reader
+
+
+def _response_error(response: Dict[str, Any]) -> Optional[str]:
+    if "error" in response:
+        return str(response["error"].get("message") if isinstance(response["error"], dict) else response["error"])
+    result = response.get("result")
+    if isinstance(result, dict) and result.get("isError"):
+        content = result.get("content") or [{}]
+        return str(content[0].get("text", "isError"))[:200]
+    return None
+
+
+async def _timed(session: _Session, message: Dict[str, Any], scheduled: float, samples: List[_Sample]) -> None:
+    """发送一条消息并记录从计划时间到收到响应的延迟"""
+    try:
+        response = await session.request(message)
+        error = _response_error(response)
+    except asyncio.TimeoutError:
+        error = "超时"
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    samples.append(_Sample(_label(message), time.perf_counter() - scheduled, error))
+
+
+async def _warm(session: _Session, messages: List[Dict[str, Any]], count: int) -> None:
+    for message in itertools.islice(itertools.cycle(messages), count):
+        await _timed(session, message, time.perf_counter(), [])
+
+
+async def _run_closed(sessions: List[_Session], messages: List[Dict[str, Any]], duration: float,
+                      total: Optional[int], think: float, samples: List[_Sample]) -> None:
+    deadline = time.perf_counter() + duration
+    issued = itertools.count()
+
+    async def worker(session: _Session, offset: int) -> None:
+        # 各会话从负载的不同位置开始，避免所有会话同时执行同一条语句
+        for message in itertools.islice(itertools.cycle(messages), offset, None):
+            if time.perf_counter() >= deadline or (total is not None and next(issued) >= total):
+                return
+            await _timed(session, message, time.perf_counter(), samples)
+            if think > 0:
+                await asyncio.sleep(think)
+
+    step = max(1, len(messages) // len(sessions))
+    await asyncio.gather(*(worker(session, i * step % len(messages)) for i, session in enumerate(sessions)))
+
+
+async def _run_open(sessions: List[_Session], messages: List[Dict[str, Any]], duration: float,
+                    total: Optional[int], rate: float, poisson: bool, samples: List[_Sample]) -> None:
+    started = time.perf_counter()
+    scheduled = started
+    tasks = []
+    for index, message in enumerate(itertools.cycle(messages)):
+        if scheduled - started >= duration or (total is not None and index >= total):
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_timed(sessions[index % len(sessions)], message, scheduled, samples)))
+        scheduled += random.expovariate(rate) if poisson else 1.0 / rate
+    await asyncio.gather(*tasks)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """最近秩分位数，values已排序"""
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def _summarize(samples: List[_Sample], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(sample.latency * 1000 for sample in samples)
+    summary: Dict[str, Any] = {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample.error),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    if latencies:
+        summary["meanMs"] = round(sum(latencies) / len(latencies), 3)
+        for percent in _PERCENTILES:
+            summary[f"p{percent}Ms"] = round(_percentile(latencies, percent), 3)
+        summary["maxMs"] = round(latencies[-1], 3)
+    return summary
+
+
+async def replay(command: List[str], initialize: Optional[Dict[str, Any]], messages: List[Dict[str, Any]],
+                 sessions: int = 4, mode: str = "closed", duration: float = 30.0, total: Optional[int] = None,
+                 rate: float = 10.0, poisson: bool = True, think: float = 0.0, timeout: float = 60.0,
+                 warmup: int = 0) -> Dict[str, Any]:
+    """
+    启动sessions个服务器进程并回放负载
+
+    Args:
+        command: 服务器命令行
+        initialize: initialize请求的参数，None时使用默认值
+        messages: load_workload返回的客户端消息
+        sessions: 并发会话数（服务器进程数）
+        mode: closed或open
+        duration: 发出请求的最长秒数
+        total: 最多发出的请求数
+        rate: open模式下每秒到达的请求数
+        poisson: open模式下到达间隔是否服从指数分布（否则均匀间隔）
+        think: closed模式下每个会话两次请求之间的等待秒数
+        timeout: 单个请求的超时秒数
+        warmup: 开始计时前每个会话依次执行的请求数（加载工作表、填充缓存），不计入统计
+
+    Returns:
+        {"command", "mode", "sessions", "summary": 总体统计, "byLabel": {工具或方法: 统计}, "errors": 前若干条错误}
+    """
+    if not messages:
+        raise ValueError("记录中没有可回放的客户端请求")
+    clients = [_Session(command, timeout) for _ in range(max(1, sessions))]
+    samples: List[_Sample] = []
+    try:
+        # 握手和服务器启动不计入负载时间
+        await asyncio.gather(*(client.start(initialize or _DEFAULT_INITIALIZE) for client in clients))
+        if warmup > 0:
+            await asyncio.gather(*(_warm(client, messages, warmup) for client in clients))
+        started = time.perf_counter()
+        if mode == "open":
+            await _run_open(clients, messages, duration, total, rate, poisson, samples)
+        else:
+            await _run_closed(clients, messages, duration, total, think, samples)
+        elapsed = time.perf_counter() - started
+    finally:
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    labels: Dict[str, List[_Sample]] = {}
+    for sample in samples:
+        labels.setdefault(sample.label, []).append(sample)
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if sample.error:
+            key = f"{sample.label}: {sample.error}"
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "command": command,
+        "mode": mode,
+        "sessions": len(clients),
+        "rate": rate if mode == "open" else None,
+        "summary": _summarize(samples, elapsed),
+        "byLabel": {label: _summarize(items, elapsed) for label, items in sorted(labels.items())},
+        "errors": dict(sorted(errors.items(), key=lambda item: -item[1])[:20]),
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"\n== {' '.join(report['command'])}  [{report['mode']}, {report['sessions']} 个会话"
+          + (f", {report['rate']}/s" if report["rate"] else "") + "]")
+    header = f"{'':<28}{'请求':>8}{'错误':>6}{'吞吐/s':>10}{'平均ms':>10}" + "".join(
+        f"{'p' + str(p) + 'ms':>10}" for p in _PERCENTILES) + f"{'最大ms':>10}"
+    print(header)
+    rows = [("总计", report["summary"])] + list(report["byLabel"].items())
+    for label, summary in rows:
+        line = f"{label[:27]:<28}{summary['requests']:>8}{summary['errors']:>6}{summary['throughput']:>10.1f}"
+        if "meanMs" in summary:
+            line += f"{summary['meanMs']:>10.1f}" + "".join(
+                f"{summary[f'p{p}Ms']:>10.1f}" for p in _PERCENTILES) + f"{summary['maxMs']:>10.1f}"
+        print(line)
+    for error, count in report["errors"].items():
+        print(f"  错误 x{count}: {error}")
+
+
+def _split_command(command: str) -> List[str]:
+    return shlex.split(command, posix=os.name != "nt")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="记录MCP stdio会话，或以多个并发会话回放并统计吞吐量和延迟")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="代理IDE与服务器之间的stdio并记录JSON-RPC消息")
+    record_parser.add_argument("--output", required=True, help="记录文件（追加写入）")
+    record_parser.add_argument("server", nargs=argparse.REMAINDER, help="服务器命令行（放在--之后）")
+
+    replay_parser = commands.add_parser("replay", help="回放记录中的请求并统计吞吐量和延迟")
+    replay_parser.add_argument("workload", help="record生成的记录文件，或每行一条客户端JSON-RPC消息的文件")
+    replay_parser.add_argument("--server", action="append", default=None,
+                               help="服务器命令行，可指定多次依次测试（默认测试mcp_server.py和fastmcp_server.py）")
+    replay_parser.add_argument("--sessions", type=int, default=4, help="并发会话数（默认4）")
+    replay_parser.add_argument("--mode", choices=("closed", "open"), default="closed", help="负载模式（默认closed）")
+    replay_parser.add_argument("--duration", type=float, default=30.0, help="发出请求的最长秒数（默认30）")
+    replay_parser.add_argument("--requests", type=int, default=None, help="最多发出的请求数")
+    replay_parser.add_argument("--rate", type=float, default=10.0, help="open模式下每秒到达的请求数（默认10）")
+    replay_parser.add_argument("--uniform", action="store_true", help="open模式下均匀间隔到达（默认泊松到达）")
+    replay_parser.add_argument("--think", type=float, default=0.0, help="closed模式下两次请求之间的等待秒数")
+    replay_parser.add_argument("--warmup", type=int, default=0, help="开始计时前每个会话执行的请求数（默认0）")
+    replay_parser.add_argument("--timeout", type=float, default=60.0, help="单个请求的超时秒数（默认60）")
+    replay_parser.add_argument("--output", default=None, help="把JSON格式的报告写入该文件")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        stream=sys.stderr)
+
+    if args.command == "record":
+        server = args.server[1:] if args.server[:1] == ["--"] else args.server
+        if not server:
+            parser.error("缺少服务器命令行，例如: record --output session.jsonl -- python mcp_server.py ./XLSX")
+        sys.exit(record(args.output, server))
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    servers = ([_split_command(command) for command in args.server] if args.server else
+               [[sys.executable, os.path.join(here, "mcp_server.py")], [sys.executable, os.path.join(here, "fastmcp_server.py")]])
+    initialize, messages = load_workload(args.workload)
+    reports = []
+    for command in servers:
+        report = asyncio.run(replay(command, initialize, messages, args.sessions, args.mode, args.duration,
+                                    args.requests, args.rate, not args.uniform, args.think, args.timeout,
+                                    args.warmup))
+        _print_report(report)
+        reports.append(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(reports, fp, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
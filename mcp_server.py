@@ -8,8 +8,10 @@ import asyncio
 import json
 import subprocess
 import sys
+import threading
+import time
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 import logging
 
 # 设置更详细的日志
@@ -47,6 +49,19 @@ except ImportError as e:
     print(f"导入mcp模块组件失败: {e}")
     sys.exit(1)
 
+from engine_daemon import default_service
+from result_format import EncodedResult, LogPreview, encode_result
+from excel_diff import DIFF_DETAIL_LIMIT, current_version_path, diff_paths
+from excel_export import run_export
+from excel_schema import is_show_tables, parse_show_create_table
+from single_flight import SingleFlight, request_key
+from slow_log import slow_query_log
+from sql_engine import UnsupportedSqlError, parse_query_params
+from text_lookup import parse_names
+
+# 同时进行的同一目录的excel_refresh_cache只执行一次（包括Excel工具进程）
+_refresh_flights = SingleFlight()
+
 def smart_parse_arguments(args: Dict[str, Any]) -> Dict[str, Any]:
     """
     智能解析工具参数，处理IDE agent可能的参数包装问题
@@ -78,6 +93,32 @@ def smart_parse_arguments(args: Dict[str, Any]) -> Dict[str, Any]:
     # 情况3: 参数是正确的格式，直接返回
     return args
 
+def parse_flag(value: Any, name: str, default: bool = False) -> bool:
+    """
+    解析布尔参数。原始MCP参数不做类型转换，bool("false")为True，这里只接受明确的取值
+
+    Args:
+        value: 参数值，True/"true"/"1"/1 为真，False/"false"/"0"/0/"" 为假（忽略大小写和首尾空白）
+        name: 参数名（用于错误信息）
+        default: 参数缺失（None）时的值
+
+    Raises:
+        ValueError: 其它取值
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return value == 1
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ("true", "1"):
+            return True
+        if text in ("false", "0", ""):
+            return False
+    raise ValueError(f"{name}必须是布尔值（true或false）: {value!r}")
+
 class ExcelSqlMcpServer:
     def __init__(self, excel_directory: str = "./XLSX"):
         self.excel_directory = excel_directory
@@ -128,7 +169,16 @@ class ExcelSqlMcpServer:
                     "properties": {
                         "sql": {
                             "type": "string",
-                            "description": "SQL查询语句，支持SELECT、SHOW TABLES、SHOW CREATE TABLE等。注意：表名应为工作表名称"
+                            "description": "SQL查询语句，支持SELECT、UPDATE、DELETE、SHOW TABLES、SHOW CREATE TABLE等。注意：表名应为工作表名称"
+                        },
+                        "params": {
+                            "type": "array",
+                            "items": {},
+                            "description": "SQL中?占位符按顺序对应的参数值（可选），如 [1001, \"攻击\"]"
+                        },
+                        "fetch_all": {
+                            "type": "boolean",
+                            "description": "返回全部结果行，不受行数/字节数上限限制（可选，默认false）"
                         }
                     },
                     "required": ["sql"]
@@ -165,6 +215,166 @@ class ExcelSqlMcpServer:
                     "properties": {},
                     "required": []
                 }
+            ),
+            Tool(
+                name="excel_explain",
+                description="返回SELECT语句的执行计划（扫描/索引/过滤/连接/聚合/排序算子树），默认执行一次并统计各算子的输入输出行数、耗时和内存；也可以在excel_query中使用EXPLAIN ANALYZE前缀",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "sql": {
+                            "type": "string",
+                            "description": "SELECT语句。注意：表名应为工作表名称"
+                        },
+                        "params": {
+                            "type": "array",
+                            "items": {},
+                            "description": "SQL中?占位符按顺序对应的参数值（可选）"
+                        },
+                        "analyze": {
+                            "type": "boolean",
+                            "description": "是否执行查询并统计各算子的行数和耗时（可选，默认true；false时只返回计划）"
+                        }
+                    },
+                    "required": ["sql"]
+                }
+            ),
+            Tool(
+                name="excel_export_query",
+                description="执行SELECT语句并把全部结果流式写入本地文件（csv/ndjson/xlsx/bytes），只返回路径、行数、字节数和耗时，不受结果行数上限约束，适合需要完整大结果的场景",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "sql": {
+                            "type": "string",
+                            "description": "SELECT语句。注意：表名应为工作表名称"
+                        },
+                        "path": {
+                            "type": "string",
+                            "description": "输出文件路径，已存在时覆盖"
+                        },
+                        "format": {
+                            "type": "string",
+                            "enum": ["csv", "ndjson", "xlsx", "bytes"],
+                            "description": "输出格式（可选，默认按扩展名推断，无法推断时为csv；bytes为excel_export的二进制表格式）"
+                        },
+                        "params": {
+                            "type": "array",
+                            "items": {},
+                            "description": "SQL中?占位符按顺序对应的参数值（可选）"
+                        }
+                    },
+                    "required": ["sql", "path"]
+                }
+            ),
+            Tool(
+                name="excel_bulk_insert",
+                description="把大量行一次追加到工作表并立即保存（代替逐条INSERT）：来源为按列的数组或本地CSV/NDJSON文件，按第一行字段名和第二行类型校验，校验失败的行汇总报告",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "table": {
+                            "type": "string",
+                            "description": "表名（工作表名称）"
+                        },
+                        "source": {
+                            "type": ["object", "string"],
+                            "description": "按列的数组，如 {\"Id\": [1, 2], \"Name\": [\"a\", \"b\"]}；或CSV（第一行为列名）/NDJSON/JSON文件路径"
+                        },
+                        "skip_invalid": {
+                            "type": "boolean",
+                            "description": "跳过校验失败的行并插入其余行（可选，默认false：有失败的行时不插入任何行）"
+                        }
+                    },
+                    "required": ["table", "source"]
+                }
+            ),
+            Tool(
+                name="excel_lookup_text",
+                description="批量查找Language表中文本键的各语言文本（键索引查找，代替逐个键的excel_query），一次可以查找数百个键",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "keys": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "要查找的文本键（key列的值）"
+                        },
+                        "languages": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "语言，如 [\"Chinese\", \"English\"]（可选，默认返回所有语言列）"
+                        },
+                        "tables": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "按顺序查找的表（可选，默认为名称以Language开头的表）"
+                        },
+                        "key_column": {
+                            "type": "string",
+                            "description": "键列名（可选，默认key）"
+                        }
+                    },
+                    "required": ["keys"]
+                }
+            ),
+            Tool(
+                name="excel_commit",
+                description="立即把UPDATE/DELETE的未保存修改写回Excel文件（修改默认在最后一次修改几秒后自动合并保存）",
+                inputSchema={
+                    "type": "object",
+                    "properties": {},
+                    "required": []
+                }
+            ),
+            Tool(
+                name="excel_export",
+                description="按config.xml增量导出表格到jsonPath和bytePath，只导出内容发生变化的工作表",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "config_path": {
+                            "type": "string",
+                            "description": "config.xml路径（可选，默认使用服务器目录下的config.xml）"
+                        },
+                        "force": {
+                            "type": "boolean",
+                            "description": "忽略导出清单，全量导出（可选）"
+                        }
+                    },
+                    "required": []
+                }
+            ),
+            Tool(
+                name="excel_diff",
+                description="比较工作表的两个版本（xlsx文件或目录），按键列报告新增、删除和修改的行及修改的单元格",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "old_path": {
+                            "type": "string",
+                            "description": "旧版本的xlsx文件或目录"
+                        },
+                        "new_path": {
+                            "type": "string",
+                            "description": "新版本的xlsx文件或目录（可选，默认为当前Excel目录或其中的同名文件）"
+                        },
+                        "sheet": {
+                            "type": "string",
+                            "description": "只比较该工作表（可选）"
+                        },
+                        "key": {
+                            "type": "string",
+                            "description": "用于匹配行的键列（可选，默认为第一列）"
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "minimum": 0,
+                            "description": f"每类差异最多返回的行明细数（可选，默认{DIFF_DETAIL_LIMIT}，0表示只返回数量）"
+                        }
+                    },
+                    "required": ["old_path"]
+                }
             )
         ]
         logger.info(f"返回 {len(tools)} 个工具")
@@ -172,11 +382,14 @@ class ExcelSqlMcpServer:
     
     async def call_tool(self, name: str, arguments: Dict[str, Any]):
         """调用指定的工具"""
-        logger.info(f"调用工具: {name}，原始参数: {arguments}")
+        # 参数可能包含excel_bulk_insert的整批数据，只记录有长度上限的摘要
+        logger.info("调用工具: %s，原始参数: %s", name, LogPreview(arguments))
+        started = time.perf_counter()
+        parsed_arguments = arguments
         try:
             # 智能解析参数
             parsed_arguments = smart_parse_arguments(arguments)
-            logger.info(f"解析后参数: {parsed_arguments}")
+            logger.info("解析后参数: %s", LogPreview(parsed_arguments))
             
             if name == "excel_show_tables":
                 result = await self._get_tables(parsed_arguments.get("directory"))
@@ -184,7 +397,15 @@ class ExcelSqlMcpServer:
                 sql = parsed_arguments.get("sql")
                 if not sql:
                     raise ValueError("SQL查询语句不能为空")
-                result = await self._execute_sql(sql, parsed_arguments.get("directory"))
+                show_create_table = parse_show_create_table(sql)
+                if is_show_tables(sql):
+                    result = await self._get_tables(parsed_arguments.get("directory"))
+                elif show_create_table:
+                    result = await self._get_create_table(show_create_table, parsed_arguments.get("directory"))
+                else:
+                    result = await self._execute_sql(sql, parsed_arguments.get("directory"),
+                                                     parse_flag(parsed_arguments.get("fetch_all"), "fetch_all"),
+                                                     parse_query_params(parsed_arguments.get("params")))
             elif name == "excel_get_table_schema":
                 table_name = parsed_arguments.get("table_name")
                 if not table_name:
@@ -193,23 +414,98 @@ class ExcelSqlMcpServer:
             elif name == "excel_refresh_cache":
                 result = await self._refresh_cache(parsed_arguments.get("directory"))
             elif name == "excel_list_sheets":
-                result = await self._get_tables(parsed_arguments.get("directory"))
+                result = await self._list_sheets(parsed_arguments.get("directory"))
+            elif name == "excel_explain":
+                sql = parsed_arguments.get("sql")
+                if not sql:
+                    raise ValueError("SQL查询语句不能为空")
+                result = await self._explain(sql, parsed_arguments.get("directory"),
+                                             parse_query_params(parsed_arguments.get("params")),
+                                             parse_flag(parsed_arguments.get("analyze"), "analyze", True))
+            elif name == "excel_export_query":
+                sql = parsed_arguments.get("sql")
+                if not sql:
+                    raise ValueError("SQL查询语句不能为空")
+                path = parsed_arguments.get("path")
+                if not path:
+                    raise ValueError("输出文件路径不能为空")
+                result = await self._export_query(sql, path, parsed_arguments.get("format"),
+                                                  parsed_arguments.get("directory"),
+                                                  parse_query_params(parsed_arguments.get("params")))
+            elif name == "excel_bulk_insert":
+                table_name = parsed_arguments.get("table")
+                if not table_name:
+                    raise ValueError("表名不能为空")
+                source = parsed_arguments.get("source")
+                if not source:
+                    raise ValueError("插入的数据来源不能为空")
+                result = await self._bulk_insert(table_name, source, parsed_arguments.get("directory"),
+                                                 parse_flag(parsed_arguments.get("skip_invalid"), "skip_invalid"))
+            elif name == "excel_lookup_text":
+                keys = parse_names(parsed_arguments.get("keys"), "keys")
+                if not keys:
+                    raise ValueError("要查找的文本键不能为空")
+                result = await self._lookup_text(keys, parse_names(parsed_arguments.get("languages"), "languages"),
+                                                 parse_names(parsed_arguments.get("tables"), "tables"),
+                                                 parsed_arguments.get("key_column") or "key",
+                                                 parsed_arguments.get("directory"))
+            elif name == "excel_commit":
+                result = await self._commit(parsed_arguments.get("directory"))
+            elif name == "excel_export":
+                result = await self._export_tables(parsed_arguments.get("config_path"), parse_flag(parsed_arguments.get("force"), "force"))
+            elif name == "excel_diff":
+                old_path = parsed_arguments.get("old_path")
+                if not old_path:
+                    raise ValueError("旧版本路径不能为空")
+                limit = parsed_arguments.get("limit")
+                # 只在未给出时使用默认值：0表示只返回数量
+                limit = DIFF_DETAIL_LIMIT if limit is None else int(limit)
+                if limit < 0:
+                    raise ValueError(f"limit不能为负数: {limit}")
+                result = await self._diff(old_path, parsed_arguments.get("new_path"), parsed_arguments.get("sheet"),
+                                          parsed_arguments.get("key"), limit)
             else:
                 raise ValueError(f"未知工具: {name}")
-            return [TextContent(type=text,text=result)]
         except Exception as e:
             logger.error(f"工具调用失败: {e}")
-            return CallToolResult(
+            result = CallToolResult(
                 content=[TextContent(
                     type="text",
                     text=f"错误: {str(e)}"
                 )],
                 isError=True
             )
+        parsed_arguments = parsed_arguments or {}
+        slow_query_log.observe("mcp", name, parsed_arguments, parsed_arguments.get("directory") or self.excel_directory,
+                               started, sum(len(getattr(item, "text", "")) for item in result.content),
+                               bool(getattr(result, "isError", False)))
+        return result
     
-    async def _execute_sql(self, sql: str, directory: str = None) -> CallToolResult:
-        """执行SQL语句"""
+    async def _execute_sql(self, sql: str, directory: str = None, fetch_all: bool = False,
+                           params: Optional[List[Any]] = None) -> CallToolResult:
+        """执行SQL语句，SELECT/UPDATE/DELETE由Python引擎执行，引擎不支持的语句转发给Excel工具"""
+        try:
+            rows = await asyncio.to_thread(default_service.encoded, "execute", sql=sql,
+                                           directory=directory or self.excel_directory, fetch_all=fetch_all,
+                                           params=params)
+            return self._safe_create_call_tool_result({"result": rows})
+        except UnsupportedSqlError as e:
+            if params:
+                return self._safe_create_call_tool_result({
+                    "content": [{"type": "text", "text": f"执行SQL失败: 带参数的语句只能由Python引擎执行，{str(e)}"}],
+                    "isError": True
+                })
+            logger.info(f"{e}，转发给Excel工具")
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"执行SQL失败: {str(e)}"}],
+                "isError": True
+            })
         try:
+            # Excel工具从磁盘读取工作簿，先写回Python引擎中尚未保存的UPDATE/DELETE，避免读到修改前的数据
+            summary = await asyncio.to_thread(default_service.commit, directory or self.excel_directory)
+            if summary.get("failed"):
+                raise RuntimeError(f"未保存的修改写回失败，无法转发给Excel工具: {summary['failed']}")
             request = {
                 "method": "execute_sql",
                 "params": {"sql": sql}
@@ -224,15 +520,11 @@ class ExcelSqlMcpServer:
             })
     
     async def _get_create_table(self, table_name: str, directory: str = None) -> CallToolResult:
-        """获取表结构"""
+        """获取表结构（只读取目标工作表的表头行）"""
         try:
-            request = {
-                "method": "get_create_table",
-                "params": {"table": table_name}
-            }
-            
-            result = await self._send_request_to_excel_tool(request, directory)
-            return self._safe_create_call_tool_result(result)
+            schema = await asyncio.to_thread(default_service.encoded, "table_schema", table_name=table_name,
+                                             directory=directory or self.excel_directory)
+            return self._safe_create_call_tool_result({"result": schema})
         except Exception as e:
             return self._safe_create_call_tool_result({
                 "content": [{"type": "text", "text": f"获取表结构失败: {str(e)}"}],
@@ -240,30 +532,35 @@ class ExcelSqlMcpServer:
             })
     
     async def _get_tables(self, directory: str = None) -> CallToolResult:
-        """获取所有表"""
+        """获取所有表（只读取工作簿目录信息，不加载单元格数据）"""
         try:
-            request = {
-                "method": "get_tables",
-                "params": {}
-            }
-            
-            result = await self._send_request_to_excel_tool(request, directory)
-            return self._safe_create_call_tool_result(result)
+            tables = await asyncio.to_thread(default_service.encoded, "table_names",
+                                             directory=directory or self.excel_directory)
+            return self._safe_create_call_tool_result({"result": tables})
         except Exception as e:
             return self._safe_create_call_tool_result({
                 "content": [{"type": "text", "text": f"获取表列表失败: {str(e)}"}],
                 "isError": True
             })
     
+    async def _list_sheets(self, directory: str = None) -> CallToolResult:
+        """列出工作表摘要（所属文件、区域、估计行数、别名）"""
+        try:
+            sheets = await asyncio.to_thread(default_service.encoded, "describe",
+                                             directory=directory or self.excel_directory)
+            return self._safe_create_call_tool_result({"result": sheets})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"获取工作表列表失败: {str(e)}"}],
+                "isError": True
+            })
+    
     async def _refresh_cache(self, directory: str = None) -> CallToolResult:
-        """刷新缓存"""
+        """刷新缓存，同时进行的同一目录的刷新只执行一次"""
         try:
-            request = {
-                "method": "refresh",
-                "params": {}
-            }
-            
-            result = await self._send_request_to_excel_tool(request, directory)
+            excel_dir = directory or self.excel_directory
+            result = await _refresh_flights.do_async(request_key("refresh", {"directory": excel_dir}),
+                                                     lambda: self._refresh_directory(excel_dir))
             return self._safe_create_call_tool_result(result)
         except Exception as e:
             return self._safe_create_call_tool_result({
@@ -271,6 +568,108 @@ class ExcelSqlMcpServer:
                 "isError": True
             })
     
+    async def _refresh_directory(self, directory: str) -> Dict[str, Any]:
+        await asyncio.to_thread(default_service.invalidate, directory)
+        request = {
+            "method": "refresh",
+            "params": {}
+        }
+        return await self._send_request_to_excel_tool(request, directory)
+
+    async def _explain(self, sql: str, directory: str = None, params: Optional[List[Any]] = None,
+                       analyze: bool = True) -> CallToolResult:
+        """生成SELECT语句的执行计划"""
+        try:
+            plan = await asyncio.to_thread(default_service.encoded, "explain", sql=sql,
+                                           directory=directory or self.excel_directory, params=params,
+                                           analyze=analyze)
+            return self._safe_create_call_tool_result({"result": plan})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"生成执行计划失败: {str(e)}"}],
+                "isError": True
+            })
+
+    async def _export_query(self, sql: str, path: str, fmt: Optional[str] = None, directory: str = None,
+                            params: Optional[List[Any]] = None) -> CallToolResult:
+        """把SELECT的结果写入本地文件"""
+        try:
+            summary = await asyncio.to_thread(default_service.encoded, "export_query", sql=sql,
+                                              directory=directory or self.excel_directory, path=path,
+                                              format=fmt, params=params)
+            return self._safe_create_call_tool_result({"result": summary})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"导出查询结果失败: {str(e)}"}],
+                "isError": True
+            })
+
+    async def _bulk_insert(self, table_name: str, source: Union[str, Dict[str, List[Any]]], directory: str = None,
+                           skip_invalid: bool = False) -> CallToolResult:
+        """批量追加行并保存工作簿"""
+        try:
+            summary = await asyncio.to_thread(default_service.encoded, "bulk_insert", table_name=table_name,
+                                              directory=directory or self.excel_directory, source=source,
+                                              skip_invalid=skip_invalid)
+            return self._safe_create_call_tool_result({"result": summary})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"批量插入失败: {str(e)}"}],
+                "isError": True
+            })
+
+    async def _lookup_text(self, keys: List[str], languages: Optional[List[str]] = None,
+                           tables: Optional[List[str]] = None, key_column: str = "key",
+                           directory: str = None) -> CallToolResult:
+        """批量查找文本键的各语言文本"""
+        try:
+            summary = await asyncio.to_thread(default_service.encoded, "lookup_text", keys=keys,
+                                              directory=directory or self.excel_directory, languages=languages,
+                                              tables=tables, key_column=key_column)
+            return self._safe_create_call_tool_result({"result": summary})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"查找文本失败: {str(e)}"}],
+                "isError": True
+            })
+
+    async def _commit(self, directory: str = None) -> CallToolResult:
+        """立即保存未保存的修改"""
+        try:
+            summary = await asyncio.to_thread(default_service.encoded, "commit",
+                                              directory=directory or self.excel_directory)
+            return self._safe_create_call_tool_result({"result": summary})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"保存修改失败: {str(e)}"}],
+                "isError": True
+            })
+    
+    async def _export_tables(self, config_path: str = None, force: bool = False) -> CallToolResult:
+        """增量导出表格"""
+        try:
+            config_path = config_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.xml")
+            summary = await asyncio.to_thread(run_export, config_path, force)
+            return self._safe_create_call_tool_result({"result": summary})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"导出失败: {str(e)}"}],
+                "isError": True
+            })
+    
+    async def _diff(self, old_path: str, new_path: str = None, sheet: str = None, key: str = None,
+                    limit: int = DIFF_DETAIL_LIMIT) -> CallToolResult:
+        """比较两个版本的工作表"""
+        try:
+            new_path = new_path or current_version_path(old_path, self.excel_directory)
+            diff = await asyncio.to_thread(diff_paths, old_path, new_path, sheet, key, limit)
+            return self._safe_create_call_tool_result({"result": diff})
+        except Exception as e:
+            return self._safe_create_call_tool_result({
+                "content": [{"type": "text", "text": f"比较失败: {str(e)}"}],
+                "isError": True
+            })
+    
     async def _send_request_to_excel_tool(self, request: Dict[str, Any], directory: str = None) -> Dict[str, Any]:
         """发送请求到Excel工具"""
         try:
@@ -290,7 +689,7 @@ class ExcelSqlMcpServer:
             
             # 发送请求
             request_json = json.dumps(request, ensure_ascii=False)
-            logger.info(f"发送请求到Excel工具: {request_json}")
+            logger.info("发送请求到Excel工具: %s", LogPreview(request_json))
             
             # 发送请求并读取响应
             try:
@@ -315,7 +714,7 @@ class ExcelSqlMcpServer:
             
             # 解析响应
             response_text = stdout.decode('utf-8', errors='ignore')
-            logger.info(f"Excel工具响应文本: {response_text}")
+            logger.info("Excel工具响应文本: %s", LogPreview(response_text))
             
             # 查找JSON响应 - 更严格的解析，支持多行JSON
             lines = response_text.split('\n')
@@ -340,7 +739,7 @@ class ExcelSqlMcpServer:
                         json_text = '\n'.join(json_lines)
                         try:
                             parsed_response = json.loads(json_text)
-                            logger.info(f"成功解析JSON响应: {json.dumps(parsed_response, indent=2, ensure_ascii=False)}")
+                            logger.info("成功解析JSON响应: %s", LogPreview(parsed_response))
                             return parsed_response
                         except json.JSONDecodeError as e:
                             logger.warning(f"JSON解析失败: {e}, JSON文本: {json_text[:200]}...")
@@ -351,7 +750,7 @@ class ExcelSqlMcpServer:
             
             # 如果没有找到JSON响应，返回原始响应
             if response_text.strip():
-                logger.warning(f"未找到有效的JSON响应，返回原始响应: {response_text}")
+                logger.warning("未找到有效的JSON响应，返回原始响应: %s", LogPreview(response_text))
                 return {"raw_response": response_text}
             
             raise Exception("无法解析Excel工具响应")
@@ -365,15 +764,16 @@ class ExcelSqlMcpServer:
     def _safe_create_call_tool_result(self, response_data: Dict[str, Any]) -> CallToolResult:
         """安全地创建CallToolResult对象，处理可能的格式错误"""
         try:
-            logger.info(f"创建CallToolResult，输入数据: {json.dumps(response_data, indent=2, ensure_ascii=False)}")
+            logger.info("创建CallToolResult，输入数据: %s", LogPreview(response_data))
             
             # 检查是否是C#工具的标准响应格式 {"result": ...}
             if "result" in response_data:
-                logger.info("检测到C#工具的标准响应格式")
                 result_data = response_data["result"]
-                # 将结果转换为JSON字符串显示
-                if isinstance(result_data, (list, dict)):
-                    text_content = json.dumps(result_data, indent=2, ensure_ascii=False)
+                # 引擎已编码的结果直接使用，不再解析和重新序列化
+                if isinstance(result_data, EncodedResult):
+                    text_content = result_data.text
+                elif isinstance(result_data, (list, dict)):
+                    text_content = encode_result(result_data)
                 else:
                     text_content = str(result_data)
                 return CallToolResult(
@@ -445,7 +845,7 @@ class ExcelSqlMcpServer:
     
     def _fix_tuple_format_response(self, response_data: Dict[str, Any]) -> CallToolResult:
         """修复元组格式的响应数据"""
-        logger.info(f"修复元组格式的响应数据: {response_data}")
+        logger.info("修复元组格式的响应数据: %s", LogPreview(response_data))
         
         try:
             # 提取字段值
@@ -503,6 +903,9 @@ async def main():
     # 创建MCP服务器
     server_instance = ExcelSqlMcpServer(excel_directory)
     
+    # 后台启动引擎服务：进程内模式（默认）重放并保存上次进程留下的修改日志，守护进程模式连接守护进程
+    threading.Thread(target=default_service.start, daemon=True).start()
+    
     # 打印注册的处理程序
     print("注册的请求处理程序:")
     for req_type in server_instance.server.request_handlers:
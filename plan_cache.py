@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+语句与查询计划缓存
+按规范化SQL（sql_engine.parameterize：?占位符和WHERE/ON/HAVING/SET/LIMIT/OFFSET中的字面量替换为参数槽位）
+缓存解析结果，SELECT的查询计划按目录缓存在同一条目下。只有字面量不同的语句跳过解析和规划，
+直接用新的参数值执行已编译的计划。
+
+计划绑定到具体的列式表对象（表的一个版本），命中时逐个核对表名当前解析到的表是否仍是同一个对象，
+工作簿重新加载或UPDATE/DELETE/批量插入发布表的新版本后自动重新规划；引擎替换表版本时调用release
+丢弃绑定到旧版本的计划，缓存不会让旧版本一直留在内存中。
+
+缓存大小可用环境变量EXCEL_SQL_PLAN_CACHE调整（默认256条，0表示不缓存）。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from column_store import ColumnTable
+from sql_engine import Plan, Statement, Token, parameterize, parse_sql, plan_query, statement_tables
+
+PLAN_CACHE_SIZE = int(os.environ.get("EXCEL_SQL_PLAN_CACHE", "256"))
+
+
+class PreparedStatement:
+    """一条规范化SQL的解析结果及其在各目录下的查询计划"""
+
+    __slots__ = ("sql", "tokens", "statement", "table_names", "plans", "planned")
+
+    def __init__(self, sql: str, tokens: List[Token], statement: Statement):
+        self.sql = sql
+        self.tokens = tokens
+        self.statement = statement
+        self.table_names = statement_tables(statement)
+        # 目录 -> 查询计划
+        self.plans: Dict[str, Plan] = {}
+        # statement是否已被规划过（规划会绑定语法树，之后的规划使用重新解析的语法树）
+        self.planned = False
+
+
+class PlanCache:
+    """LRU缓存：规范化SQL -> PreparedStatement，线程安全"""
+
+    def __init__(self, capacity: int = PLAN_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries: "OrderedDict[str, PreparedStatement]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.plan_hits = 0
+        self.plan_misses = 0
+        self.parse_seconds = 0.0
+        self.plan_seconds = 0.0
+
+    def prepare(self, sql: str, params: Sequence[Any] = ()) -> Tuple[PreparedStatement, List[Any]]:
+        """
+        取得语句的解析结果，未命中时解析并缓存
+
+        Args:
+            sql: SQL语句
+            params: ?占位符对应的参数值
+
+        Returns:
+            (解析结果, 参数槽位的值)
+
+        Raises:
+            UnsupportedSqlError: 语句不受支持
+            SqlError: 语法错误或参数不匹配
+        """
+        key, tokens, values = parameterize(sql, params)
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared, values
+        started = time.perf_counter()
+        prepared = PreparedStatement(sql, tokens, parse_sql(sql, tokens))
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.misses += 1
+            self.parse_seconds += elapsed
+            if self.capacity > 0:
+                prepared = self._entries.setdefault(key, prepared)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return prepared, values
+
+    def plan(self, prepared: PreparedStatement, directory: str,
+             resolve_table: Callable[[str], ColumnTable]) -> Plan:
+        """
+        取得SELECT语句在目录下的查询计划，表已重新加载时重新规划
+
+        Args:
+            prepared: prepare返回的解析结果
+            directory: Excel文件目录
+            resolve_table: 表名 -> 列式表
+        """
+        # 先解析表（可能需要加载工作表），加载耗时不计入规划耗时
+        tables = [resolve_table(name) for name in prepared.table_names]
+        plan = prepared.plans.get(directory)
+        if plan is not None and all(table is binding.table for table, binding in zip(tables, plan.bindings)):
+            with self._lock:
+                self.plan_hits += 1
+            return plan
+        with self._lock:
+            statement = None if prepared.planned else prepared.statement
+            prepared.planned = True
+        started = time.perf_counter()
+        if statement is None:
+            statement = parse_sql(prepared.sql, prepared.tokens)
+        resolved = dict(zip(prepared.table_names, tables))
+        plan = plan_query(statement, lambda name: resolved[name] if name in resolved else resolve_table(name))
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.plan_misses += 1
+            self.plan_seconds += elapsed
+            prepared.plans[directory] = plan
+        return plan
+
+    def release(self, table: ColumnTable) -> None:
+        """丢弃绑定到该表的查询计划（表被新版本替换、重新加载或移出缓存时调用，避免旧版本被计划引用而无法释放）"""
+        with self._lock:
+            for prepared in self._entries.values():
+                for directory, plan in list(prepared.plans.items()):
+                    if any(binding.table is table for binding in plan.bindings):
+                        del prepared.plans[directory]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率及累计的解析/规划耗时"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "planHits": self.plan_hits,
+                "planMisses": self.plan_misses,
+                "parseMs": round(self.parse_seconds * 1000, 3),
+                "planMs": round(self.plan_seconds * 1000, 3),
+            }
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+查询结果导出
+把SELECT的结果按批流式写入本地文件，只有一批的值在内存中，返回路径、行数、字节数，不返回结果本身。
+
+支持的格式:
+    csv: UTF-8，第一行为列名
+    ndjson: 每行一个JSON对象
+    xlsx: 单个工作表，第一行列名、第二行类型、第三行留空（注释），数据从第四行开始，可以作为表再次查询
+    bytes: 与excel_export相同的XTB1二进制表格式（snapshot）
+
+文件先写入同目录下的临时文件，完成后原子地替换目标文件，导出失败时目标文件保持不变。
+"""
+
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import zipfile
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+from atomic_io import atomic_open
+from excel_export import bytes_header, bytes_row_writers, pack_bytes_rows
+from xlsx_reader import column_letter
+from xlsx_writer import format_cell
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "ndjson", "xlsx", "bytes")
+_FORMAT_ALIASES = {"jsonl": "ndjson", "snapshot": "bytes", "binary": "bytes"}
+_EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".xlsx": "xlsx", ".bytes": "bytes"}
+# 文本格式每次写入的行数，限制一批结果编码后的文本同时占用的内存
+_WRITE_ROWS = 4096
+# 工作表名中不允许的字符
+_SHEET_NAME_INVALID = re.compile(r"[\[\]:*?/\\]")
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+class ExportError(ValueError):
+    """导出参数错误（不支持的格式等）"""
+
+
+def resolve_format(path: str, fmt: Optional[str] = None) -> str:
+    """
+    确定导出格式：显式指定的格式（允许jsonl/snapshot/binary别名），否则按扩展名推断，都没有时为csv
+
+    Raises:
+        ExportError: 不支持的格式
+    """
+    if fmt:
+        name = fmt.strip().lower()
+        name = _FORMAT_ALIASES.get(name, name)
+        if name not in EXPORT_FORMATS:
+            raise ExportError(f"不支持的导出格式: {fmt}，可选: {', '.join(EXPORT_FORMATS)}")
+        return name
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower(), "csv")
+
+
+def infer_type(values: Sequence[Any]) -> str:
+    """按第一个非空值推断列类型（long/double/bool/string），用于没有声明类型的计算列"""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return "bool"
+        if isinstance(value, int):
+            return "long"
+        if isinstance(value, float):
+            return "double"
+        return "string"
+    return "string"
+
+
+def _write_csv(fp, names: List[str], batches: Iterable[List[Sequence[Any]]]) -> None:
+    text = io.TextIOWrapper(fp, encoding="utf-8", newline="", write_through=False)
+    try:
+        writer = csv.writer(text)
+        writer.writerow(names)
+        for columns in batches:
+            writer.writerows(zip(*columns))
+        text.flush()
+    finally:
+        # 文件由atomic_open关闭
+        text.detach()
+
+
+def _write_ndjson(fp, names: List[str], batches: Iterable[List[Sequence[Any]]]) -> None:
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str).encode
+    lines = []
+    for columns in batches:
+        for row in zip(*columns):
+            lines.append(encode(dict(zip(names, row))))
+            if len(lines) >= _WRITE_ROWS:
+                fp.write(("\n".join(lines) + "\n").encode("utf-8"))
+                lines.clear()
+    if lines:
+        fp.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def _sheet_name(path: str) -> str:
+    name = _SHEET_NAME_INVALID.sub("_", os.path.splitext(os.path.basename(path))[0]).strip("'")
+    return name[:31] or "Sheet1"
+
+
+def _write_xlsx(fp, path: str, names: List[str], types: List[str], row_count: int,
+                batches: Iterable[List[Sequence[Any]]]) -> None:
+    letters = [column_letter(index) for index in range(max(len(names), 1))]
+    with zipfile.ZipFile(fp, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _ROOT_RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(_sheet_name(path), {'"': "&quot;"})))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                f'<dimension ref="A1:{letters[-1]}{row_count + 3}"/><sheetData>'
+            ).encode("utf-8"))
+            header = []
+            for number, values in ((1, names), (2, types)):
+                cells = "".join(format_cell(f"{letters[i]}{number}", value) for i, value in enumerate(values))
+                header.append(f'<row r="{number}">{cells}</row>')
+            header.append('<row r="3"/>')
+            sheet.write("".join(header).encode("utf-8"))
+            number = 4
+            rows = []
+            for columns in batches:
+                for row in zip(*columns):
+                    cells = [f'<row r="{number}">']
+                    for letter, value in zip(letters, row):
+                        if value is None:
+                            continue
+                        # 整数最常见，直接生成（与format_cell的结果相同）
+                        if value.__class__ is int:
+                            cells.append(f'<c r="{letter}{number}"><v>{value}</v></c>')
+                        else:
+                            cells.append(format_cell(f"{letter}{number}", value))
+                    cells.append("</row>")
+                    rows.append("".join(cells))
+                    number += 1
+                    if len(rows) >= _WRITE_ROWS:
+                        sheet.write("".join(rows).encode("utf-8"))
+                        rows.clear()
+            sheet.write("".join(rows).encode("utf-8"))
+            sheet.write(b"</sheetData></worksheet>")
+
+
+def _write_bytes(fp, names: List[str], types: List[str], row_count: int,
+                 batches: Iterable[List[Sequence[Any]]]) -> None:
+    fp.write(bytes_header(names, types, row_count))
+    writers = bytes_row_writers(types)
+    for columns in batches:
+        out = bytearray()
+        pack_bytes_rows(out, writers, zip(*columns))
+        fp.write(out)
+
+
+def write_result(path: str, fmt: str, names: List[str], types: Sequence[Optional[str]], row_count: int,
+                 batches: Iterable[List[Sequence[Any]]]) -> Dict[str, Any]:
+    """
+    把按批计算的查询结果写入文件
+
+    Args:
+        path: 目标文件路径
+        fmt: 导出格式（见resolve_format）
+        names: 列名
+        types: 列的声明类型，None表示按第一批的值推断
+        row_count: 总行数
+        batches: 各批的列值（每批为每列一个值序列）
+
+    Returns:
+        {"path": 绝对路径, "format": 格式, "rows": 行数, "bytes": 文件字节数}
+    """
+    path = os.path.abspath(path)
+    batches = iter(batches)
+    first = next(batches, None)
+    if any(data_type is None for data_type in types):
+        types = [data_type or infer_type(first[i] if first else ()) for i, data_type in enumerate(types)]
+    if first is not None:
+        batches = itertools.chain([first], batches)
+    with atomic_open(path) as fp:
+        if fmt == "csv":
+            _write_csv(fp, names, batches)
+        elif fmt == "ndjson":
+            _write_ndjson(fp, names, batches)
+        elif fmt == "xlsx":
+            _write_xlsx(fp, path, names, list(types), row_count, batches)
+        elif fmt == "bytes":
+            _write_bytes(fp, names, list(types), row_count, batches)
+        else:
+            raise ExportError(f"不支持的导出格式: {fmt}")
+    size = os.path.getsize(path)
+    logger.info(f"导出 {row_count} 行到 {path}（{fmt}，{size} 字节）")
+    return {"path": path, "format": fmt, "rows": row_count, "bytes": size}
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+工具结果编码
+引擎结果只序列化一次：由执行方（进程内服务或守护进程）编码为JSON文本，包装为EncodedResult，
+MCP服务器把文本直接放入响应，不再json.loads后重新json.dumps。
+
+日志只记录有长度上限、在实际输出时才格式化的摘要（LogPreview），不再完整序列化结果。
+"""
+
+import json
+from typing import Any
+
+# 日志摘要的最大字符数
+LOG_PREVIEW_CHARS = 500
+# 摘要中列表/字典最多展示的元素数
+_PREVIEW_ITEMS = 5
+
+
+class EncodedResult:
+    """已编码为JSON文本的工具结果"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def __repr__(self) -> str:
+        return f"EncodedResult({len(self.text)} chars)"
+
+
+def encode_result(value: Any) -> str:
+    """
+    把结果编码为JSON文本
+
+    列表（查询结果行）和截断后的查询结果（见result_guard.bound_result）用C实现的编码器一次编码为单行JSON；
+    json.dumps指定indent时会退回纯Python编码器，大结果慢数倍，因此只用于其它较小的值（表结构、保存摘要等）
+
+    Args:
+        value: 可JSON序列化的结果，无法序列化的值按str输出
+
+    Returns:
+        JSON文本
+    """
+    if isinstance(value, list) or (isinstance(value, dict) and value.get("truncated")):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return json.dumps(value, ensure_ascii=False, indent=2, default=str)
+
+
+def wrap_result(result: EncodedResult) -> str:
+    """生成{"result": ...}响应文本，结果部分原样拼接"""
+    return '{\n  "result": ' + result.text + "\n}"
+
+
+def _preview(value: Any, limit: int) -> str:
+    if isinstance(value, EncodedResult):
+        return f"<JSON {len(value.text)} 字符> {value.text[:limit]}"
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value[:limit * 4]).decode("utf-8", errors="replace")
+    if isinstance(value, str):
+        return value if len(value) <= limit else value[:limit]
+    if isinstance(value, (list, tuple)):
+        items = [_preview(item, limit) for item in value[:_PREVIEW_ITEMS]]
+        more = f", ...共{len(value)}项" if len(value) > _PREVIEW_ITEMS else ""
+        return "[" + ", ".join(items) + more + "]"
+    if isinstance(value, dict):
+        items = [f"{key!r}: {_preview(item, limit)}" for key, item in list(value.items())[:_PREVIEW_ITEMS * 2]]
+        more = f", ...共{len(value)}项" if len(value) > _PREVIEW_ITEMS * 2 else ""
+        return "{" + ", ".join(items) + more + "}"
+    return repr(value)
+
+
+class LogPreview:
+    """
+    日志摘要：作为%s参数传给logger时，只在日志实际输出时格式化，且最多输出limit个字符
+
+    列表和字典只展示前几个元素，不会为了截断而先序列化整个结果
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: int = LOG_PREVIEW_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = _preview(self.value, self.limit)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...(已截断)"
+        return text
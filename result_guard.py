@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+查询结果上限
+SELECT结果超过行数或字节数上限时只返回前若干行，附带总行数和每列摘要
+（空值数、最小值/最大值、不同值个数、出现最多的值），避免一次调用把几十万行写进一个文本块。
+
+上限可用环境变量EXCEL_SQL_MAX_ROWS（默认1000行）和EXCEL_SQL_MAX_BYTES（默认1MB）调整；
+需要完整结果时使用LIMIT/OFFSET分页，或在excel_query中设置fetch_all=true。
+"""
+
+import json
+import os
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Union
+
+MAX_RESULT_ROWS = int(os.environ.get("EXCEL_SQL_MAX_ROWS", "1000"))
+MAX_RESULT_BYTES = int(os.environ.get("EXCEL_SQL_MAX_BYTES", str(1 << 20)))
+# 摘要中列出的高频值个数
+TOP_VALUES = 5
+
+_NUMERIC = (int, float)
+
+
+def summarize_column(values: Sequence[Any]) -> Dict[str, Any]:
+    """
+    计算一列的摘要，只遍历一次数据（计数），其余统计在不同值上完成
+
+    min/max按SQLite的比较规则：数值小于文本
+
+    Args:
+        values: 列的全部值
+
+    Returns:
+        {"nulls": 空值数, "distinct": 不同非空值个数, "min": 最小值, "max": 最大值,
+         "top": [{"value": 值, "count": 次数}]}
+    """
+    counts = Counter(values)
+    nulls = counts.pop(None, 0)
+    numbers = [v for v in counts if isinstance(v, _NUMERIC)]
+    texts = [v for v in counts if not isinstance(v, _NUMERIC)]
+    if texts and not all(isinstance(v, str) for v in texts):
+        texts = [str(v) for v in texts]
+    summary: Dict[str, Any] = {"nulls": nulls, "distinct": len(counts)}
+    if counts:
+        summary["min"] = min(numbers) if numbers else min(texts)
+        summary["max"] = max(texts) if texts else max(numbers)
+        summary["top"] = [{"value": value, "count": count} for value, count in counts.most_common(TOP_VALUES)]
+    return summary
+
+
+def bound_result(names: List[str], columns: List[Sequence[Any]], row_count: int,
+                 max_rows: int = MAX_RESULT_ROWS, max_bytes: int = MAX_RESULT_BYTES
+                 ) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    按上限整理按列返回的查询结果
+
+    Args:
+        names: 列名
+        columns: 各列的值，与names对齐
+        row_count: 结果行数
+        max_rows: 最多返回的行数
+        max_bytes: 返回行编码为JSON后的最大字节数（估算）
+
+    Returns:
+        未超过上限时返回完整的行列表；否则返回
+        {"rows": 前若干行, "totalRows": 总行数, "returnedRows": 返回行数, "truncated": True,
+         "columns": {列名: 摘要}, "message": 说明}
+    """
+    rows: List[Dict[str, Any]] = []
+    size = 2
+    truncated = False
+    for row in zip(*columns):
+        if len(rows) >= max_rows:
+            truncated = True
+            break
+        record = dict(zip(names, row))
+        size += len(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8")) + 2
+        if size > max_bytes and rows:
+            truncated = True
+            break
+        rows.append(record)
+    if not truncated:
+        return rows
+    return {
+        "rows": rows,
+        "totalRows": row_count,
+        "returnedRows": len(rows),
+        "truncated": True,
+        "columns": {name: summarize_column(values) for name, values in zip(names, columns)},
+        "message": f"结果共 {row_count} 行，超过返回上限（{max_rows} 行或 {max_bytes} 字节），只返回前 {len(rows)} 行；"
+                   f"columns为全部结果的逐列摘要。需要更多数据时使用LIMIT/OFFSET分页，或设置fetch_all=true获取全部结果",
+    }
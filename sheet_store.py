@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+内容寻址的工作表存储
+加载好的列式表按内容键保存为不可变的镜像：内容键由工作表部件的CRC/大小和它引用的共享字符串计算，
+不同目录（如多个分支的检出）或刷新前后内容相同的工作表共享同一份内存中的列数据和磁盘上的副本，
+各目录的表只是镜像的视图（ColumnTable.view），修改时写时复制。
+
+- 内存中的镜像按引用计数管理，最后一个视图被替换或丢弃后从内存中移除
+- 镜像同时写入磁盘存储（默认为缓存目录下的sheets），新进程或移出内存后再次需要时直接反序列化，不再解析xlsx；
+  工作簿字符串字典单独按(共享字符串表签名, 大小)保存，同一工作簿的多个镜像共用一份
+- 工作表位置（部件和共享字符串表的CRC/大小）到内容键的映射记录在磁盘存储的index.json中，
+  未变化的工作簿不需要重新扫描即可得到内容键
+
+环境变量:
+    EXCEL_SQL_SHEET_STORE: 磁盘存储目录（默认为缓存目录下的sheets）
+    EXCEL_SQL_SHEET_STORE_BYTES: 磁盘存储的容量上限（默认2GB），超过时删除最久未使用的镜像；0表示只在内存中共享
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import weakref
+import zipfile
+from typing import Any, Dict, Optional
+
+from atomic_io import atomic_open, atomic_write_json
+from column_store import ColumnTable, StringDictionary
+from excel_catalog import default_cache_dir
+from xlsx_reader import SHARED_STRINGS_PART, read_shared_string_items, referenced_shared_strings
+
+logger = logging.getLogger(__name__)
+
+# 镜像格式版本，列式表结构或内容键的计算方式变化时递增
+STORE_FORMAT_VERSION = 1
+# 磁盘存储的容量上限（字节），0表示不写磁盘
+SHEET_STORE_BYTES = int(os.environ.get("EXCEL_SQL_SHEET_STORE_BYTES", str(2 << 30)))
+
+_IMAGE_SUFFIX = ".table"
+_DICTIONARY_PREFIX = "dict-"
+_INDEX_FILE = "index.json"
+
+
+def default_store_dir(cache_dir: Optional[str] = None) -> str:
+    return os.environ.get("EXCEL_SQL_SHEET_STORE") or os.path.join(cache_dir or default_cache_dir(), "sheets")
+
+
+def _signature(info: Optional[zipfile.ZipInfo]) -> str:
+    return f"{info.CRC:08x}:{info.file_size}" if info is not None else "-"
+
+
+def _dictionary_key(dictionary: StringDictionary) -> str:
+    # 字典只会追加，签名和大小相同的字典内容相同
+    return hashlib.sha1(f"{dictionary.signature}|{len(dictionary.strings)}".encode("utf-8")).hexdigest()
+
+
+class _ImagePickler(pickle.Pickler):
+    """镜像中的字符串字典以引用保存，字典本身单独写入"""
+
+    def __init__(self, fp, store: "SheetStore"):
+        super().__init__(fp, protocol=pickle.HIGHEST_PROTOCOL)
+        self.store = store
+
+    def persistent_id(self, obj: Any) -> Any:
+        if isinstance(obj, StringDictionary):
+            return ("dictionary", self.store._save_dictionary(obj))
+        return None
+
+
+class _ImageUnpickler(pickle.Unpickler):
+    def __init__(self, fp, store: "SheetStore"):
+        super().__init__(fp)
+        self.store = store
+
+    def persistent_load(self, pid: Any) -> Any:
+        kind, key = pid
+        if kind != "dictionary":
+            raise pickle.UnpicklingError(f"未知的持久化引用: {kind}")
+        return self.store._load_dictionary(key)
+
+
+class SheetStore:
+    """内容寻址的列式表镜像存储，线程安全"""
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = SHEET_STORE_BYTES):
+        """
+        Args:
+            directory: 磁盘存储目录，None表示只在内存中共享
+            max_bytes: 磁盘存储的容量上限，0表示不写磁盘
+        """
+        self.directory = directory if max_bytes > 0 else None
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        # 内容键 -> 镜像 / 引用计数
+        self._images: Dict[str, ColumnTable] = {}
+        self._refs: Dict[str, int] = {}
+        # 工作表位置 -> 内容键
+        self._locations: Dict[str, str] = {}
+        self._locations_loaded = False
+        # 字典键 -> 内存中的字典，从磁盘读取的多个镜像共用同一个字典对象
+        self._dictionaries: "weakref.WeakValueDictionary[str, StringDictionary]" = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.scans = 0
+
+    def _load_locations(self) -> None:
+        if self._locations_loaded:
+            return
+        self._locations_loaded = True
+        if self.directory is None:
+            return
+        try:
+            with open(os.path.join(self.directory, _INDEX_FILE), "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == STORE_FORMAT_VERSION:
+                self._locations.update(data.get("locations") or {})
+        except (OSError, ValueError) as e:
+            logger.debug(f"没有可用的工作表存储索引: {e}")
+
+    def _save_locations(self) -> None:
+        if self.directory is None:
+            return
+        try:
+            atomic_write_json(os.path.join(self.directory, _INDEX_FILE),
+                              {"version": STORE_FORMAT_VERSION, "locations": self._locations}, indent=None)
+        except OSError as e:
+            logger.warning(f"保存工作表存储索引失败: {e}")
+
+    def content_key(self, zf: zipfile.ZipFile, part: str) -> str:
+        """
+        工作表的内容键：工作表部件的CRC/大小 + 引用的共享字符串（索引和原始XML）的摘要
+
+        工作簿中其它工作表的修改会改变共享字符串表，但只要本表引用的字符串不变，内容键就不变。
+        结果按(部件CRC/大小, 共享字符串表CRC/大小)缓存，只有新出现的组合才扫描工作表部件
+        """
+        sheet = _signature(zf.NameToInfo.get(part))
+        location = f"{sheet}|{_signature(zf.NameToInfo.get(SHARED_STRINGS_PART))}"
+        with self._lock:
+            self._load_locations()
+            key = self._locations.get(location)
+        if key is not None:
+            return key
+        started = time.perf_counter()
+        digest = hashlib.sha1(f"v{STORE_FORMAT_VERSION}|{sheet}".encode("ascii"))
+        indices = referenced_shared_strings(zf, part)
+        if indices:
+            items = read_shared_string_items(zf)
+            for index in indices:
+                digest.update(b"\0%d:" % index)
+                digest.update(items[index] if index < len(items) else b"?")
+        key = digest.hexdigest()
+        with self._lock:
+            self.scans += 1
+            self._locations[location] = key
+            self._save_locations()
+        logger.debug(f"计算内容键 {part}: {len(indices)} 个共享字符串，耗时 {time.perf_counter() - started:.2f}s")
+        return key
+
+    def acquire(self, key: str) -> Optional[ColumnTable]:
+        """
+        取得内容键对应的镜像并增加引用计数，内存和磁盘上都没有时返回None
+
+        Returns:
+            镜像（只读，调用方应使用其view）
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._refs[key] += 1
+                self.hits += 1
+                return image
+            image = self._read_image(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._images[key] = image
+            self._refs[key] = 1
+            return image
+
+    def put(self, key: str, table: ColumnTable) -> ColumnTable:
+        """
+        保存新加载的表为镜像（引用计数为1）并写入磁盘；其它线程已保存同一内容键时返回已有的镜像
+
+        Returns:
+            镜像
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._refs[key] += 1
+                return image
+            table.shared = True
+            table.content_key = key
+            self._images[key] = table
+            self._refs[key] = 1
+            self._write_image(key, table)
+            return table
+
+    def release(self, key: str) -> None:
+        """减少引用计数，归零时从内存中移除镜像（磁盘上的副本保留）"""
+        if not key:
+            return
+        with self._lock:
+            refs = self._refs.get(key)
+            if refs is None:
+                return
+            if refs > 1:
+                self._refs[key] = refs - 1
+                return
+            del self._refs[key]
+            del self._images[key]
+
+    def clear(self) -> None:
+        """移除内存中的全部镜像（磁盘上的副本保留）"""
+        with self._lock:
+            self._images.clear()
+            self._refs.clear()
+
+    def _image_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _IMAGE_SUFFIX)
+
+    def _dictionary_path(self, key: str) -> str:
+        return os.path.join(self.directory, _DICTIONARY_PREFIX + key + _IMAGE_SUFFIX)
+
+    def _open_trusted(self, path: str):
+        """打开存储中的文件；拒绝不属于当前用户的文件（存储目录位于共享的临时目录下）"""
+        fp = open(path, "rb")
+        if hasattr(os, "getuid") and os.fstat(fp.fileno()).st_uid != os.getuid():
+            fp.close()
+            raise PermissionError(f"文件不属于当前用户: {path}")
+        return fp
+
+    def _save_dictionary(self, dictionary: StringDictionary) -> str:
+        key = _dictionary_key(dictionary)
+        self._dictionaries[key] = dictionary
+        path = self._dictionary_path(key)
+        if not os.path.exists(path):
+            with atomic_open(path) as fp:
+                pickle.dump(dictionary, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        return key
+
+    def _load_dictionary(self, key: str) -> StringDictionary:
+        dictionary = self._dictionaries.get(key)
+        if dictionary is None:
+            with self._open_trusted(self._dictionary_path(key)) as fp:
+                dictionary = pickle.load(fp)
+            self._dictionaries[key] = dictionary
+        return dictionary
+
+    def _write_image(self, key: str, table: ColumnTable) -> None:
+        if self.directory is None:
+            return
+        started = time.perf_counter()
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            path = self._image_path(key)
+            if not os.path.exists(path):
+                with atomic_open(path) as fp:
+                    _ImagePickler(fp, self).dump((STORE_FORMAT_VERSION, table))
+            logger.debug(f"写入工作表镜像 {table.name}: 耗时 {time.perf_counter() - started:.2f}s")
+            self._trim()
+        except (OSError, pickle.PicklingError) as e:
+            logger.warning(f"写入工作表镜像失败 {table.name}: {e}")
+
+    def _read_image(self, key: str) -> Optional[ColumnTable]:
+        if self.directory is None:
+            return None
+        path = self._image_path(key)
+        try:
+            with self._open_trusted(path) as fp:
+                version, image = _ImageUnpickler(fp, self).load()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # 损坏或引用的字典已被清理：删除后重新加载并写入
+            logger.warning(f"读取工作表镜像失败 {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        if version != STORE_FORMAT_VERSION:
+            return None
+        image.shared = True
+        image.content_key = key
+        try:
+            # 更新修改时间，供容量超限时按最久未使用删除
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def _trim(self) -> None:
+        """磁盘存储超过容量上限时删除最久未使用的镜像，字典文件随引用它的镜像一起清理"""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_IMAGE_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if name.startswith(_DICTIONARY_PREFIX) or name[:-len(_IMAGE_SUFFIX)] in self._images:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+            except OSError:
+                pass
+        if total > self.max_bytes:
+            # 镜像删完仍然超限时清理当前内存中没有使用的字典
+            for _, size, name in sorted(files):
+                key = name[len(_DICTIONARY_PREFIX):-len(_IMAGE_SUFFIX)]
+                if total <= self.max_bytes:
+                    break
+                if not name.startswith(_DICTIONARY_PREFIX) or key in self._dictionaries:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        """镜像数、引用数、内存中镜像的列数据大小和命中统计"""
+        with self._lock:
+            images = list(self._images.values())
+            refs = sum(self._refs.values())
+        return {
+            "images": len(images),
+            "references": refs,
+            "imageBytes": sum(image.nbytes() for image in images),
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "keyScans": self.scans,
+            "directory": self.directory,
+        }
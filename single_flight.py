@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+相同请求的合并执行（single-flight）
+多个会话同时发出相同的只读请求（列出表、表结构、相同的SELECT、相同的文本键查找、刷新同一目录）时，只有第一个请求实际执行，
+执行期间到达的相同请求等待这次执行并共享它的结果或异常；执行结束后的请求重新执行，不缓存结果。
+
+请求键由方法名、规范化后的参数（SQL按词法单元比较，忽略空白、注释和末尾分号）、目录下工作簿文件的
+(文件名, 修改时间, 大小)指纹和引擎的写入次数组成：文件或表在执行期间被修改后到达的请求不会合并到修改前
+开始的执行上。UPDATE/DELETE和commit不合并，WITH开头但主语句为INSERT/UPDATE/DELETE/REPLACE的语句也不合并。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from excel_catalog import list_workbook_files
+from sql_engine import SqlError, tokenize
+
+logger = logging.getLogger(__name__)
+
+# 可以合并的方法（execute/explain只合并只读语句，refresh为MCP服务器的excel_refresh_cache）
+COALESCED_METHODS = {"execute", "explain", "lookup_text", "table_names", "describe", "table_schema", "invalidate",
+                     "refresh"}
+_READ_KEYWORDS = {"SELECT", "WITH", "SHOW", "EXPLAIN"}
+# 出现在括号外时表示语句会修改数据（如 WITH x AS (...) DELETE ...）；后面紧跟括号的REPLACE是字符串函数
+_WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "REPLACE"}
+
+
+def _modifies_data(tokens: List[Tuple[str, Any]]) -> bool:
+    """括号外是否有INSERT/UPDATE/DELETE/REPLACE"""
+    depth = 0
+    for position, (kind, value) in enumerate(tokens):
+        if kind == "op" and value in ("(", ")"):
+            depth += 1 if value == "(" else -1
+        elif depth == 0 and kind == "id" and value.upper() in _WRITE_KEYWORDS:
+            following = tokens[position + 1] if position + 1 < len(tokens) else None
+            if following != ("op", "("):
+                return True
+    return False
+
+
+def normalize_sql(sql: str) -> Optional[Tuple[Tuple[str, Any], ...]]:
+    """
+    把SQL规范化为词法单元序列
+
+    Returns:
+        (类别, 值)元组，只读语句以外（UPDATE/DELETE、修改数据的WITH语句等）或无法识别时返回None
+    """
+    try:
+        tokens = [(token.kind, token.value) for token in tokenize(sql or "")[:-1]]
+    except SqlError:
+        return None
+    while tokens and tokens[-1] == ("op", ";"):
+        tokens.pop()
+    if not tokens or tokens[0][0] != "id" or tokens[0][1].upper() not in _READ_KEYWORDS:
+        return None
+    if _modifies_data(tokens):
+        return None
+    return tuple(tokens)
+
+
+def directory_fingerprint(directory: Optional[str]) -> Tuple[Tuple[str, int, int], ...]:
+    """目录下各工作簿的(文件名, 修改时间, 大小)"""
+    fingerprint = []
+    for path in list_workbook_files(directory):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        fingerprint.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+def request_key(method: str, params: Dict[str, Any], generation: int = 0) -> Optional[Hashable]:
+    """
+    计算请求的合并键
+
+    Args:
+        method: 方法名
+        params: 请求参数
+        generation: 引擎的写入次数，写入后到达的请求不与写入前开始的执行合并
+
+    Returns:
+        合并键，不能合并的请求返回None
+    """
+    if method not in COALESCED_METHODS:
+        return None
+    normalized = dict(params)
+    if method in ("execute", "explain"):
+        sql = normalize_sql(normalized.get("sql"))
+        if sql is None:
+            return None
+        normalized["sql"] = sql
+    directory = normalized.get("directory")
+    if directory:
+        directory = normalized["directory"] = os.path.normcase(os.path.abspath(directory))
+    arguments = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return method, arguments, directory_fingerprint(directory), generation
+
+
+class _Call:
+    """一次正在进行的执行"""
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并同时进行的相同执行，线程安全；do_async用于同一事件循环中的协程"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, "asyncio.Future"] = {}
+        # 方法名 -> [实际执行次数, 合并的请求数]
+        self._counts: Dict[str, List[int]] = {}
+
+    def _count(self, key: Hashable, coalesced: bool) -> None:
+        name = key[0] if isinstance(key, tuple) and key else str(key)
+        counts = self._counts.setdefault(name, [0, 0])
+        counts[1 if coalesced else 0] += 1
+
+    def do(self, key: Optional[Hashable], fn: Callable[[], Any]) -> Any:
+        """
+        执行fn，相同键的执行正在进行时等待它并返回同一结果
+
+        Args:
+            key: 合并键，None表示不合并直接执行
+            fn: 执行函数
+
+        Returns:
+            fn的结果（合并的请求共享同一个结果对象，调用方不能修改）
+
+        Raises:
+            fn抛出的异常，合并的请求抛出同一个异常
+        """
+        if key is None:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+            self._count(key, not leader)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.info(f"合并了 {call.waiters} 个相同的 {key[0] if isinstance(key, tuple) else key} 请求")
+
+    async def do_async(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        协程版本的do：相同键的协程正在执行时等待它的结果
+
+        Args:
+            key: 合并键
+            factory: 创建执行协程的函数，只在没有相同执行时调用
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(factory())
+                task.add_done_callback(lambda _task: self._forget(key))
+            self._count(key, not leader)
+        if not leader:
+            logger.info(f"合并相同的 {key[0] if isinstance(key, tuple) else key} 请求")
+        # 某个等待方被取消时不取消共享的执行
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable) -> None:
+        with self._lock:
+            self._tasks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计：实际执行次数、合并的请求数、正在进行的执行数，以及按方法的明细"""
+        with self._lock:
+            counts = {name: {"executions": c[0], "coalesced": c[1]} for name, c in sorted(self._counts.items())}
+            inflight = len(self._calls) + len(self._tasks)
+        return {
+            "executions": sum(c["executions"] for c in counts.values()),
+            "coalesced": sum(c["coalesced"] for c in counts.values()),
+            "inflight": inflight,
+            "methods": counts,
+        }
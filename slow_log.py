@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+慢查询日志
+MCP服务器把耗时超过阈值的工具调用追加到JSON Lines日志（按大小轮转），
+replay命令在目录快照上按日志重新执行这些调用并对比耗时，用于确认或排除性能回退。
+
+每条记录:
+    {"time": 开始时间, "server": "mcp"/"fastmcp", "tool": 工具名, "arguments": 解析后的参数,
+     "directory": 目录, "directoryFingerprint": 目录指纹, "elapsedMs": 耗时, "resultBytes": 响应文本字符数,
+     "isError": 是否出错}
+
+目录指纹由各工作表的内容指纹计算，复制出的目录快照与原目录指纹相同。
+
+阈值、路径和轮转可用环境变量调整：EXCEL_SQL_SLOW_MS（默认1000毫秒，负数表示不记录）、
+EXCEL_SQL_SLOW_LOG（默认为缓存目录下的slow-queries.jsonl）、EXCEL_SQL_SLOW_LOG_BYTES（默认10MB，保留3个旧文件）。
+
+用法:
+    python slow_log.py 日志文件 [--directory 目录快照] [--concurrency 并发数] [--repeat 次数]
+                       [--tolerance 倍数] [--include-writes] [--output 报告.json]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from excel_catalog import SheetCatalog, default_cache_dir, default_catalog
+from excel_engine import ExcelEngine
+from excel_schema import get_table_schema, is_show_tables, parse_show_create_table
+from result_format import EncodedResult, encode_result, wrap_result
+from sql_engine import UnsupportedSqlError, parse_query_params
+from text_lookup import DEFAULT_KEY_COLUMN, parse_names
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("EXCEL_SQL_SLOW_MS", "1000"))
+SLOW_LOG_BYTES = int(os.environ.get("EXCEL_SQL_SLOW_LOG_BYTES", str(10 << 20)))
+SLOW_LOG_BACKUPS = 3
+# 耗时差小于该值时不判定回退/改善（计时噪声）
+NOISE_MS = 1.0
+
+# 修改数据或文件的工具，回放时跳过
+_WRITE_TOOLS = {"excel_bulk_insert", "excel_commit", "excel_export", "excel_export_query", "excel_refresh_cache"}
+_DML = re.compile(r"^\s*(UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+def _loggable_arguments(tool: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """记录的参数：excel_bulk_insert按列的数组只记录每列的行数"""
+    source = arguments.get("source")
+    if tool == "excel_bulk_insert" and isinstance(source, dict):
+        summary = {name: f"<{len(values)} 个值>" if isinstance(values, list) else values
+                   for name, values in source.items()}
+        return dict(arguments, source=summary)
+    return arguments
+
+
+def default_log_path() -> str:
+    return os.environ.get("EXCEL_SQL_SLOW_LOG") or os.path.join(default_cache_dir(), "slow-queries.jsonl")
+
+
+def directory_fingerprint(directory: str, catalog: SheetCatalog = default_catalog) -> Optional[str]:
+    """由目录下各工作表的内容指纹计算目录指纹，目录无法读取时返回None"""
+    try:
+        entries = catalog.entries(directory)
+    except OSError:
+        return None
+    digest = hashlib.sha1()
+    for entry in sorted(entries, key=lambda e: (e.file_name.lower(), e.name)):
+        digest.update(f"{entry.file_name}\0{entry.name}\0{entry.fingerprint}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SlowQueryLog:
+    """按大小轮转的慢查询日志，多个进程可以同时追加"""
+
+    def __init__(self, path: Optional[str] = None, threshold_ms: float = SLOW_QUERY_MS,
+                 max_bytes: int = SLOW_LOG_BYTES, backups: int = SLOW_LOG_BACKUPS):
+        self.path = path or default_log_path()
+        self.threshold_ms = threshold_ms
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def observe(self, server: str, tool: str, arguments: Optional[Dict[str, Any]], directory: Optional[str],
+                started: float, result_bytes: int, is_error: bool = False) -> None:
+        """
+        工具调用结束时调用，耗时超过阈值时追加一条记录；写日志失败只记录警告
+
+        Args:
+            server: 服务器类型
+            tool: 工具名
+            arguments: smart_parse_arguments解析后的参数
+            directory: 实际使用的Excel目录
+            started: 调用开始时的time.perf_counter()
+            result_bytes: 响应文本的字符数
+            is_error: 调用是否出错
+        """
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.threshold_ms < 0 or elapsed_ms < self.threshold_ms:
+            return
+        record = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "server": server,
+            "tool": tool,
+            "arguments": _loggable_arguments(tool, arguments or {}),
+            "directory": os.path.abspath(directory) if directory else directory,
+            "directoryFingerprint": directory_fingerprint(directory) if directory else None,
+            "elapsedMs": round(elapsed_ms, 3),
+            "resultBytes": result_bytes,
+            "isError": is_error,
+        }
+        try:
+            self.append(record)
+        except OSError as e:
+            logger.warning(f"写入慢查询日志失败: {e}")
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "ab") as fp:
+                    fp.write(line)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _rotate(self) -> None:
+        """slow-queries.jsonl -> .1 -> .2 ...，超出保留个数的旧文件删除"""
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+# MCP服务器共用的慢查询日志
+slow_query_log = SlowQueryLog()
+
+
+# ---------------------------------------------------------------------------
+# 回放
+# ---------------------------------------------------------------------------
+
+def read_log(path: str) -> List[Dict[str, Any]]:
+    """读取慢查询日志，忽略无法解析的行"""
+    records = []
+    with open(path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"忽略无法解析的日志行: {line[:80]}")
+    return records
+
+
+class Replayer:
+    """在目录快照上用独立的目录缓存和引擎实例重新执行日志中的工具调用"""
+
+    def __init__(self, directory: Optional[str], cache_dir: str, include_writes: bool = False):
+        self.directory = directory
+        self.catalog = SheetCatalog(cache_dir=cache_dir)
+        self.engine = ExcelEngine(self.catalog)
+        self.include_writes = include_writes
+
+    def skip_reason(self, record: Dict[str, Any]) -> Optional[str]:
+        tool = record.get("tool")
+        if tool in _WRITE_TOOLS:
+            return "修改文件的工具"
+        if tool == "excel_query" and not self.include_writes and _DML.match(record["arguments"].get("sql") or ""):
+            return "UPDATE/DELETE（使用--include-writes回放）"
+        return None
+
+    def call(self, record: Dict[str, Any]) -> Any:
+        """按工具名执行一条记录，返回工具结果"""
+        tool = record["tool"]
+        arguments = record.get("arguments") or {}
+        directory = self.directory or arguments.get("directory") or record.get("directory")
+        if tool == "excel_query":
+            sql = arguments.get("sql") or ""
+            if is_show_tables(sql):
+                return self.catalog.table_names(directory)
+            table = parse_show_create_table(sql)
+            if table:
+                return get_table_schema(table, directory, self.catalog)
+            return self.engine.execute(sql, directory, bool(arguments.get("fetch_all", False)),
+                                       parse_query_params(arguments.get("params")))
+        if tool == "excel_explain":
+            return self.engine.explain(arguments.get("sql") or "", directory,
+                                       parse_query_params(arguments.get("params")),
+                                       bool(arguments.get("analyze", True)))
+        if tool == "excel_lookup_text":
+            return self.engine.lookup_text(parse_names(arguments.get("keys"), "keys") or [], directory,
+                                           parse_names(arguments.get("languages"), "languages"),
+                                           parse_names(arguments.get("tables"), "tables"),
+                                           arguments.get("key_column") or DEFAULT_KEY_COLUMN)
+        if tool == "excel_get_table_schema":
+            return get_table_schema(arguments.get("table_name") or "", directory, self.catalog)
+        if tool == "excel_show_tables":
+            return self.catalog.table_names(directory)
+        if tool == "excel_list_sheets":
+            return self.catalog.describe(directory)
+        raise ValueError(f"无法回放的工具: {tool}")
+
+    def replay(self, record: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+        """执行一条记录repeat次，返回首次和最快耗时及结果大小"""
+        timings = []
+        result_bytes = None
+        error = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                result = self.call(record)
+                result_bytes = len(wrap_result(EncodedResult(encode_result(result))))
+            except UnsupportedSqlError as e:
+                return {"skipped": f"由ExcelSqlTool执行: {e}"}
+            except Exception as e:
+                error = str(e)
+            timings.append((time.perf_counter() - started) * 1000)
+        outcome = {"firstMs": round(timings[0], 3), "bestMs": round(min(timings), 3), "resultBytes": result_bytes}
+        if error is not None:
+            outcome["error"] = error
+        return outcome
+
+
+def run_replay(records: List[Dict[str, Any]], directory: Optional[str], concurrency: int = 1, repeat: int = 3,
+               tolerance: float = 1.5, include_writes: bool = False) -> Dict[str, Any]:
+    """
+    回放日志记录并与记录的耗时对比
+
+    Args:
+        records: 日志记录
+        directory: 目录快照，None时使用记录中的目录
+        concurrency: 同时执行的记录数
+        repeat: 每条记录执行的次数，以最快一次与记录的耗时对比
+        tolerance: 回放耗时超过记录耗时的该倍数时判定为回退（低于其倒数时判定为改善），相差不足NOISE_MS时不判定
+
+    Returns:
+        {"entries": [每条记录的对比], "summary": 汇总}
+    """
+    cache_dir = tempfile.mkdtemp(prefix="excel-sql-replay-")
+    try:
+        replayer = Replayer(directory, cache_dir, include_writes)
+        fingerprints: Dict[str, Optional[str]] = {}
+
+        def run(record: Dict[str, Any]) -> Dict[str, Any]:
+            entry = {"tool": record.get("tool"), "arguments": record.get("arguments"),
+                     "loggedMs": record.get("elapsedMs"), "loggedBytes": record.get("resultBytes")}
+            reason = replayer.skip_reason(record)
+            if reason is not None:
+                entry["skipped"] = reason
+                return entry
+            target = directory or record.get("directory")
+            if target not in fingerprints:
+                fingerprints[target] = directory_fingerprint(target, replayer.catalog)
+            logged = record.get("directoryFingerprint")
+            if logged and fingerprints[target] != logged:
+                entry["fingerprintMismatch"] = True
+            entry.update(replayer.replay(record, max(1, repeat)))
+            if "bestMs" in entry and entry["loggedMs"]:
+                ratio = entry["bestMs"] / entry["loggedMs"]
+                entry["ratio"] = round(ratio, 3)
+                delta = entry["bestMs"] - entry["loggedMs"]
+                entry["verdict"] = ("regression" if ratio > tolerance and delta > NOISE_MS else
+                                    "improvement" if ratio < 1 / tolerance and -delta > NOISE_MS else "unchanged")
+            return entry
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            entries = list(executor.map(run, records))
+        if include_writes:
+            replayer.engine.commit()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    ratios = [e["ratio"] for e in entries if "ratio" in e]
+    summary = {
+        "records": len(entries),
+        "replayed": sum(1 for e in entries if "bestMs" in e),
+        "skipped": sum(1 for e in entries if "skipped" in e),
+        "errors": sum(1 for e in entries if "error" in e),
+        "fingerprintMismatches": sum(1 for e in entries if e.get("fingerprintMismatch")),
+        "regressions": sum(1 for e in entries if e.get("verdict") == "regression"),
+        "improvements": sum(1 for e in entries if e.get("verdict") == "improvement"),
+        "medianRatio": round(statistics.median(ratios), 3) if ratios else None,
+        "loggedMs": round(sum(e["loggedMs"] or 0 for e in entries if "bestMs" in e), 3),
+        "replayMs": round(sum(e["bestMs"] for e in entries if "bestMs" in e), 3),
+    }
+    return {"entries": entries, "summary": summary}
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"{'#':>4}  {'工具':<22}{'记录ms':>10}{'首次ms':>10}{'最快ms':>10}{'倍数':>8}  结论")
+    for i, entry in enumerate(report["entries"], 1):
+        tool = entry.get("tool") or ""
+        if "skipped" in entry:
+            print(f"{i:>4}  {tool:<22}{entry['loggedMs'] or 0:>10.1f}  跳过: {entry['skipped']}")
+            continue
+        flags = []
+        if entry.get("error"):
+            flags.append(f"错误: {entry['error']}")
+        if entry.get("fingerprintMismatch"):
+            flags.append("目录指纹不同")
+        if entry.get("loggedBytes") is not None and entry.get("resultBytes") not in (None, entry["loggedBytes"]):
+            flags.append(f"结果大小 {entry['loggedBytes']} -> {entry['resultBytes']}")
+        print(f"{i:>4}  {tool:<22}{entry['loggedMs'] or 0:>10.1f}{entry['firstMs']:>10.1f}{entry['bestMs']:>10.1f}"
+              f"{entry.get('ratio', 0):>8.2f}  {entry.get('verdict', '')} {'; '.join(flags)}")
+    summary = report["summary"]
+    print(f"\n回放 {summary['replayed']}/{summary['records']} 条，跳过 {summary['skipped']}，错误 {summary['errors']}，"
+          f"目录指纹不同 {summary['fingerprintMismatches']}")
+    print(f"回退 {summary['regressions']} 条，改善 {summary['improvements']} 条，耗时倍数中位数 {summary['medianRatio']}，"
+          f"合计 {summary['loggedMs']:.1f}ms -> {summary['replayMs']:.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="在目录快照上回放慢查询日志并对比耗时")
+    parser.add_argument("log", nargs="?", default=None, help="慢查询日志文件（默认为缓存目录下的slow-queries.jsonl）")
+    parser.add_argument("--directory", default=None, help="Excel目录快照，默认使用日志中记录的目录")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时回放的记录数（默认1，按日志顺序依次执行）")
+    parser.add_argument("--repeat", type=int, default=3, help="每条记录执行的次数，取最快一次对比（默认3）")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="判定回退/改善的耗时倍数（默认1.5）")
+    parser.add_argument("--include-writes", action="store_true", help="同时回放UPDATE/DELETE（会修改目录快照）")
+    parser.add_argument("--output", default=None, help="把JSON格式的对比报告写入该文件")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    records = read_log(args.log or default_log_path())
+    report = run_replay(records, args.directory, args.concurrency, args.repeat, args.tolerance, args.include_writes)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, ensure_ascii=False, indent=2)
+    sys.exit(1 if report["summary"]["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+查询算子的外存溢出
+排序、哈希连接和哈希聚合的工作状态（排序键、哈希表、分组）按输入行数估算，超过单条查询的内存上限时
+把有序段或分区写入临时文件，再用多路归并（外部排序）或逐分区处理（grace哈希连接/聚合）完成，
+同一时刻只有一个有序段或一个分区的工作状态在内存中。
+
+算子的输入和输出（各表的行号序列）仍然在内存中，溢出只限制算子自身的中间状态。
+溢出文件是匿名临时文件，算子结束（包括出错）时关闭并删除。
+
+环境变量:
+    EXCEL_SQL_QUERY_MEMORY: 单个算子工作状态的内存上限（字节，默认256MB，0表示不溢出）
+    EXCEL_SQL_SPILL_DIR: 溢出文件目录（默认为系统临时目录）
+"""
+
+import heapq
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUERY_MEMORY = int(os.environ.get("EXCEL_SQL_QUERY_MEMORY", str(256 << 20)))
+SPILL_DIR = os.environ.get("EXCEL_SQL_SPILL_DIR") or None
+
+# 估算的每行工作状态（键元组、行号、哈希表或列表中的槽位）占用的字节数
+ROW_STATE_BYTES = 128
+# 每个有序段或分区至少包含的行数，避免上限很小时产生大量小文件
+MIN_CHUNK_ROWS = 1024
+MAX_PARTITIONS = 128
+# 写入溢出文件时每批序列化的记录数
+_BATCH_SIZE = 4096
+
+
+def should_spill(rows: int, limit: int) -> bool:
+    """rows行的工作状态是否超过内存上限"""
+    return limit > 0 and rows * ROW_STATE_BYTES > limit
+
+
+def chunk_rows(limit: int) -> int:
+    """内存上限内一次处理的行数"""
+    return max(MIN_CHUNK_ROWS, limit // ROW_STATE_BYTES)
+
+
+def partition_count(rows: int, limit: int) -> int:
+    """rows行分区后每个分区的工作状态约为内存上限的一半"""
+    return max(2, min(MAX_PARTITIONS, -(-rows * ROW_STATE_BYTES // max(1, limit)) * 2))
+
+
+class Descending:
+    """反转比较顺序的排序键，用于降序排序键参与元组比较"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: "Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: "Descending") -> bool:
+        return self.value == other.value
+
+    def __reduce__(self):
+        return Descending, (self.value,)
+
+
+class SpillFile:
+    """只追加的匿名临时记录文件：按批序列化写入，读取时逐条返回"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self._fp = tempfile.TemporaryFile(prefix="excel-sql-spill-", dir=directory)
+        self._batch: List[Any] = []
+        self.count = 0
+
+    def append(self, record: Any) -> None:
+        self._batch.append(record)
+        self.count += 1
+        if len(self._batch) >= _BATCH_SIZE:
+            self._flush()
+
+    def extend(self, records: Iterable[Any]) -> None:
+        for record in records:
+            self.append(record)
+
+    def _flush(self) -> None:
+        if self._batch:
+            pickle.dump(self._batch, self._fp, protocol=pickle.HIGHEST_PROTOCOL)
+            self._batch = []
+
+    @property
+    def nbytes(self) -> int:
+        self._flush()
+        return self._fp.tell()
+
+    def __iter__(self) -> Iterator[Any]:
+        self._flush()
+        fp = self._fp
+        fp.seek(0)
+        while True:
+            try:
+                batch = pickle.load(fp)
+            except EOFError:
+                return
+            yield from batch
+
+    def close(self) -> None:
+        self._batch = []
+        self._fp.close()
+
+
+class Spill:
+    """
+    一次算子执行的溢出文件和统计，作为上下文管理器使用，退出时删除全部文件
+
+    Args:
+        limit: 内存上限（字节）
+        directory: 溢出文件目录，None为SPILL_DIR
+    """
+
+    def __init__(self, limit: int, directory: Optional[str] = None):
+        self.limit = limit
+        self.directory = directory or SPILL_DIR
+        self.files: List[SpillFile] = []
+        self.runs = 0
+        self.partitions = 0
+        self.records = 0
+        self.bytes = 0
+
+    def __enter__(self) -> "Spill":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _new_file(self) -> SpillFile:
+        spill_file = SpillFile(self.directory)
+        self.files.append(spill_file)
+        return spill_file
+
+    def _written(self, files: List[SpillFile]) -> None:
+        for spill_file in files:
+            self.records += spill_file.count
+            self.bytes += spill_file.nbytes
+
+    def sort(self, chunks: Iterable[List[Any]], key: Optional[Callable[[Any], Any]] = None) -> Iterator[Any]:
+        """
+        外部排序：每块排序后写为一个有序段，再多路归并
+
+        Args:
+            chunks: 记录块，每块不超过内存上限
+            key: 排序键，None为记录本身
+
+        Returns:
+            按key有序的记录迭代器（相等的记录保持块的先后顺序）
+        """
+        runs = []
+        for chunk in chunks:
+            chunk.sort(key=key)
+            run = self._new_file()
+            run.extend(chunk)
+            runs.append(run)
+            self.runs += 1
+        self._written(runs)
+        logger.debug(f"外部排序: {len(runs)} 个有序段，{self.bytes} 字节")
+        return heapq.merge(*runs, key=key)
+
+    def partition(self, records: Iterable[Tuple[Any, Any]], count: int) -> List[SpillFile]:
+        """
+        按键的哈希值把(键, 值)记录分到若干分区文件
+
+        Args:
+            records: (键, 值)记录
+            count: 分区数（见partition_count），需要按分区对应的两组记录使用相同的分区数
+
+        Returns:
+            分区文件列表，同一个键的记录在同一个分区中并保持原有顺序
+        """
+        parts = [self._new_file() for _ in range(count)]
+        for record in records:
+            parts[hash(record[0]) % count].append(record)
+        self.partitions += count
+        self._written(parts)
+        logger.debug(f"分区溢出: {count} 个分区，{sum(part.count for part in parts)} 条记录")
+        return parts
+
+    def close(self) -> None:
+        for spill_file in self.files:
+            spill_file.close()
+        self.files = []
+
+    def stats(self) -> Dict[str, Any]:
+        """执行计划中展示的溢出统计"""
+        return {"limit": self.limit, "runs": self.runs, "partitions": self.partitions,
+                "records": self.records, "bytes": self.bytes}
@@ -0,0 +1,2764 @@
+#!/usr/bin/env python3
+"""
+SQL查询引擎
+在列式表（column_store.ColumnTable）上执行SELECT语句，语义尽量与ExcelSqlTool使用的SQLite一致：
+NULL参与比较的结果为NULL，LIKE对ASCII字母不区分大小写，ORDER BY时NULL排在最前。
+
+支持:
+    SELECT [DISTINCT] ... FROM 表 [别名]
+    [INNER | LEFT [OUTER] | CROSS] JOIN ... ON ... / 逗号连接
+    WHERE ... GROUP BY ... HAVING ... ORDER BY ... LIMIT n [OFFSET m]
+不支持的语句（INSERT/UPDATE/DELETE、子查询、UNION等）抛出UnsupportedSqlError，由调用方回退到ExcelSqlTool。
+
+字典编码的文本列在等值比较、IN、GROUP BY和JOIN中直接比较整数编码，
+LIKE及字符串函数对每个不同的编码只计算一次。
+
+声明为数组/字典类型的列（cell_codecs）可以用CONTAINS(列, 值)、ELEMENT(列, 下标或键)、ELEMENT_COUNT(列)
+在加载时解码好的元素上查询；其它表达式按逗号分隔的文本数组解码。
+
+语句中的?占位符按出现顺序绑定参数；parameterize把WHERE/ON/HAVING/SET/LIMIT/OFFSET中的字面量
+也提升为参数，只有这些值不同的语句得到相同的规范化文本，可以共用解析结果和查询计划（见plan_cache）。
+
+排序、哈希连接和GROUP BY的工作状态超过单个算子的内存上限（spill.QUERY_MEMORY）时，
+改用写入临时文件的外部归并排序和grace哈希连接/聚合（见spill），结果与内存中执行相同。
+"""
+
+import json
+import logging
+import operator
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from collections import deque
+from itertools import compress
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from cell_codecs import CompositeColumn, codec_for, decode_column
+from column_store import ColumnTable, DictColumn, StringDictionary
+from spill import QUERY_MEMORY, Descending, Spill, chunk_rows, partition_count, should_spill
+from text_index import TEXT_INDEX_MIN_ROWS, get_trigram_index, like_fragments
+
+logger = logging.getLogger(__name__)
+
+# 无连接键时嵌套循环连接允许的最大行对数
+NESTED_LOOP_LIMIT = 10_000_000
+
+
+class SqlError(ValueError):
+    """SQL语法或语义错误"""
+
+
+class UnsupportedSqlError(SqlError):
+    """Python引擎不支持的语句"""
+
+
+# ---------------------------------------------------------------------------
+# 词法分析
+# ---------------------------------------------------------------------------
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+|--[^\n]*|/\*.*?\*/)
+  | (?P<num>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<str>'(?:[^']|'')*')
+  | (?P<qid>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+  | (?P<id>[^\W\d]\w*)
+  | (?P<op><>|!=|<=|>=|==|\|\||[-+*/%(),.;=<>?])
+""", re.VERBOSE | re.DOTALL)
+
+
+class Token:
+    __slots__ = ("kind", "value", "pos", "end")
+
+    def __init__(self, kind: str, value: Any, pos: int, end: int):
+        self.kind = kind
+        self.value = value
+        self.pos = pos
+        self.end = end
+
+    def is_keyword(self, *keywords: str) -> bool:
+        return self.kind == "id" and self.value.upper() in keywords
+
+    def __repr__(self) -> str:
+        return f"Token({self.kind}, {self.value!r})"
+
+
+def tokenize(sql: str) -> List[Token]:
+    """将SQL拆分为词法单元，标识符支持中文及"..."、`...`、[...]三种引用方式"""
+    tokens = []
+    pos = 0
+    length = len(sql)
+    while pos < length:
+        match = _TOKEN.match(sql, pos)
+        if match is None:
+            raise SqlError(f"无法识别的字符 '{sql[pos]}'（位置 {pos}）")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "num":
+            value = float(text) if any(ch in text for ch in ".eE") else int(text)
+            tokens.append(Token(kind, value, pos, match.end()))
+        elif kind == "str":
+            tokens.append(Token(kind, text[1:-1].replace("''", "'"), pos, match.end()))
+        elif kind == "qid":
+            quote = text[0]
+            value = text[1:-1]
+            if quote == '"':
+                value = value.replace('""', '"')
+            elif quote == "`":
+                value = value.replace("``", "`")
+            tokens.append(Token("qid", (quote, value), pos, match.end()))
+        elif kind != "ws":
+            tokens.append(Token(kind, text, pos, match.end()))
+        pos = match.end()
+    tokens.append(Token("eof", None, length, length))
+    return tokens
+
+
+# 这些子句中的字面量提升为参数；SELECT列表（原文作为输出列名）和GROUP BY/ORDER BY（整数表示列序号）中的保留
+_LIFTED_CLAUSES = {"WHERE", "ON", "HAVING", "SET", "LIMIT", "OFFSET"}
+_CLAUSES = _LIFTED_CLAUSES | {"SELECT", "FROM", "JOIN", "GROUP", "ORDER", "UPDATE", "DELETE"}
+
+
+def _param_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    raise SqlError(f"不支持的参数类型 {type(value).__name__}，参数只能是数字、字符串、布尔值或null")
+
+
+def parse_query_params(value: Any) -> Optional[List[Any]]:
+    """
+    解析工具调用中的params参数，兼容被序列化为JSON字符串的数组
+
+    Raises:
+        SqlError: 参数不是数组
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise SqlError("params必须是JSON数组")
+    if not isinstance(value, list):
+        raise SqlError("params必须是数组")
+    return value
+
+
+def parameterize(sql: str, params: Sequence[Any] = (),
+                 lift_literals: bool = True) -> Tuple[str, List[Token], List[Any]]:
+    """
+    把?占位符和可提升的字面量替换为参数槽位
+
+    Args:
+        sql: SQL语句
+        params: ?占位符按顺序对应的参数值
+        lift_literals: 是否提升字面量，False时只替换?占位符
+
+    Returns:
+        (规范化文本（参数槽位写作?，其余原文不变）, 参数槽位换成param单元的词法单元, 各槽位的值)
+
+    Raises:
+        SqlError: 参数个数与?占位符个数不一致，或参数类型不支持
+    """
+    tokens = tokenize(sql)
+    placeholders = sum(1 for t in tokens if t.kind == "op" and t.value == "?")
+    if placeholders != len(params):
+        raise SqlError(f"参数个数不匹配：语句中有 {placeholders} 个?占位符，提供了 {len(params)} 个参数")
+    supplied = iter(params)
+    values: List[Any] = []
+    parts: List[str] = []
+    copied = 0
+    clause = None
+    for i, token in enumerate(tokens):
+        if token.kind == "id":
+            keyword = token.value.upper()
+            if keyword in _CLAUSES:
+                clause = keyword
+            continue
+        if token.kind == "op" and token.value == "?":
+            value = _param_value(next(supplied))
+        elif lift_literals and token.kind in ("num", "str") and clause in _LIFTED_CLAUSES:
+            value = token.value
+        else:
+            continue
+        tokens[i] = Token("param", len(values), token.pos, token.end)
+        values.append(value)
+        parts.append(sql[copied:token.pos])
+        parts.append("?")
+        copied = token.end
+    parts.append(sql[copied:])
+    return "".join(parts), tokens, values
+
+
+# ---------------------------------------------------------------------------
+# 语法树
+# ---------------------------------------------------------------------------
+
+class Node:
+    __slots__ = ()
+
+    def children(self) -> List["Node"]:
+        return []
+
+
+class Literal(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+class Param(Node):
+    """参数槽位，执行时取Evaluator.params中对应的值"""
+    __slots__ = ("index",)
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+class ColumnRef(Node):
+    __slots__ = ("table", "name", "quoted")
+
+    def __init__(self, table: Optional[str], name: str, quoted: bool = False):
+        self.table = table
+        self.name = name
+        # 双引号标识符：找不到同名列时按字符串处理（与SQLite一致）
+        self.quoted = quoted
+
+
+class Star(Node):
+    __slots__ = ("table",)
+
+    def __init__(self, table: Optional[str] = None):
+        self.table = table
+
+
+class Unary(Node):
+    __slots__ = ("op", "operand")
+
+    def __init__(self, op: str, operand: Node):
+        self.op = op
+        self.operand = operand
+
+    def children(self):
+        return [self.operand]
+
+
+class Binary(Node):
+    __slots__ = ("op", "left", "right")
+
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def children(self):
+        return [self.left, self.right]
+
+
+class Like(Node):
+    __slots__ = ("expr", "pattern", "negated", "escape")
+
+    def __init__(self, expr: Node, pattern: Node, negated: bool = False, escape: Optional[Node] = None):
+        self.expr = expr
+        self.pattern = pattern
+        self.negated = negated
+        self.escape = escape
+
+    def children(self):
+        return [self.expr, self.pattern] + ([self.escape] if self.escape else [])
+
+
+class InList(Node):
+    __slots__ = ("expr", "items", "negated")
+
+    def __init__(self, expr: Node, items: List[Node], negated: bool = False):
+        self.expr = expr
+        self.items = items
+        self.negated = negated
+
+    def children(self):
+        return [self.expr] + self.items
+
+
+class Between(Node):
+    __slots__ = ("expr", "low", "high", "negated")
+
+    def __init__(self, expr: Node, low: Node, high: Node, negated: bool = False):
+        self.expr = expr
+        self.low = low
+        self.high = high
+        self.negated = negated
+
+    def children(self):
+        return [self.expr, self.low, self.high]
+
+
+class IsNull(Node):
+    __slots__ = ("expr", "negated")
+
+    def __init__(self, expr: Node, negated: bool = False):
+        self.expr = expr
+        self.negated = negated
+
+    def children(self):
+        return [self.expr]
+
+
+class Case(Node):
+    __slots__ = ("operand", "whens", "default")
+
+    def __init__(self, operand: Optional[Node], whens: List[Tuple[Node, Node]], default: Optional[Node]):
+        self.operand = operand
+        self.whens = whens
+        self.default = default
+
+    def children(self):
+        nodes = [self.operand] if self.operand else []
+        for condition, result in self.whens:
+            nodes += [condition, result]
+        return nodes + ([self.default] if self.default else [])
+
+
+class Cast(Node):
+    __slots__ = ("expr", "type_name")
+
+    def __init__(self, expr: Node, type_name: str):
+        self.expr = expr
+        self.type_name = type_name
+
+    def children(self):
+        return [self.expr]
+
+
+AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX", "TOTAL", "GROUP_CONCAT"}
+
+
+class Func(Node):
+    __slots__ = ("name", "args", "distinct", "star")
+
+    def __init__(self, name: str, args: List[Node], distinct: bool = False, star: bool = False):
+        self.name = name
+        self.args = args
+        self.distinct = distinct
+        self.star = star
+
+    @property
+    def is_aggregate(self) -> bool:
+        # MIN/MAX多参数时为标量函数
+        return self.name in AGGREGATES and (self.name not in ("MIN", "MAX") or len(self.args) == 1)
+
+    def children(self):
+        return list(self.args)
+
+
+def walk(node: Node):
+    """深度优先遍历表达式"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(current.children())
+
+
+def contains_aggregate(node: Node) -> bool:
+    return any(isinstance(n, Func) and n.is_aggregate for n in walk(node))
+
+
+@dataclass
+class SelectItem:
+    expr: Node
+    alias: Optional[str] = None
+    # 表达式在SQL中的原文，作为无别名时的输出列名
+    text: str = ""
+
+
+@dataclass
+class TableRef:
+    name: str
+    alias: Optional[str] = None
+
+
+@dataclass
+class JoinClause:
+    kind: str
+    table: TableRef
+    on: Optional[Node] = None
+
+
+@dataclass
+class SelectStatement:
+    items: List[SelectItem]
+    table: Optional[TableRef] = None
+    joins: List[JoinClause] = field(default_factory=list)
+    where: Optional[Node] = None
+    group_by: List[Node] = field(default_factory=list)
+    having: Optional[Node] = None
+    order_by: List[Tuple[Node, bool]] = field(default_factory=list)
+    limit: Optional[Node] = None
+    offset: Optional[Node] = None
+    distinct: bool = False
+
+
+@dataclass
+class UpdateStatement:
+    table: TableRef
+    # (列名, 新值表达式)
+    assignments: List[Tuple[str, Node]]
+    where: Optional[Node] = None
+
+
+@dataclass
+class DeleteStatement:
+    table: TableRef
+    where: Optional[Node] = None
+
+
+Statement = Union[SelectStatement, UpdateStatement, DeleteStatement]
+
+
+def _literal_text(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+def expr_text(node: Node) -> str:
+    """把表达式还原为SQL文本（用于执行计划展示，参数显示为?）"""
+    if isinstance(node, Literal):
+        return _literal_text(node.value)
+    if isinstance(node, Param):
+        return "?"
+    if isinstance(node, ColumnRef):
+        return f"{node.table}.{node.name}" if node.table else node.name
+    if isinstance(node, Star):
+        return f"{node.table}.*" if node.table else "*"
+    if isinstance(node, Unary):
+        return f"NOT {expr_text(node.operand)}" if node.op == "NOT" else f"-{expr_text(node.operand)}"
+    if isinstance(node, Binary):
+        return f"({expr_text(node.left)} {node.op} {expr_text(node.right)})"
+    if isinstance(node, Like):
+        text = f"{expr_text(node.expr)} {'NOT ' if node.negated else ''}LIKE {expr_text(node.pattern)}"
+        return text + (f" ESCAPE {expr_text(node.escape)}" if node.escape is not None else "")
+    if isinstance(node, InList):
+        items = ", ".join(expr_text(item) for item in node.items)
+        return f"{expr_text(node.expr)} {'NOT ' if node.negated else ''}IN ({items})"
+    if isinstance(node, Between):
+        return (f"{expr_text(node.expr)} {'NOT ' if node.negated else ''}BETWEEN "
+                f"{expr_text(node.low)} AND {expr_text(node.high)}")
+    if isinstance(node, IsNull):
+        return f"{expr_text(node.expr)} IS {'NOT ' if node.negated else ''}NULL"
+    if isinstance(node, Case):
+        parts = ["CASE"] + ([expr_text(node.operand)] if node.operand is not None else [])
+        for condition, then in node.whens:
+            parts.append(f"WHEN {expr_text(condition)} THEN {expr_text(then)}")
+        if node.default is not None:
+            parts.append(f"ELSE {expr_text(node.default)}")
+        return " ".join(parts + ["END"])
+    if isinstance(node, Cast):
+        return f"CAST({expr_text(node.expr)} AS {node.type_name})"
+    if isinstance(node, Func):
+        if node.star:
+            return f"{node.name}(*)"
+        return f"{node.name}({'DISTINCT ' if node.distinct else ''}{', '.join(expr_text(a) for a in node.args)})"
+    return type(node).__name__
+
+
+# ---------------------------------------------------------------------------
+# 语法分析
+# ---------------------------------------------------------------------------
+
+# 不能作为隐式别名的关键字
+_RESERVED = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "HAVING", "ORDER", "LIMIT", "OFFSET", "JOIN", "INNER", "LEFT",
+    "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL", "ON", "USING", "AND", "OR", "NOT", "AS", "UNION", "EXCEPT",
+    "INTERSECT", "ASC", "DESC", "IS", "IN", "LIKE", "BETWEEN", "CASE", "WHEN", "THEN", "ELSE", "END", "NULL",
+    "SET",
+}
+
+_COMPARISONS = {"=", "==", "!=", "<>", "<", "<=", ">", ">="}
+
+
+class _Parser:
+    def __init__(self, sql: str, tokens: Optional[List[Token]] = None):
+        self.sql = sql
+        self.tokens = tokens if tokens is not None else tokenize(sql)
+        self.i = 0
+
+    # 基础操作
+
+    def peek(self, offset: int = 0) -> Token:
+        return self.tokens[min(self.i + offset, len(self.tokens) - 1)]
+
+    def next(self) -> Token:
+        token = self.tokens[self.i]
+        if token.kind != "eof":
+            self.i += 1
+        return token
+
+    def accept_keyword(self, *keywords: str) -> Optional[Token]:
+        if self.peek().is_keyword(*keywords):
+            return self.next()
+        return None
+
+    def expect_keyword(self, keyword: str) -> Token:
+        token = self.accept_keyword(keyword)
+        if token is None:
+            self.error(f"缺少 {keyword}")
+        return token
+
+    def accept_op(self, *ops: str) -> Optional[Token]:
+        token = self.peek()
+        if token.kind == "op" and token.value in ops:
+            return self.next()
+        return None
+
+    def expect_op(self, op: str) -> Token:
+        token = self.accept_op(op)
+        if token is None:
+            self.error(f"缺少 '{op}'")
+        return token
+
+    def error(self, message: str):
+        token = self.peek()
+        near = self.sql[token.pos:token.pos + 20] if token.kind != "eof" else "语句结尾"
+        raise SqlError(f"SQL语法错误: {message}（位置 {token.pos}，附近: {near}）")
+
+    def identifier(self) -> str:
+        token = self.peek()
+        if token.kind == "qid":
+            self.next()
+            return token.value[1]
+        if token.kind == "id":
+            self.next()
+            return token.value
+        self.error("缺少标识符")
+
+    # 语句
+
+    def parse_statement(self) -> Statement:
+        first = self.peek()
+        if first.is_keyword("UPDATE"):
+            statement = self.parse_update()
+        elif first.is_keyword("DELETE"):
+            statement = self.parse_delete()
+        elif first.is_keyword("SELECT"):
+            statement = self.parse_select()
+        else:
+            keyword = first.value.upper() if first.kind == "id" else str(first.value)
+            raise UnsupportedSqlError(f"Python引擎不支持 {keyword} 语句")
+        self.accept_op(";")
+        if self.peek().kind != "eof":
+            if self.peek().is_keyword("UNION", "EXCEPT", "INTERSECT"):
+                raise UnsupportedSqlError("Python引擎不支持复合查询")
+            self.error("多余的内容")
+        return statement
+
+    def parse_select(self) -> SelectStatement:
+        self.expect_keyword("SELECT")
+        distinct = bool(self.accept_keyword("DISTINCT"))
+        if not distinct:
+            self.accept_keyword("ALL")
+        statement = SelectStatement(items=self.parse_select_items(), distinct=distinct)
+
+        if self.accept_keyword("FROM"):
+            statement.table = self.parse_table_ref()
+            while True:
+                join = self.parse_join()
+                if join is None:
+                    break
+                statement.joins.append(join)
+        if self.accept_keyword("WHERE"):
+            statement.where = self.parse_expr()
+        if self.accept_keyword("GROUP"):
+            self.expect_keyword("BY")
+            statement.group_by = self.parse_expr_list()
+        if self.accept_keyword("HAVING"):
+            statement.having = self.parse_expr()
+        if self.accept_keyword("ORDER"):
+            self.expect_keyword("BY")
+            while True:
+                expr = self.parse_expr()
+                descending = False
+                if self.accept_keyword("DESC"):
+                    descending = True
+                else:
+                    self.accept_keyword("ASC")
+                statement.order_by.append((expr, descending))
+                if not self.accept_op(","):
+                    break
+        if self.accept_keyword("LIMIT"):
+            first = self.parse_expr()
+            if self.accept_op(","):
+                statement.offset = first
+                statement.limit = self.parse_expr()
+            else:
+                statement.limit = first
+                if self.accept_keyword("OFFSET"):
+                    statement.offset = self.parse_expr()
+        return statement
+
+    def parse_update(self) -> UpdateStatement:
+        self.expect_keyword("UPDATE")
+        if self.peek().is_keyword("OR"):
+            raise UnsupportedSqlError("Python引擎不支持 UPDATE OR 冲突处理")
+        table = self.parse_table_ref()
+        self.expect_keyword("SET")
+        assignments = []
+        while True:
+            column = self.identifier()
+            if self.peek().kind == "op" and self.peek().value == ".":
+                self.next()
+                column = self.identifier()
+            self.expect_op("=")
+            assignments.append((column, self.parse_expr()))
+            if not self.accept_op(","):
+                break
+        where = self.parse_expr() if self.accept_keyword("WHERE") else None
+        if self.peek().is_keyword("FROM", "RETURNING", "ORDER", "LIMIT"):
+            raise UnsupportedSqlError(f"Python引擎不支持 UPDATE ... {self.peek().value.upper()}")
+        return UpdateStatement(table, assignments, where)
+
+    def parse_delete(self) -> DeleteStatement:
+        self.expect_keyword("DELETE")
+        self.expect_keyword("FROM")
+        table = self.parse_table_ref()
+        where = self.parse_expr() if self.accept_keyword("WHERE") else None
+        if self.peek().is_keyword("RETURNING", "ORDER", "LIMIT"):
+            raise UnsupportedSqlError(f"Python引擎不支持 DELETE ... {self.peek().value.upper()}")
+        return DeleteStatement(table, where)
+
+    def parse_select_items(self) -> List[SelectItem]:
+        items = []
+        while True:
+            start = self.peek().pos
+            token = self.peek()
+            if token.kind == "op" and token.value == "*":
+                self.next()
+                items.append(SelectItem(Star(), text="*"))
+            elif (token.kind in ("id", "qid") and self.peek(1).kind == "op" and self.peek(1).value == "."
+                  and self.peek(2).kind == "op" and self.peek(2).value == "*"):
+                table = self.identifier()
+                self.next()
+                self.next()
+                items.append(SelectItem(Star(table), text=self.sql[start:self.tokens[self.i - 1].end]))
+            else:
+                expr = self.parse_expr()
+                text = self.sql[start:self.tokens[self.i - 1].end]
+                alias = None
+                if self.accept_keyword("AS"):
+                    alias = self.identifier()
+                elif self.peek().kind == "qid" or (self.peek().kind == "id" and self.peek().value.upper() not in _RESERVED):
+                    alias = self.identifier()
+                items.append(SelectItem(expr, alias, text))
+            if not self.accept_op(","):
+                return items
+
+    def parse_table_ref(self) -> TableRef:
+        if self.peek().kind == "op" and self.peek().value == "(":
+            raise UnsupportedSqlError("Python引擎不支持子查询")
+        name = self.identifier()
+        alias = None
+        if self.accept_keyword("AS"):
+            alias = self.identifier()
+        elif self.peek().kind == "qid" or (self.peek().kind == "id" and self.peek().value.upper() not in _RESERVED):
+            alias = self.identifier()
+        return TableRef(name, alias)
+
+    def parse_join(self) -> Optional[JoinClause]:
+        if self.accept_op(","):
+            return JoinClause("CROSS", self.parse_table_ref())
+        token = self.peek()
+        if token.is_keyword("RIGHT", "FULL", "NATURAL"):
+            raise UnsupportedSqlError(f"Python引擎不支持 {token.value.upper()} JOIN")
+        if token.is_keyword("JOIN"):
+            kind = "INNER"
+        elif token.is_keyword("INNER", "CROSS"):
+            kind = token.value.upper()
+            self.next()
+        elif token.is_keyword("LEFT"):
+            kind = "LEFT"
+            self.next()
+            self.accept_keyword("OUTER")
+        else:
+            return None
+        self.expect_keyword("JOIN")
+        table = self.parse_table_ref()
+        on = None
+        if self.accept_keyword("ON"):
+            on = self.parse_expr()
+        elif self.peek().is_keyword("USING"):
+            raise UnsupportedSqlError("Python引擎不支持 JOIN ... USING")
+        return JoinClause(kind, table, on)
+
+    def parse_expr_list(self) -> List[Node]:
+        items = [self.parse_expr()]
+        while self.accept_op(","):
+            items.append(self.parse_expr())
+        return items
+
+    # 表达式（优先级从低到高）
+
+    def parse_expr(self) -> Node:
+        return self.parse_or()
+
+    def parse_or(self) -> Node:
+        node = self.parse_and()
+        while self.accept_keyword("OR"):
+            node = Binary("OR", node, self.parse_and())
+        return node
+
+    def parse_and(self) -> Node:
+        node = self.parse_not()
+        while self.accept_keyword("AND"):
+            node = Binary("AND", node, self.parse_not())
+        return node
+
+    def parse_not(self) -> Node:
+        if self.accept_keyword("NOT"):
+            return Unary("NOT", self.parse_not())
+        return self.parse_predicate()
+
+    def parse_predicate(self) -> Node:
+        node = self.parse_additive()
+        while True:
+            token = self.peek()
+            if token.kind == "op" and token.value in _COMPARISONS:
+                self.next()
+                op = {"==": "=", "<>": "!="}.get(token.value, token.value)
+                node = Binary(op, node, self.parse_additive())
+                continue
+            if token.is_keyword("IS"):
+                self.next()
+                negated = bool(self.accept_keyword("NOT"))
+                self.expect_keyword("NULL")
+                node = IsNull(node, negated)
+                continue
+            if token.is_keyword("NOTNULL"):
+                self.next()
+                node = IsNull(node, True)
+                continue
+            if token.is_keyword("ISNULL"):
+                self.next()
+                node = IsNull(node, False)
+                continue
+            negated = False
+            if token.is_keyword("NOT") and self.peek(1).is_keyword("LIKE", "IN", "BETWEEN"):
+                self.next()
+                negated = True
+                token = self.peek()
+            if token.is_keyword("LIKE"):
+                self.next()
+                pattern = self.parse_additive()
+                escape = self.parse_additive() if self.accept_keyword("ESCAPE") else None
+                node = Like(node, pattern, negated, escape)
+            elif token.is_keyword("IN"):
+                self.next()
+                self.expect_op("(")
+                if self.peek().is_keyword("SELECT"):
+                    raise UnsupportedSqlError("Python引擎不支持子查询")
+                items = [] if self.peek().kind == "op" and self.peek().value == ")" else self.parse_expr_list()
+                self.expect_op(")")
+                node = InList(node, items, negated)
+            elif token.is_keyword("BETWEEN"):
+                self.next()
+                low = self.parse_additive()
+                self.expect_keyword("AND")
+                high = self.parse_additive()
+                node = Between(node, low, high, negated)
+            else:
+                return node
+
+    def parse_additive(self) -> Node:
+        node = self.parse_multiplicative()
+        while True:
+            token = self.accept_op("+", "-")
+            if token is None:
+                return node
+            node = Binary(token.value, node, self.parse_multiplicative())
+
+    def parse_multiplicative(self) -> Node:
+        node = self.parse_concat()
+        while True:
+            token = self.accept_op("*", "/", "%")
+            if token is None:
+                return node
+            node = Binary(token.value, node, self.parse_concat())
+
+    def parse_concat(self) -> Node:
+        node = self.parse_unary()
+        while self.accept_op("||"):
+            node = Binary("||", node, self.parse_unary())
+        return node
+
+    def parse_unary(self) -> Node:
+        token = self.accept_op("-", "+")
+        if token is not None:
+            operand = self.parse_unary()
+            if token.value == "+":
+                return operand
+            if isinstance(operand, Literal) and isinstance(operand.value, (int, float)):
+                return Literal(-operand.value)
+            return Unary("-", operand)
+        return self.parse_primary()
+
+    def parse_primary(self) -> Node:
+        token = self.peek()
+        if token.kind == "num" or token.kind == "str":
+            self.next()
+            return Literal(token.value)
+        if token.kind == "param":
+            self.next()
+            return Param(token.value)
+        if token.kind == "op":
+            if token.value == "(":
+                self.next()
+                if self.peek().is_keyword("SELECT"):
+                    raise UnsupportedSqlError("Python引擎不支持子查询")
+                node = self.parse_expr()
+                self.expect_op(")")
+                return node
+            if token.value == "?":
+                self.error("参数占位符需要通过parameterize绑定参数")
+            self.error(f"意外的符号 '{token.value}'")
+        if token.kind == "qid":
+            self.next()
+            quote, name = token.value
+            return self.parse_column_tail(name, quote == '"')
+        if token.kind != "id":
+            self.error("缺少表达式")
+
+        keyword = token.value.upper()
+        if keyword == "NULL":
+            self.next()
+            return Literal(None)
+        if keyword in ("TRUE", "FALSE"):
+            self.next()
+            return Literal(1 if keyword == "TRUE" else 0)
+        if keyword == "CASE":
+            self.next()
+            return self.parse_case()
+        if keyword == "CAST" and self.peek(1).kind == "op" and self.peek(1).value == "(":
+            self.next()
+            self.next()
+            expr = self.parse_expr()
+            self.expect_keyword("AS")
+            type_name = self.identifier().upper()
+            # 允许VARCHAR(20)之类的长度声明
+            if self.accept_op("("):
+                while not self.accept_op(")"):
+                    if self.next().kind == "eof":
+                        self.error("缺少 ')'")
+            self.expect_op(")")
+            return Cast(expr, type_name)
+        if keyword == "EXISTS":
+            raise UnsupportedSqlError("Python引擎不支持子查询")
+        if keyword in _RESERVED:
+            self.error(f"意外的关键字 {keyword}")
+        self.next()
+        if self.peek().kind == "op" and self.peek().value == "(":
+            return self.parse_function(keyword)
+        return self.parse_column_tail(token.value, False)
+
+    def parse_column_tail(self, name: str, quoted: bool) -> Node:
+        if self.peek().kind == "op" and self.peek().value == "." and self.peek(1).kind in ("id", "qid"):
+            self.next()
+            return ColumnRef(name, self.identifier())
+        return ColumnRef(None, name, quoted)
+
+    def parse_function(self, name: str) -> Node:
+        self.expect_op("(")
+        if self.accept_op("*"):
+            self.expect_op(")")
+            return Func(name, [], star=True)
+        distinct = bool(self.accept_keyword("DISTINCT"))
+        args = [] if self.peek().kind == "op" and self.peek().value == ")" else self.parse_expr_list()
+        self.expect_op(")")
+        return Func(name, args, distinct=distinct)
+
+    def parse_case(self) -> Node:
+        operand = None
+        if not self.peek().is_keyword("WHEN"):
+            operand = self.parse_expr()
+        whens = []
+        while self.accept_keyword("WHEN"):
+            condition = self.parse_expr()
+            self.expect_keyword("THEN")
+            whens.append((condition, self.parse_expr()))
+        if not whens:
+            self.error("CASE缺少WHEN")
+        default = self.parse_expr() if self.accept_keyword("ELSE") else None
+        self.expect_keyword("END")
+        return Case(operand, whens, default)
+
+
+def parse_sql(sql: str, tokens: Optional[List[Token]] = None) -> Statement:
+    """
+    解析SELECT/UPDATE/DELETE语句
+
+    Args:
+        sql: SQL语句
+        tokens: 已完成参数化的词法单元（见parameterize），None时直接对sql做词法分析
+
+    Raises:
+        UnsupportedSqlError: 其他语句或使用了不支持的语法
+        SqlError: 语法错误
+    """
+    return _Parser(sql, tokens).parse_statement()
+
+
+_EXPLAIN = re.compile(r"^\s*EXPLAIN(?:\s+(ANALYZE)|\s+QUERY\s+PLAN)?\s+(.+)$", re.IGNORECASE | re.DOTALL)
+
+
+def parse_explain(sql: str) -> Optional[Tuple[str, bool]]:
+    """
+    识别 EXPLAIN [ANALYZE | QUERY PLAN] 前缀
+
+    Returns:
+        (被解释的语句, 是否ANALYZE)；不是EXPLAIN语句时返回None
+    """
+    match = _EXPLAIN.match(sql)
+    if match is None:
+        return None
+    return match.group(2), match.group(1) is not None
+
+
+def statement_tables(statement: Statement) -> List[str]:
+    """语句引用的表名，按FROM/JOIN中出现的顺序"""
+    if isinstance(statement, SelectStatement):
+        if statement.table is None:
+            return []
+        return [statement.table.name] + [join.table.name for join in statement.joins]
+    return [statement.table.name]
+
+
+# ---------------------------------------------------------------------------
+# 值语义（与SQLite一致）
+# ---------------------------------------------------------------------------
+
+class CodeVec:
+    """字典编码的列向量，-1表示空值"""
+    __slots__ = ("dictionary", "codes")
+
+    def __init__(self, dictionary: StringDictionary, codes: Sequence[int]):
+        self.dictionary = dictionary
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def decode(self) -> List[Optional[str]]:
+        strings = self.dictionary.strings
+        return [strings[c] if c >= 0 else None for c in self.codes]
+
+    def key_codes(self) -> List[Optional[int]]:
+        """用作分组/连接键的编码，空值为None"""
+        return [c if c >= 0 else None for c in self.codes]
+
+
+class Const:
+    """常量（未展开为向量）"""
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float))
+
+
+def type_rank(value: Any) -> int:
+    """SQLite的跨类型排序：NULL < 数值 < 文本"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    return 3
+
+
+def parse_number(text: str) -> Optional[Any]:
+    """将文本转换为数值，不是数值格式时返回None"""
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def to_number(value: Any) -> Any:
+    """算术运算中的数值转换：非数值文本视为0"""
+    if value is None or _is_number(value):
+        return value
+    if isinstance(value, str):
+        number = parse_number(value)
+        return 0 if number is None else number
+    return 0
+
+
+def to_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def truthy(value: Any) -> Optional[bool]:
+    """SQLite的真值判断：数值非0为真，文本按数值转换"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return to_number(value) != 0
+    return bool(value)
+
+
+_ORDER_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+              "=": operator.eq, "!=": operator.ne}
+
+
+def compare_values(op: str, a: Any, b: Any) -> Optional[bool]:
+    """比较两个值，数值与数值格式的文本比较时按数值比较，其余跨类型比较按类型排序"""
+    if a is None or b is None:
+        return None
+    fn = _ORDER_OPS[op]
+    number_a = _is_number(a)
+    number_b = _is_number(b)
+    if number_a == number_b and (number_a or type(a) is type(b)):
+        return fn(a, b)
+    if number_a and isinstance(b, str):
+        converted = parse_number(b)
+        if converted is not None:
+            return fn(a, converted)
+    elif number_b and isinstance(a, str):
+        converted = parse_number(a)
+        if converted is not None:
+            return fn(converted, b)
+    return fn(type_rank(a), type_rank(b))
+
+
+def sort_key(value: Any) -> Tuple[int, Any]:
+    rank = type_rank(value)
+    return (rank, value) if rank in (1, 2) else (rank, 0)
+
+
+def descending_key(value: Any) -> Tuple[int, Any]:
+    """与sort_key顺序相反的排序键：数值取负，只有文本需要Descending包装"""
+    rank = type_rank(value)
+    if rank == 1:
+        return (-1, -value)
+    return (-2, Descending(value)) if rank == 2 else (-rank, 0)
+
+
+def _arith(op: str, a: Any, b: Any) -> Any:
+    if a is None or b is None:
+        return None
+    a = to_number(a)
+    b = to_number(b)
+    if op == "+":
+        return a + b
+    if op == "-":
+        return a - b
+    if op == "*":
+        return a * b
+    if op == "/":
+        if b == 0:
+            return None
+        if isinstance(a, int) and isinstance(b, int):
+            # 整数除法向零取整
+            quotient = abs(a) // abs(b)
+            return quotient if (a >= 0) == (b >= 0) else -quotient
+        return a / b
+    if op == "%":
+        a = int(a)
+        b = int(b)
+        if b == 0:
+            return None
+        remainder = abs(a) % abs(b)
+        return remainder if a >= 0 else -remainder
+    raise SqlError(f"不支持的运算符 {op}")
+
+
+def _concat(a: Any, b: Any) -> Optional[str]:
+    if a is None or b is None:
+        return None
+    return to_text(a) + to_text(b)
+
+
+@lru_cache(maxsize=256)
+def like_matcher(pattern: str, escape: Optional[str] = None) -> Callable[[str], bool]:
+    """
+    将LIKE模式编译为匹配函数（%任意串，_任意单字符，ASCII字母不区分大小写）
+
+    首尾的%不进入正则：'%x%'使用search，'x%'使用match，避免.*回溯
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if escape and ch == escape and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        if ch == "%":
+            if not parts or parts[-1] != ".*":
+                parts.append(".*")
+        elif ch == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+        i += 1
+    leading = bool(parts) and parts[0] == ".*"
+    trailing = len(parts) > int(leading) and parts[-1] == ".*"
+    core = parts[int(leading):len(parts) - int(trailing)]
+    flags = re.DOTALL | re.IGNORECASE | re.ASCII
+    if ".*" in core or not core:
+        regex = re.compile("".join(parts), flags)
+        return lambda text: regex.fullmatch(text) is not None
+    body = "".join(core)
+    if leading and trailing:
+        search = re.compile(body, flags).search
+    elif trailing:
+        search = re.compile(body, flags).match
+    elif leading:
+        search = re.compile(body + r"\Z", flags).search
+    else:
+        search = re.compile(body, flags).fullmatch
+    return lambda text: search(text) is not None
+
+
+def _round(value: Any, digits: Any = 0) -> Optional[float]:
+    if value is None or digits is None:
+        return None
+    value = float(to_number(value))
+    digits = int(to_number(digits))
+    scale = 10 ** digits
+    # SQLite按远离零的方向舍入
+    rounded = int(abs(value) * scale + 0.5) / scale
+    return rounded if value >= 0 else -rounded
+
+
+def _substr(text: Any, start: Any, length: Any = -1) -> Optional[str]:
+    if text is None or start is None or length is None:
+        return None
+    text = to_text(text)
+    start = int(to_number(start))
+    length = int(to_number(length))
+    if start > 0:
+        begin = start - 1
+    elif start < 0:
+        begin = max(0, len(text) + start)
+    else:
+        begin = 0
+        if length >= 0:
+            length = max(0, length - 1)
+    if length < 0 and length != -1:
+        return ""
+    return text[begin:] if length == -1 else text[begin:begin + length]
+
+
+def _trim(method: str):
+    def trim(text: Any, chars: Any = " ") -> Optional[str]:
+        if text is None or chars is None:
+            return None
+        return getattr(to_text(text), method)(to_text(chars))
+    return trim
+
+
+def _cast(value: Any, type_name: str) -> Any:
+    if value is None:
+        return None
+    kind = type_name.upper()
+    if "INT" in kind:
+        number = to_number(value)
+        return int(number)
+    if any(k in kind for k in ("REAL", "FLOA", "DOUB")):
+        return float(to_number(value))
+    if any(k in kind for k in ("CHAR", "CLOB", "TEXT")):
+        return to_text(value)
+    if kind in ("NUMERIC", "DECIMAL"):
+        return to_number(value)
+    return value
+
+
+def _typeof(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (bool, int)):
+        return "integer"
+    if isinstance(value, float):
+        return "real"
+    return "text"
+
+
+def _null_safe(fn: Callable) -> Callable:
+    def wrapper(*args):
+        if any(a is None for a in args):
+            return None
+        return fn(*args)
+    return wrapper
+
+
+def _instr(text, sub):
+    return to_text(text).find(to_text(sub)) + 1
+
+
+def _length(value):
+    return len(to_text(value))
+
+
+def _replace(text, old, new):
+    old = to_text(old)
+    return to_text(text).replace(old, to_text(new)) if old else to_text(text)
+
+
+def _nullif(a, b):
+    return None if compare_values("=", a, b) else a
+
+
+def _scalar_min(*args):
+    if any(a is None for a in args):
+        return None
+    return min(args, key=sort_key)
+
+
+def _scalar_max(*args):
+    if any(a is None for a in args):
+        return None
+    return max(args, key=sort_key)
+
+
+def _coalesce(*args):
+    for a in args:
+        if a is not None:
+            return a
+    return None
+
+
+# 标量函数：名称 -> (实现, 最少参数, 最多参数)
+SCALAR_FUNCTIONS: Dict[str, Tuple[Callable, int, int]] = {
+    "UPPER": (_null_safe(lambda s: to_text(s).upper()), 1, 1),
+    "LOWER": (_null_safe(lambda s: to_text(s).lower()), 1, 1),
+    "LENGTH": (_null_safe(_length), 1, 1),
+    "ABS": (_null_safe(lambda v: abs(to_number(v))), 1, 1),
+    "ROUND": (_round, 1, 2),
+    "SUBSTR": (_substr, 2, 3),
+    "SUBSTRING": (_substr, 2, 3),
+    "TRIM": (_trim("strip"), 1, 2),
+    "LTRIM": (_trim("lstrip"), 1, 2),
+    "RTRIM": (_trim("rstrip"), 1, 2),
+    "REPLACE": (_null_safe(_replace), 3, 3),
+    "INSTR": (_null_safe(_instr), 2, 2),
+    "COALESCE": (_coalesce, 2, 64),
+    "IFNULL": (_coalesce, 2, 2),
+    "NULLIF": (_nullif, 2, 2),
+    "TYPEOF": (_typeof, 1, 1),
+    "MIN": (_scalar_min, 2, 64),
+    "MAX": (_scalar_max, 2, 64),
+}
+
+
+# 复合类型列的元素函数：名称 -> (最少参数, 最多参数)
+COMPOSITE_FUNCTIONS: Dict[str, Tuple[int, int]] = {
+    "CONTAINS": (2, 2),
+    "ELEMENT": (2, 2),
+    "ELEMENT_COUNT": (1, 1),
+}
+
+# 非复合类型的表达式按文本数组解码
+_TEXT_ARRAY_CODEC = codec_for("string[]")
+
+
+# ---------------------------------------------------------------------------
+# 执行
+# ---------------------------------------------------------------------------
+
+class Relation:
+    """
+    中间结果：每个已连接的绑定（表）对应一个行号序列，第i行由各绑定序列的第i个行号组成
+
+    ids中的-1表示外连接补出的空行（只会出现在outer中的绑定上）；extra存放与行对齐的附加向量（如聚合结果）
+    """
+    __slots__ = ("ids", "size", "outer", "extra")
+
+    def __init__(self, ids: Dict[int, Sequence[int]], size: int, outer: Optional[Set[int]] = None,
+                 extra: Optional[Dict[int, List[Any]]] = None):
+        self.ids = ids
+        self.size = size
+        self.outer = outer or set()
+        self.extra = extra or {}
+
+    def filter(self, mask: Sequence[Any]) -> "Relation":
+        ids = {b: list(compress(seq, mask)) for b, seq in self.ids.items()}
+        extra = {k: list(compress(v, mask)) for k, v in self.extra.items()}
+        size = len(next(iter(ids.values()))) if ids else sum(1 for m in mask if m)
+        if not ids and extra:
+            size = len(next(iter(extra.values())))
+        return Relation(ids, size, self.outer, extra)
+
+    def take(self, positions: Sequence[int]) -> "Relation":
+        ids = {b: [seq[p] for p in positions] for b, seq in self.ids.items()}
+        extra = {k: [v[p] for p in positions] for k, v in self.extra.items()}
+        return Relation(ids, len(positions), self.outer, extra)
+
+    def slice(self, start: int, stop: Optional[int]) -> "Relation":
+        ids = {b: seq[start:stop] for b, seq in self.ids.items()}
+        extra = {k: v[start:stop] for k, v in self.extra.items()}
+        size = len(range(self.size)[start:stop])
+        return Relation(ids, size, self.outer, extra)
+
+    def nbytes(self) -> int:
+        """估算行号序列和附加向量本身占用的内存（不含元素对象）"""
+        return sum(sys.getsizeof(seq) for seq in self.ids.values()) + \
+            sum(sys.getsizeof(v) for v in self.extra.values())
+
+
+# 常量表达式求值使用的单行关系
+_SINGLE_ROW = Relation({}, 1)
+
+
+@dataclass
+class Binding:
+    """FROM/JOIN中的一个表"""
+    index: int
+    alias: str
+    table: ColumnTable
+
+
+def _gather(seq: Sequence[Any], ids: Sequence[int], nullable: bool, null: Any) -> Sequence[Any]:
+    if type(ids) is range and ids.start == 0 and ids.step == 1 and ids.stop == len(seq):
+        # 全表扫描直接使用列数据，不复制
+        return seq
+    if nullable:
+        return [seq[i] if i >= 0 else null for i in ids]
+    return list(map(seq.__getitem__, ids))
+
+
+def values_of(vector: Any, size: int) -> Sequence[Any]:
+    """将向量展开为值序列"""
+    if type(vector) is CodeVec:
+        return vector.decode()
+    if type(vector) is Const:
+        return [vector.value] * size
+    return vector
+
+
+def _per_code(vector: CodeVec, fn: Callable[[Optional[str]], Any]) -> List[Any]:
+    """对字典编码向量的每个不同编码只计算一次fn"""
+    strings = vector.dictionary.strings
+    table = {c: fn(strings[c]) for c in set(vector.codes) if c >= 0}
+    table[-1] = fn(None)
+    return list(map(table.__getitem__, vector.codes))
+
+
+def _map_unary(vector: Any, fn: Callable[[Any], Any], size: int) -> Any:
+    if type(vector) is Const:
+        return Const(fn(vector.value))
+    if type(vector) is CodeVec:
+        return _per_code(vector, fn)
+    return [fn(v) for v in vector]
+
+
+def _map_binary(fn: Callable[[Any, Any], Any], left: Any, right: Any, size: int) -> Any:
+    if type(left) is Const and type(right) is Const:
+        return Const(fn(left.value, right.value))
+    if type(right) is Const:
+        value = right.value
+        if type(left) is CodeVec:
+            return _per_code(left, lambda s: fn(s, value))
+        return [fn(a, value) for a in left]
+    if type(left) is Const:
+        value = left.value
+        if type(right) is CodeVec:
+            return _per_code(right, lambda s: fn(value, s))
+        return [fn(value, b) for b in right]
+    return [fn(a, b) for a, b in zip(values_of(left, size), values_of(right, size))]
+
+
+def aligned_codes(vector: CodeVec, dictionary: StringDictionary) -> Sequence[int]:
+    """将编码向量转换为另一个字典的编码（-1为空值，-2为该字典中不存在的文本）"""
+    if vector.dictionary is dictionary:
+        return vector.codes
+    mapping = dictionary.translation_from(vector.dictionary)
+    return [mapping[c] if c >= 0 else -1 for c in vector.codes]
+
+
+def _sorted_codes(vector: CodeVec, codes: Set[int]) -> List[int]:
+    """按文本排序编码集合，空值（-1）排在最前"""
+    has_null = -1 in codes
+    codes.discard(-1)
+    ordered = sorted(codes, key=vector.dictionary.strings.__getitem__)
+    return [-1] + ordered if has_null else ordered
+
+
+def _three_valued_and(left: Sequence[Any], right: Sequence[Any]) -> List[Optional[bool]]:
+    return [False if (a is False or b is False) else (None if (a is None or b is None) else True)
+            for a, b in zip(left, right)]
+
+
+def _three_valued_or(left: Sequence[Any], right: Sequence[Any]) -> List[Optional[bool]]:
+    return [True if (a is True or b is True) else (None if (a is None or b is None) else False)
+            for a, b in zip(left, right)]
+
+
+def _is_predicate(node: Node) -> bool:
+    if isinstance(node, Binary):
+        return node.op in _ORDER_OPS or node.op in ("AND", "OR")
+    if isinstance(node, Unary):
+        return node.op == "NOT"
+    return isinstance(node, (Like, InList, Between, IsNull))
+
+
+class Evaluator:
+    """向量化表达式求值"""
+
+    def __init__(self, bindings: List[Binding], refs: Dict[int, Any], params: Sequence[Any] = (),
+                 analyze: bool = False, memory_limit: Optional[int] = None):
+        self.bindings = bindings
+        # id(ColumnRef) -> (绑定序号, 列位置) 或 ("literal", 文本)
+        self.refs = refs
+        self.params = params
+        # 是否记录各算子输出的内存占用（EXPLAIN ANALYZE）
+        self.analyze = analyze
+        # 排序/连接/聚合算子工作状态的内存上限，超过时溢出到临时文件（0表示不溢出）
+        self.memory_limit = QUERY_MEMORY if memory_limit is None else memory_limit
+
+    def eval(self, node: Node, rel: Relation) -> Any:
+        extra = rel.extra.get(id(node))
+        if extra is not None:
+            return extra
+        method = getattr(self, "_eval_" + type(node).__name__, None)
+        if method is None:
+            raise SqlError(f"不支持的表达式 {type(node).__name__}")
+        return method(node, rel)
+
+    def constant(self, node: Node) -> Any:
+        """计算不引用列的常量表达式（LIMIT、LIKE模式等）"""
+        return values_of(self.eval(node, _SINGLE_ROW), 1)[0]
+
+    def truth(self, node: Node, rel: Relation) -> Sequence[Any]:
+        """计算谓词的三值真值向量"""
+        vector = self.eval(node, rel)
+        if type(vector) is Const:
+            return [truthy(vector.value)] * rel.size
+        if type(vector) is CodeVec:
+            return _per_code(vector, truthy)
+        if _is_predicate(node):
+            # 谓词节点的结果已经是True/False/None
+            return vector
+        return [truthy(v) for v in vector]
+
+    def mask(self, node: Node, rel: Relation) -> Sequence[Any]:
+        """
+        计算过滤掩码，NULL与假不作区分，只用于WHERE/HAVING/ON顶层条件
+
+        字典编码列与常量的等值比较直接在编码数组上完成
+        """
+        if isinstance(node, Binary):
+            if node.op == "AND":
+                left = self.mask(node.left, rel)
+                if not any(left):
+                    return left
+                return [a and b for a, b in zip(left, self.mask(node.right, rel))]
+            if node.op == "OR":
+                left = self.mask(node.left, rel)
+                if all(left):
+                    return left
+                return [a or b for a, b in zip(left, self.mask(node.right, rel))]
+            if node.op == "=":
+                left = self.eval(node.left, rel)
+                right = self.eval(node.right, rel)
+                if type(right) is CodeVec:
+                    left, right = right, left
+                if type(left) is CodeVec and type(right) is Const and isinstance(right.value, str):
+                    code = left.dictionary.code_of(right.value)
+                    if code is None:
+                        return [False] * rel.size
+                    return list(map(code.__eq__, left.codes))
+                result = self._compare("=", left, right, rel.size)
+                return [truthy(result.value)] * rel.size if type(result) is Const else result
+        return self.truth(node, rel)
+
+    def _eval_Literal(self, node: Literal, rel: Relation) -> Any:
+        return Const(node.value)
+
+    def _eval_Param(self, node: Param, rel: Relation) -> Any:
+        if node.index >= len(self.params):
+            raise SqlError(f"缺少第 {node.index + 1} 个参数")
+        return Const(self.params[node.index])
+
+    def _eval_ColumnRef(self, node: ColumnRef, rel: Relation) -> Any:
+        ref = self.refs.get(id(node))
+        if ref is None:
+            raise SqlError(f"列 '{node.name}' 不存在")
+        if ref[0] == "literal":
+            return Const(ref[1])
+        binding_index, position = ref
+        ids = rel.ids.get(binding_index)
+        if ids is None:
+            raise SqlError(f"列 '{node.name}' 在此处不可用")
+        column = self.bindings[binding_index].table.data[position]
+        nullable = binding_index in rel.outer
+        if type(column) is DictColumn:
+            return CodeVec(column.dictionary, _gather(column.codes, ids, nullable, -1))
+        return _gather(column.data, ids, nullable, None)
+
+    def _eval_Star(self, node: Star, rel: Relation) -> Any:
+        raise SqlError("* 只能用于SELECT列表或COUNT(*)")
+
+    def _eval_Unary(self, node: Unary, rel: Relation) -> Any:
+        if node.op == "NOT":
+            vector = self.truth(node.operand, rel)
+            return [None if v is None else not v for v in vector]
+        operand = self.eval(node.operand, rel)
+        return _map_unary(operand, lambda v: None if v is None else -to_number(v), rel.size)
+
+    def _eval_Binary(self, node: Binary, rel: Relation) -> Any:
+        op = node.op
+        if op == "AND":
+            left = self.truth(node.left, rel)
+            if not any(v is not False for v in left):
+                return left
+            return _three_valued_and(left, self.truth(node.right, rel))
+        if op == "OR":
+            left = self.truth(node.left, rel)
+            if all(v is True for v in left):
+                return left
+            return _three_valued_or(left, self.truth(node.right, rel))
+        left = self.eval(node.left, rel)
+        right = self.eval(node.right, rel)
+        if op in _ORDER_OPS:
+            return self._compare(op, left, right, rel.size)
+        if op == "||":
+            return _map_binary(_concat, left, right, rel.size)
+        return _map_binary(lambda a, b: _arith(op, a, b), left, right, rel.size)
+
+    def _compare(self, op: str, left: Any, right: Any, size: int) -> Any:
+        if type(right) is CodeVec and type(left) is not CodeVec:
+            left, right = right, left
+            op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+        if type(left) is CodeVec and op in ("=", "!="):
+            equal = op == "="
+            if type(right) is Const:
+                value = right.value
+                if value is None:
+                    return Const(None)
+                if _is_number(value):
+                    # 文本列与数值字面量比较时按文本比较
+                    value = to_text(value) if not isinstance(value, float) or not value.is_integer() else str(int(value))
+                code = left.dictionary.code_of(value)
+                if code is None:
+                    return [None if c < 0 else not equal for c in left.codes]
+                return [None if c < 0 else ((c == code) == equal) for c in left.codes]
+            if type(right) is CodeVec:
+                # 同一工作簿直接比较编码，不同工作簿先转换到左侧字典
+                right_codes = aligned_codes(right, left.dictionary)
+                return [None if a < 0 or b == -1 else ((a == b) == equal) for a, b in zip(left.codes, right_codes)]
+        if type(right) is Const and type(left) is list and right.value is not None:
+            value = right.value
+            fn = _ORDER_OPS[op]
+            if _is_number(value):
+                try:
+                    return [None if v is None else fn(v, value) for v in left]
+                except TypeError:
+                    pass
+        return _map_binary(lambda a, b: compare_values(op, a, b), left, right, size)
+
+    def _eval_Like(self, node: Like, rel: Relation) -> Any:
+        value = self.eval(node.expr, rel)
+        pattern = self.eval(node.pattern, rel)
+        escape = None
+        if node.escape is not None:
+            escape_vector = self.eval(node.escape, rel)
+            if type(escape_vector) is not Const:
+                raise SqlError("ESCAPE必须是常量")
+            escape = to_text(escape_vector.value)
+        negated = node.negated
+
+        def like(text: Any, pattern_text: Any) -> Optional[bool]:
+            if text is None or pattern_text is None:
+                return None
+            matched = like_matcher(to_text(pattern_text), escape)(to_text(text))
+            return matched != negated
+
+        return _map_binary(like, value, pattern, rel.size)
+
+    def _eval_InList(self, node: InList, rel: Relation) -> Any:
+        value = self.eval(node.expr, rel)
+        items = [self.eval(item, rel) for item in node.items]
+        negated = node.negated
+        if all(type(item) is Const for item in items):
+            constants = [item.value for item in items]
+            has_null = any(c is None for c in constants)
+            if type(value) is CodeVec:
+                texts = {to_text(c) for c in constants if c is not None}
+                codes = {value.dictionary.code_of(t) for t in texts} - {None}
+                miss = None if has_null else negated
+                return [None if c < 0 else ((not negated) if c in codes else miss) for c in value.codes]
+
+            def member(v: Any) -> Optional[bool]:
+                if v is None:
+                    return None
+                if any(compare_values("=", v, c) for c in constants if c is not None):
+                    return not negated
+                return None if has_null else negated
+
+            return _map_unary(value, member, rel.size)
+        size = rel.size
+        columns = [values_of(item, size) for item in items]
+        values = values_of(value, size)
+        result = []
+        for i, v in enumerate(values):
+            if v is None:
+                result.append(None)
+                continue
+            candidates = [column[i] for column in columns]
+            if any(compare_values("=", v, c) for c in candidates if c is not None):
+                result.append(not negated)
+            else:
+                result.append(None if any(c is None for c in candidates) else negated)
+        return result
+
+    def _eval_Between(self, node: Between, rel: Relation) -> Any:
+        value = self.eval(node.expr, rel)
+        low = self._compare(">=", value, self.eval(node.low, rel), rel.size)
+        high = self._compare("<=", value, self.eval(node.high, rel), rel.size)
+        result = _three_valued_and(values_of(low, rel.size), values_of(high, rel.size))
+        if node.negated:
+            return [None if v is None else not v for v in result]
+        return result
+
+    def _eval_IsNull(self, node: IsNull, rel: Relation) -> Any:
+        value = self.eval(node.expr, rel)
+        negated = node.negated
+        if type(value) is Const:
+            return Const((value.value is None) != negated)
+        if type(value) is CodeVec:
+            return [(c < 0) != negated for c in value.codes]
+        return [(v is None) != negated for v in value]
+
+    def _eval_Case(self, node: Case, rel: Relation) -> Any:
+        size = rel.size
+        result: List[Any] = [None] * size
+        undecided = [True] * size
+        operand = values_of(self.eval(node.operand, rel), size) if node.operand is not None else None
+        for condition, then in node.whens:
+            if operand is not None:
+                matched = [compare_values("=", a, b) for a, b in
+                           zip(operand, values_of(self.eval(condition, rel), size))]
+            else:
+                matched = self.truth(condition, rel)
+            values = values_of(self.eval(then, rel), size)
+            for i in range(size):
+                if undecided[i] and matched[i]:
+                    result[i] = values[i]
+                    undecided[i] = False
+        if node.default is not None:
+            values = values_of(self.eval(node.default, rel), size)
+            for i in range(size):
+                if undecided[i]:
+                    result[i] = values[i]
+        return result
+
+    def _eval_Cast(self, node: Cast, rel: Relation) -> Any:
+        type_name = node.type_name
+        return _map_unary(self.eval(node.expr, rel), lambda v: _cast(v, type_name), rel.size)
+
+    def _eval_Func(self, node: Func, rel: Relation) -> Any:
+        if node.is_aggregate:
+            raise SqlError(f"聚合函数 {node.name} 不能用于此处")
+        if node.name in COMPOSITE_FUNCTIONS:
+            return self._composite_function(node, rel)
+        spec = SCALAR_FUNCTIONS.get(node.name)
+        if spec is None:
+            raise SqlError(f"不支持的函数 {node.name}")
+        fn, min_args, max_args = spec
+        if not min_args <= len(node.args) <= max_args:
+            raise SqlError(f"函数 {node.name} 的参数个数不正确")
+        args = [self.eval(arg, rel) for arg in node.args]
+        size = rel.size
+        if len(args) == 1:
+            return _map_unary(args[0], fn, size)
+        vectors = [a for a in args if type(a) is not Const]
+        if not vectors:
+            return Const(fn(*[a.value for a in args]))
+        if len(vectors) == 1 and type(vectors[0]) is CodeVec:
+            position = next(i for i, a in enumerate(args) if type(a) is not Const)
+            constants = [a.value if type(a) is Const else None for a in args]
+
+            def call(text):
+                constants[position] = text
+                return fn(*constants)
+            return _per_code(vectors[0], call)
+        columns = [values_of(a, size) for a in args]
+        return [fn(*row) for row in zip(*columns)]
+
+
+    def _composite_source(self, node: Node, rel: Relation) -> Tuple[CompositeColumn, Sequence[int]]:
+        """
+        元素函数的第一个参数：声明为复合类型的表列直接使用加载时的解码结果，
+        其它表达式把各行文本按文本数组解码（相同文本只解码一次）
+
+        Returns:
+            (解码后的列, 每行在列中的行号，-1表示外连接补出的空行)
+        """
+        ref = self.refs.get(id(node)) if isinstance(node, ColumnRef) and id(node) not in rel.extra else None
+        if ref is not None and ref[0] != "literal" and ref[0] in rel.ids:
+            binding_index, position = ref
+            decoded = self.bindings[binding_index].table.composite(position)
+            if decoded is not None:
+                return decoded, rel.ids[binding_index]
+        texts = [to_text(v) for v in values_of(self.eval(node, rel), rel.size)]
+        return decode_column(_TEXT_ARRAY_CODEC, texts), range(rel.size)
+
+    def _composite_function(self, node: Func, rel: Relation) -> List[Any]:
+        min_args, max_args = COMPOSITE_FUNCTIONS[node.name]
+        if not min_args <= len(node.args) <= max_args:
+            raise SqlError(f"函数 {node.name} 的参数个数不正确")
+        decoded, ids = self._composite_source(node.args[0], rel)
+        nulls = decoded.nulls
+        if node.name == "ELEMENT_COUNT":
+            return [decoded.count(i) if i >= 0 else None for i in ids]
+        argument = self.eval(node.args[1], rel)
+        if node.name == "CONTAINS" and type(argument) is Const:
+            if argument.value is None:
+                return [None] * rel.size
+            # 一次遍历扁平元素数组得到全表的命中标记，再按行号取出
+            hits = decoded.rows_containing(argument.value)
+            return [None if i < 0 or nulls[i] else hits[i] for i in ids]
+        values = values_of(argument, rel.size)
+        if node.name == "ELEMENT":
+            return [decoded.element(i, value) if i >= 0 else None for i, value in zip(ids, values)]
+        codec = decoded.codec
+        element = codec.key if codec.is_map else codec.element
+        result = []
+        for i, value in zip(ids, values):
+            items = decoded.elements(i) if i >= 0 else None
+            result.append(None if items is None else int(element.coerce(value) in items))
+        return result
+
+
+# ---------------------------------------------------------------------------
+# 算子
+# ---------------------------------------------------------------------------
+
+class Operator:
+    """执行计划中的算子，记录输出行数和耗时"""
+
+    name = "Operator"
+
+    def __init__(self, *children: "Operator"):
+        self.children = list(children)
+        self.rows_out = 0
+        self.elapsed = 0.0
+        self.bytes_out = 0
+        # 最近一次执行溢出到临时文件时的统计（见spill.Spill.stats）
+        self.spilled: Optional[Dict[str, Any]] = None
+
+    def execute(self, evaluator: Evaluator) -> Relation:
+        started = time.perf_counter()
+        rel = self._execute(evaluator)
+        self.elapsed += time.perf_counter() - started
+        self.rows_out = rel.size
+        if evaluator.analyze:
+            self.bytes_out = rel.nbytes()
+        return rel
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        return self.name
+
+    def rows_in(self) -> int:
+        """输入行数：子算子输出行数之和，扫描算子为表的行数"""
+        return sum(child.rows_out for child in self.children)
+
+    def details(self) -> Dict[str, Any]:
+        """执行计划中展示的算子属性"""
+        return {}
+
+    def explain(self, analyze: bool) -> Dict[str, Any]:
+        """
+        生成算子子树的执行计划
+
+        Args:
+            analyze: 是否包含执行统计（算子已执行过）
+
+        Returns:
+            {"operator": 名称, "detail": 描述, ...算子属性, "rowsIn", "rowsOut", "timeMs": 含子算子的耗时,
+             "selfMs": 自身耗时, "bytes": 输出占用的内存, "spill": 溢出统计（仅溢出时）, "children": [子算子]}
+        """
+        node: Dict[str, Any] = {"operator": self.name, "detail": self.describe()}
+        node.update(self.details())
+        if analyze:
+            children_elapsed = sum(child.elapsed for child in self.children)
+            node.update(rowsIn=self.rows_in(), rowsOut=self.rows_out, timeMs=round(self.elapsed * 1000, 3),
+                        selfMs=round(max(0.0, self.elapsed - children_elapsed) * 1000, 3), bytes=self.bytes_out)
+            if self.spilled is not None:
+                node["spill"] = self.spilled
+        if self.children:
+            node["children"] = [child.explain(analyze) for child in self.children]
+        return node
+
+
+class ScanOp(Operator):
+    name = "Scan"
+
+    def __init__(self, binding: Binding):
+        super().__init__()
+        self.binding = binding
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        return Relation({self.binding.index: range(self.binding.table.row_count)}, self.binding.table.row_count)
+
+    def describe(self) -> str:
+        return f"Scan {self.binding.table.name}" + (f" AS {self.binding.alias}" if self.binding.alias != self.binding.table.name else "")
+
+    def rows_in(self) -> int:
+        return self.binding.table.row_count
+
+    def details(self) -> Dict[str, Any]:
+        return {"table": self.binding.table.name, "access": "full_scan"}
+
+
+class LikeIndexScanOp(Operator):
+    """
+    用三元组索引求出满足 LIKE 常量模式的行，候选行已逐个精确验证
+
+    模式可以是参数，执行时才知道取值；模式没有字面片段（如 '%'）或不是文本时退回全表扫描加过滤
+    """
+    name = "LikeIndexScan"
+
+    def __init__(self, binding: Binding, position: int, like: Like):
+        super().__init__()
+        self.binding = binding
+        self.position = position
+        self.like = like
+        # 最近一次执行是否实际使用了索引（参数模式可能退回全表扫描）
+        self.used_index: Optional[bool] = None
+
+    def _arguments(self, evaluator: Evaluator) -> Optional[Tuple[str, Optional[str], List[str]]]:
+        pattern = evaluator.constant(self.like.pattern)
+        escape = evaluator.constant(self.like.escape) if self.like.escape is not None else None
+        if not isinstance(pattern, str) or not (escape is None or isinstance(escape, str)):
+            return None
+        if type(self.binding.table.data[self.position]) is not DictColumn:
+            return None
+        fragments = like_fragments(pattern, escape)
+        return (pattern, escape, fragments) if fragments else None
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        table = self.binding.table
+        arguments = self._arguments(evaluator)
+        self.used_index = arguments is not None
+        if arguments is None:
+            rel = Relation({self.binding.index: range(table.row_count)}, table.row_count)
+            return rel.filter(evaluator.mask(self.like, rel))
+        pattern, escape, fragments = arguments
+        rows = get_trigram_index(table, self.position).matching_rows(fragments, like_matcher(pattern, escape))
+        return Relation({self.binding.index: rows}, len(rows))
+
+    def describe(self) -> str:
+        table = self.binding.table
+        pattern = repr(self.like.pattern.value) if isinstance(self.like.pattern, Literal) else "?"
+        return f"LikeIndexScan {table.name} USING trigram({table.columns[self.position].name} LIKE {pattern})"
+
+    def rows_in(self) -> int:
+        return self.binding.table.row_count
+
+    def details(self) -> Dict[str, Any]:
+        details = {"table": self.binding.table.name, "access": "index_scan",
+                   "index": f"trigram({self.binding.table.columns[self.position].name})",
+                   "predicate": expr_text(self.like)}
+        if self.used_index is not None:
+            details["usedIndex"] = self.used_index
+        return details
+
+
+class SingleRowOp(Operator):
+    """无FROM子句的SELECT"""
+    name = "SingleRow"
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        return Relation({}, 1)
+
+
+class FilterOp(Operator):
+    name = "Filter"
+
+    def __init__(self, child: Operator, predicate: Node, pushed: bool = False):
+        super().__init__(child)
+        self.predicate = predicate
+        # 是否为下推到扫描上的条件
+        self.pushed = pushed
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        rel = self.children[0].execute(evaluator)
+        if rel.size == 0:
+            return rel
+        return rel.filter(evaluator.mask(self.predicate, rel))
+
+    def describe(self) -> str:
+        return "Filter (pushed down)" if self.pushed else "Filter"
+
+    def details(self) -> Dict[str, Any]:
+        return {"predicate": expr_text(self.predicate), "pushedDown": self.pushed}
+
+
+class JoinOp(Operator):
+    """等值条件使用哈希连接，否则使用嵌套循环连接"""
+
+    name = "Join"
+
+    def __init__(self, left: Operator, right: Operator, kind: str, right_binding: int,
+                 left_keys: List[Node], right_keys: List[Node], residual: List[Node]):
+        super().__init__(left, right)
+        self.kind = kind
+        self.right_binding = right_binding
+        self.left_keys = left_keys
+        self.right_keys = right_keys
+        self.residual = residual
+
+    @property
+    def strategy(self) -> str:
+        return "hash" if self.left_keys else "nested_loop"
+
+    def describe(self) -> str:
+        return f"{self.kind} Join ({self.strategy})"
+
+    def details(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "strategy": self.strategy,
+                "keys": [f"{expr_text(l)} = {expr_text(r)}" for l, r in zip(self.left_keys, self.right_keys)],
+                "residual": [expr_text(c) for c in self.residual]}
+
+    def _key_vectors(self, evaluator: Evaluator, left: Relation, right: Relation):
+        """计算连接键；两侧都是字典编码时比较编码（跨工作簿时先对齐到左侧字典）"""
+        left_columns = []
+        right_columns = []
+        for left_node, right_node in zip(self.left_keys, self.right_keys):
+            lv = evaluator.eval(left_node, left)
+            rv = evaluator.eval(right_node, right)
+            if type(lv) is CodeVec and type(rv) is CodeVec:
+                left_columns.append(lv.key_codes())
+                right_columns.append([c if c != -1 else None for c in aligned_codes(rv, lv.dictionary)])
+                continue
+            left_columns.append(values_of(lv, left.size))
+            right_columns.append(values_of(rv, right.size))
+        if len(left_columns) == 1:
+            return left_columns[0], right_columns[0]
+        return (list(zip(*left_columns)), list(zip(*right_columns)))
+
+    def _keyed_rows(self, evaluator: Evaluator, left: Relation, right: Relation,
+                    side: int) -> Iterator[Tuple[Any, int]]:
+        """按块计算一侧的连接键，返回(键, 行位置)，跳过含空值的键（不与任何行匹配）"""
+        rel = right if side else left
+        empty_left, empty_right = left.slice(0, 0), right.slice(0, 0)
+        composite = len(self.left_keys) > 1
+        step = chunk_rows(evaluator.memory_limit)
+        for start in range(0, rel.size, step):
+            part = rel.slice(start, start + step)
+            keys = self._key_vectors(evaluator, empty_left, part)[1] if side else \
+                self._key_vectors(evaluator, part, empty_right)[0]
+            for position, key in enumerate(keys, start):
+                if key is not None and not (composite and None in key):
+                    yield key, position
+
+    def _grace_join(self, evaluator: Evaluator, left: Relation, right: Relation) -> Tuple[List[int], List[int]]:
+        """
+        grace哈希连接：两侧按连接键的哈希分区写入临时文件，逐个分区建立哈希表并探测
+
+        Returns:
+            (左侧行位置, 右侧行位置)，与内存中的哈希连接顺序相同（按左侧、再按右侧行位置）
+        """
+        with Spill(evaluator.memory_limit) as spill:
+            count = partition_count(right.size, evaluator.memory_limit)
+            right_parts = spill.partition(self._keyed_rows(evaluator, left, right, 1), count)
+            left_parts = spill.partition(self._keyed_rows(evaluator, left, right, 0), count)
+            width = max(1, right.size)
+            pairs: List[int] = []
+            for right_part, left_part in zip(right_parts, left_parts):
+                table: Dict[Any, List[int]] = {}
+                for key, position in right_part:
+                    bucket = table.get(key)
+                    if bucket is None:
+                        table[key] = [position]
+                    else:
+                        bucket.append(position)
+                right_part.close()
+                for key, position in left_part:
+                    bucket = table.get(key)
+                    if bucket is not None:
+                        base = position * width
+                        pairs.extend([base + p for p in bucket])
+                left_part.close()
+            self.spilled = spill.stats()
+        pairs.sort()
+        return [p // width for p in pairs], [p % width for p in pairs]
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        left = self.children[0].execute(evaluator)
+        right = self.children[1].execute(evaluator)
+        right_ids = right.ids[self.right_binding]
+
+        if self.left_keys and should_spill(right.size, evaluator.memory_limit):
+            left_positions, right_positions = self._grace_join(evaluator, left, right)
+        elif self.left_keys:
+            left_keys, right_keys = self._key_vectors(evaluator, left, right)
+            composite = len(self.left_keys) > 1
+            table: Dict[Any, List[int]] = {}
+            for position, key in enumerate(right_keys):
+                if key is None or (composite and None in key):
+                    continue
+                bucket = table.get(key)
+                if bucket is None:
+                    table[key] = [position]
+                else:
+                    bucket.append(position)
+            left_positions = []
+            right_positions = []
+            for position, key in enumerate(left_keys):
+                bucket = table.get(key)
+                if bucket is not None:
+                    left_positions.extend([position] * len(bucket))
+                    right_positions.extend(bucket)
+        else:
+            pairs = left.size * right.size
+            if pairs > NESTED_LOOP_LIMIT:
+                raise SqlError(f"连接缺少等值条件，结果过大（{left.size} x {right.size} 行）")
+            left_positions = [p for p in range(left.size) for _ in range(right.size)]
+            right_positions = list(range(right.size)) * left.size
+
+        ids = {b: [seq[p] for p in left_positions] for b, seq in left.ids.items()}
+        ids[self.right_binding] = [right_ids[p] for p in right_positions]
+        joined = Relation(ids, len(left_positions), set(left.outer))
+        kept = left_positions
+        for predicate in self.residual:
+            if joined.size == 0:
+                break
+            mask = evaluator.mask(predicate, joined)
+            joined = joined.filter(mask)
+            kept = list(compress(kept, mask))
+
+        if self.kind != "LEFT":
+            return joined
+        matched = set(kept)
+        if len(matched) == left.size:
+            return joined
+        # 左连接：没有匹配的左侧行补空，并保持左侧行的顺序
+        unmatched = [p for p in range(left.size) if p not in matched]
+        order = sorted(range(len(kept) + len(unmatched)),
+                       key=lambda i: kept[i] if i < len(kept) else unmatched[i - len(kept)])
+        merged = {}
+        for b, seq in joined.ids.items():
+            source = left.ids[b] if b in left.ids else None
+            extended = list(seq) + ([-1] * len(unmatched) if source is None else [source[p] for p in unmatched])
+            merged[b] = [extended[i] for i in order]
+        return Relation(merged, len(order), set(left.outer) | {self.right_binding})
+
+
+class AggregateOp(Operator):
+    name = "Aggregate"
+
+    def __init__(self, child: Operator, group_by: List[Node], aggregates: List[Func]):
+        super().__init__(child)
+        self.group_by = group_by
+        self.aggregates = aggregates
+
+    def describe(self) -> str:
+        return f"HashAggregate ({len(self.group_by)} keys)" if self.group_by else "Aggregate"
+
+    def details(self) -> Dict[str, Any]:
+        return {"groupBy": [expr_text(n) for n in self.group_by], "aggregates": [expr_text(n) for n in self.aggregates]}
+
+    def _group_keys(self, evaluator: Evaluator, rel: Relation) -> Tuple[Sequence[Any], Callable[[Any], Any]]:
+        """
+        每行的分组键（字典编码列为编码，多列时为元组）及组的排序键函数
+        """
+        key_columns = []
+        sorters = []
+        for node in self.group_by:
+            vector = evaluator.eval(node, rel)
+            if type(vector) is CodeVec:
+                # 同一列的编码与文本一一对应，直接按编码分组
+                strings = vector.dictionary.strings
+                key_columns.append(vector.codes)
+                sorters.append(lambda c, strings=strings: (0, "") if c < 0 else (2, strings[c]))
+            else:
+                key_columns.append(values_of(vector, rel.size))
+                sorters.append(sort_key)
+        if len(key_columns) == 1:
+            return key_columns[0], sorters[0]
+        return list(zip(*key_columns)), lambda key: tuple(s(k) for s, k in zip(sorters, key))
+
+    def _group(self, evaluator: Evaluator, rel: Relation) -> Tuple[Optional[List[int]], List[int]]:
+        """
+        分组，组按键排序（与SQLite的GROUP BY输出顺序一致）
+
+        Returns:
+            (每行的组号, 每组第一行的位置)；没有GROUP BY时组号为None（整体为一组）
+        """
+        if not self.group_by:
+            return None, [0]
+        keys, order = self._group_keys(evaluator, rel)
+        distinct = sorted(set(keys), key=order)
+        index = {key: number for number, key in enumerate(distinct)}
+        group_ids = list(map(index.__getitem__, keys))
+        firsts = [0] * len(distinct)
+        # 倒序写入，每组最终保留第一次出现的位置
+        deque(map(firsts.__setitem__, reversed(group_ids), range(len(group_ids) - 1, -1, -1)), maxlen=0)
+        return group_ids, firsts
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        rel = self.children[0].execute(evaluator)
+        if self.group_by and should_spill(rel.size, evaluator.memory_limit):
+            return self._grace_aggregate(evaluator, rel)
+        group_ids, firsts = self._group(evaluator, rel)
+        extra = {}
+        for node in self.aggregates:
+            extra[id(node)] = self._aggregate(node, evaluator, rel, group_ids, len(firsts))
+        if group_ids is None and rel.size == 0:
+            # 没有GROUP BY且输入为空时返回一行，非聚合列为NULL
+            return Relation({b: [-1] for b in rel.ids}, 1, set(rel.ids), extra)
+        grouped = rel.take(firsts) if group_ids is not None else rel.slice(0, 1)
+        grouped.extra = extra
+        return grouped
+
+    def _grace_aggregate(self, evaluator: Evaluator, rel: Relation) -> Relation:
+        """
+        grace哈希聚合：行按分组键的哈希分区写入临时文件，逐个分区分组聚合，最后按组的键排序
+        """
+        step = chunk_rows(evaluator.memory_limit)
+
+        def keyed_rows() -> Iterator[Tuple[Any, int]]:
+            for start in range(0, rel.size, step):
+                keys, _ = self._group_keys(evaluator, rel.slice(start, start + step))
+                yield from zip(keys, range(start, start + len(keys)))
+
+        groups: List[Tuple[Any, int, List[Any]]] = []
+        order = None
+        with Spill(evaluator.memory_limit) as spill:
+            for part in spill.partition(keyed_rows(), partition_count(rel.size, evaluator.memory_limit)):
+                records = list(part)
+                part.close()
+                if not records:
+                    continue
+                positions = [position for _, position in records]
+                sub = rel.take(positions)
+                group_ids, firsts = self._group(evaluator, sub)
+                if order is None:
+                    order = self._group_keys(evaluator, sub.slice(0, 1))[1]
+                values = [self._aggregate(node, evaluator, sub, group_ids, len(firsts)) for node in self.aggregates]
+                for number, first in enumerate(firsts):
+                    groups.append((order(records[first][0]), positions[first], [v[number] for v in values]))
+            self.spilled = spill.stats()
+        groups.sort(key=lambda group: group[0])
+        grouped = rel.take([position for _, position, _ in groups])
+        grouped.extra = {id(node): [values[i] for _, _, values in groups] for i, node in enumerate(self.aggregates)}
+        return grouped
+
+    @staticmethod
+    def _aggregate(node: Func, evaluator: Evaluator, rel: Relation, group_ids: Optional[List[int]],
+                   group_count: int) -> List[Any]:
+        name = node.name
+        if node.star:
+            if name != "COUNT":
+                raise SqlError(f"{name}(*) 无效")
+            if group_ids is None:
+                return [rel.size]
+            counts = [0] * group_count
+            for g in group_ids:
+                counts[g] += 1
+            return counts
+        if not node.args:
+            raise SqlError(f"聚合函数 {name} 缺少参数")
+        vector = evaluator.eval(node.args[0], rel)
+        separator = ","
+        if name == "GROUP_CONCAT" and len(node.args) > 1:
+            separator_vector = evaluator.eval(node.args[1], rel)
+            if type(separator_vector) is not Const:
+                raise SqlError("GROUP_CONCAT的分隔符必须是常量")
+            separator = to_text(separator_vector.value)
+
+        if type(vector) is CodeVec and name == "COUNT":
+            # 计数只需要编码，不解码文本
+            codes = vector.codes
+            if group_ids is None:
+                if node.distinct:
+                    return [len(set(codes) - {-1})]
+                return [len(codes) - codes.count(-1)]
+            pairs = zip(group_ids, codes)
+            if node.distinct:
+                pairs = set(pairs)
+            counts = [0] * group_count
+            for g, c in pairs:
+                if c >= 0:
+                    counts[g] += 1
+            return counts
+
+        values = values_of(vector, rel.size)
+        if group_ids is None:
+            buckets = [[v for v in values if v is not None]]
+        else:
+            buckets = [[] for _ in range(group_count)]
+            for g, v in zip(group_ids, values):
+                if v is not None:
+                    buckets[g].append(v)
+        if node.distinct:
+            buckets = [list(dict.fromkeys(items)) for items in buckets]
+        return [_reduce(name, items, separator) for items in buckets]
+
+
+def _reduce(name: str, items: List[Any], separator: str) -> Any:
+    if name == "COUNT":
+        return len(items)
+    if name == "GROUP_CONCAT":
+        return separator.join(to_text(v) for v in items) if items else None
+    if name == "MIN":
+        return min(items, key=sort_key) if items else None
+    if name == "MAX":
+        return max(items, key=sort_key) if items else None
+    numbers = [to_number(v) for v in items]
+    if name == "TOTAL":
+        return float(sum(numbers))
+    if not numbers:
+        return None
+    if name == "SUM":
+        total = sum(numbers)
+        return total if all(isinstance(v, int) for v in numbers) else float(total)
+    if name == "AVG":
+        return sum(numbers) / len(numbers)
+    raise SqlError(f"不支持的聚合函数 {name}")
+
+
+class DistinctOp(Operator):
+    name = "Distinct"
+
+    def __init__(self, child: Operator, exprs: List[Node]):
+        super().__init__(child)
+        self.exprs = exprs
+
+    def details(self) -> Dict[str, Any]:
+        return {"columns": [expr_text(n) for n in self.exprs]}
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        rel = self.children[0].execute(evaluator)
+        columns = []
+        for node in self.exprs:
+            vector = evaluator.eval(node, rel)
+            columns.append(vector.codes if type(vector) is CodeVec else values_of(vector, rel.size))
+        seen = set()
+        positions = []
+        for position, key in enumerate(zip(*columns) if columns else [()] * rel.size):
+            if key not in seen:
+                seen.add(key)
+                positions.append(position)
+        return rel.take(positions)
+
+
+class SortOp(Operator):
+    name = "Sort"
+
+    def __init__(self, child: Operator, keys: List[Tuple[Node, bool]]):
+        super().__init__(child)
+        self.keys = keys
+
+    def details(self) -> Dict[str, Any]:
+        return {"keys": [expr_text(n) + (" DESC" if descending else "") for n, descending in self.keys]}
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        rel = self.children[0].execute(evaluator)
+        if rel.size <= 1:
+            return rel
+        if should_spill(rel.size, evaluator.memory_limit):
+            return rel.take(self._external_order(evaluator, rel))
+        order = list(range(rel.size))
+        # 从最后一个排序键开始做稳定排序
+        for node, descending in reversed(self.keys):
+            vector = evaluator.eval(node, rel)
+            if type(vector) is Const:
+                continue
+            if type(vector) is CodeVec:
+                # 只对列中出现的编码按文本排序，再用名次作为排序键
+                ordered = _sorted_codes(vector, set(vector.codes))
+                ranks = dict(zip(ordered, range(len(ordered))))
+                key = list(map(ranks.__getitem__, vector.codes))
+            else:
+                values = values_of(vector, rel.size)
+                if all(v is not None and _is_number(v) for v in values):
+                    key = values
+                else:
+                    key = [sort_key(v) for v in values]
+            order.sort(key=key.__getitem__, reverse=descending)
+        return rel.take(order)
+
+    def _external_order(self, evaluator: Evaluator, rel: Relation) -> List[int]:
+        """
+        外部归并排序：按块计算排序键并排序写入临时文件，再多路归并得到行位置的顺序
+
+        记录为(各排序键..., 行位置)，降序键见descending_key，行位置保证与稳定排序的结果相同
+        """
+        step = chunk_rows(evaluator.memory_limit)
+
+        def chunks() -> Iterator[List[Tuple[Any, ...]]]:
+            for start in range(0, rel.size, step):
+                part = rel.slice(start, start + step)
+                columns = []
+                for node, descending in self.keys:
+                    vector = evaluator.eval(node, part)
+                    if type(vector) is Const:
+                        continue
+                    columns.append(list(map(descending_key if descending else sort_key, values_of(vector, part.size))))
+                columns.append(range(start, start + part.size))
+                yield list(zip(*columns))
+
+        with Spill(evaluator.memory_limit) as spill:
+            order = [record[-1] for record in spill.sort(chunks())]
+            self.spilled = spill.stats()
+        return order
+
+
+class LimitOp(Operator):
+    name = "Limit"
+
+    def __init__(self, child: Operator, limit: Optional[Node], offset: Optional[Node]):
+        super().__init__(child)
+        self.limit = limit
+        self.offset = offset
+
+    def describe(self) -> str:
+        def text(node: Node) -> str:
+            return str(node.value) if isinstance(node, Literal) else "?"
+        return (f"Limit {text(self.limit)}" if self.limit is not None else "Limit") + \
+            (f" Offset {text(self.offset)}" if self.offset is not None else "")
+
+    def details(self) -> Dict[str, Any]:
+        return {"limit": expr_text(self.limit) if self.limit is not None else None,
+                "offset": expr_text(self.offset) if self.offset is not None else None}
+
+    @staticmethod
+    def _integer(evaluator: Evaluator, node: Optional[Node], clause: str) -> Optional[int]:
+        if node is None:
+            return None
+        value = evaluator.constant(node)
+        if not _is_number(value):
+            raise SqlError(f"{clause} 必须是整数常量")
+        return int(value)
+
+    def _execute(self, evaluator: Evaluator) -> Relation:
+        limit = self._integer(evaluator, self.limit, "LIMIT")
+        offset = max(0, self._integer(evaluator, self.offset, "OFFSET") or 0)
+        rel = self.children[0].execute(evaluator)
+        stop = None if limit is None or limit < 0 else offset + limit
+        return rel.slice(offset, stop)
+
+
+# ---------------------------------------------------------------------------
+# 查询计划
+# ---------------------------------------------------------------------------
+
+class Plan:
+    """绑定到具体表的查询计划"""
+
+    def __init__(self, root: Operator, bindings: List[Binding], refs: Dict[int, Any],
+                 outputs: List[Tuple[str, Node]]):
+        self.root = root
+        self.bindings = bindings
+        self.refs = refs
+        self.outputs = outputs
+
+    @property
+    def columns(self) -> List[str]:
+        return [name for name, _ in self.outputs]
+
+    def execute_columns(self, params: Sequence[Any] = ()) -> Tuple[List[str], List[Sequence[Any]], int]:
+        """执行查询，按列返回(列名, 各列的值, 行数)，不构造行字典；params为参数槽位的值"""
+        evaluator = Evaluator(self.bindings, self.refs, params)
+        rel = self.root.execute(evaluator)
+        return self.columns, [values_of(evaluator.eval(node, rel), rel.size) for _, node in self.outputs], rel.size
+
+    def execute_batches(self, params: Sequence[Any] = (),
+                        batch_rows: int = 65536) -> Tuple[List[str], int, Iterator[List[Sequence[Any]]]]:
+        """
+        执行查询，输出列按batch_rows行一批计算，流式写出大结果时只有一批的值在内存中
+
+        Returns:
+            (列名, 行数, 各批的列值迭代器)
+        """
+        evaluator = Evaluator(self.bindings, self.refs, params)
+        rel = self.root.execute(evaluator)
+
+        def batches() -> Iterator[List[Sequence[Any]]]:
+            for start in range(0, rel.size, batch_rows):
+                part = rel.slice(start, start + batch_rows)
+                yield [values_of(evaluator.eval(node, part), part.size) for _, node in self.outputs]
+
+        return self.columns, rel.size, batches()
+
+    def column_types(self) -> List[Optional[str]]:
+        """输出列直接引用表列时为该列声明的类型（第二行），其余为None"""
+        types: List[Optional[str]] = []
+        for _, node in self.outputs:
+            ref = self.refs.get(id(node)) if isinstance(node, ColumnRef) else None
+            if ref is not None and ref[0] != "literal":
+                types.append(self.bindings[ref[0]].table.columns[ref[1]].data_type or None)
+            else:
+                types.append(None)
+        return types
+
+    def execute(self, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        names, columns, _ = self.execute_columns(params)
+        return [dict(zip(names, row)) for row in zip(*columns)] if columns else []
+
+    def explain(self, params: Sequence[Any] = (), analyze: bool = True) -> Dict[str, Any]:
+        """
+        生成执行计划，analyze为True时先执行查询（结果丢弃）并附带各算子的行数、耗时和内存
+
+        计划对象应是新规划的：算子的统计在多次执行间累加
+
+        Returns:
+            {"columns": 输出列, "rows": 结果行数, "executeMs": 执行耗时, "plan": 算子树}
+        """
+        result: Dict[str, Any] = {"columns": self.columns}
+        if analyze:
+            started = time.perf_counter()
+            evaluator = Evaluator(self.bindings, self.refs, params, analyze=True)
+            rel = self.root.execute(evaluator)
+            for _, node in self.outputs:
+                values_of(evaluator.eval(node, rel), rel.size)
+            result["rows"] = rel.size
+            result["executeMs"] = round((time.perf_counter() - started) * 1000, 3)
+        result["plan"] = self.root.explain(analyze)
+        return result
+
+
+def _split_conjuncts(node: Optional[Node]) -> List[Node]:
+    if node is None:
+        return []
+    if isinstance(node, Binary) and node.op == "AND":
+        return _split_conjuncts(node.left) + _split_conjuncts(node.right)
+    return [node]
+
+
+class _Planner:
+    def __init__(self, statement: SelectStatement, resolve_table: Callable[[str], ColumnTable]):
+        self.statement = statement
+        self.resolve_table = resolve_table
+        self.bindings: List[Binding] = []
+        self.refs: Dict[int, Any] = {}
+        self.aliases: Dict[str, Node] = {}
+
+    # 名称解析
+
+    def _find_binding(self, name: str) -> Binding:
+        for binding in self.bindings:
+            if binding.alias == name:
+                return binding
+        lowered = name.lower()
+        for binding in self.bindings:
+            if binding.alias.lower() == lowered or binding.table.name.lower() == lowered:
+                return binding
+        raise SqlError(f"表 '{name}' 未出现在FROM子句中")
+
+    def _resolve_column(self, node: ColumnRef) -> Optional[Tuple[int, int]]:
+        if node.table is not None:
+            binding = self._find_binding(node.table)
+            position = binding.table.column_position(node.name)
+            if position is None:
+                raise SqlError(f"列 '{node.table}.{node.name}' 不存在")
+            return binding.index, position
+        found = None
+        for binding in self.bindings:
+            position = binding.table.column_position(node.name)
+            if position is not None:
+                if found is not None:
+                    raise SqlError(f"列名 '{node.name}' 不明确，请加上表名前缀")
+                found = (binding.index, position)
+        return found
+
+    def bind(self, node: Node, alias_first: bool = False) -> Node:
+        """解析表达式中的列引用，列不存在时尝试SELECT别名；返回可能被别名替换后的表达式"""
+        if isinstance(node, ColumnRef):
+            if alias_first and node.table is None and node.name in self.aliases:
+                return self.aliases[node.name]
+            ref = self._resolve_column(node)
+            if ref is not None:
+                self.refs[id(node)] = ref
+                return node
+            if node.table is None and node.name in self.aliases:
+                return self.aliases[node.name]
+            if node.quoted:
+                self.refs[id(node)] = ("literal", node.name)
+                return node
+            raise SqlError(f"列 '{node.name}' 不存在")
+        for attr in getattr(type(node), "__slots__", ()):
+            value = getattr(node, attr)
+            if isinstance(value, Node):
+                setattr(node, attr, self.bind(value, alias_first))
+            elif isinstance(value, list):
+                setattr(node, attr, [self._bind_item(v, alias_first) for v in value])
+        return node
+
+    def _bind_item(self, value: Any, alias_first: bool) -> Any:
+        if isinstance(value, Node):
+            return self.bind(value, alias_first)
+        if isinstance(value, tuple):
+            return tuple(self.bind(v, alias_first) if isinstance(v, Node) else v for v in value)
+        return value
+
+    def _bindings_of(self, node: Node) -> Set[int]:
+        result = set()
+        for n in walk(node):
+            if isinstance(n, ColumnRef):
+                ref = self.refs.get(id(n))
+                if ref is not None and ref[0] != "literal":
+                    result.add(ref[0])
+        return result
+
+    def _constant(self, node: Optional[Node], clause: str) -> Optional[Node]:
+        """LIMIT/OFFSET只能是常量表达式（可以含参数），取值在执行时计算"""
+        if node is None:
+            return None
+        if isinstance(node, Literal) and not isinstance(node.value, (int, float)) or \
+                any(isinstance(n, (ColumnRef, Star)) or isinstance(n, Func) and n.is_aggregate for n in walk(node)):
+            raise SqlError(f"{clause} 必须是整数常量")
+        return node
+
+    # 规划
+
+    def plan(self) -> Plan:
+        statement = self.statement
+        # 绑定表
+        refs_order = [statement.table] + [j.table for j in statement.joins] if statement.table else []
+        for table_ref in refs_order:
+            table = self.resolve_table(table_ref.name)
+            self.bindings.append(Binding(len(self.bindings), table_ref.alias or table_ref.name, table))
+
+        # 展开SELECT列表
+        outputs: List[Tuple[str, Node]] = []
+        for item in statement.items:
+            if isinstance(item.expr, Star):
+                targets = self.bindings if item.expr.table is None else [self._find_binding(item.expr.table)]
+                if not targets:
+                    raise SqlError("SELECT * 需要FROM子句")
+                for binding in targets:
+                    for position, column in enumerate(binding.table.columns):
+                        ref = ColumnRef(binding.alias, column.name)
+                        self.refs[id(ref)] = (binding.index, position)
+                        outputs.append((column.name, ref))
+                continue
+            expr = self.bind(item.expr)
+            if item.alias:
+                name = item.alias
+            elif isinstance(expr, ColumnRef) and self.refs.get(id(expr), ("literal",))[0] != "literal":
+                name = expr.name
+            else:
+                name = item.text
+            outputs.append((name, expr))
+            if item.alias:
+                self.aliases[item.alias] = expr
+
+        where = [self.bind(c) for c in _split_conjuncts(statement.where)]
+        for conjunct in where:
+            if contains_aggregate(conjunct):
+                raise SqlError("WHERE子句中不能使用聚合函数")
+        join_conditions = [[self.bind(c) for c in _split_conjuncts(j.on)] for j in statement.joins]
+
+        group_by = []
+        for node in statement.group_by:
+            if isinstance(node, Literal) and isinstance(node.value, int) and 1 <= node.value <= len(outputs):
+                group_by.append(outputs[node.value - 1][1])
+            else:
+                group_by.append(self.bind(node))
+        having = self.bind(statement.having) if statement.having is not None else None
+        order_by = []
+        for node, descending in statement.order_by:
+            if isinstance(node, Literal) and isinstance(node.value, int):
+                if not 1 <= node.value <= len(outputs):
+                    raise SqlError(f"ORDER BY 序号 {node.value} 超出范围")
+                order_by.append((outputs[node.value - 1][1], descending))
+            else:
+                order_by.append((self.bind(node, alias_first=True), descending))
+
+        root = self._plan_from(where, join_conditions)
+
+        aggregates: List[Func] = []
+        seen = set()
+        for node in [n for _, n in outputs] + ([having] if having else []) + [n for n, _ in order_by]:
+            for n in walk(node):
+                if isinstance(n, Func) and n.is_aggregate and id(n) not in seen:
+                    if any(contains_aggregate(arg) for arg in n.args):
+                        raise SqlError("聚合函数不能嵌套")
+                    seen.add(id(n))
+                    aggregates.append(n)
+        if aggregates or group_by:
+            root = AggregateOp(root, group_by, aggregates)
+        elif having is not None:
+            raise SqlError("HAVING子句需要GROUP BY或聚合函数")
+        if having is not None:
+            root = FilterOp(root, having)
+        if statement.distinct:
+            root = DistinctOp(root, [n for _, n in outputs])
+        if order_by:
+            root = SortOp(root, order_by)
+        limit = self._constant(statement.limit, "LIMIT")
+        offset = self._constant(statement.offset, "OFFSET")
+        if limit is not None or offset is not None:
+            root = LimitOp(root, limit, offset)
+        return Plan(root, self.bindings, self.refs, outputs)
+
+    def _plan_from(self, where: List[Node], join_conditions: List[List[Node]]) -> Operator:
+        if not self.bindings:
+            root: Operator = SingleRowOp()
+            for conjunct in where:
+                root = FilterOp(root, conjunct)
+            return root
+
+        joins = self.statement.joins
+        # LEFT JOIN右侧的表不能接受WHERE条件下推
+        nullable = {i + 1 for i, j in enumerate(joins) if j.kind == "LEFT"}
+        remaining = []
+        pushed: Dict[int, List[Node]] = {b.index: [] for b in self.bindings}
+        for conjunct in where:
+            used = self._bindings_of(conjunct)
+            if len(used) == 1 and not (used & nullable):
+                pushed[next(iter(used))].append(conjunct)
+            else:
+                remaining.append(conjunct)
+
+        def scan(binding: Binding) -> Operator:
+            conjuncts = pushed[binding.index]
+            op: Operator = ScanOp(binding)
+            for conjunct in conjuncts:
+                index_scan = self._like_index_scan(binding, conjunct)
+                if index_scan is not None:
+                    op = index_scan
+                    conjuncts = [c for c in conjuncts if c is not conjunct]
+                    break
+            for conjunct in conjuncts:
+                op = FilterOp(op, conjunct, pushed=True)
+            return op
+
+        root = scan(self.bindings[0])
+        available = {0}
+        for i, join in enumerate(joins):
+            right = self.bindings[i + 1]
+            conditions = list(join_conditions[i])
+            if join.kind != "LEFT":
+                # 内连接时，引用已连接表与当前表的WHERE条件等价于ON条件
+                movable = [c for c in remaining if self._bindings_of(c) <= available | {right.index}
+                           and right.index in self._bindings_of(c)]
+                remaining = [c for c in remaining if not any(c is m for m in movable)]
+                conditions += movable
+            left_keys, right_keys, residual = [], [], []
+            for condition in conditions:
+                if isinstance(condition, Binary) and condition.op == "=":
+                    left_used = self._bindings_of(condition.left)
+                    right_used = self._bindings_of(condition.right)
+                    if left_used and right_used:
+                        if left_used <= available and right_used == {right.index}:
+                            left_keys.append(condition.left)
+                            right_keys.append(condition.right)
+                            continue
+                        if right_used <= available and left_used == {right.index}:
+                            left_keys.append(condition.right)
+                            right_keys.append(condition.left)
+                            continue
+                if join.kind == "LEFT" and self._bindings_of(condition) == {right.index}:
+                    # 只涉及右表的ON条件可以先过滤右表
+                    pushed[right.index].append(condition)
+                    continue
+                residual.append(condition)
+            root = JoinOp(root, scan(right), "INNER" if join.kind == "CROSS" and conditions else join.kind,
+                          right.index, left_keys, right_keys, residual)
+            available.add(right.index)
+        for conjunct in remaining:
+            root = FilterOp(root, conjunct)
+        return root
+
+
+    def _like_index_scan(self, binding: Binding, conjunct: Node) -> Optional[Operator]:
+        """文本列 LIKE 常量模式（含至少一个字面片段）且表足够大时，改用三元组索引扫描"""
+        if not isinstance(conjunct, Like) or conjunct.negated or binding.table.row_count < TEXT_INDEX_MIN_ROWS:
+            return None
+        if not isinstance(conjunct.expr, ColumnRef) or not isinstance(conjunct.pattern, (Literal, Param)):
+            return None
+        if conjunct.escape is not None and not isinstance(conjunct.escape, (Literal, Param)):
+            return None
+        ref = self.refs.get(id(conjunct.expr))
+        if ref is None or ref[0] != binding.index or type(binding.table.data[ref[1]]) is not DictColumn:
+            return None
+        # 字面量模式在规划时就能判断是否可用索引；参数模式在执行时判断
+        if isinstance(conjunct.pattern, Literal) and (conjunct.escape is None or isinstance(conjunct.escape, Literal)):
+            pattern = conjunct.pattern.value
+            escape = conjunct.escape.value if conjunct.escape is not None else None
+            if not isinstance(pattern, str) or not (escape is None or isinstance(escape, str)) \
+                    or not like_fragments(pattern, escape):
+                return None
+        return LikeIndexScanOp(binding, ref[1], conjunct)
+
+
+def plan_query(statement: SelectStatement, resolve_table: Callable[[str], ColumnTable]) -> Plan:
+    """
+    为语句生成查询计划
+
+    Args:
+        statement: 解析后的SELECT语句
+        resolve_table: 表名 -> 列式表，表不存在时应抛出异常
+    """
+    return _Planner(statement, resolve_table).plan()
+
+
+def execute_query(sql: str, resolve_table: Callable[[str], ColumnTable]) -> List[Dict[str, Any]]:
+    """解析、规划并执行SELECT语句，返回行列表（与ExcelSqlTool的execute_sql结果格式一致）"""
+    statement = parse_sql(sql)
+    if not isinstance(statement, SelectStatement):
+        raise SqlError("execute_query只执行SELECT语句")
+    return plan_query(statement, resolve_table).execute()
+
+
+def _target_rows(table: ColumnTable, table_ref: TableRef, where: Optional[Node], exprs: List[Node],
+                 params: Sequence[Any]) -> Tuple[List[int], List[Sequence[Any]]]:
+    """求出单表语句命中的行号（升序）及各表达式在这些行上的值"""
+    select = SelectStatement(items=[SelectItem(e) for e in exprs], table=table_ref, where=where)
+    plan = plan_query(select, lambda name: table)
+    evaluator = Evaluator(plan.bindings, plan.refs, params)
+    rel = plan.root.execute(evaluator)
+    values = [values_of(evaluator.eval(node, rel), rel.size) for _, node in plan.outputs]
+    return list(rel.ids[0]), values
+
+
+def evaluate_update(statement: UpdateStatement, table: ColumnTable,
+                    params: Sequence[Any] = ()) -> Tuple[List[int], List[Tuple[int, Sequence[Any]]]]:
+    """
+    计算UPDATE语句的效果，不修改表，params为参数槽位的值
+
+    Returns:
+        (命中的行号, [(列位置, 与行号对齐的新值)])
+    """
+    positions = []
+    for name, _ in statement.assignments:
+        position = table.column_position(name)
+        if position is None:
+            raise SqlError(f"列 '{name}' 不存在")
+        positions.append(position)
+    rows, values = _target_rows(table, statement.table, statement.where, [e for _, e in statement.assignments],
+                                params)
+    return rows, list(zip(positions, values))
+
+
+def evaluate_delete(statement: DeleteStatement, table: ColumnTable, params: Sequence[Any] = ()) -> List[int]:
+    """计算DELETE语句命中的行号，不修改表，params为参数槽位的值"""
+    rows, _ = _target_rows(table, statement.table, statement.where, [], params)
+    return rows
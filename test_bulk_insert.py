@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+bulk_insert的回归测试：按列数组或CSV/NDJSON/JSON文件追加行，值按第二行类型转换和校验，
+有失败的行时默认不插入（skip_invalid时跳过这些行），插入后立即保存且新行沿用最后一个数据行的样式
+"""
+
+import json
+import os
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+from bulk_insert import BulkInsertError, converter_for, read_source
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+from xlsx_reader import NS_MAIN, list_workbook_sheets, load_sheet
+
+
+@pytest.fixture
+def engine(cache_dir) -> ExcelEngine:
+    return ExcelEngine(SheetCatalog(cache_dir))
+
+
+def cell_styles(path: str, sheet: str, row: int):
+    """工作表中一行单元格的s属性：{列字母: 样式}"""
+    with zipfile.ZipFile(path) as zf:
+        part = next(info.part for info in list_workbook_sheets(zf) if info.name == sheet)
+        root = ElementTree.fromstring(zf.read(part))
+    for element in root.iter(f"{{{NS_MAIN}}}row"):
+        if element.get("r") == str(row):
+            return {cell.get("r").rstrip("0123456789"): cell.get("s") for cell in element.iter(f"{{{NS_MAIN}}}c")}
+    return None
+
+
+def test_inserts_and_saves_converted_rows(engine, workdir):
+    workbook = os.path.join(workdir, "Language.xlsx")
+    last_styles = cell_styles(workbook, "Language", 72)
+    result = engine.bulk_insert("Language", workdir, {
+        "Id": [1000, "1001", 1002.0],
+        "key": ["Bulk_A", "Bulk_B", "Bulk_C"],
+        "category": [3, "4", None],
+        "DataMap[Enums.ELanguage.English]": ["A", "B", "C"],
+    })
+    assert (result["insertedRows"], result["rejectedRows"], result["totalRows"]) == (3, 0, 72)
+    assert result["saved"]
+
+    assert engine.execute("SELECT Id, key, Category FROM Language WHERE Id >= 1000 ORDER BY Id", workdir) == [
+        {"Id": 1000, "key": "Bulk_A", "Category": "3"}, {"Id": 1001, "key": "Bulk_B", "Category": "4"},
+        {"Id": 1002, "key": "Bulk_C", "Category": None}]
+    rows = load_sheet(workbook, "Language").rows
+    assert len(rows) == 72 and rows[-1][:4] == [1002, "Bulk_C", None, None]
+    # 新行写在最后一行之后，沿用最后一个数据行的样式
+    new_styles = cell_styles(workbook, "Language", 73)
+    assert set(new_styles) >= {"A", "B"}
+    assert all(new_styles[letter] == last_styles.get(letter) for letter in new_styles)
+
+
+def test_invalid_rows_block_the_batch_unless_skipped(engine, workdir):
+    source = {"Id": [2000, "abc", 2 ** 40, 2003], "key": ["a", "b", "c", "d"]}
+    result = engine.bulk_insert("Language", workdir, source)
+    assert (result["insertedRows"], result["rejectedRows"]) == (0, 2)
+    assert result["byColumn"] == {"Id": 2}
+    assert [(error["row"], error["value"]) for error in result["errors"]] == [(2, "abc"), (3, 2 ** 40)]
+    assert engine.execute("SELECT COUNT(*) AS n FROM Language WHERE Id >= 2000", workdir) == [{"n": 0}]
+
+    result = engine.bulk_insert("Language", workdir, source, skip_invalid=True)
+    assert (result["insertedRows"], result["rejectedRows"]) == (2, 2)
+    assert engine.execute("SELECT Id FROM Language WHERE Id >= 2000 ORDER BY Id", workdir) == [
+        {"Id": 2000}, {"Id": 2003}]
+
+
+@pytest.mark.parametrize("name, content", [
+    ("rows.csv", "Id,key,Content\n3000,csv_a,hello\n3001,csv_b,\n"),
+    ("rows.ndjson", '{"Id": 3000, "key": "csv_a", "Content": "hello"}\n\n{"Id": 3001, "key": "csv_b"}\n'),
+    ("rows.json", json.dumps([{"Id": 3000, "key": "csv_a", "Content": "hello"}, {"Id": 3001, "key": "csv_b"}])),
+    ("columns.json", json.dumps({"Id": [3000, 3001], "key": ["csv_a", "csv_b"], "Content": ["hello", None]})),
+])
+def test_file_sources(engine, workdir, tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding="utf-8")
+    assert engine.bulk_insert("Language", workdir, str(path))["insertedRows"] == 2
+    assert engine.execute("SELECT Id, key, Content FROM Language WHERE Id >= 3000 ORDER BY Id", workdir) == [
+        {"Id": 3000, "key": "csv_a", "Content": "hello"}, {"Id": 3001, "key": "csv_b", "Content": None}]
+
+
+def test_source_and_column_errors(engine, workdir, tmp_path):
+    with pytest.raises(BulkInsertError, match="Missing"):
+        engine.bulk_insert("Language", workdir, {"Id": [1], "Missing": [2]})
+    with pytest.raises(BulkInsertError, match="重复"):
+        engine.bulk_insert("Language", workdir, {"Id": [1], "id": [2]})
+    with pytest.raises(BulkInsertError, match="行数不一致"):
+        read_source({"Id": [1, 2], "key": ["a"]})
+    with pytest.raises(BulkInsertError, match="不支持的文件类型"):
+        read_source(str(tmp_path / "rows.txt"))
+    bad = tmp_path / "bad.ndjson"
+    bad.write_text('{"Id": 1}\n[1, 2]\n', encoding="utf-8")
+    with pytest.raises(BulkInsertError, match="第 2 行"):
+        read_source(str(bad))
+
+
+def test_converters_validate_declared_types():
+    assert converter_for("byte")("255") == 255
+    for kind, value in (("byte", 256), ("int", 1.5), ("int", True), ("uint", -1)):
+        with pytest.raises(ValueError):
+            converter_for(kind)(value)
+    assert converter_for("float")("2.5") == 2.5
+    with pytest.raises(ValueError):
+        converter_for("double")("inf")
+    assert [converter_for("bool")(value) for value in ("yes", "0", 1, True)] == [True, False, True, True]
+    with pytest.raises(ValueError):
+        converter_for("bool")("maybe")
+    assert converter_for("int[]")([1, 2, None]) == "1,2,"
+    assert converter_for("Map<string,int>")({"a": 1, "b": 2}) == "a:1,b:2"
+    assert converter_for("string")(3.0) == "3"
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+cell_codecs的回归测试：数组和字典类型按声明类型解码一次，CONTAINS/ELEMENT/ELEMENT_COUNT在解码结果上计算，
+SELECT仍返回单元格的原始文本
+"""
+
+import pytest
+
+import cell_codecs
+from cell_codecs import ArrayCodec, CellCodec, MapCodec, codec_for, decode_column, register_codec
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+
+ITEMS = [
+    ["Id", "Tags", "Weights", "Names", "Label"],
+    ["int", "int[]", "List<float>", "Map<Enums.ELanguage,string>()", "string"],
+    ["编号", "标签", "权重", "名称", "说明"],
+    [1, "1,2,3", "[0.5|1.5]", "Chinese:你好,English:Hello", "a"],
+    [2, "3;4", "2", "English=Bye", "b"],
+    [3, None, "", None, "c"],
+    [4, "7", "x,1", "Chinese", "d"],
+]
+
+
+@pytest.fixture
+def items_dir(make_workbook, tmp_path) -> str:
+    make_workbook("Items.xlsx", {"Items": ITEMS}, directory=str(tmp_path / "items"))
+    return str(tmp_path / "items")
+
+
+def query(directory: str, cache_dir: str, sql: str):
+    return [tuple(row.values()) for row in ExcelEngine(SheetCatalog(cache_dir)).execute(sql, directory)]
+
+
+def test_declared_types_select_codecs():
+    assert isinstance(codec_for("int[]"), ArrayCodec) and codec_for("int[]").element.typecode == "q"
+    assert codec_for("List<string>").element.typecode is None
+    assert isinstance(codec_for("Map<Enums.ELanguage,string>()"), MapCodec)
+    assert codec_for("Dictionary<int, float>").element.typecode == "d"
+    assert codec_for("string") is None and codec_for("Enums.ECategory") is None
+
+
+def test_array_and_map_text_formats():
+    assert codec_for("int[]").decode("[1|2|3]") == [1, 2, 3]
+    assert codec_for("int[]").decode(" 4 ; 5 ") == [4, 5]
+    assert codec_for("int[]").decode("") == []
+    # 无法转换的元素保留原文本
+    assert codec_for("float[]").decode("1.5,x") == [1.5, "x"]
+    assert codec_for("Map<string,int>").decode("a:1,b=2,c") == [("a", 1), ("b", 2), ("c", None)]
+
+
+def test_decoded_column_elements_counts_and_membership():
+    column = decode_column(codec_for("int[]"), ["1,2,3", None, "3,4", "1,2,3"])
+    assert list(column.elements(0)) == [1, 2, 3] and column.elements(1) is None
+    assert [column.count(row) for row in range(4)] == [3, None, 2, 3]
+    assert column.element(2, 1) == 4 and column.element(2, 5) is None and column.element(0, "x") is None
+    assert list(column.rows_containing("3")) == [1, 0, 1, 1]
+    assert list(column.rows_containing("abc")) == [0, 0, 0, 0]
+
+    names = decode_column(codec_for("Map<string,string>"), ["CN:你好,EN:Hello", "EN:Bye"])
+    assert names.element(0, "EN") == "Hello" and names.element(1, "CN") is None
+    assert list(names.rows_containing("EN")) == [1, 1]
+
+
+def test_sql_functions_use_decoded_cells(items_dir, cache_dir):
+    assert query(items_dir, cache_dir, "SELECT Id FROM Items WHERE CONTAINS(Tags, 3) ORDER BY Id") == [(1,), (2,)]
+    assert query(items_dir, cache_dir, "SELECT Id, ELEMENT(Tags, 1), ELEMENT_COUNT(Tags) FROM Items ORDER BY Id") == [
+        (1, 2, 3), (2, 4, 2), (3, None, None), (4, None, 1)]
+    assert query(items_dir, cache_dir, "SELECT Id, ELEMENT(Names, 'English') FROM Items ORDER BY Id") == [
+        (1, "Hello"), (2, "Bye"), (3, None), (4, None)]
+    assert query(items_dir, cache_dir, "SELECT Id FROM Items WHERE CONTAINS(Names, 'Chinese') ORDER BY Id") == [
+        (1,), (4,)]
+    assert query(items_dir, cache_dir, "SELECT ELEMENT(Weights, 0) FROM Items ORDER BY Id") == [
+        (0.5,), (2.0,), (None,), ("x",)]
+
+
+def test_select_returns_the_original_text(items_dir, cache_dir):
+    assert query(items_dir, cache_dir, "SELECT Tags, Weights FROM Items WHERE Id = 1") == [("1,2,3", "[0.5|1.5]")]
+
+
+def test_updates_are_decoded_again(items_dir, cache_dir):
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    engine.execute("UPDATE Items SET Tags = '9,10' WHERE Id = 3", items_dir)
+    assert engine.execute("SELECT Id FROM Items WHERE CONTAINS(Tags, 10)", items_dir) == [{"Id": 3}]
+    engine.commit()
+
+
+def test_registered_codecs_take_precedence(monkeypatch):
+    monkeypatch.setattr(cell_codecs, "_REGISTRY", list(cell_codecs._REGISTRY))
+
+    class PointCodec(CellCodec):
+        def decode(self, text):
+            return [int(part) for part in text.split("x")]
+
+    register_codec(lambda data_type: True if data_type == "Point" else None, lambda data_type, _: PointCodec(data_type))
+    assert isinstance(codec_for("Point"), PointCodec)
+    assert codec_for("Point").decode("3x4") == [3, 4]
+    assert isinstance(codec_for("int[]"), ArrayCodec)
+    codec_for.cache_clear()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+engine_daemon的回归测试：守护进程在套接字上按行处理请求，异常按原类型传回客户端；
+套接字只允许当前用户连接，客户端每个线程使用自己的连接，请求超时和工作进程替换（WorkerDraining）时的行为
+"""
+
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+import pytest
+
+from engine_daemon import EngineClient, EngineDaemon
+from excel_catalog import TableNotFoundError
+from result_format import EncodedResult, encode_result
+from single_flight import SingleFlight
+from sql_engine import SqlError
+
+
+class FakeService:
+    """代替LocalEngineService，不加载任何工作簿：execute按sql返回行，SLEEP n 等待n秒"""
+
+    def __init__(self):
+        self.flights = SingleFlight()
+        self.threads = set()
+
+    def execute(self, sql, directory, fetch_all=False, params=None):
+        self.threads.add(threading.get_ident())
+        if sql.startswith("SLEEP"):
+            time.sleep(float(sql.split()[1]))
+        if sql == "BAD":
+            raise SqlError("语法错误")
+        return [{"sql": sql, "directory": directory, "params": params}]
+
+    def table_schema(self, table_name, directory):
+        raise TableNotFoundError(table_name, ["Language"])
+
+    def encoded(self, method, **params):
+        return EncodedResult(encode_result(getattr(self, method)(**params)))
+
+
+@pytest.fixture
+def daemon():
+    # Unix域套接字路径有长度限制，不放在较深的tmp_path下
+    directory = tempfile.mkdtemp(prefix="engine-test-")
+    server = EngineDaemon(os.path.join(directory, "engine.sock"), FakeService())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join(10)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+def client(daemon):
+    client = EngineClient(daemon.server_address, spawn=False, timeout=10)
+    yield client
+    client.close()
+
+
+def test_socket_is_owner_only(daemon):
+    assert stat.S_IMODE(os.stat(daemon.server_address).st_mode) == 0o600
+
+
+def test_requests_and_errors_round_trip(client, tmp_path):
+    directory = str(tmp_path)
+    assert client.execute("SELECT 1", directory, params=[1]) == [
+        {"sql": "SELECT 1", "directory": directory, "params": [1]}]
+    # 相对路径在客户端解析
+    assert client.execute("SELECT 1", "xlsx")[0]["directory"] == os.path.abspath("xlsx")
+    encoded = client.encoded("execute", sql="SELECT 2", directory=directory)
+    assert isinstance(encoded, EncodedResult)
+    assert encoded.text == encode_result([{"sql": "SELECT 2", "directory": directory, "params": None}])
+
+    with pytest.raises(SqlError, match="语法错误"):
+        client.execute("BAD", directory)
+    with pytest.raises(TableNotFoundError) as error:
+        client.table_schema("Missing", directory)
+    assert error.value.table_name == "Missing" and error.value.available == ["Language"]
+    with pytest.raises(RuntimeError, match="AttributeError"):
+        client.describe(directory)
+    # 出错后连接仍可使用
+    assert client.execute("SELECT 3", directory)[0]["sql"] == "SELECT 3"
+
+
+def test_missing_daemon_is_reported_without_spawning(tmp_path):
+    client = EngineClient(str(tmp_path / "none.sock"), spawn=False)
+    with pytest.raises(ConnectionError):
+        client.execute("SELECT 1", str(tmp_path))
+
+
+def test_each_thread_uses_its_own_connection(daemon, client, tmp_path):
+    slow = threading.Thread(target=client.execute, args=("SLEEP 1", str(tmp_path)))
+    slow.start()
+    deadline = time.monotonic() + 10
+    while daemon.connections < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # 另一个线程的请求不等待正在执行的慢请求
+    started = time.monotonic()
+    client.execute("SELECT 1", str(tmp_path))
+    assert time.monotonic() - started < 0.5
+    assert daemon.connections == 2
+    slow.join(10)
+    assert len(daemon.service.threads) == 2
+
+
+def test_request_timeout_closes_the_connection(daemon, tmp_path):
+    client = EngineClient(daemon.server_address, spawn=False, timeout=0.2)
+    with pytest.raises(TimeoutError):
+        client.execute("SLEEP 1", str(tmp_path))
+    # 迟到的响应不会被下一个请求读到
+    time.sleep(1)
+    assert client.execute("SELECT 1", str(tmp_path))[0]["sql"] == "SELECT 1"
+    client.close()
+
+
+def test_draining_worker_requests_are_resent(daemon, client, tmp_path):
+    daemon.draining = True
+    threading.Timer(0.3, lambda: setattr(daemon, "draining", False)).start()
+    assert client.execute("SELECT 1", str(tmp_path))[0]["sql"] == "SELECT 1"
+    assert daemon.requests == 1
+
+    daemon.draining = True
+    short = EngineClient(daemon.server_address, spawn=False, timeout=0.3)
+    with pytest.raises(TimeoutError, match="没有完成替换"):
+        short.execute("SELECT 1", str(tmp_path))
+    short.close()
+    assert daemon.requests == 1
+
+
+def test_drain_gives_up_while_requests_are_running(daemon, client, tmp_path):
+    slow = threading.Thread(target=client.execute, args=("SLEEP 1", str(tmp_path)))
+    slow.start()
+    deadline = time.monotonic() + 10
+    while not daemon._inflight:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    result = daemon._drain(grace=0, wait=0.1)
+    assert result["drained"] is False and result["inflight"] == 1
+    assert daemon.draining is False
+    slow.join(10)
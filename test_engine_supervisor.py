@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+engine_supervisor的回归测试：监督进程按请求数预热替换工作进程、异常退出后重启，客户端在替换和重启后继续得到正确结果；
+挂起和回收的判断按EXCEL_SQL_REQUEST_TIMEOUT、EXCEL_SQL_WORKER_MAX_REQUESTS和EXCEL_SQL_WORKER_MAX_RSS
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+import engine_supervisor
+from engine_daemon import EngineClient
+from engine_supervisor import Supervisor
+
+DAEMON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine_daemon.py")
+COUNT = "SELECT COUNT(*) AS n FROM Language"
+
+
+def wait_for(predicate, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = predicate()
+            if result:
+                return result
+        except OSError:
+            pass
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.1)
+
+
+@pytest.fixture
+def supervised(cache_dir):
+    """在临时套接字上运行的监督进程（每3个请求替换一次工作进程），返回(监督进程, 客户端)"""
+    directory = tempfile.mkdtemp(prefix="engine-test-")
+    path = os.path.join(directory, "engine.sock")
+    env = dict(os.environ, EXCEL_SQL_CACHE_DIR=cache_dir, EXCEL_SQL_WORKER_MAX_REQUESTS="3",
+               EXCEL_SQL_HEALTH_INTERVAL="0.2")
+    process = subprocess.Popen([sys.executable, DAEMON, "--socket", path, "--supervise", "--idle", "0"],
+                               env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, cwd=os.path.dirname(DAEMON))
+    client = EngineClient(path, spawn=False, timeout=60)
+    try:
+        wait_for(lambda: os.path.exists(path))
+        yield process, client
+    finally:
+        client.close()
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_workers_are_recycled_and_restarted(supervised, workdir):
+    process, client = supervised
+    first = client.stats()["pid"]
+    assert client.execute(COUNT, workdir, fetch_all=True) == [{"n": 69}]
+    client.execute("DELETE FROM Language WHERE Id = 25", workdir)
+
+    # 请求数达到阈值后换成新的工作进程，未保存的修改在替换前保存
+    second = wait_for(lambda: client.stats()["pid"] != first and client.stats()["pid"])
+    assert client.execute(COUNT, workdir, fetch_all=True) == [{"n": 68}]
+
+    # 工作进程异常退出后重启
+    os.kill(second, signal.SIGKILL)
+    wait_for(lambda: client.stats()["pid"] not in (first, second))
+    assert client.execute(COUNT, workdir, fetch_all=True) == [{"n": 68}]
+
+    process.terminate()
+    assert process.wait(30) == 0
+    assert not os.path.exists(client.socket_path)
+
+
+def test_hung_and_recycle_reasons(monkeypatch):
+    monkeypatch.setattr(engine_supervisor, "REQUEST_TIMEOUT", 5.0)
+    assert Supervisor._hung_reason({"oldestRequest": 4.0}) is None
+    assert "execute" in Supervisor._hung_reason({"oldestRequest": 6.0, "oldestMethod": "execute"})
+    monkeypatch.setattr(engine_supervisor, "REQUEST_TIMEOUT", 0.0)
+    assert Supervisor._hung_reason({"oldestRequest": 600.0}) is None
+
+    supervisor = Supervisor("unused.sock")
+    monkeypatch.setattr(engine_supervisor, "MAX_REQUESTS", 0)
+    monkeypatch.setattr(engine_supervisor, "MAX_RSS", 0)
+    assert supervisor._recycle_reason({"requests": 10 ** 6, "rss": 1 << 40}) is None
+    monkeypatch.setattr(engine_supervisor, "MAX_REQUESTS", 100)
+    assert supervisor._recycle_reason({"requests": 99}) is None
+    assert supervisor._recycle_reason({"requests": 100}) == "已处理 100 个请求"
+    monkeypatch.setattr(engine_supervisor, "MAX_RSS", 512 << 20)
+    assert supervisor._recycle_reason({"requests": 0, "rss": 600 << 20}) == "常驻内存 600MB"
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+excel_catalog的回归测试：表名、区域和估计行数只来自workbook.xml和<dimension>，
+目录持久化到缓存目录，新进程只对未变化的工作簿执行stat；别名按table_mapping.json解析
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+import excel_catalog
+from excel_catalog import SheetCatalog, TableNotFoundError
+
+
+def forbid_reading(monkeypatch):
+    def fail(path):
+        raise AssertionError(f"不应重新读取 {path}")
+    monkeypatch.setattr(excel_catalog, "read_workbook_entries", fail)
+
+
+def test_lists_tables_with_dimensions_and_aliases(workdir, cache_dir):
+    catalog = SheetCatalog(cache_dir)
+    assert catalog.table_names(workdir) == ["ActionType", "Config", "Language", "Preload"]
+    described = {info["table"]: info for info in catalog.describe(workdir)}
+    assert described["Language"] == {"table": "Language", "file": "Language.xlsx", "dimension": "A1:G72",
+                                     "rowCount": 69}
+    assert described["Config"]["aliases"] == ["Configuration"]
+    assert catalog.aliases(workdir)["PreloadData"] == "Preload"
+
+
+def test_resolve_exact_case_insensitive_and_alias(workdir, cache_dir):
+    catalog = SheetCatalog(cache_dir)
+    assert catalog.resolve(workdir, "Language").file_name == "Language.xlsx"
+    assert catalog.resolve(workdir, "language").name == "Language"
+    assert catalog.resolve(workdir, "configuration").name == "Config"
+    with pytest.raises(TableNotFoundError) as error:
+        catalog.resolve(workdir, "Missing")
+    assert error.value.available == ["ActionType", "Config", "Language", "Preload"]
+    assert "- Language" in str(error.value)
+
+
+def test_directory_mapping_file_overrides_the_default(workdir, cache_dir):
+    with open(os.path.join(workdir, "table_mapping.json"), "w", encoding="utf-8") as fp:
+        json.dump({"tableMappings": {"Text": "Language", "Gone": "NoSuchSheet"}}, fp)
+    catalog = SheetCatalog(cache_dir)
+    assert catalog.aliases(workdir) == {"Text": "Language"}
+    assert catalog.resolve(workdir, "Text").name == "Language"
+
+
+def test_new_process_reuses_the_persisted_catalog(workdir, cache_dir, monkeypatch):
+    expected = SheetCatalog(cache_dir).describe(workdir)
+    forbid_reading(monkeypatch)
+    assert SheetCatalog(cache_dir).describe(workdir) == expected
+
+
+def test_only_changed_workbooks_are_reread(workdir, cache_dir, monkeypatch):
+    SheetCatalog(cache_dir).entries(workdir)
+    read = []
+    original = excel_catalog.read_workbook_entries
+    monkeypatch.setattr(excel_catalog, "read_workbook_entries", lambda path: read.append(path) or original(path))
+
+    shutil.copy(os.path.join(workdir, "Actions.xlsx"), os.path.join(workdir, "Language.xlsx"))
+    os.remove(os.path.join(workdir, "Build.xlsx"))
+    catalog = SheetCatalog(cache_dir)
+    assert catalog.table_names(workdir) == ["ActionType"]
+    assert [os.path.basename(path) for path in read] == ["Language.xlsx"]
+
+    # 删除的工作簿同时从持久化的目录中移除
+    forbid_reading(monkeypatch)
+    assert [entry.file_name for entry in SheetCatalog(cache_dir).entries(workdir)] == ["Actions.xlsx", "Language.xlsx"]
+
+
+def test_invalidate_rereads_every_workbook(workdir, cache_dir, monkeypatch):
+    catalog = SheetCatalog(cache_dir)
+    catalog.entries(workdir)
+    read = []
+    original = excel_catalog.read_workbook_entries
+    monkeypatch.setattr(excel_catalog, "read_workbook_entries", lambda path: read.append(path) or original(path))
+    catalog.invalidate(workdir)
+    catalog.entries(workdir)
+    assert len(read) == 3
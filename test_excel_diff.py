@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+excel_diff的回归测试：按键列匹配行，报告新增、删除和修改的单元格；
+单元格属性的顺序、样式等属性、行号的变化和其它工具的写法不影响结果
+"""
+
+import os
+import shutil
+
+import pytest
+
+from excel_diff import diff_paths, diff_sheet, diff_workbooks
+
+HEADER = [["Id", "Name", "Level"], ["int", "string", "int"], ["编号", "名称", "等级"]]
+
+
+def sheet(rows, start=1):
+    """XML形式的工作表数据：rows中每行为 [(属性文本, 内容XML或None), ...]，属性文本中的{r}替换为单元格引用"""
+    letters = "ABCDEFG"
+    xml = []
+    for number, row in enumerate(rows, start):
+        cells = []
+        for index, (attributes, inner) in enumerate(row):
+            attributes = attributes.format(r=f"{letters[index]}{number}")
+            cells.append(f"<c {attributes}/>" if inner is None else f"<c {attributes}>{inner}</c>")
+        xml.append(f'<row r="{number}">' + "".join(cells) + "</row>")
+    return "".join(xml)
+
+
+def header():
+    return [[('r="{r}" t="inlineStr"', f"<is><t>{value}</t></is>") for value in row] for row in HEADER]
+
+
+def excel_row(id_, name, level):
+    """Excel的写法：r在最前，样式在类型之前"""
+    return [('r="{r}" s="1"', f"<v>{id_}</v>"), ('r="{r}" s="2" t="inlineStr"', f"<is><t>{name}</t></is>"),
+            ('r="{r}" s="1"', f"<v>{level}</v>")]
+
+
+def other_row(id_, name, level):
+    """其它工具的写法：属性顺序不同，带cm/vm属性和t="n"，单引号"""
+    return [('s="3" t="n" r="{r}"', f"<v>{id_}</v>"), ("t='inlineStr' cm=\"1\" r='{r}'", f"<is><t>{name}</t></is>"),
+            ('vm="1" r="{r}"  s="4"', f"<v>{level}</v>")]
+
+
+def test_identical_copy_has_no_differences(workdir, tmp_path):
+    copy = str(tmp_path / "copy")
+    shutil.copytree(workdir, copy)
+    result = diff_paths(workdir, copy)
+    assert result["workbooks"] == [] and result["filesAdded"] == [] and result["filesRemoved"] == []
+
+
+def test_reports_engine_updates(workdir, tmp_path, cache_dir):
+    from excel_catalog import SheetCatalog
+    from excel_engine import ExcelEngine
+
+    old = str(tmp_path / "Language.xlsx")
+    shutil.copy(os.path.join(workdir, "Language.xlsx"), old)
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    engine.execute("UPDATE Language SET Content = 'new text' WHERE Id = 25", workdir)
+    engine.execute("DELETE FROM Language WHERE Id = 26", workdir)
+    engine.commit()
+
+    diff = diff_sheet(old, os.path.join(workdir, "Language.xlsx"), "Language")
+    assert (diff["added"], diff["removed"], diff["changed"]) == (0, 1, 1)
+    assert diff["removedRows"][0]["key"] == 26
+    assert diff["changedRows"][0]["key"] == 25
+    assert diff["changedRows"][0]["cells"] == {"Content": {"old": None, "new": "new text"}}
+
+
+def test_attribute_order_and_extra_attributes_are_ignored(make_workbook):
+    rows = [(1, "alpha", 10), (2, "beta", 20), (3, "gamma", 30)]
+    old = make_workbook("old.xlsx", {"Items": sheet(header() + [excel_row(*row) for row in rows])})
+    new = make_workbook("new.xlsx", {"Items": sheet(header() + [other_row(*row) for row in rows])})
+    result = diff_workbooks(old, new)
+    assert result["sheets"] == [] and result["unchangedSheets"] == ["Items"]
+
+
+def test_changes_are_decoded_whatever_the_attribute_order(make_workbook):
+    old = make_workbook("old.xlsx", {"Items": sheet(header() + [excel_row(1, "alpha", 10), excel_row(2, "beta", 20)])})
+    new = make_workbook("new.xlsx", {"Items": sheet(header() + [other_row(1, "alpha", 11), other_row(3, "delta", 30)])})
+    diff = diff_sheet(old, new, "Items")
+    assert (diff["added"], diff["removed"], diff["changed"], diff["formatOnly"]) == (1, 1, 1, 0)
+    assert diff["changedRows"][0]["cells"] == {"Level": {"old": 10, "new": 11}}
+    assert diff["addedRows"][0]["values"] == {"Id": 3, "Name": "delta", "Level": 30}
+    assert diff["removedRows"][0]["values"] == {"Id": 2, "Name": "beta", "Level": 20}
+
+
+def test_row_numbers_in_cell_text_are_kept(make_workbook):
+    # 行号只从单元格引用中去掉：内容中与行号相同的文本（如 5" 显示器）不受影响
+    rows = [excel_row(1, 'size 5"', 1), excel_row(2, 'size 6"', 2), excel_row(3, "=A5&quot;", 3)]
+    old = make_workbook("old.xlsx", {"Items": sheet(header() + rows)})
+    new = make_workbook("new.xlsx", {"Items": sheet(header() + [excel_row(9, "inserted", 9)] + rows)})
+    diff = diff_sheet(old, new, "Items")
+    assert (diff["added"], diff["removed"], diff["changed"], diff["formatOnly"]) == (1, 0, 0, 0)
+
+
+def test_moved_rows_are_matched_by_key(make_workbook):
+    # 只有数字和共享字符串的行（整块替换行号的快速路径）
+    names = [f"name{index}" for index in range(30)]
+    rows = [[('r="{r}" s="1"', f"<v>{index}</v>"), ('r="{r}" s="2" t="s"', f"<v>{index}</v>"),
+             ('r="{r}"', f"<v>{index % 7}</v>")] for index in range(1, 30)]
+    old = make_workbook("old.xlsx", {"Items": sheet(header() + rows)}, names)
+    new = make_workbook("new.xlsx", {"Items": sheet(header() + rows[::-1])}, names)
+    diff = diff_sheet(old, new, "Items")
+    assert (diff["added"], diff["removed"], diff["changed"], diff["formatOnly"]) == (0, 0, 0, 0)
+
+
+def test_limit_zero_returns_counts_only(make_workbook):
+    old = make_workbook("old.xlsx", {"Items": sheet(header() + [excel_row(1, "a", 1), excel_row(2, "b", 2)])})
+    new = make_workbook("new.xlsx", {"Items": sheet(header() + [excel_row(1, "a", 5), excel_row(3, "c", 3)])})
+    diff = diff_sheet(old, new, "Items", limit=0)
+    assert (diff["added"], diff["removed"], diff["changed"]) == (1, 1, 1)
+    assert diff["addedRows"] == diff["removedRows"] == diff["changedRows"] == []
+    assert diff["truncated"]
+
+
+def test_negative_limit_is_rejected(workdir):
+    with pytest.raises(ValueError):
+        diff_paths(workdir, workdir, limit=-1)
+
+
+def test_directories_report_added_and_removed_workbooks(workdir, tmp_path):
+    copy = str(tmp_path / "copy")
+    shutil.copytree(workdir, copy)
+    os.remove(os.path.join(copy, "Build.xlsx"))
+    shutil.copy(os.path.join(workdir, "Actions.xlsx"), os.path.join(copy, "Extra.xlsx"))
+    result = diff_paths(workdir, copy)
+    assert result["filesRemoved"] == ["Build.xlsx"] and result["filesAdded"] == ["Extra.xlsx"]
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Python查询引擎的回归测试
+在XLSX目录中工作簿的副本上执行，不修改原文件：
+- 查询结果与把同样数据载入sqlite3后执行的结果一致
+- 进程崩溃后（延迟保存没有执行）新进程按写前日志重放未保存的修改
+- 写回工作簿保留单元格样式和共享字符串表
+- 算子内存上限很小（溢出到临时文件）时结果与默认上限相同
+"""
+
+import glob
+import os
+import sqlite3
+import zipfile
+from typing import Any, Dict, List, Tuple
+from xml.etree import ElementTree
+
+import pytest
+
+import excel_engine
+import spill
+import sql_engine
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+from excel_journal import list_journaled_workbooks
+from xlsx_reader import NS_MAIN, list_workbook_sheets, load_sheet, load_workbook, read_shared_strings
+
+_TAG_C = f"{{{NS_MAIN}}}c"
+_TAG_V = f"{{{NS_MAIN}}}v"
+
+QUERIES = [
+    "SELECT * FROM Language ORDER BY Id",
+    "SELECT Id, key FROM Language WHERE Id > 30 AND Id <= 60 ORDER BY Id DESC",
+    "SELECT Category, COUNT(*) AS n FROM Language GROUP BY Category ORDER BY Category",
+    "SELECT COUNT(*) AS n, MIN(Id) AS lo, MAX(Id) AS hi, SUM(Id) AS total FROM Language",
+    "SELECT key FROM Language WHERE key LIKE 'Trait%' ORDER BY key",
+    "SELECT Id FROM Language WHERE Id IN (25, 26, 999) OR Id BETWEEN 40 AND 42 ORDER BY Id",
+    "SELECT DISTINCT Category FROM ActionType ORDER BY Category",
+    "SELECT a.Id, a.className, l.key FROM ActionType a JOIN Language l ON l.Id = a.Id + 20 ORDER BY a.Id",
+    "SELECT a.Id, l.key FROM ActionType a LEFT JOIN Language l ON l.Id = a.Id + 30 ORDER BY a.Id",
+    "SELECT Id, key FROM Language ORDER BY key LIMIT 5 OFFSET 10",
+    'SELECT Id, "DataMap[Enums.ELanguage.English]" AS en FROM Language '
+    'WHERE "DataMap[Enums.ELanguage.Chinese]" IS NOT NULL ORDER BY Id',
+    "SELECT Id % 7 AS bucket, COUNT(*) AS n, MAX(key) AS last_key FROM Language "
+    "GROUP BY Id % 7 HAVING COUNT(*) > 5 ORDER BY n DESC, bucket",
+    "SELECT Id, CASE WHEN Id % 2 = 0 THEN 'even' ELSE 'odd' END AS parity FROM Language ORDER BY Id",
+    "SELECT id, Platform FROM Config WHERE channel IS NULL ORDER BY id",
+    "SELECT UPPER(key) AS k, LENGTH(key) AS n FROM Language ORDER BY Id LIMIT 10",
+]
+
+
+def new_engine(cache_dir: str) -> ExcelEngine:
+    """使用独立缓存目录的引擎，相当于一个新进程"""
+    return ExcelEngine(SheetCatalog(cache_dir))
+
+
+def rows(engine: ExcelEngine, sql: str, directory: str) -> List[Tuple[Any, ...]]:
+    return [tuple(row.values()) for row in engine.execute(sql, directory)]
+
+
+def load_sqlite(directory: str) -> sqlite3.Connection:
+    """用xlsx_reader（不经过列式表）读取目录中的工作表，载入内存中的sqlite3数据库，值的类型与引擎相同（cell_converter）"""
+    db = sqlite3.connect(":memory:")
+    for path in glob.glob(os.path.join(directory, "*.xlsx")):
+        for table in load_workbook(path):
+            if not table.columns:
+                continue
+            columns = ", ".join(f'"{column.name}"' for column in table.columns)
+            db.execute(f'CREATE TABLE "{table.name}" ({columns})')
+            db.executemany(f'INSERT INTO "{table.name}" VALUES ({", ".join("?" * len(table.columns))})',
+                           table.rows)
+    return db
+
+
+def sheet_part(path: str, sheet: str) -> str:
+    with zipfile.ZipFile(path) as zf:
+        return next(info.part for info in list_workbook_sheets(zf) if info.name == sheet)
+
+
+def sheet_cells(path: str, part: str) -> Dict[str, Tuple[Dict[str, str], Any]]:
+    """单元格引用 -> (属性, <v>的文本)"""
+    with zipfile.ZipFile(path) as zf:
+        root = ElementTree.fromstring(zf.read(part))
+    cells = {}
+    for cell in root.iter(_TAG_C):
+        value = cell.find(_TAG_V)
+        cells[cell.get("r")] = (dict(cell.attrib), value.text if value is not None else None)
+    return cells
+
+
+def shared_strings(path: str) -> List[str]:
+    with zipfile.ZipFile(path) as zf:
+        return read_shared_strings(zf)
+
+
+def read_part(path: str, part: str) -> bytes:
+    with zipfile.ZipFile(path) as zf:
+        return zf.read(part)
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_matches_sqlite(workdir, cache_dir, sql):
+    engine = new_engine(cache_dir)
+    assert rows(engine, sql, workdir) == load_sqlite(workdir).execute(sql).fetchall()
+
+
+def test_matches_sqlite_after_update_and_delete(workdir, cache_dir):
+    engine = new_engine(cache_dir)
+    db = load_sqlite(workdir)
+    for statement in ["UPDATE Language SET Content = key || '!' WHERE Id % 3 = 0",
+                      "DELETE FROM Language WHERE Id BETWEEN 40 AND 45"]:
+        result = engine.execute(statement, workdir)
+        assert result["affectedRows"] == db.execute(statement).rowcount
+    for sql in QUERIES:
+        assert rows(engine, sql, workdir) == db.execute(sql).fetchall(), sql
+    engine.commit()
+
+
+def test_journal_replay_after_crash(workdir, cache_dir, monkeypatch):
+    monkeypatch.setattr(excel_engine, "SAVE_DELAY", 3600.0)
+    monkeypatch.setattr(excel_engine, "SAVE_MAX_DELAY", 3600.0)
+    workbook = os.path.join(workdir, "Language.xlsx")
+    crashed = new_engine(cache_dir)
+    crashed.execute("UPDATE Language SET Content = '崩溃前的修改' WHERE Id = 25", workdir)
+    crashed.execute("DELETE FROM Language WHERE Id = 26", workdir)
+    expected = rows(crashed, "SELECT Id, Content FROM Language ORDER BY Id", workdir)
+    # 进程在延迟保存之前退出：修改只在日志中
+    for timer in list(crashed._timers.values()):
+        timer.cancel()
+    assert os.path.abspath(workbook) in {os.path.abspath(p) for p in list_journaled_workbooks(cache_dir)}
+    assert len(load_sheet(workbook, "Language").rows) == 69
+
+    engine = new_engine(cache_dir)
+    assert rows(engine, "SELECT Id, Content FROM Language ORDER BY Id", workdir) == expected
+    assert engine.recover()["saved"] == ["Language.xlsx"]
+    assert list_journaled_workbooks(cache_dir) == []
+    saved = {row[0]: row for row in load_sheet(workbook, "Language").rows}
+    assert 26 not in saved
+    assert saved[25][6] == "崩溃前的修改"
+    assert rows(new_engine(cache_dir), "SELECT Id, Content FROM Language ORDER BY Id", workdir) == expected
+
+
+def test_write_preserves_styles_and_shared_strings(workdir, cache_dir):
+    workbook = os.path.join(workdir, "Language.xlsx")
+    part = sheet_part(workbook, "Language")
+    cells_before = sheet_cells(workbook, part)
+    strings_before = shared_strings(workbook)
+    styles_before = read_part(workbook, "xl/styles.xml")
+    rows_before = {row[0]: row for row in load_sheet(workbook, "Language").rows}
+    assert "Optimistic!" not in strings_before and "Brave" in strings_before
+
+    engine = new_engine(cache_dir)
+    engine.execute('UPDATE Language SET "DataMap[Enums.ELanguage.English]" = \'Optimistic!\' WHERE Id = 25', workdir)
+    engine.execute('UPDATE Language SET "DataMap[Enums.ELanguage.English]" = \'Brave\' WHERE Id = 26', workdir)
+    assert engine.commit()["saved"] == ["Language.xlsx"]
+
+    cells_after = sheet_cells(workbook, part)
+    strings_after = shared_strings(workbook)
+    assert read_part(workbook, "xl/styles.xml") == styles_before
+    # 已有的共享字符串位置不变，只在末尾追加新文本；已存在的文本复用原来的索引
+    assert strings_after[:len(strings_before)] == strings_before
+    assert strings_after[len(strings_before):] == ["Optimistic!"]
+    changed = {ref for ref in cells_before if cells_before[ref] != cells_after.get(ref)}
+    assert len(changed) == 2
+    for ref in cells_before:
+        assert cells_after[ref][0].get("s") == cells_before[ref][0].get("s"), ref
+    for ref in changed:
+        attributes, value = cells_after[ref]
+        assert attributes.get("t") == "s"
+        assert strings_after[int(value)] in ("Optimistic!", "Brave")
+
+    rows_after = {row[0]: row for row in load_sheet(workbook, "Language").rows}
+    assert rows_after[25][5] == "Optimistic!" and rows_after[26][5] == "Brave"
+    for key in set(rows_before) - {25, 26}:
+        assert rows_after[key] == rows_before[key]
+    assert rows(new_engine(cache_dir), 'SELECT "DataMap[Enums.ELanguage.English]" FROM Language '
+                                       'WHERE Id IN (25, 26) ORDER BY Id', workdir) == [("Optimistic!",), ("Brave",)]
+
+
+def test_tiny_query_memory_matches_default(workdir, cache_dir, tmp_path, monkeypatch):
+    expected = {sql: rows(new_engine(cache_dir), sql, workdir) for sql in QUERIES}
+
+    spills = []
+
+    class CountingSpill(spill.Spill):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            spills.append(self)
+
+    # 相当于EXCEL_SQL_QUERY_MEMORY=1：排序、连接和分组都溢出到临时文件，每个有序段或分区只有几行
+    monkeypatch.setattr(sql_engine, "QUERY_MEMORY", 1)
+    monkeypatch.setattr(spill, "MIN_CHUNK_ROWS", 4)
+    monkeypatch.setattr(sql_engine, "Spill", CountingSpill)
+    engine = new_engine(str(tmp_path / "cache-tiny"))
+    for sql in QUERIES:
+        assert rows(engine, sql, workdir) == expected[sql], sql
+    assert spills
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+excel_export的回归测试：
+- config.xml中Windows风格的相对路径按配置文件所在目录解析
+- JSON和二进制文件的内容与SQL查询结果一致（同一单元格类型相同）
+- 未变化的工作表跳过，修改和删除的工作表重新导出或清理，force和清单版本变化时全量导出
+"""
+
+import json
+import os
+import struct
+from typing import Any, List, Tuple
+
+import pytest
+
+import excel_export
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+from excel_export import BYTES_MAGIC, load_export_config, run_export
+
+CONFIG = """<?xml version="1.0" encoding="utf-8"?>
+<Config>
+  <xlsPath>.\\xlsx</xlsPath>
+  <jsonPath>.\\out\\json</jsonPath>
+  <bytePath>.\\out\\bytes</bytePath>
+</Config>"""
+
+
+@pytest.fixture
+def config_path(workdir, tmp_path) -> str:
+    path = tmp_path / "config.xml"
+    path.write_text(CONFIG, encoding="utf-8")
+    return str(path)
+
+
+def read_json(tmp_path, sheet: str) -> List[dict]:
+    with open(tmp_path / "out" / "json" / f"{sheet}.json", encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def read_bytes(tmp_path, sheet: str) -> Tuple[List[str], List[str], List[List[Any]]]:
+    """按encode_table_bytes的布局解码二进制表文件"""
+    data = (tmp_path / "out" / "bytes" / f"{sheet}.bytes").read_bytes()
+    assert data[:4] == BYTES_MAGIC
+    offset = 4
+
+    def unpack(fmt):
+        nonlocal offset
+        value = struct.unpack_from(fmt, data, offset)[0]
+        offset += struct.calcsize(fmt)
+        return value
+
+    def string():
+        nonlocal offset
+        length = unpack("<I")
+        if length == 0xFFFFFFFF:
+            return None
+        offset += length
+        return data[offset - length:offset].decode("utf-8")
+
+    count = unpack("<H")
+    names, types = [], []
+    for _ in range(count):
+        names.append(string())
+        types.append(string())
+    writers = excel_export.bytes_row_writers(types)
+    rows = []
+    for _ in range(unpack("<I")):
+        rows.append([unpack(fmt) if kind == "num" else bool(unpack(fmt)) if kind == "bool" else string()
+                     for kind, fmt in writers])
+    assert offset == len(data)
+    return names, types, rows
+
+
+def test_config_paths_are_relative_to_the_config_file(config_path, tmp_path):
+    config = load_export_config(config_path)
+    assert config.xls_path == str(tmp_path / "xlsx")
+    assert config.json_path == str(tmp_path / "out" / "json")
+    assert config.byte_path == str(tmp_path / "out" / "bytes")
+
+
+def test_exports_match_query_results(config_path, workdir, cache_dir, tmp_path):
+    summary = run_export(config_path, max_workers=1)
+    assert summary["failed"] == [] and summary["skipped"] == 0
+    assert {item["key"] for item in summary["exported"]} >= {"Language.xlsx/Language", "Build.xlsx/Config"}
+
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    expected = engine.execute("SELECT * FROM Language ORDER BY Id", workdir)
+    assert read_json(tmp_path, "Language") == expected
+    # 枚举列中的数值单元格与查询结果一样是文本
+    assert expected[0]["Category"] == "3"
+
+    names, types, rows = read_bytes(tmp_path, "Language")
+    assert names == list(expected[0]) and types[0] == "int"
+    assert rows == [list(row.values()) for row in expected]
+
+
+def test_second_run_skips_unchanged_sheets(config_path, workdir, cache_dir, tmp_path):
+    first = run_export(config_path, max_workers=1)
+    second = run_export(config_path, max_workers=1)
+    assert second["exported"] == [] and second["skipped"] == len(first["exported"])
+
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    engine.execute("UPDATE Language SET Content = 'exported' WHERE Id = 25", workdir)
+    engine.commit()
+    third = run_export(config_path, max_workers=1)
+    assert [item["key"] for item in third["exported"]] == ["Language.xlsx/Language"]
+    assert next(row for row in read_json(tmp_path, "Language") if row["Id"] == 25)["Content"] == "exported"
+
+    # 导出文件被删除时重新导出
+    os.remove(tmp_path / "out" / "bytes" / "Config.bytes")
+    fourth = run_export(config_path, max_workers=1)
+    assert [item["key"] for item in fourth["exported"]] == ["Build.xlsx/Config"]
+
+
+def test_removed_workbook_outputs_are_cleaned_up(config_path, workdir, tmp_path):
+    run_export(config_path, max_workers=1)
+    os.remove(os.path.join(workdir, "Build.xlsx"))
+    summary = run_export(config_path, max_workers=1)
+    assert sorted(summary["removed"]) == ["Build.xlsx/Config", "Build.xlsx/Preload"]
+    assert not (tmp_path / "out" / "json" / "Config.json").exists()
+    assert not (tmp_path / "out" / "bytes" / "Preload.bytes").exists()
+
+
+def test_force_and_format_version_trigger_a_full_export(config_path, tmp_path, monkeypatch):
+    total = len(run_export(config_path, max_workers=1)["exported"])
+    assert len(run_export(config_path, force=True, max_workers=1)["exported"]) == total
+    monkeypatch.setattr(excel_export, "EXPORT_FORMAT_VERSION", excel_export.EXPORT_FORMAT_VERSION + 1)
+    assert len(run_export(config_path, max_workers=1)["exported"]) == total
+
+
+def test_parallel_export_matches_single_process(config_path, tmp_path):
+    run_export(config_path, max_workers=1)
+    single = {path.name: path.read_bytes() for path in (tmp_path / "out" / "bytes").iterdir()}
+    summary = run_export(config_path, force=True, max_workers=2)
+    assert summary["failed"] == []
+    assert {path.name: path.read_bytes() for path in (tmp_path / "out" / "bytes").iterdir()} == single
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+excel_schema的回归测试：建表语句只读取工作表开头的元数据行，按工作表指纹缓存，
+工作表修改后重新读取；也可以按Excel文件名查询
+"""
+
+from collections import OrderedDict
+
+import pytest
+
+import excel_schema
+from conftest import rows_xml
+from excel_catalog import SheetCatalog, TableNotFoundError
+from excel_engine import ExcelEngine
+from excel_schema import get_table_schema, is_show_tables, parse_show_create_table
+
+
+@pytest.fixture(autouse=True)
+def empty_header_cache(monkeypatch):
+    monkeypatch.setattr(excel_schema, "_header_cache", OrderedDict())
+
+
+def test_create_table_uses_declared_types_and_descriptions(workdir, cache_dir):
+    schema = get_table_schema("Language", workdir, SheetCatalog(cache_dir))
+    assert schema["table"] == "Language"
+    lines = schema["createTable"].splitlines()
+    assert lines[0] == 'CREATE TABLE "Language" ('
+    assert lines[1] == '    "Id" INTEGER, -- 多语言id'
+    assert lines[4] == '    "Category" TEXT, -- 分类'
+    assert lines[-2] == '    "Content" TEXT -- 注释' and lines[-1] == ");"
+
+
+def test_only_header_rows_are_read(make_workbook, tmp_path, cache_dir):
+    # 表头之后的数据不是合法的XML：完整解析会失败，只读取表头时不会读到这里
+    header = rows_xml([["Id", "Name", "Weight"], ["int", "string", "float"], ["编号", "名称", "重量"], [1, "a", 0.5]])
+    make_workbook("Items.xlsx", {"Items": header + '<row r="5"><c r="A5"><v>2</v></c></row><row <<<'},
+                  directory=str(tmp_path / "items"))
+    schema = get_table_schema("Items", str(tmp_path / "items"), SheetCatalog(cache_dir))
+    assert '"Weight" REAL -- 重量' in schema["createTable"]
+
+
+def test_headers_are_cached_by_fingerprint(workdir, cache_dir, monkeypatch):
+    catalog = SheetCatalog(cache_dir)
+    first = get_table_schema("Language", workdir, catalog)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("命中缓存时不应打开工作簿")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(excel_schema.zipfile, "ZipFile", fail)
+        assert get_table_schema("Language", workdir, catalog) == first
+
+    # 工作表修改后指纹变化，重新读取
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    engine.execute("DELETE FROM Language WHERE Id = 25", workdir)
+    engine.commit()
+    catalog.invalidate(workdir)
+    assert get_table_schema("Language", workdir, catalog) == first
+    assert len(excel_schema._header_cache) == 2
+
+
+def test_lookup_by_file_name_and_missing_table(workdir, cache_dir):
+    catalog = SheetCatalog(cache_dir)
+    assert [schema["table"] for schema in get_table_schema("Build", workdir, catalog)] == ["Config", "Preload"]
+    assert get_table_schema("Language.xlsx", workdir, catalog)["table"] == "Language"
+    with pytest.raises(TableNotFoundError):
+        get_table_schema("Missing", workdir, catalog)
+
+
+def test_show_statements_are_recognised():
+    assert is_show_tables(" show tables; ")
+    assert not is_show_tables("SHOW TABLES Language")
+    assert parse_show_create_table('SHOW CREATE TABLE "Language";') == "Language"
+    assert parse_show_create_table("show create table [Config]") == "Config"
+    assert parse_show_create_table("SELECT * FROM Language") is None
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+plan_cache的回归测试：只有字面量或?参数不同的语句复用解析结果和查询计划，
+表发布新版本后重新规划，绑定到旧版本的计划被丢弃
+"""
+
+import pytest
+
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+from plan_cache import PlanCache
+from sql_engine import SqlError
+
+
+@pytest.fixture
+def engine(cache_dir) -> ExcelEngine:
+    return ExcelEngine(SheetCatalog(cache_dir))
+
+
+def bound_tables(engine: ExcelEngine):
+    return [binding.table for prepared in engine.plans._entries.values()
+            for plan in prepared.plans.values() for binding in plan.bindings]
+
+
+def test_literals_and_parameters_share_one_plan(engine, workdir):
+    assert engine.execute("SELECT key FROM Language WHERE Id = 25", workdir) == [{"key": "Trait_Optimist"}]
+    second = engine.execute("SELECT key FROM Language WHERE Id = 26", workdir)
+    third = engine.execute("SELECT key FROM Language WHERE Id = ?", workdir, params=[26])
+    assert second == third and second != [{"key": "Trait_Optimist"}]
+    stats = engine.plans.stats()
+    assert (stats["entries"], stats["misses"], stats["hits"]) == (1, 1, 2)
+    assert (stats["planMisses"], stats["planHits"]) == (1, 2)
+
+
+def test_parameter_count_must_match(engine, workdir):
+    with pytest.raises(SqlError):
+        engine.execute("SELECT key FROM Language WHERE Id = ?", workdir, params=[1, 2])
+    with pytest.raises(SqlError):
+        engine.execute("SELECT key FROM Language WHERE Id = ? OR Id = ?", workdir, params=[1])
+
+
+def test_new_table_version_replans_and_releases_old_plans(engine, workdir):
+    sql = "SELECT COUNT(*) AS n FROM Language WHERE Id >= 25"
+    assert engine.execute(sql, workdir) == [{"n": 69}]
+    [old_table] = bound_tables(engine)
+
+    engine.execute("DELETE FROM Language WHERE Id = 25", workdir)
+    assert all(table is not old_table for table in bound_tables(engine))
+    assert engine.execute(sql, workdir) == [{"n": 68}]
+    assert engine.plans.stats()["planMisses"] == 2
+    engine.commit()
+
+
+def test_capacity_bounds_the_cache():
+    cache = PlanCache(capacity=2)
+    for column in ("Id", "key", "Category"):
+        cache.prepare(f"SELECT {column} FROM Language")
+    assert cache.stats()["entries"] == 2
+    cache.prepare("SELECT Id FROM Language")
+    assert cache.stats()["misses"] == 4
+
+    disabled = PlanCache(capacity=0)
+    disabled.prepare("SELECT Id FROM Language")
+    disabled.prepare("SELECT Id FROM Language")
+    assert disabled.stats()["entries"] == 0 and disabled.stats()["misses"] == 2
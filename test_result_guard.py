@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+result_guard的回归测试：超过行数或字节数上限的SELECT结果只返回前若干行，附带总行数和逐列摘要；
+fetch_all=true时返回完整结果，MCP参数中的fetch_all按严格的布尔值解析
+"""
+
+import pytest
+
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+from mcp_server import parse_flag
+from result_guard import MAX_RESULT_ROWS, bound_result, summarize_column
+
+# 69 x 69 = 4761行，超过默认的1000行上限
+PAIRS = "SELECT a.Id AS a, b.key AS b FROM Language a JOIN Language b ON a.Category = b.Category"
+
+
+def test_summary_counts_nulls_distinct_and_top_values():
+    summary = summarize_column([3, None, "x", 1, 3, None, "abc", 3])
+    assert summary["nulls"] == 2 and summary["distinct"] == 4
+    # 与SQLite一样数值小于文本
+    assert summary["min"] == 1 and summary["max"] == "x"
+    assert summary["top"][0] == {"value": 3, "count": 3}
+    assert summarize_column([None, None]) == {"nulls": 2, "distinct": 0}
+
+
+def test_results_within_limits_are_returned_as_rows():
+    assert bound_result(["a", "b"], [[1, 2], ["x", "y"]], 2) == [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]
+
+
+def test_row_limit_truncates_with_column_summaries():
+    result = bound_result(["n"], [list(range(10))], 10, max_rows=4)
+    assert result["truncated"] and result["totalRows"] == 10 and result["returnedRows"] == 4
+    assert result["rows"] == [{"n": value} for value in range(4)]
+    # 摘要覆盖全部结果，不只是返回的行
+    assert result["columns"]["n"]["max"] == 9 and result["columns"]["n"]["distinct"] == 10
+
+
+def test_byte_limit_truncates_but_keeps_at_least_one_row():
+    text = ["x" * 100] * 5
+    result = bound_result(["t"], [text], 5, max_bytes=250)
+    assert result["returnedRows"] == 2
+    assert bound_result(["t"], [text], 5, max_bytes=10)["returnedRows"] == 1
+
+
+def test_engine_caps_select_unless_fetch_all(workdir, cache_dir):
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    bounded = engine.execute(PAIRS, workdir, fetch_all=False)
+    assert bounded["totalRows"] == 69 * 69 and bounded["returnedRows"] == MAX_RESULT_ROWS
+    assert bounded["columns"]["a"]["distinct"] == 69 and bounded["columns"]["a"]["min"] == 25
+    assert len(engine.execute(PAIRS, workdir, fetch_all=True)) == 69 * 69
+    # 分页的结果在上限内，按行返回
+    page = engine.execute(PAIRS + " ORDER BY a, b LIMIT 10 OFFSET 20", workdir, fetch_all=False)
+    assert isinstance(page, list) and len(page) == 10
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, False), (True, True), (False, False), (1, True), (0, False),
+    ("true", True), (" TRUE ", True), ("1", True), ("false", False), ("False", False), ("0", False), ("", False),
+])
+def test_parse_flag_accepts_explicit_values(value, expected):
+    assert parse_flag(value, "fetch_all") is expected
+
+
+@pytest.mark.parametrize("value", ["yes", "no", "off", 2, -1, 0.5, [], {}])
+def test_parse_flag_rejects_other_values(value):
+    with pytest.raises(ValueError, match="fetch_all"):
+        parse_flag(value, "fetch_all")
+
+
+def test_parse_flag_default():
+    assert parse_flag(None, "analyze", True) is True
+    assert parse_flag("false", "analyze", True) is False
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+single_flight的回归测试：同时到达的相同只读请求只执行一次并共享结果或异常；
+写入语句（包括修改数据的WITH语句）不合并，工作簿或引擎写入次数变化后的请求不与之前的执行合并
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight, normalize_sql, request_key
+
+
+def wait_until(predicate, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.001)
+
+
+def test_sql_is_normalized_ignoring_whitespace_comments_and_semicolons():
+    assert normalize_sql("SELECT  *\n FROM Language -- 注释\n;") == normalize_sql("SELECT * FROM Language")
+    assert normalize_sql("SELECT Id FROM Language") != normalize_sql("SELECT Id FROM Language WHERE Id = 1")
+
+
+@pytest.mark.parametrize("sql", [
+    "UPDATE Language SET Content = 'x'",
+    "DELETE FROM Language",
+    "WITH old AS (SELECT Id FROM Language) DELETE FROM Language WHERE Id IN (SELECT Id FROM old)",
+    "WITH rows AS (SELECT 1 AS Id) INSERT INTO Language SELECT * FROM rows",
+    "WITH x AS (SELECT 1) UPDATE Language SET Content = 'x'",
+    "WITH x AS (SELECT 1) REPLACE INTO Language SELECT * FROM x",
+    "SELECT 'unterminated",
+    "",
+])
+def test_writes_and_unparsable_statements_are_not_coalesced(sql):
+    assert normalize_sql(sql) is None
+    assert request_key("execute", {"sql": sql, "directory": None}) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH t AS (SELECT Id FROM Language) SELECT * FROM t",
+    "SELECT REPLACE(key, 'a', 'b') FROM Language",
+    "SELECT key FROM Language WHERE key = 'DELETE'",
+    "EXPLAIN SELECT * FROM Language",
+])
+def test_read_only_statements_are_coalesced(sql):
+    assert normalize_sql(sql) is not None
+
+
+def test_key_changes_with_files_and_write_generation(workdir):
+    params = {"sql": "SELECT * FROM Language", "directory": workdir}
+    key = request_key("execute", params)
+    assert key == request_key("execute", dict(params, sql="SELECT *\n  FROM Language;"))
+    assert key != request_key("execute", params, generation=1)
+    assert request_key("commit", {"directory": workdir}) is None
+    path = os.path.join(workdir, "Build.xlsx")
+    with open(path, "ab") as fp:
+        fp.write(b"\0")
+    assert key != request_key("execute", params)
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return {"rows": [1]}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do(("execute", "k"), work)))
+    leader.start()
+    assert started.wait(10)
+    followers = [threading.Thread(target=lambda: results.append(flight.do(("execute", "k"), work))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    wait_until(lambda: flight.stats()["coalesced"] == 3)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(10)
+    assert len(calls) == 1 and len(results) == 4 and all(result is results[0] for result in results)
+    assert flight.stats()["methods"]["execute"] == {"executions": 1, "coalesced": 3}
+
+    # 执行结束后不缓存结果
+    flight.do(("execute", "k"), work)
+    assert len(calls) == 2 and flight.stats()["inflight"] == 0
+
+
+def test_errors_are_shared_and_none_key_always_runs():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(10)
+        raise ValueError("失败")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do(("execute", "k"), fail)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    assert started.wait(10)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    wait_until(lambda: flight.stats()["coalesced"] == 1)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+    counter = []
+    flight.do(None, lambda: counter.append(1))
+    flight.do(None, lambda: counter.append(1))
+    assert len(counter) == 2 and flight.stats()["executions"] == 1
+
+
+def test_async_calls_share_one_task():
+    flight = SingleFlight()
+    calls = []
+
+    async def refresh():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async(("refresh", "d"), refresh) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["done"] * 5
+    assert len(calls) == 1 and flight.stats()["methods"]["refresh"] == {"executions": 1, "coalesced": 4}
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+快照隔离的回归测试：查询在开始时固定已发布的表版本，执行期间发布的修改不影响它；
+DML按写时复制只复制被修改的列；后台刷新只重新载入内容变化的表
+"""
+
+import gc
+import time
+
+import pytest
+
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+
+CONTENT = "SELECT Content FROM Language WHERE Id = 25"
+
+
+@pytest.fixture
+def engine(cache_dir) -> ExcelEngine:
+    engine = ExcelEngine(SheetCatalog(cache_dir))
+    yield engine
+    engine.commit()
+
+
+def test_query_reads_the_snapshot_it_started_with(engine, workdir, monkeypatch):
+    assert engine.execute(CONTENT, workdir) == [{"Content": None}]
+    plan = engine.plans.plan
+    writes = []
+
+    def plan_then_write(prepared, directory, resolve_table):
+        # 在查询固定快照并规划之后、执行之前发布一次修改
+        result = plan(prepared, directory, resolve_table)
+        if not writes:
+            writes.append(engine.execute("UPDATE Language SET Content = 'new' WHERE Id = 25", workdir))
+        return result
+
+    monkeypatch.setattr(engine.plans, "plan", plan_then_write)
+    assert engine.execute(CONTENT, workdir) == [{"Content": None}]
+    assert writes[0]["affectedRows"] == 1
+    assert engine.execute(CONTENT, workdir) == [{"Content": "new"}]
+
+
+def test_dml_copies_only_modified_columns(engine, workdir):
+    engine.execute(CONTENT, workdir)
+    old = engine.get_table(workdir, "Language")
+    engine.execute("UPDATE Language SET Content = 'new' WHERE Id = 25", workdir)
+    new = engine.get_table(workdir, "Language")
+    assert new is not old
+    content = [column.name for column in new.columns].index("Content")
+    assert new.data[content] is not old.data[content]
+    assert all(new.data[i] is old.data[i] for i in range(len(new.data)) if i != content)
+    # 旧版本仍是修改前的内容
+    assert not old.changed and new.changed
+
+
+def test_old_snapshots_live_only_while_referenced(engine, workdir):
+    engine.execute(CONTENT, workdir)
+    pinned = engine._snapshot
+    engine.execute("DELETE FROM Language WHERE Id = 26", workdir)
+    stats = engine.stats()["snapshots"]
+    assert stats["version"] > pinned.version and stats["liveVersions"] >= 2
+    assert engine.get_table(workdir, "Language", pinned).row_count == 69
+    assert engine.get_table(workdir, "Language").row_count == 68
+    del pinned
+    gc.collect()
+    assert engine.stats()["snapshots"]["liveVersions"] == 1
+
+
+def test_background_refresh_reloads_only_changed_tables(engine, workdir, tmp_path):
+    engine.execute("SELECT COUNT(*) AS n FROM Language", workdir)
+    engine.execute("SELECT COUNT(*) AS n FROM Config", workdir)
+    config = engine.get_table(workdir, "Config")
+
+    # 另一个进程修改了Language.xlsx
+    other = ExcelEngine(SheetCatalog(str(tmp_path / "other-cache")))
+    other.execute("DELETE FROM Language WHERE Id = 26", workdir)
+    other.commit()
+
+    version = engine.stats()["snapshots"]["version"]
+    engine.catalog.invalidate(workdir)
+    engine.invalidate(workdir)
+    deadline = time.monotonic() + 30
+    while engine.stats()["snapshots"]["refreshing"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert engine.stats()["snapshots"]["version"] == version + 1
+    assert engine._snapshot.tables[(config.file_path, "Config")] is config
+    assert engine.execute("SELECT COUNT(*) AS n FROM Language", workdir) == [{"n": 68}]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+text_lookup的回归测试：按键批量查找各语言文本，语言列为空时从字典类型的列取值，
+多个表按顺序查找；键索引在表未变时复用、只追加行时增量更新、其余修改后重新建立
+"""
+
+import pytest
+
+from excel_catalog import SheetCatalog
+from excel_engine import ExcelEngine
+from text_lookup import TextLookupError, parse_names
+
+EXTRA = [
+    ["Id", "key", "DataMap[Enums.ELanguage.English]"],
+    ["int", "EnumName", "string"],
+    ["编号", "键", "英文"],
+    [1, "Trait_Optimist", "Other optimist"],
+    [2, "UI_Ok", "OK"],
+]
+
+
+@pytest.fixture
+def engine(cache_dir) -> ExcelEngine:
+    return ExcelEngine(SheetCatalog(cache_dir))
+
+
+def test_batched_lookup_returns_all_languages(engine, workdir):
+    result = engine.lookup_text(["Trait_Optimist", "Trait_Brave", "Nope", "Trait_Optimist"], workdir)
+    assert result["languages"] == ["Chinese", "English"]
+    assert result["texts"] == {"Trait_Optimist": {"Chinese": "乐观主义者", "English": "Optimist"},
+                               "Trait_Brave": {"Chinese": "勇敢", "English": "Brave"}}
+    assert (result["found"], result["missing"], result["tables"]) == (2, ["Nope"], ["Language"])
+
+
+def test_language_selection_and_map_fallback(engine, workdir):
+    assert engine.lookup_text(["Trait_Brave"], workdir, languages=["english"])["texts"] == {
+        "Trait_Brave": {"English": "Brave"}}
+    result = engine.lookup_text(["Trait_Brave"], workdir, languages=["DataMap[Enums.ELanguage.Chinese]"])
+    assert result["languages"] == ["Chinese"]
+
+    # 没有语言列的语言从Map<Enums.ELanguage,string>()列中取值
+    engine.execute("UPDATE Language SET DataMap = 'Japanese:勇敢だ,English:Bold' WHERE key = 'Trait_Brave'", workdir)
+    result = engine.lookup_text(["Trait_Brave", "Trait_Coward"], workdir, languages=["Japanese", "English"])
+    assert result["texts"] == {"Trait_Brave": {"Japanese": "勇敢だ", "English": "Brave"},
+                               "Trait_Coward": {"Japanese": None, "English": "Coward"}}
+    engine.commit()
+
+
+def test_tables_are_searched_in_order(engine, workdir, make_workbook):
+    make_workbook("LanguageUI.xlsx", {"LanguageUI": EXTRA}, directory=workdir)
+    engine.catalog.invalidate(workdir)
+    result = engine.lookup_text(["Trait_Optimist", "UI_Ok"], workdir, languages=["English"],
+                                tables=["Language", "LanguageUI"])
+    assert result["texts"] == {"Trait_Optimist": {"English": "Optimist", "table": "Language"},
+                               "UI_Ok": {"English": "OK", "table": "LanguageUI"}}
+    result = engine.lookup_text(["Trait_Optimist"], workdir, languages=["English"], tables=["LanguageUI", "Language"])
+    assert result["texts"]["Trait_Optimist"] == {"English": "Other optimist", "table": "LanguageUI"}
+
+
+def test_lookup_errors(engine, workdir):
+    with pytest.raises(TextLookupError, match="Missing"):
+        engine.lookup_text(["a"], workdir, key_column="Missing")
+    with pytest.raises(TextLookupError, match="没有语言列"):
+        engine.lookup_text(["a"], workdir, tables=["Config"], key_column="mainLogic")
+    assert parse_names('["a", "b"]', "keys") == ["a", "b"]
+    assert parse_names("a, b,,", "keys") == ["a", "b"]
+    assert parse_names("", "keys") is None
+    with pytest.raises(TextLookupError):
+        parse_names("[1,", "keys")
+
+
+def test_key_index_is_reused_extended_and_rebuilt(engine, workdir):
+    def counts():
+        stats = engine.stats()["textLookup"]
+        return stats["builds"], stats["extensions"], stats["reuses"]
+
+    engine.lookup_text(["Trait_Optimist"], workdir)
+    engine.lookup_text(["Trait_Brave"], workdir)
+    assert counts() == (1, 0, 1)
+
+    # 只修改了其他列，键列对象不变
+    engine.execute("UPDATE Language SET Content = 'x' WHERE Id = 25", workdir)
+    engine.lookup_text(["Trait_Optimist"], workdir)
+    assert counts() == (1, 0, 2)
+
+    engine.bulk_insert("Language", workdir, {"Id": [900], "key": ["Bulk_Key"],
+                                             "DataMap[Enums.ELanguage.English]": ["Bulk"]})
+    assert engine.lookup_text(["Bulk_Key"], workdir, languages=["English"])["texts"] == {
+        "Bulk_Key": {"English": "Bulk"}}
+    assert counts() == (1, 1, 2)
+
+    engine.execute("DELETE FROM Language WHERE Id = 26", workdir)
+    result = engine.lookup_text(["Trait_Pessimist", "Bulk_Key"], workdir)
+    assert result["missing"] == ["Trait_Pessimist"] and result["found"] == 1
+    assert counts() == (2, 1, 2)
+    engine.commit()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+文本列的三元组（trigram）索引
+用于加速 LIKE '%...%' 子串查询：索引只建立在字典编码的文本列上，记录每个三元组出现在哪些编码中，
+查询时由模式中的字面片段求出候选编码，再用LIKE匹配函数逐个精确验证，最后映射回行号。
+
+- n-gram按字符（而不是字节）切分，中文等CJK文本与ASCII文本处理方式相同
+- 同时记录二元组，两个字的中文片段也可以使用索引
+- 与SQLite的LIKE一致只对ASCII字母做大小写折叠
+- 索引在首次LIKE查询时按列构建并挂在列式表上；工作簿变化后表按指纹重新加载，旧索引随旧表一起丢弃
+"""
+
+import logging
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+from typing import Callable, List, Optional, Set
+
+from column_store import ColumnTable, DictColumn
+
+logger = logging.getLogger(__name__)
+
+# 行数少于该值的表直接扫描，不建立索引
+TEXT_INDEX_MIN_ROWS = 1000
+
+# 桶数量范围（2的幂），按不同文本数选择，平均每桶约几十到几百个编码
+_MIN_BUCKETS = 1 << 10
+_MAX_BUCKETS = 1 << 18
+
+# 只折叠ASCII字母，与LIKE的大小写规则一致
+_ASCII_LOWER = {c: c + 32 for c in range(ord("A"), ord("Z") + 1)}
+
+_build_lock = threading.Lock()
+
+
+def _bucket_count(distinct: int) -> int:
+    count = _MIN_BUCKETS
+    while count < _MAX_BUCKETS and count * 4 < distinct:
+        count <<= 1
+    return count
+
+
+def fold_case(text: str) -> str:
+    return text.translate(_ASCII_LOWER)
+
+
+def like_fragments(pattern: str, escape: Optional[str] = None) -> List[str]:
+    """提取LIKE模式中必须原样出现的字面片段（以%和_分隔），返回折叠大小写后的非空片段"""
+    fragments = []
+    current = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if escape and ch == escape and i + 1 < len(pattern):
+            current.append(pattern[i + 1])
+            i += 2
+            continue
+        if ch in ("%", "_"):
+            if current:
+                fragments.append("".join(current))
+                current = []
+        else:
+            current.append(ch)
+        i += 1
+    if current:
+        fragments.append("".join(current))
+    return [fold_case(f) for f in fragments]
+
+
+class TrigramIndex:
+    """
+    单个文本列的n-gram索引
+
+    每个不同文本的字符三元组和二元组按哈希分到固定数量的桶中，桶内是升序的编码数组；
+    不为每个n-gram单独建对象，100万条文本的内存与倒排项总数成正比。
+    长度≥3的片段取其所有三元组所在桶的交集，长度为2的片段（常见于中文词）使用二元组桶，
+    单字符片段无法缩小范围，直接验证所有不同文本。哈希冲突只会多出候选，不影响结果。
+    """
+
+    def __init__(self, column: DictColumn):
+        started = time.perf_counter()
+        self.dictionary = column.dictionary
+        codes = column.codes
+        self.column_codes = codes
+        # 按编码排序的行号，用于把匹配的编码映射回行
+        self.order = array("i", sorted(range(len(codes)), key=codes.__getitem__))
+        self.sorted_codes = array("i", (codes[i] for i in self.order))
+        strings = self.dictionary.strings
+        self.codes = array("i", (c for c in sorted(set(codes)) if c >= 0))
+        self.bucket_mask = _bucket_count(len(self.codes)) - 1
+        mask = self.bucket_mask
+        buckets = [array("i") for _ in range(mask + 1)]
+        self.postings = 0
+        for code in self.codes:
+            text = fold_case(strings[code])
+            size = len(text)
+            grams = {hash(text[i:i + 3]) & mask for i in range(size - 2)}
+            grams.update(hash(text[i:i + 2]) & mask for i in range(size - 1))
+            for bucket in grams:
+                buckets[bucket].append(code)
+            self.postings += len(grams)
+        # 编码按升序加入，桶内数组有序
+        self.buckets = buckets
+        self.build_seconds = time.perf_counter() - started
+
+    def _fragment_candidates(self, fragment: str) -> Optional[Set[int]]:
+        if len(fragment) < 2:
+            return None
+        mask = self.bucket_mask
+        width = 3 if len(fragment) >= 3 else 2
+        buckets = {hash(fragment[i:i + width]) & mask for i in range(len(fragment) - width + 1)}
+        postings = sorted((self.buckets[b] for b in buckets), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(posting)
+        return result
+
+    def candidates(self, fragments: List[str]) -> Set[int]:
+        """可能满足所有片段的编码（超集，需要再精确验证）"""
+        result: Optional[Set[int]] = None
+        # 先处理长片段，候选集合通常最小
+        for fragment in sorted(fragments, key=len, reverse=True):
+            found = self._fragment_candidates(fragment)
+            if found is None:
+                continue
+            result = found if result is None else result & found
+            if not result:
+                break
+        return result if result is not None else set(self.codes)
+
+    def matching_rows(self, fragments: List[str], matcher: Callable[[str], bool]) -> List[int]:
+        """返回满足匹配函数的行号（升序）"""
+        strings = self.dictionary.strings
+        matched = sorted(c for c in self.candidates(fragments) if matcher(strings[c]))
+        if len(matched) * 8 > len(self.codes):
+            # 匹配的文本较多时直接按编码集合扫描一遍列，比逐个编码查找行号更快
+            wanted = set(matched)
+            return list(compress(range(len(self.column_codes)), map(wanted.__contains__, self.column_codes)))
+        order = self.order
+        sorted_codes = self.sorted_codes
+        rows: List[int] = []
+        for code in matched:
+            rows.extend(order[bisect_left(sorted_codes, code):bisect_right(sorted_codes, code)])
+        rows.sort()
+        return rows
+
+    def nbytes(self) -> int:
+        """估算索引占用的内存（倒排数组与行号映射）"""
+        size = self.order.itemsize * (len(self.order) + len(self.sorted_codes) + len(self.codes))
+        return size + sum(sys.getsizeof(b) for b in self.buckets)
+
+
+def get_trigram_index(table: ColumnTable, position: int) -> TrigramIndex:
+    """获取（必要时构建）表中某列的三元组索引"""
+    index = table.indexes.get(position)
+    if index is not None:
+        return index
+    with _build_lock:
+        index = table.indexes.get(position)
+        if index is None:
+            index = TrigramIndex(table.data[position])
+            table.indexes[position] = index
+            logger.info(f"建立三元组索引 {table.name}.{table.columns[position].name}: "
+                        f"{len(index.codes)} 个不同文本，{index.postings} 个倒排项，耗时 {index.build_seconds:.2f}s")
+    return index
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+多语言文本的批量按键查找
+excel_lookup_text一次查找多个文本键在各语言下的文本，代替逐个键的excel_query全表扫描：
+
+- 每个Language表的键列上建立键 -> 行号的哈希索引（KeyIndex），文本列按字典编码建立索引，
+  查找时一次字典查询得到编码、再一次得到行号，各语言的文本直接从字典编码的语言列中读取
+- 语言列按列名识别：`DataMap[Enums.ELanguage.Chinese]` 形式的列对应语言Chinese；
+  语言在这些列中为空时再从字典类型的列（如 `Map<Enums.ELanguage,string>()`）中按语言取值
+- 同一个键出现多次时取第一次出现的行，空键不进入索引
+- 表有新版本（UPDATE/DELETE/bulk_insert或工作簿被外部修改后重新加载）时：键列对象未变则直接复用索引，
+  新版本的键列只是在末尾追加了行则只索引追加的行，其余情况重新建立
+"""
+
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from cell_codecs import codec_for
+from column_store import NULL_CODE, ColumnTable
+from xlsx_reader import coerce_value
+
+logger = logging.getLogger(__name__)
+
+# 默认的键列名
+DEFAULT_KEY_COLUMN = "key"
+
+# 列名末尾的 [Enums.ELanguage.Chinese] 或 [Chinese]
+_LANGUAGE_COLUMN = re.compile(r"\[(?:[\w.]*\.)?(\w+)\]\s*$")
+
+
+class TextLookupError(ValueError):
+    """查找参数错误（没有键列、未知的语言等）"""
+
+
+def parse_names(value: Any, name: str) -> Optional[List[str]]:
+    """
+    解析工具调用中的keys/languages/tables参数，兼容被序列化为JSON字符串的数组和逗号分隔的文本
+
+    Raises:
+        TextLookupError: 参数不是数组或文本
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith("["):
+            try:
+                value = json.loads(text)
+            except json.JSONDecodeError:
+                raise TextLookupError(f"{name}必须是JSON数组")
+        else:
+            return [part.strip() for part in text.split(",") if part.strip()]
+    if not isinstance(value, list):
+        raise TextLookupError(f"{name}必须是数组")
+    return [str(item) for item in value if item is not None]
+
+
+class KeyIndex:
+    """
+    单个键列的哈希索引：键（文本列为字典编码）-> 第一次出现的行号
+
+    只会在末尾追加行（extend），已索引行的行号不变；读取旧版本表的查找用行数过滤掉追加的行
+    """
+
+    def __init__(self, column: Any):
+        self.column = column
+        self.encoded = column.encoded
+        self.rows: Dict[Any, int] = {}
+        self.size = 0
+        self.duplicates = 0
+        self.extend(column)
+
+    def extend(self, column: Any) -> int:
+        """索引列中尚未索引的行（调用方已用covers确认前面的行相同），返回新索引的行数；extend后索引属于column"""
+        start = self.size
+        keys = column.codes[start:] if self.encoded else column.data[start:]
+        empty = NULL_CODE if self.encoded else None
+        rows = self.rows
+        before = len(rows)
+        count = 0
+        setdefault = rows.setdefault
+        for row, key in enumerate(keys, start):
+            if key != empty:
+                setdefault(key, row)
+                count += 1
+        self.duplicates += count - (len(rows) - before)
+        self.column = column
+        self.size = len(column)
+        return self.size - start
+
+    def covers(self, column: Any) -> bool:
+        """
+        索引能否用于column：column是已索引的列、在其末尾追加行得到的列（extend后可用），
+        或是已索引的列的前面部分（仍在读取旧版本的查找，按行数过滤）
+        """
+        old = self.column
+        if column is old:
+            return True
+        if column.encoded != self.encoded:
+            return False
+        size = min(len(column), self.size)
+        if self.encoded:
+            return column.dictionary is old.dictionary and column.codes[:size] == old.codes[:size]
+        return column.data[:size] == old.data[:size]
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.rows)
+
+
+def language_columns(table: ColumnTable) -> Dict[str, int]:
+    """按列名识别的语言列：语言名 -> 列位置（同一语言有多列时取第一列）"""
+    languages: Dict[str, int] = {}
+    for position, column in enumerate(table.columns):
+        match = _LANGUAGE_COLUMN.search(column.name)
+        if match:
+            languages.setdefault(match.group(1), position)
+    return languages
+
+
+def _map_columns(table: ColumnTable) -> List[int]:
+    """字典类型（Map<...>）的列位置"""
+    return [position for position, column in enumerate(table.columns)
+            if column.data_type.strip().lower().startswith("map<")]
+
+
+def _resolve_languages(tables: Sequence[ColumnTable], languages: Optional[Sequence[str]]) -> List[str]:
+    """把请求的语言规范为语言列的语言名；没有对应的语言列但表中有字典类型的列时原样保留，从字典中取值"""
+    available: Dict[str, str] = {}
+    for table in tables:
+        for name in language_columns(table):
+            available.setdefault(name.lower(), name)
+    if not languages:
+        if not available:
+            raise TextLookupError(f"表 {', '.join(t.name for t in tables)} 中没有语言列"
+                                  f"（如 DataMap[Enums.ELanguage.Chinese]）")
+        return list(available.values())
+    has_maps = any(_map_columns(table) for table in tables)
+    resolved: List[str] = []
+    for language in languages:
+        text = str(language).strip()
+        match = _LANGUAGE_COLUMN.search(text)
+        if match:
+            text = match.group(1)
+        name = available.get(text.lower())
+        if name is None:
+            if not has_maps or not text:
+                raise TextLookupError(f"未知的语言: {language}；可用的语言: {', '.join(available.values()) or '无'}")
+            name = text
+        if name not in resolved:
+            resolved.append(name)
+    return resolved
+
+
+def _language_readers(table: ColumnTable, languages: Sequence[str]) -> List[Tuple[str, Any]]:
+    """各语言的取值函数（行号 -> 文本）：先读语言列，为空时再按语言从字典类型的列中取值"""
+    columns = {name.lower(): position for name, position in language_columns(table).items()}
+    # 只解码找到的行的单元格，不为少数几个键解码整列
+    maps = [(table.data[position].value, codec_for(table.columns[position].data_type))
+            for position in _map_columns(table)]
+    maps = [(value, codec) for value, codec in maps if codec is not None and codec.is_map]
+    readers = []
+    for name in languages:
+        position = columns.get(name.lower())
+        value = table.data[position].value if position is not None else None
+        if not maps:
+            readers.append((name, value or (lambda row: None)))
+            continue
+
+        keys = [(cell, codec, codec.key.coerce(name)) for cell, codec in maps]
+
+        def read(row: int, value=value, keys=keys) -> Any:
+            text = value(row) if value is not None else None
+            if text is not None:
+                return text
+            for cell, codec, key in keys:
+                raw = cell(row)
+                if raw is None or raw == "":
+                    continue
+                for item, element in codec.decode(str(raw)):
+                    if item == key and element is not None:
+                        return element
+            return None
+
+        readers.append((name, read))
+    return readers
+
+
+def _find(table: ColumnTable, position: int, index: KeyIndex, key: str) -> Optional[int]:
+    """键在表中第一次出现的行号"""
+    if index.encoded:
+        code = table.data[position].dictionary.code_of(key)
+        row = index.rows.get(code) if code is not None else None
+    else:
+        try:
+            row = index.rows.get(coerce_value(key, table.columns[position].data_type))
+        except (TypeError, ValueError):
+            row = None
+    # 索引可能已为更新的表版本追加了行，只取本版本中存在的行
+    return row if row is not None and row < table.row_count else None
+
+
+class TextLookup:
+    """
+    各Language表的键索引缓存，按(工作簿路径, 工作表名)保存最近一个版本的索引
+
+    表版本变化时按KeyIndex.covers判断能否增量更新；表被移出缓存时由引擎调用release丢弃索引
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (工作簿路径, 工作表名, 键列名) -> 索引
+        self._indexes: Dict[Tuple[str, str, str], KeyIndex] = {}
+        self.builds = 0
+        self.extensions = 0
+        self.reuses = 0
+        self.build_seconds = 0.0
+        self.lookups = 0
+        self.keys = 0
+
+    def index(self, table: ColumnTable, position: int) -> KeyIndex:
+        """取得表的键列索引，必要时建立或增量更新"""
+        column = table.data[position]
+        key = (table.file_path, table.name, table.columns[position].name)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and index.column is column:
+                self.reuses += 1
+                return index
+            started = time.perf_counter()
+            if index is not None and index.covers(column):
+                if len(column) <= index.size:
+                    self.reuses += 1
+                    return index
+                added = index.extend(column)
+                self.extensions += 1
+                logger.info(f"增量更新键索引 {table.name}.{table.columns[position].name}: 追加 {added} 行")
+            else:
+                index = self._indexes[key] = KeyIndex(column)
+                self.builds += 1
+                logger.info(f"建立键索引 {table.name}.{table.columns[position].name}: {index.size} 行，"
+                            f"{len(index.rows)} 个键")
+            self.build_seconds += time.perf_counter() - started
+            return index
+
+    def release(self, workbook: str, sheet: str) -> None:
+        """丢弃表的键索引（表被移出缓存或工作表已不存在）"""
+        with self._lock:
+            for key in [key for key in self._indexes if key[0] == workbook and key[1] == sheet]:
+                del self._indexes[key]
+
+    def lookup(self, tables: Sequence[ColumnTable], keys: Sequence[Any], languages: Optional[Sequence[str]] = None,
+               key_column: str = DEFAULT_KEY_COLUMN) -> Dict[str, Any]:
+        """
+        在一个或多个Language表中查找文本键
+
+        Args:
+            tables: 按顺序查找的表，键在前面的表中找到时不再查找后面的表
+            keys: 文本键
+            languages: 语言名（如Chinese、English，忽略大小写，也可以是完整列名），为空时返回所有语言列
+            key_column: 键列名
+
+        Returns:
+            {"languages": 语言, "texts": {键: {语言: 文本}}, "found": 找到的键数, "missing": 未找到的键}；
+            查找多个表时texts中每个键附带所在的table
+
+        Raises:
+            TextLookupError: 表中没有键列，或语言既不是语言列也没有字典类型的列可以取值
+        """
+        sources = []
+        for table in tables:
+            position = table.column_position(key_column)
+            if position is None:
+                raise TextLookupError(f"表 {table.name} 中不存在键列 {key_column}；可用的列: "
+                                      f"{', '.join(table.column_names)}")
+            sources.append((table, position, self.index(table, position)))
+        names = _resolve_languages(tables, languages)
+        plans = [(table, position, index, _language_readers(table, names)) for table, position, index in sources]
+        tag = len(plans) > 1
+        texts: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        keys = [str(key) for key in keys if key is not None]
+        for key in dict.fromkeys(keys):
+            for table, position, index, readers in plans:
+                row = _find(table, position, index, key)
+                if row is None:
+                    continue
+                entry = {name: read(row) for name, read in readers}
+                if tag:
+                    entry["table"] = table.name
+                texts[key] = entry
+                break
+            else:
+                missing.append(key)
+        with self._lock:
+            self.lookups += 1
+            self.keys += len(keys)
+        return {"languages": names, "texts": texts, "found": len(texts), "missing": missing}
+
+    def stats(self) -> Dict[str, Any]:
+        """索引数、键数、估算内存，以及建立/增量更新/复用次数和累计耗时"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+            return {
+                "indexes": len(indexes),
+                "keys": sum(len(index.rows) for index in indexes),
+                "bytes": sum(index.nbytes() for index in indexes),
+                "builds": self.builds,
+                "extensions": self.extensions,
+                "reuses": self.reuses,
+                "buildMs": round(self.build_seconds * 1000, 3),
+                "lookups": self.lookups,
+                "lookupKeys": self.keys,
+            }
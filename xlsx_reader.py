@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+xlsx读取器
+仅依赖标准库（zipfile + xml.etree）的流式xlsx解析，供导出、表结构查询和Python引擎共用。
+
+表格约定与C#端ExcelManager保持一致：
+- 前三行为元数据：字段名、数据类型、描述（字段名行与类型行可以互换，见determine_header_row_index）
+- A列为数字的第一行为数据开始行
+- 名为Struct的工作表不作为数据表
+"""
+
+import hashlib
+import logging
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_TAG_SHEET = f"{{{NS_MAIN}}}sheet"
+_TAG_SHEET_DATA = f"{{{NS_MAIN}}}sheetData"
+_TAG_ROW = f"{{{NS_MAIN}}}row"
+_TAG_C = f"{{{NS_MAIN}}}c"
+_TAG_V = f"{{{NS_MAIN}}}v"
+_TAG_T = f"{{{NS_MAIN}}}t"
+_TAG_IS = f"{{{NS_MAIN}}}is"
+_TAG_SI = f"{{{NS_MAIN}}}si"
+_TAG_RPH = f"{{{NS_MAIN}}}rPh"
+_TAG_RELATIONSHIP = f"{{{NS_PKG_REL}}}Relationship"
+_ATTR_RID = f"{{{NS_REL}}}id"
+
+WORKBOOK_PART = "xl/workbook.xml"
+WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+SHARED_STRINGS_PART = "xl/sharedStrings.xml"
+
+# 不作为数据表的工作表
+SKIPPED_SHEETS = {"Struct"}
+
+# 元数据行数（字段名、类型、描述）
+HEADER_ROWS = 3
+
+
+@dataclass
+class SheetInfo:
+    """工作簿中的工作表条目（来自xl/workbook.xml）"""
+    name: str
+    part: str
+    sheet_id: str = ""
+
+
+@dataclass
+class Column:
+    """列定义"""
+    name: str
+    data_type: str
+    index: int
+    comments: Optional[str] = None
+
+
+@dataclass
+class SheetTable:
+    """解析后的工作表：列定义 + 按列对齐的数据行"""
+    name: str
+    file_path: str
+    columns: List[Column] = field(default_factory=list)
+    rows: List[List[Any]] = field(default_factory=list)
+    fingerprint: str = ""
+
+
+def column_index(cell_ref: str) -> int:
+    """将单元格引用（如"AB12"）的列部分转换为从0开始的列索引"""
+    index = 0
+    for ch in cell_ref:
+        if "A" <= ch <= "Z":
+            index = index * 26 + (ord(ch) - 64)
+        elif "a" <= ch <= "z":
+            index = index * 26 + (ord(ch) - 96)
+        else:
+            break
+    return index - 1
+
+
+def column_letter(index: int) -> str:
+    """将从0开始的列索引转换为列字母"""
+    letters = ""
+    index += 1
+    while index > 0:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _resolve_part(target: str, base_dir: str = "xl") -> str:
+    """将关系文件中的Target解析为zip内的部件路径"""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def list_workbook_sheets(zf: zipfile.ZipFile) -> List[SheetInfo]:
+    """
+    读取xl/workbook.xml和xl/_rels/workbook.xml.rels，列出工作表及其部件路径
+
+    Args:
+        zf: 已打开的xlsx压缩包
+
+    Returns:
+        按工作簿顺序排列的工作表条目
+    """
+    rels = {}
+    try:
+        rels_root = ElementTree.fromstring(zf.read(WORKBOOK_RELS_PART))
+        for rel in rels_root.iter(_TAG_RELATIONSHIP):
+            rels[rel.get("Id")] = _resolve_part(rel.get("Target", ""))
+    except KeyError:
+        logger.warning(f"{zf.filename} 缺少 {WORKBOOK_RELS_PART}")
+
+    sheets = []
+    root = ElementTree.fromstring(zf.read(WORKBOOK_PART))
+    for index, sheet in enumerate(root.iter(_TAG_SHEET), start=1):
+        rid = sheet.get(_ATTR_RID)
+        part = rels.get(rid) or f"xl/worksheets/sheet{index}.xml"
+        sheets.append(SheetInfo(name=sheet.get("name", ""), part=part, sheet_id=sheet.get("sheetId", "")))
+    return sheets
+
+
+def _si_text(si) -> str:
+    """拼接<si>中的文本，忽略拼音注音<rPh>"""
+    parts = []
+    for child in si:
+        if child.tag == _TAG_T:
+            parts.append(child.text or "")
+        elif child.tag != _TAG_RPH:
+            # 富文本<r><t>...</t></r>
+            for t in child.iter(_TAG_T):
+                parts.append(t.text or "")
+    return "".join(parts)
+
+
+def read_shared_strings(zf: zipfile.ZipFile) -> List[str]:
+    """读取共享字符串表，工作簿没有共享字符串时返回空列表"""
+    if SHARED_STRINGS_PART not in zf.NameToInfo:
+        return []
+    strings = []
+    with zf.open(SHARED_STRINGS_PART) as fp:
+        for event, elem in ElementTree.iterparse(fp, events=("end",)):
+            if elem.tag == _TAG_SI:
+                strings.append(_si_text(elem))
+                elem.clear()
+    return strings
+
+
+_SHARED_ITEM = re.compile(rb"<si>(.*?)</si>|<si/>", re.S)
+_SHARED_CELL_INDEX = re.compile(rb'\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+
+def read_shared_string_items(zf: zipfile.ZipFile) -> List[bytes]:
+    """读取共享字符串表中每个<si>的原始XML（不解码），用于按内容比较或计算摘要"""
+    if SHARED_STRINGS_PART not in zf.NameToInfo:
+        return []
+    with zf.open(SHARED_STRINGS_PART) as fp:
+        return _SHARED_ITEM.findall(fp.read())
+
+
+def referenced_shared_strings(zf: zipfile.ZipFile, part: str, chunk_size: int = 1 << 20) -> List[int]:
+    """
+    流式扫描工作表部件，返回其中单元格引用的共享字符串索引（升序、去重）
+
+    只做正则匹配，不解析XML，比加载工作表快一个数量级
+    """
+    indices = set()
+    buffer = b""
+    with zf.open(part) as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            buffer += chunk
+            # 在最后一个完整的单元格之后切分，避免匹配跨越数据块
+            end = len(buffer) if not chunk else buffer.rfind(b"</c>") + len(b"</c>")
+            if end >= len(b"</c>"):
+                indices.update(map(int, _SHARED_CELL_INDEX.findall(buffer, 0, end)))
+                buffer = buffer[end:]
+            if not chunk:
+                break
+    return sorted(indices)
+
+
+class LazySharedStrings:
+    """
+    按需读取的共享字符串表
+
+    只解析到被访问的最大索引为止，用于只需要少量字符串（如表头）的场景，
+    避免为读取几个单元格而解析整个共享字符串部件
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self._strings: List[str] = []
+        self._fp = None
+        self._events = None
+        if SHARED_STRINGS_PART in zf.NameToInfo:
+            self._fp = zf.open(SHARED_STRINGS_PART)
+            self._events = ElementTree.iterparse(self._fp, events=("end",))
+
+    def __getitem__(self, index: int) -> str:
+        while index >= len(self._strings) and self._events is not None:
+            try:
+                event, elem = next(self._events)
+            except StopIteration:
+                self.close()
+                break
+            if elem.tag == _TAG_SI:
+                self._strings.append(_si_text(elem))
+                elem.clear()
+        return self._strings[index]
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+        self._fp = None
+        self._events = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def part_signature(zf: zipfile.ZipFile, part: str) -> str:
+    """从中央目录读取部件的CRC和大小，无需解压"""
+    info = zf.NameToInfo.get(part)
+    if info is None:
+        return f"{part}:-"
+    return f"{part}:{info.CRC:08x}:{info.file_size}"
+
+
+def sheet_fingerprint(zf: zipfile.ZipFile, part: str) -> str:
+    """
+    计算工作表指纹：工作表部件和共享字符串部件的CRC/大小组合后的哈希
+
+    只读取zip中央目录，不解压任何数据，可以在毫秒级完成
+    """
+    signature = part_signature(zf, part) + "|" + part_signature(zf, SHARED_STRINGS_PART)
+    return hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+
+_DIMENSION = re.compile(rb"<(?:\w+:)?dimension\s+ref=\"([A-Za-z0-9:$]+)\"")
+_SHEET_DATA_START = re.compile(rb"<(?:\w+:)?sheetData[\s>/]")
+
+
+def read_sheet_dimension(zf: zipfile.ZipFile, part: str, limit: int = 65536) -> str:
+    """
+    读取工作表的<dimension ref>，只解压部件开头的少量数据
+
+    Returns:
+        形如"A1:G72"的区域引用，工作表没有声明时返回空字符串
+    """
+    head = b""
+    with zf.open(part) as fp:
+        while len(head) < limit:
+            chunk = fp.read(4096)
+            if not chunk:
+                break
+            head += chunk
+            match = _DIMENSION.search(head)
+            if match:
+                return match.group(1).decode("ascii")
+            if _SHEET_DATA_START.search(head):
+                break
+    return ""
+
+
+def dimension_last_row(dimension: str) -> int:
+    """返回区域引用中的最后一行行号（从1开始），无法解析时返回0"""
+    last = dimension.split(":")[-1]
+    digits = "".join(ch for ch in last if ch.isdigit())
+    return int(digits) if digits else 0
+
+
+class SharedStringRef(int):
+    """未解码的共享字符串索引，供需要按索引做字典编码的调用方使用"""
+    __slots__ = ()
+
+
+def _number(text: str) -> Any:
+    """将数值单元格文本转换为int或float"""
+    try:
+        value = float(text)
+    except ValueError:
+        return text
+    if value.is_integer() and "E" not in text and "e" not in text and abs(value) < 2 ** 63:
+        return int(value)
+    return value
+
+
+def _cell_value(cell, shared_strings: Optional[List[str]]) -> Any:
+    """解析单个<c>元素的值，shared_strings为None时共享字符串以SharedStringRef返回"""
+    cell_type = cell.get("t")
+    if cell_type == "inlineStr":
+        inline = cell.find(_TAG_IS)
+        return _si_text(inline) if inline is not None else None
+    v = cell.find(_TAG_V)
+    if v is None or v.text is None:
+        return None
+    text = v.text
+    if cell_type == "s":
+        if shared_strings is None:
+            return SharedStringRef(text)
+        try:
+            return shared_strings[int(text)]
+        except (ValueError, IndexError):
+            return None
+    if cell_type == "b":
+        return text == "1"
+    if cell_type in ("str", "e"):
+        return text
+    return _number(text)
+
+
+def iter_sheet_rows(zf: zipfile.ZipFile, part: str, shared_strings: Optional[List[str]],
+                    max_rows: Optional[int] = None) -> Iterator[Tuple[int, Dict[int, Any]]]:
+    """
+    流式遍历工作表行
+
+    Args:
+        zf: 已打开的xlsx压缩包
+        part: 工作表部件路径（如xl/worksheets/sheet1.xml）
+        shared_strings: 共享字符串表，None表示不解码，以SharedStringRef返回索引
+        max_rows: 只读取前N行（按行号计算），读完即停止解析
+
+    Yields:
+        (从0开始的行索引, {列索引: 值})
+    """
+    next_row = 0
+    sheet_data = None
+    with zf.open(part) as fp:
+        for event, elem in ElementTree.iterparse(fp, events=("start", "end")):
+            if event == "start":
+                if elem.tag == _TAG_SHEET_DATA:
+                    sheet_data = elem
+                continue
+            if elem.tag != _TAG_ROW:
+                continue
+            r = elem.get("r")
+            row_index = int(r) - 1 if r else next_row
+            next_row = row_index + 1
+            if max_rows is not None and row_index >= max_rows:
+                break
+            cells = {}
+            next_col = 0
+            for cell in elem.iter(_TAG_C):
+                ref = cell.get("r")
+                col = column_index(ref) if ref else next_col
+                next_col = col + 1
+                value = _cell_value(cell, shared_strings)
+                if value is not None:
+                    cells[col] = value
+            # 释放已处理的行，保证大表解析时内存恒定
+            elem.clear()
+            if sheet_data is not None:
+                sheet_data.remove(elem)
+            yield row_index, cells
+            if max_rows is not None and next_row >= max_rows:
+                break
+
+
+def is_numeric(value: Any) -> bool:
+    """判断值是否为数字（与ExcelManager.IsNumeric一致）"""
+    if value is None or isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    if isinstance(value, str):
+        try:
+            float(value)
+            return True
+        except ValueError:
+            return False
+    return False
+
+
+def determine_header_row_index(row1: Optional[Dict[int, Any]], row2: Optional[Dict[int, Any]]) -> int:
+    """判断字段名所在行（0或1），规则与ExcelManager.DetermineHeaderRowIndex一致"""
+    if row1 is None and row2 is None:
+        return 0
+    if row1 is None:
+        return 1
+    if row2 is None:
+        return 0
+    a1 = row1.get(0)
+    a2 = row2.get(0)
+    if a1 is None and a2 is None:
+        return 0
+    if a1 is None:
+        return 1
+    if a2 is None:
+        return 0
+    if str(a1).lower() == "int":
+        return 1
+    if str(a2).lower() == "int":
+        return 0
+    a1_numeric = is_numeric(a1)
+    a2_numeric = is_numeric(a2)
+    if a1_numeric and not a2_numeric:
+        return 1
+    return 0
+
+
+def parse_header(head_rows: Dict[int, Dict[int, Any]]) -> Tuple[List[Column], int]:
+    """
+    根据前三行解析列定义
+
+    Args:
+        head_rows: {行索引: {列索引: 值}}，至少包含前三行中存在的行
+
+    Returns:
+        (列定义列表, 字段名行索引)
+    """
+    header_index = determine_header_row_index(head_rows.get(0), head_rows.get(1))
+    type_index = 1 if header_index == 0 else 0
+    header_row = head_rows.get(header_index) or {}
+    type_row = head_rows.get(type_index) or {}
+    # 字段名行与类型行占据前两行，描述固定在第三行
+    comments_row = head_rows.get(HEADER_ROWS - 1) or {}
+
+    columns = []
+    for col in sorted(header_row):
+        name = header_row[col]
+        if name is None or str(name) == "":
+            continue
+        comments = comments_row.get(col)
+        data_type = type_row.get(col)
+        columns.append(Column(
+            name=str(name),
+            data_type=str(data_type) if data_type is not None else "",
+            index=col,
+            comments=str(comments) if comments is not None else None,
+        ))
+    return columns, header_index
+
+
+def read_sheet_header(zf: zipfile.ZipFile, part: str, shared_strings=None) -> List[Column]:
+    """
+    只读取工作表的元数据行并解析列定义，读完即停止解析
+
+    Args:
+        zf: 已打开的xlsx压缩包
+        part: 工作表部件路径
+        shared_strings: 共享字符串表，None时按需读取（只解析到表头引用的最大索引）
+
+    Returns:
+        列定义列表
+    """
+    lazy = None
+    if shared_strings is None:
+        shared_strings = lazy = LazySharedStrings(zf)
+    try:
+        head_rows = dict(iter_sheet_rows(zf, part, shared_strings, max_rows=HEADER_ROWS))
+        columns, _ = parse_header(head_rows)
+        return columns
+    finally:
+        if lazy is not None:
+            lazy.close()
+
+
+_INTEGER_TYPES = ("int", "long", "short", "byte", "uint", "ulong")
+
+# 这些声明类型按数值（布尔）转换和存储，其余类型按文本
+NUMERIC_TYPES = {"int", "long", "short", "byte", "uint", "ulong", "float", "double", "bool", "boolean"}
+
+
+def coerce_value(value: Any, data_type: str) -> Any:
+    """按第二行声明的类型转换单元格值，无法转换时保留原值"""
+    if value is None:
+        return None
+    kind = data_type.lower()
+    try:
+        if kind in _INTEGER_TYPES:
+            if isinstance(value, str):
+                value = value.strip()
+                if value == "":
+                    return None
+            return int(float(value)) if not isinstance(value, int) else value
+        if kind in ("float", "double"):
+            if isinstance(value, str) and value.strip() == "":
+                return None
+            return float(value)
+        if kind in ("bool", "boolean"):
+            if isinstance(value, str):
+                return value.strip().lower() in ("1", "true", "yes")
+            return bool(value)
+    except (TypeError, ValueError):
+        return value
+    if kind in ("string", "#string") and not isinstance(value, str):
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    return value
+
+
+def _to_text(value: Any) -> Any:
+    if value is None or type(value) is str:
+        return value
+    return coerce_value(value, "string")
+
+
+def cell_converter(data_type: str) -> Callable[[Any], Any]:
+    """
+    按列的声明类型得到单元格值的转换函数：数值和布尔类型按coerce_value转换，
+    其余类型（string、枚举、Map等）转换为文本，与SQLite的TEXT亲和一致（如枚举列中的数值单元格3为"3"）。
+    Python引擎的列式表和load_sheet都按此转换，同一单元格在查询结果和导出文件中的类型相同
+    """
+    kind = data_type.lower()
+    if kind not in NUMERIC_TYPES:
+        return _to_text
+    # 已经是目标类型的值（大多数单元格）不再经过coerce_value
+    exact = int if kind in _INTEGER_TYPES else float if kind in ("float", "double") else bool
+
+    def convert(value: Any) -> Any:
+        if value is None or type(value) is exact:
+            return value
+        return coerce_value(value, kind)
+    return convert
+
+
+def _load_sheet_rows(zf: zipfile.ZipFile, info: SheetInfo, shared_strings: List[str], file_path: str) -> SheetTable:
+    """解析单个工作表的表头和数据行"""
+    table = SheetTable(name=info.name, file_path=file_path, fingerprint=sheet_fingerprint(zf, info.part))
+    head_rows: Dict[int, Dict[int, Any]] = {}
+    data_start: Optional[int] = None
+    pending: List[Tuple[int, Dict[int, Any]]] = []
+    last_row = -1
+
+    for row_index, cells in iter_sheet_rows(zf, info.part, shared_strings):
+        last_row = row_index
+        if row_index < HEADER_ROWS:
+            head_rows[row_index] = cells
+        if data_start is None and is_numeric(cells.get(0)):
+            data_start = row_index
+        pending.append((row_index, cells))
+
+    if last_row < HEADER_ROWS:
+        logger.debug(f"工作表 {info.name} 行数不足，跳过")
+        return table
+
+    table.columns, header_index = parse_header(head_rows)
+    if data_start is None:
+        data_start = header_index + 1
+
+    columns = [(column, cell_converter(column.data_type)) for column in table.columns]
+    for row_index, cells in pending:
+        if row_index < data_start:
+            continue
+        table.rows.append([convert(cells.get(c.index)) for c, convert in columns])
+    return table
+
+
+def load_workbook(path: str, sheet_names: Optional[List[str]] = None) -> List[SheetTable]:
+    """
+    加载工作簿中的数据表
+
+    Args:
+        path: xlsx文件路径
+        sheet_names: 只加载这些工作表，None表示全部
+
+    Returns:
+        工作表列表（跳过Struct表）
+    """
+    tables = []
+    with zipfile.ZipFile(path) as zf:
+        sheets = [s for s in list_workbook_sheets(zf) if s.name not in SKIPPED_SHEETS]
+        if sheet_names is not None:
+            wanted = set(sheet_names)
+            sheets = [s for s in sheets if s.name in wanted]
+        if not sheets:
+            return tables
+        shared_strings = read_shared_strings(zf)
+        for info in sheets:
+            tables.append(_load_sheet_rows(zf, info, shared_strings, path))
+    return tables
+
+
+def load_sheet(path: str, sheet_name: str) -> Optional[SheetTable]:
+    """加载工作簿中的单个工作表，不存在时返回None"""
+    tables = load_workbook(path, [sheet_name])
+    return tables[0] if tables else None
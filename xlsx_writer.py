@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+xlsx写回
+把Python引擎中的修改（更新的单元格、删除的行、追加的行）写回工作簿，只改动被修改工作表的<sheetData>：
+
+- 未修改的行原样保留（删除行之后的行只重新编号行号和单元格引用）
+- 更新的单元格保留原有样式（s属性），文本写为共享字符串，共享字符串表中没有的文本追加到表尾
+- 追加的行写在最后一行之后，单元格沿用最后一个数据行中同一列的样式
+- 未修改的zip部件按压缩后的原始字节复制（沿用原CRC），不解压也不重新压缩，
+  保存开销与被修改工作表（及需要追加时的共享字符串表）的大小成正比，与工作簿总大小无关
+- 新工作簿先写入临时文件再重命名，保存失败时原文件不受影响
+"""
+
+import logging
+import re
+from bisect import bisect_left
+import struct
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+from xml.sax.saxutils import escape
+
+from atomic_io import atomic_open
+from xlsx_reader import HEADER_ROWS, SHARED_STRINGS_PART, column_index, column_letter, read_shared_strings
+
+logger = logging.getLogger(__name__)
+
+_ROW = re.compile(r"<row\b[^>]*?/>|<row\b[^>]*>.*?</row>", re.DOTALL)
+_CELL = re.compile(r"<c\b[^>]*?/>|<c\b[^>]*>.*?</c>", re.DOTALL)
+_ROW_NUMBER = re.compile(r'(<row\b[^>]*?\br=")(\d+)(")')
+_CELL_REF = re.compile(r'(<c\b[^>]*?\br=")([A-Z]+)(\d+)(")')
+_STYLE = re.compile(r'\bs="(\d+)"')
+_DIMENSION = re.compile(r'(<dimension\b[^>]*?\bref="[A-Z]+\d+:[A-Z]+)(\d+)(")')
+_SHEET_DATA = re.compile(r"<sheetData\b[^>]*?/>|<sheetData\b[^>]*>(.*)</sheetData>", re.DOTALL)
+_SST_START = re.compile(rb"<sst\b[^>]*>")
+_SST_COUNT = re.compile(rb'(\b(?:count|uniqueCount)=")(\d+)(")')
+# XML 1.0不允许的控制字符
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+@dataclass
+class SheetPatch:
+    """
+    单个工作表的修改
+
+    Attributes:
+        updates: 工作表行索引（从0开始） -> {列索引: 新值}
+        deleted: 删除的工作表行索引
+        appended: 追加行的工作表行索引（删除行之前的编号，大于所有已有行） -> {列索引: 值}
+    """
+    updates: Dict[int, Dict[int, Any]] = field(default_factory=dict)
+    deleted: Set[int] = field(default_factory=set)
+    appended: Dict[int, Dict[int, Any]] = field(default_factory=dict)
+
+
+def format_cell(ref: str, value: Any, style: Optional[str] = None,
+                shared: Optional[Callable[[str], int]] = None) -> str:
+    """
+    生成单元格XML：数值写<v>，布尔写t="b"，None只保留样式；
+    文本在提供shared（文本 -> 共享字符串索引）时写为共享字符串，否则写为内联字符串
+    """
+    attrs = f' r="{ref}"' + (f' s="{style}"' if style is not None else "")
+    if value is None:
+        return f"<c{attrs}/>"
+    if isinstance(value, bool):
+        return f'<c{attrs} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, int):
+        return f"<c{attrs}><v>{value}</v></c>"
+    if isinstance(value, float):
+        text = str(int(value)) if value.is_integer() and abs(value) < 2 ** 53 else repr(value)
+        return f"<c{attrs}><v>{text}</v></c>"
+    text = _INVALID_XML.sub("", str(value))
+    if shared is not None:
+        return f'<c{attrs} t="s"><v>{shared(text)}</v></c>'
+    text = escape(text)
+    return f'<c{attrs} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _patch_row(row_xml: str, row_number: int, updates: Dict[int, Any],
+               shared: Optional[Callable[[str], int]]) -> str:
+    """替换行中的单元格，不存在的单元格按列顺序插入"""
+    if row_xml.endswith("/>"):
+        head, body, tail = row_xml[:-2] + ">", "", "</row>"
+    else:
+        end = row_xml.index(">") + 1
+        head, body, tail = row_xml[:end], row_xml[end:-len("</row>")], "</row>"
+    cells = []
+    for match in _CELL.finditer(body):
+        cell = match.group(0)
+        ref = re.search(r'\br="([A-Z]+)\d+"', cell)
+        cells.append((column_index(ref.group(1)) if ref else len(cells), cell))
+    # 单元格缺少r属性时按位置推断列号
+    existing = {col: i for i, (col, _) in enumerate(cells)}
+    for col, value in sorted(updates.items()):
+        ref = f"{column_letter(col)}{row_number}"
+        position = existing.get(col)
+        if position is not None:
+            style = _STYLE.search(cells[position][1].split(">", 1)[0])
+            cells[position] = (col, format_cell(ref, value, style.group(1) if style else None, shared))
+        else:
+            cells.append((col, format_cell(ref, value, shared=shared)))
+    cells.sort(key=lambda item: item[0])
+    return head + "".join(cell for _, cell in cells) + tail
+
+
+def _renumber_row(row_xml: str, row_number: int) -> str:
+    row_xml = _ROW_NUMBER.sub(lambda m: f"{m.group(1)}{row_number}{m.group(3)}", row_xml, count=1)
+    return _CELL_REF.sub(lambda m: f"{m.group(1)}{m.group(2)}{row_number}{m.group(4)}", row_xml)
+
+
+def _patch_rows_in_place(xml: str, start: int, updates: Dict[int, Dict[int, Any]],
+                         shared: Optional[Callable[[str], int]]) -> Optional[str]:
+    """
+    只有单元格更新时按行号直接定位被修改的行，不逐行扫描整个<sheetData>
+
+    Returns:
+        新的工作表XML；有行找不到（行缺少r属性或整行不存在）时返回None，由调用方逐行处理
+    """
+    spans: List[Tuple[int, int, int]] = []
+    position = start
+    for row_index in sorted(updates):
+        row_number = row_index + 1
+        pattern = re.compile(rf'<row\b[^>]*?\br="{row_number}"[^>]*?(/?)>')
+        # 常见写法r为第一个属性，先用字符串查找定位，避免正则逐个尝试前面的行
+        found = xml.find(f'<row r="{row_number}"', position)
+        match = pattern.match(xml, found) if found >= 0 else pattern.search(xml, position)
+        if match is None:
+            return None
+        position = match.end() if match.group(1) else xml.index("</row>", match.end()) + len("</row>")
+        spans.append((row_index, match.start(), position))
+    parts: List[str] = []
+    last = 0
+    for row_index, row_start, row_end in spans:
+        parts.append(xml[last:row_start])
+        parts.append(_patch_row(xml[row_start:row_end], row_index + 1, updates[row_index], shared))
+        last = row_end
+    parts.append(xml[last:])
+    return "".join(parts)
+
+
+def patch_sheet_xml(xml: str, patch: SheetPatch, shared: Optional[Callable[[str], int]] = None) -> str:
+    """
+    在工作表XML上应用修改
+
+    Args:
+        xml: 原工作表XML
+        patch: 更新的单元格、删除的行和追加的行
+        shared: 文本 -> 共享字符串索引，None时文本写为内联字符串
+
+    Returns:
+        新的工作表XML
+    """
+    if patch.updates or patch.deleted:
+        xml = _patch_existing_rows(xml, patch, shared)
+    if patch.appended:
+        xml = _append_rows(xml, patch.appended, patch.deleted, shared)
+    return xml
+
+
+def _patch_existing_rows(xml: str, patch: SheetPatch, shared: Optional[Callable[[str], int]]) -> str:
+    """更新已有行的单元格并删除行"""
+    sheet_data = _SHEET_DATA.search(xml)
+    if sheet_data is None or sheet_data.group(1) is None:
+        if patch.updates:
+            raise ValueError("工作表没有<sheetData>，无法写入修改")
+        return xml
+    if not patch.deleted:
+        patched = _patch_rows_in_place(xml, sheet_data.start(1), patch.updates, shared)
+        if patched is not None:
+            return patched
+    body = sheet_data.group(1)
+    deleted = patch.deleted
+    parts: List[str] = []
+    removed = 0
+    next_index = 0
+    last = 0
+    for match in _ROW.finditer(body):
+        parts.append(body[last:match.start()])
+        last = match.end()
+        row_xml = match.group(0)
+        number = _ROW_NUMBER.search(row_xml)
+        row_index = int(number.group(2)) - 1 if number else next_index
+        next_index = row_index + 1
+        if row_index in deleted:
+            removed += 1
+            continue
+        row_number = row_index + 1 - removed
+        updates = patch.updates.get(row_index)
+        if removed:
+            row_xml = _renumber_row(row_xml, row_number)
+        if updates:
+            row_xml = _patch_row(row_xml, row_number, updates, shared)
+        parts.append(row_xml)
+    parts.append(body[last:])
+    start, end = sheet_data.span(1)
+    xml = xml[:start] + "".join(parts) + xml[end:]
+    if removed:
+        xml = _DIMENSION.sub(lambda m: f"{m.group(1)}{max(1, int(m.group(2)) - removed)}{m.group(3)}", xml, count=1)
+    return xml
+
+
+def _append_rows(xml: str, appended: Dict[int, Dict[int, Any]], deleted: Set[int],
+                 shared: Optional[Callable[[str], int]]) -> str:
+    """
+    在<sheetData>末尾追加行，行号与ColumnTable.mark_saved重新编号后的行索引一致
+
+    Raises:
+        ValueError: 工作表没有<sheetData>，或追加的行与已有行重叠
+    """
+    sheet_data = _SHEET_DATA.search(xml)
+    if sheet_data is None:
+        raise ValueError("工作表没有<sheetData>，无法追加行")
+    body = sheet_data.group(1) or ""
+    last_number = 0
+    styles: Dict[int, str] = {}
+    start = body.rfind("<row")
+    last_row = _ROW.match(body, start) if start >= 0 else None
+    if last_row is not None:
+        number = _ROW_NUMBER.search(last_row.group(0))
+        last_number = int(number.group(2)) if number else len(_ROW.findall(body))
+        # 表头行的样式（加粗、底色等）不用于数据行
+        if last_number > HEADER_ROWS:
+            for match in _CELL.finditer(last_row.group(0)):
+                head = match.group(0).split(">", 1)[0]
+                ref = re.search(r'\br="([A-Z]+)\d+"', head)
+                style = _STYLE.search(head)
+                if ref and style:
+                    styles[column_index(ref.group(1))] = style.group(1)
+    ordered = sorted(deleted)
+    letters: Dict[int, str] = {}
+    rows: List[str] = []
+    for row_index in sorted(appended):
+        row_number = row_index + 1 - bisect_left(ordered, row_index)
+        if row_number <= last_number:
+            raise ValueError(f"追加的第 {row_number} 行与工作表中已有的行重叠")
+        cells = []
+        for col, value in sorted(appended[row_index].items()):
+            if value is None:
+                continue
+            letter = letters.get(col)
+            if letter is None:
+                letter = letters[col] = column_letter(col)
+            cells.append(format_cell(f"{letter}{row_number}", value, styles.get(col), shared))
+        rows.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+        last_number = row_number
+    if sheet_data.group(1) is None:
+        xml = xml[:sheet_data.start()] + "<sheetData>" + "".join(rows) + "</sheetData>" + xml[sheet_data.end():]
+    else:
+        end = sheet_data.end(1)
+        xml = xml[:end] + "".join(rows) + xml[end:]
+    return _DIMENSION.sub(lambda m: f"{m.group(1)}{max(int(m.group(2)), last_number)}{m.group(3)}", xml, count=1)
+
+
+class _SharedStrings:
+    """
+    保存过程中的共享字符串分配：已有文本返回原索引，新文本追加到表尾
+
+    lookup由调用方提供（例如与磁盘上共享字符串表对齐的引擎字典），未提供时读取工作簿的共享字符串表
+    """
+
+    def __init__(self, source: zipfile.ZipFile, lookup: Optional[Callable[[str], Optional[int]]]):
+        if lookup is None:
+            index: Dict[str, int] = {}
+            for i, text in enumerate(read_shared_strings(source)):
+                index.setdefault(text, i)
+            lookup = index.get
+        self.lookup = lookup
+        self.unique_count = _shared_strings_count(source)
+        self.appended: Dict[str, int] = {}
+        self.references = 0
+
+    def __call__(self, text: str) -> int:
+        self.references += 1
+        position = self.lookup(text)
+        if position is None:
+            position = self.appended.get(text)
+            if position is None:
+                position = self.appended[text] = self.unique_count + len(self.appended)
+        return position
+
+    def patch(self, xml: bytes) -> bytes:
+        """在共享字符串表末尾追加新文本，并更新count/uniqueCount"""
+        end = xml.rindex(b"</sst>")
+        items = "".join(f'<si><t xml:space="preserve">{escape(text)}</t></si>' for text in self.appended)
+        start = _SST_START.search(xml)
+        added = {b"count": self.references, b"uniqueCount": len(self.appended)}
+        head = _SST_COUNT.sub(lambda m: m.group(1) + str(int(m.group(2)) + added[m.group(1)[:-2].strip()]).encode()
+                              + m.group(3), start.group(0))
+        return xml[:start.start()] + head + xml[start.end():end] + items.encode("utf-8") + xml[end:]
+
+
+def _shared_strings_count(source: zipfile.ZipFile) -> int:
+    """共享字符串表的条目数：优先读取开头的uniqueCount属性，缺失时统计<si>起始标签"""
+    with source.open(SHARED_STRINGS_PART) as fp:
+        head = fp.read(4096)
+    start = _SST_START.search(head)
+    unique = re.search(rb'\buniqueCount="(\d+)"', start.group(0)) if start else None
+    if unique:
+        return int(unique.group(1))
+    data = source.read(SHARED_STRINGS_PART)
+    return len(re.findall(rb"<si[\s>/]", data))
+
+
+class _RawZipWriter:
+    """
+    按顺序写出zip：未修改的条目直接复制压缩后的字节，修改的条目重新压缩
+
+    只支持非ZIP64的工作簿（单个部件和整个文件都小于4GB）
+    """
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        # (原条目, 本地文件头偏移, 标志位, 压缩方式, CRC, 压缩后大小, 原始大小, 修改时间)
+        self.entries: List[Tuple[zipfile.ZipInfo, int, int, int, int, int, int, Tuple[int, ...]]] = []
+
+    def _write_local_header(self, info: zipfile.ZipInfo, name: bytes, flags: int, method: int,
+                            crc: int, compress_size: int, file_size: int, date_time: Tuple[int, ...]) -> None:
+        if max(compress_size, file_size, self.fp.tell()) >= 0xFFFFFFFF:
+            raise ValueError(f"部件 {info.filename} 超过4GB，不支持写回")
+        dos_time, dos_date = _dos_date_time(date_time)
+        self.entries.append((info, self.fp.tell(), flags, method, crc, compress_size, file_size, date_time))
+        self.fp.write(struct.pack("<4s5H3L2H", b"PK\x03\x04", 20, flags, method, dos_time, dos_date,
+                                  crc, compress_size, file_size, len(name), 0))
+        self.fp.write(name)
+
+    def copy(self, source: BinaryIO, info: zipfile.ZipInfo) -> None:
+        """复制压缩后的原始字节，CRC和大小取自中央目录"""
+        source.seek(info.header_offset)
+        header = source.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"部件 {info.filename} 的本地文件头损坏")
+        name_length, extra_length = struct.unpack("<2H", header[26:30])
+        source.seek(info.header_offset + 30 + name_length + extra_length)
+        name, flags = _encode_name(info)
+        # 大小已写入本地文件头，不再需要数据描述符
+        self._write_local_header(info, name, flags | (info.flag_bits & 0x06), info.compress_type,
+                                 info.CRC, info.compress_size, info.file_size, info.date_time)
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise zipfile.BadZipFile(f"部件 {info.filename} 的数据不完整")
+            self.fp.write(chunk)
+            remaining -= len(chunk)
+
+    def write(self, info: zipfile.ZipInfo, data: bytes) -> None:
+        """写入新内容，沿用原条目的压缩方式"""
+        method = info.compress_type
+        if method == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+        else:
+            method, payload = zipfile.ZIP_STORED, data
+        name, flags = _encode_name(info)
+        self._write_local_header(info, name, flags, method, zlib.crc32(data),
+                                 len(payload), len(data), time.localtime()[:6])
+        self.fp.write(payload)
+
+    def close(self, comment: bytes = b"") -> None:
+        """写出中央目录和目录结束记录"""
+        start = self.fp.tell()
+        for info, offset, flags, method, crc, compress_size, file_size, date_time in self.entries:
+            name = _encode_name(info)[0]
+            dos_time, dos_date = _dos_date_time(date_time)
+            self.fp.write(struct.pack("<4s6H3L5H2L", b"PK\x01\x02", (info.create_system << 8) | 20, 20, flags,
+                                      method, dos_time, dos_date, crc, compress_size, file_size, len(name), 0, 0,
+                                      0, info.internal_attr, info.external_attr, offset))
+            self.fp.write(name)
+        end = self.fp.tell()
+        if len(self.entries) >= 0xFFFF or end >= 0xFFFFFFFF:
+            raise ValueError("工作簿条目过多或超过4GB，不支持写回")
+        self.fp.write(struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, len(self.entries), len(self.entries),
+                                  end - start, start, len(comment)))
+        self.fp.write(comment)
+
+
+def _encode_name(info: zipfile.ZipInfo) -> Tuple[bytes, int]:
+    """部件名编码和对应的标志位（非ASCII名称使用UTF-8并设置第11位）"""
+    try:
+        return info.filename.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return info.filename.encode("utf-8"), 0x800
+
+
+def _dos_date_time(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def write_workbook(path: str, patches: Dict[str, SheetPatch],
+                   before_replace: Optional[Callable[[str], None]] = None,
+                   shared_lookup: Optional[Callable[[str], Optional[int]]] = None) -> List[str]:
+    """
+    把修改写回工作簿
+
+    Args:
+        path: xlsx文件路径
+        patches: 工作表部件路径 -> 修改
+        before_replace: 新工作簿写完、替换原文件之前调用，参数为临时文件路径
+        shared_lookup: 文本 -> 磁盘上共享字符串表中的索引（不存在时返回None），
+            None时读取工作簿的共享字符串表建立索引
+
+    Returns:
+        追加到共享字符串表末尾的新文本（按索引顺序）
+    """
+    with open(path, "rb") as raw, zipfile.ZipFile(raw) as source, atomic_open(path) as fp:
+        shared = None
+        if SHARED_STRINGS_PART in source.NameToInfo:
+            shared = _SharedStrings(source, shared_lookup)
+        sheets: Dict[str, bytes] = {}
+        for name, patch in patches.items():
+            xml = source.read(name).decode("utf-8")
+            sheets[name] = patch_sheet_xml(xml, patch, shared).encode("utf-8")
+        writer = _RawZipWriter(fp)
+        for info in source.infolist():
+            if info.filename in sheets:
+                writer.write(info, sheets[info.filename])
+            elif info.filename == SHARED_STRINGS_PART and shared.appended:
+                writer.write(info, shared.patch(source.read(info)))
+            else:
+                writer.copy(raw, info)
+        writer.close(source.comment)
+        fp.flush()
+        if before_replace is not None:
+            before_replace(fp.name)
+    appended = list(shared.appended) if shared is not None else []
+    logger.info(f"已保存 {path}（{len(patches)} 个工作表，新增 {len(appended)} 个共享字符串）")
+    return appended